@@ -1,7 +1,6 @@
 import os
 import sys
 import logging
-import itertools
 from holland.core.command import Command, option
 from holland.core.config import hollandcfg, ConfigError
 from holland.core.spool import spool, CONFIGSPEC
@@ -68,7 +67,9 @@ class Purge(Command):
                     LOG.error("Failed to find single backup '%s'", name)
                     error = 1
                     continue
-                purge_backup(backup, opts.force)
+                if purge_backup(backup, opts.force):
+                    error = 1
+                    continue
                 if opts.force:
                     spool.find_backupset(backup.backupset).update_symlinks()
         return error
@@ -100,11 +101,10 @@ def purge_backupset(backupset, force=False, all_backups=False):
     LOG.info("Evaluating purge for backupset %s", backupset.name)
     LOG.info("Retaining up to %d backup%s", 
              retention_count, 's'[0:bool(retention_count)])
-    backups = []
     bytes = 0
     backup_list = backupset.list_backups(reverse=True)
-    for backup in itertools.islice(backup_list, retention_count, None):
-        backups.append(backup)
+    backups = backupset.purge_candidates(retention_count)
+    for backup in backups:
         config = backup.config['holland:backup']
         bytes += int(config['on-disk-size'])
 
@@ -112,8 +112,10 @@ def purge_backupset(backupset, force=False, all_backups=False):
     for backup in backup_list:
         LOG.info("        * %s", backup.path)
     LOG.info("    %d backups to keep", len(backup_list) - len(backups))
-    for backup in backup_list[0:-len(backups)]:
-        LOG.info("        + %s", backup.path)
+    purge_paths = [backup.path for backup in backups]
+    for backup in backup_list:
+        if backup.path not in purge_paths:
+            LOG.info("        + %s", backup.path)
     LOG.info("    %d backups to purge", len(backups))
     for backup in backups:
         LOG.info("        - %s", backup.path)
@@ -137,7 +139,15 @@ def purge_backup(backup, force=False):
 
     :param backup: Backup object to purge
     :param force: Force the purge - this is not a dry-run
+    :returns: 0 on success, 1 if other backups depend on ``backup``
     """
+    dependents = spool.find_backupset(backup.backupset).dependents(backup)
+    if dependents:
+        LOG.error("Not purging %s: it is needed to restore %s",
+                  backup.name,
+                  ', '.join([dependent.name for dependent in dependents]))
+        LOG.error("Purge those backups first")
+        return 1
     if not force:
         config = backup.config['holland:backup']
         LOG.info("Would purge single backup '%s' %s",
@@ -146,3 +156,4 @@ def purge_backup(backup, force=False):
     else:
         backup.purge()
         LOG.info("Purged %s", backup.name)
+    return 0
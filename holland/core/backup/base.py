@@ -141,6 +141,13 @@ class BackupRunner(object):
 
             spool_entry.config['holland:backup']['on-disk-size'] = final_size
             spool_entry.flush()
+        elif not dry_run:
+            # record the failure for plugins inspecting previous backups
+            try:
+                spool_entry.flush()
+            except IOError, exc:
+                LOG.warning("Failed to record backup failure in %s: %s",
+                            spool_entry.config.filename, exc)
 
         start_time = spool_entry.config['holland:backup']['start-time']
         stop_time = spool_entry.config['holland:backup']['stop-time']
@@ -174,29 +181,38 @@ class BackupRunner(object):
                  format_bytes(required_bytes))
         LOG.info("purge-on-demand is enabled. Discovering old backups to purge.")
         available_bytes = disk_free(os.path.join(self.spool.path, name))
+        backupset = self.spool.find_backupset(name)
         to_purge = {}
         for backup in self.spool.list_backups(name):
-            backup_size = directory_size(backup.path)
-            LOG.info("Found backup '%s': %s",
-                     backup.path, format_bytes(backup_size))
-            available_bytes += backup_size
-            to_purge[backup] = backup_size
+            if backup.path in to_purge:
+                continue
+            # purging a backup also purges the backups that depend on it,
+            # rather than leave them unrestorable
+            for member in [backup] + backupset.dependents(backup):
+                if member.path in to_purge:
+                    continue
+                backup_size = directory_size(member.path)
+                LOG.info("Found backup '%s': %s",
+                         member.path, format_bytes(backup_size))
+                available_bytes += backup_size
+                to_purge[member.path] = (member, backup_size)
             if available_bytes > required_bytes:
                 break
         else:
             LOG.info("Purging would only recover an additional %s", 
-                     format_bytes(sum(to_purge.values())))
+                     format_bytes(sum([size for backup, size
+                                       in to_purge.values()])))
             LOG.info("Only %s total would be available, but the current "
                      "backup requires %s",
                      format_bytes(available_bytes),
                      format_bytes(required_bytes))
             return False
 
-        purge_bytes = sum(to_purge.values())
+        purge_bytes = sum([size for backup, size in to_purge.values()])
         LOG.info("Found %d backups to purge which will recover %s",
                  len(to_purge), format_bytes(purge_bytes))
 
-        for backup in to_purge:
+        for backup, size in to_purge.values():
             if dry_run:
                 LOG.info("Would purge: %s", backup.path)
             else:
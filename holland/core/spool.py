@@ -7,7 +7,6 @@ import sys
 import time
 import errno
 import logging
-import itertools
 import shutil
 from holland.core.config import BaseConfig
 
@@ -144,10 +143,38 @@ class Backupset(object):
     def purge(self, retention_count=0):
         if retention_count < 0:
             raise ValueError("Invalid retention count %s" % retention_count)
-        for backup in itertools.islice(self.list_backups(reverse=True), retention_count, None):
+        for backup in self.purge_candidates(retention_count):
             backup.purge()
             yield backup
 
+    def purge_candidates(self, retention_count=0):
+        """
+        List the backups that purging down to ``retention_count`` backups
+        would remove, newest first.
+
+        Backups that a retained backup depends on, such as the full backup
+        an incremental backup was taken against, are retained as well so
+        that a purge never leaves an incremental backup without its base.
+        """
+        backups = self.list_backups(reverse=True) or []
+        by_name = dict([(backup.dirname, backup) for backup in backups])
+        needed = set()
+        for backup in backups[:retention_count]:
+            needed.update(_requires(backup, by_name))
+        return [backup for backup in backups[retention_count:]
+                if backup.dirname not in needed]
+
+    def dependents(self, backup):
+        """
+        List the backups that depend on ``backup``, directly or through
+        other backups, oldest first.
+        """
+        backups = self.list_backups() or []
+        by_name = dict([(other.dirname, other) for other in backups])
+        return [other for other in backups
+                if other.dirname != backup.dirname and
+                backup.dirname in _requires(other, by_name)]
+
     def list_backups(self, name=None, reverse=False):
         """
         Return list of backups for this backupset in order of their
@@ -216,6 +243,7 @@ plugin                  = string(default="")
 start-time              = float(default=0)
 stop-time               = float(default=0)
 failed-backup           = boolean(default=no)
+failed                  = boolean(default=no)
 estimated-size          = float(default=0)
 on-disk-size            = float(default=0)
 estimated-size-factor   = float(default=1.0)
@@ -223,6 +251,7 @@ backups-to-keep         = integer(min=0, default=1)
 auto-purge-failures     = boolean(default=yes)
 purge-policy            = option(manual, before-backup, after-backup, default='after-backup')
 purge-on-demand         = boolean(default=no)
+depends-on              = force_list(default=list())
 before-backup-command   = string(default=None)
 after-backup-command    = string(default=None)
 failed-backup-command   = string(default=None)
@@ -235,6 +264,7 @@ class Backup(object):
     def __init__(self, path, backupset, name):
         self.path = path
         self.backupset = backupset
+        self.dirname = name
         self.name = '/'.join((backupset, name))
         # Initialize an empty config
         # This will not be loaded until load_config is called
@@ -268,6 +298,25 @@ class Backup(object):
             if exc.errno != errno.ENOENT:
                 raise
 
+    def depends_on(self):
+        """
+        List the names of the backups in this backup's backupset that are
+        needed to restore it, as recorded by the plugin in
+        [holland:backup] depends-on.
+        """
+        return list(self.config['holland:backup']['depends-on'])
+
+    def is_failed(self):
+        """
+        Check if this backup did not complete successfully.
+
+        A backup that never recorded its stop-time did not finish, for
+        instance because holland was killed while it ran, and is treated
+        as failed as well.
+        """
+        cfg = self.config['holland:backup']
+        return bool(cfg['failed']) or not cfg['stop-time']
+
     def exists(self):
         """
         Check if this backup exists on disk
@@ -338,4 +387,34 @@ class Backup(object):
 
     __repr__ = __str__
 
+def _requires(backup, by_name):
+    """
+    Find the names of every backup ``backup`` depends on, following the
+    dependencies of the backups in ``by_name``.
+    """
+    needed = set()
+    pending = [backup]
+    while pending:
+        for name in pending.pop().depends_on():
+            if name not in needed:
+                needed.add(name)
+                if name in by_name:
+                    pending.append(by_name[name])
+    return needed
+
+def previous_backups(backup_path):
+    """
+    Find the backups that precede the backup at ``backup_path`` in its
+    backupset, newest first.
+
+    This allows a plugin to inspect the backup.conf of earlier runs given
+    only its own target directory.
+    """
+    backup_path = os.path.realpath(backup_path)
+    backupset_path = os.path.dirname(backup_path)
+    backupset = Backupset(os.path.basename(backupset_path), backupset_path)
+    backups = [backup for backup in backupset.list_backups(reverse=True)
+               if os.path.realpath(backup.path) != backup_path]
+    return backups
+
 spool = Spool()
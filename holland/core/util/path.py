@@ -10,10 +10,22 @@ import os
 import sys
 import stat
 import time
+import Queue
+import random
 import logging
+import threading
+
+try:
+    # the scandir package; python 2 has no os.scandir
+    from scandir import scandir
+except ImportError:
+    scandir = None
 
 LOG = logging.getLogger(__name__)
 
+#: directories shallower than this are always scanned when sampling
+SAMPLE_MIN_DEPTH = 2
+
 def ensure_dir(dir_path):
     """
     Ensure a directory path exists (by creating it if it doesn't).
@@ -141,19 +153,146 @@ def disk_free(target_path):
     info = os.statvfs(path)
     return info.f_frsize*info.f_bavail
 
-def directory_size(path):
+def directory_size(path, workers=4):
     """
     Find the size of all files in a directory, recursively
 
     Returns the size in bytes on success
     """
-    from os.path import join, getsize
-    result = 0
-    for root, dirs, files in os.walk(path):
-        for name in files:
+    return estimate_size(path, workers=workers)
+
+def estimate_size(path, workers=4, newer_than=0, sample=1.0,
+                  use_statvfs=False, seed=None):
+    """
+    Estimate the bytes of file data under a directory
+
+    Each directory is listed once and each entry lstat'd once (through the
+    scandir package when it is installed).  Subtrees are walked by
+    ``workers`` threads, which helps on cold caches and network
+    filesystems.  Symlinks are not followed or counted.
+
+    :param newer_than: only count files modified or changed at or after
+                       this timestamp, as an incremental backup would
+    :param sample: fraction of the subdirectories of each directory below
+                   the top two levels to scan.  Each scanned directory
+                   stands in for those skipped beside it, so large trees
+                   can be estimated quickly at some cost in accuracy.
+    :param use_statvfs: if ``path`` is a mount point, return the space used
+                        on its filesystem from statvfs rather than walking it
+    :param seed: seed for the sampling, for repeatable estimates
+
+    :returns: integer number of bytes
+    """
+    if not 0 < sample <= 1:
+        raise ValueError("sample must be greater than 0 and at most 1")
+    if use_statvfs and not newer_than:
+        real_path = os.path.realpath(path)
+        if os.path.ismount(real_path):
+            info = os.statvfs(real_path)
+            return (info.f_blocks - info.f_bfree)*info.f_frsize
+        LOG.debug("%s is not a mount point. Walking it instead.", path)
+
+    totals = [0.0]
+    # files with several links are only counted once, as tar stores them
+    linked = {}
+    lock = threading.Lock()
+    rng = random.Random(seed)
+
+    def process(item):
+        """Scan one directory, returning the subdirectories to scan next"""
+        dirpath, depth, weight = item
+        try:
+            files, subdirs = _scan_directory(dirpath)
+        except OSError, exc:
+            LOG.debug("Skipping %s: %s", dirpath, exc)
+            return []
+        size = 0
+        lock.acquire()
+        try:
+            for st in files:
+                if newer_than and \
+                   max(st.st_mtime, st.st_ctime) < newer_than:
+                    continue
+                if st.st_nlink > 1:
+                    if (st.st_dev, st.st_ino) in linked:
+                        continue
+                    linked[(st.st_dev, st.st_ino)] = True
+                size += st.st_size
+            totals[0] += size*weight
+            if sample < 1.0 and depth + 1 >= SAMPLE_MIN_DEPTH and subdirs:
+                # scan a random share of the subdirectories, each standing
+                # in for the ones skipped
+                count = max(1, int(round(len(subdirs)*sample)))
+                weight = weight*len(subdirs)/count
+                chooser = rng
+                if seed is not None:
+                    # the same choice whichever thread gets here first
+                    chooser = random.Random('%s:%s' % (seed, dirpath))
+                subdirs = chooser.sample(sorted(subdirs), count)
+        finally:
+            lock.release()
+        return [(subdir, depth + 1, weight) for subdir in subdirs]
+
+    if workers <= 1:
+        pending = [(path, 0, 1.0)]
+        while pending:
+            pending.extend(process(pending.pop()))
+        return int(round(totals[0]))
+
+    work = Queue.Queue()
+    def run():
+        while True:
+            item = work.get()
             try:
-                sz = getsize(join(root,name))
-                result = result + sz
-            except OSError, exc:
-                pass
-    return result
+                if item is None:
+                    break
+                for subdir in process(item):
+                    work.put(subdir)
+            finally:
+                work.task_done()
+
+    threads = []
+    for _ in range(workers):
+        thread = threading.Thread(target=run)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    work.put((path, 0, 1.0))
+    work.join()
+    for thread in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    return int(round(totals[0]))
+
+def _scan_directory(path):
+    """
+    List a directory
+
+    :returns: (list of lstat results of regular files, list of
+              subdirectory paths)
+    """
+    files = []
+    subdirs = []
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(entry.stat(follow_symlinks=False))
+            except OSError:
+                # removed while we were looking
+                continue
+        return files, subdirs
+    for name in os.listdir(path):
+        child = os.path.join(path, name)
+        try:
+            st = os.lstat(child)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            subdirs.append(child)
+        elif stat.S_ISREG(st.st_mode):
+            files.append(st)
+    return files, subdirs
@@ -0,0 +1,174 @@
+"""Wait on child processes and signals without sleep loops
+
+`ProcessSupervisor` blocks in select() on a pipe that is written to when a
+child process exits (SIGCHLD) or, on python 2.6+, when any other signal
+with a python handler arrives (signal.set_wakeup_fd).  Waiting for a
+process therefore returns as soon as it exits or the backup is
+interrupted, rather than on the next tick of a polling loop.
+
+Conditions that cannot be signalled, such as a server starting to accept
+connections, are checked with an exponential backoff while still waking
+immediately if the process being waited on dies.
+"""
+
+import os
+import time
+import errno
+import fcntl
+import select
+import signal
+import logging
+
+LOG = logging.getLogger(__name__)
+
+class ProcessSupervisor(object):
+    """Wait for child processes, interrupts and readiness checks
+
+    :param interrupted: callable returning True when waiting should stop
+                        early (e.g. because SIGINT is pending)
+    :param max_interval: longest time to block between checks.  This only
+                         matters when signals cannot be used (outside the
+                         main thread), or as a safety net.
+    """
+
+    def __init__(self, interrupted=None, max_interval=5.0):
+        self.interrupted = interrupted
+        self.max_interval = max_interval
+
+    def is_interrupted(self):
+        """Check whether waiting was interrupted"""
+        return self.interrupted is not None and bool(self.interrupted())
+
+    def wait(self, processes, timeout=None):
+        """Wait for every process in ``processes`` to exit
+
+        ``processes`` are subprocess.Popen instances.
+
+        :returns: True if all processes exited, False if interrupted or
+                  ``timeout`` seconds passed first
+        """
+        def done():
+            return not [process for process in processes
+                        if process.poll() is None]
+        return self._wait(done, timeout)
+
+    def wait_for(self, ready, processes=(), timeout=None,
+                 min_delay=0.01, max_delay=1.0):
+        """Wait for ``ready()`` to return True
+
+        ``ready`` is retried with an exponential backoff from ``min_delay``
+        to ``max_delay`` seconds.  Waiting stops early if any process in
+        ``processes`` exits.
+
+        :returns: True if ``ready()`` succeeded, False otherwise
+        """
+        exited = []
+        def done():
+            for process in processes:
+                if process.poll() is not None:
+                    exited.append(process)
+                    return True
+            return ready()
+        return self._wait(done, timeout, min_delay, max_delay) and not exited
+
+    def _wait(self, done, timeout, min_delay=None, max_delay=None):
+        """Call ``done()`` each time the wakeup pipe fires until it returns
+        True, waiting is interrupted or ``timeout`` passes"""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        delay = min_delay
+        wakeup = _WakeupPipe()
+        try:
+            armed = wakeup.arm()
+            while True:
+                if done():
+                    return True
+                if self.is_interrupted():
+                    return False
+                if delay is not None:
+                    interval = delay
+                    delay = min(delay*2, max_delay)
+                elif armed:
+                    interval = self.max_interval
+                else:
+                    interval = min(self.max_interval, 0.5)
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    interval = min(interval, remaining)
+                wakeup.wait(interval)
+        finally:
+            wakeup.close()
+
+class _WakeupPipe(object):
+    """Self pipe written to by signal handlers"""
+
+    def __init__(self):
+        self.rfd, self.wfd = os.pipe()
+        for fd in (self.rfd, self.wfd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._previous_handler = None
+        self._previous_fd = None
+        self._armed = False
+
+    def arm(self):
+        """Install signal handlers that write to this pipe
+
+        :returns: False if signal handlers cannot be installed here (only
+                  the main thread may install them)
+        """
+        try:
+            self._previous_handler = signal.signal(signal.SIGCHLD,
+                                                   self._handler)
+        except ValueError:
+            return False
+        self._armed = True
+        if hasattr(signal, 'siginterrupt'):
+            # let other blocking calls restart rather than fail with EINTR
+            signal.siginterrupt(signal.SIGCHLD, False)
+        if hasattr(signal, 'set_wakeup_fd'):
+            self._previous_fd = signal.set_wakeup_fd(self.wfd)
+        return True
+
+    def _handler(self, signum, frame):
+        """SIGCHLD handler for pythons without set_wakeup_fd"""
+        if self._previous_fd is None:
+            self.notify()
+
+    def notify(self):
+        """Wake up anything waiting on this pipe"""
+        try:
+            os.write(self.wfd, '\0')
+        except OSError:
+            # pipe is full - a wakeup is already pending
+            pass
+
+    def wait(self, timeout):
+        """Block until this pipe is written to or timeout seconds pass"""
+        try:
+            readable = select.select([self.rfd], [], [], timeout)[0]
+        except select.error, exc:
+            if exc.args[0] != errno.EINTR:
+                raise
+            return
+        if readable:
+            try:
+                while os.read(self.rfd, 4096):
+                    pass
+            except OSError, exc:
+                if exc.errno != errno.EAGAIN:
+                    raise
+
+    def close(self):
+        """Restore signal handlers and close the pipe"""
+        if self._armed:
+            if self._previous_fd is not None:
+                signal.set_wakeup_fd(self._previous_fd)
+            signal.signal(signal.SIGCHLD,
+                          self._previous_handler or signal.SIG_DFL)
+            self._armed = False
+        os.close(self.rfd)
+        os.close(self.wfd)
@@ -0,0 +1,470 @@
+"""Block-level incremental archives of a snapshot datadir
+
+Rather than archiving every byte of the datadir on every run,
+`IncrementalArchiveAction` reads each file on the snapshot in fixed size
+chunks and hashes them.  A chunk whose digest matches the chunk at the same
+position in the previous backup is not written again; only changed chunks
+are appended to this backup's data stream (backup.data, compressed with the
+configured [compression] method).
+
+Every backup also writes a complete chunk index (backup.chunks) that maps
+each chunk of each file to the backup whose data stream holds it.  A backup
+can therefore be restored from its own index plus the data streams of the
+backups it refers to, which `restore_chunks` does.
+
+The chunk index is a tab separated text file::
+
+    holland-chunk-index     1
+    chunk-size              <bytes>
+    digest                  <digest name>
+    chain                   <incremental backups since the last full one>
+    source  <n>  <backup directory>  <data file>  <compression method>
+    d       <mode>  <uid>  <gid>  <mtime>  <path>
+    l       <uid>  <gid>  <path>  <symlink target>
+    f       <mode>  <uid>  <gid>  <mtime>  <size>  <path>
+    c       <digest>  <source>  <sequence>
+
+Each ``c`` line describes the next chunk of the preceding ``f`` line: the
+chunk is the ``sequence``'th chunk written to the data stream of source
+``n``.  Backup directories are named relative to the backupset.  In a data
+stream each chunk is preceded by its length as a 4 byte big endian integer.
+"""
+
+import os
+import stat
+import struct
+import signal
+import logging
+from holland.core.exceptions import BackupError
+from holland.core.spool import previous_backups
+from holland.core.util.fmt import format_bytes
+from holland.lib.compression import open_stream
+from holland.backup.mysql_lvm.actions.tar import _excluded
+try:
+    from xxhash import xxh64 as new_digest
+    DIGEST_NAME = 'xxh64'
+except ImportError:
+    from hashlib import sha1 as new_digest
+    DIGEST_NAME = 'sha1'
+
+LOG = logging.getLogger(__name__)
+
+INDEX_NAME = 'backup.chunks'
+INDEX_VERSION = 1
+
+# chunk length header in data streams
+LENGTH_FORMAT = '!I'
+LENGTH_SIZE = struct.calcsize(LENGTH_FORMAT)
+
+def lookup_digest(name):
+    """Find the digest constructor for a digest name recorded in an index
+
+    :returns: constructor or None if the digest is not available here
+    """
+    if name == 'xxh64':
+        try:
+            from xxhash import xxh64
+            return xxh64
+        except ImportError:
+            return None
+    try:
+        import hashlib
+        return getattr(hashlib, name)
+    except (ImportError, AttributeError):
+        return None
+
+class ChunkIndex(object):
+    """Chunk index of one incremental backup
+
+    ``entries`` is a list of dicts, one per directory ('d'), symlink ('l')
+    or file ('f') in the datadir, in the order they were archived.  File
+    entries carry a ``chunks`` list of (digest, source, sequence) tuples.
+    ``sources`` is a list of (backup directory, data file, compression
+    method) tuples.
+    """
+
+    def __init__(self, chunk_size, digest=DIGEST_NAME, chain=0):
+        self.chunk_size = chunk_size
+        self.digest = digest
+        self.chain = chain
+        self.sources = []
+        self.entries = []
+
+    def add_source(self, name, data_file, method):
+        """Add a backup holding chunk data
+
+        :returns: the source number for ``name``
+        """
+        for index, source in enumerate(self.sources):
+            if source[0] == name:
+                return index
+        self.sources.append((name, data_file, method))
+        return len(self.sources) - 1
+
+    def files(self):
+        """Map the relative path of each file to its index entry"""
+        return dict([(entry['path'], entry) for entry in self.entries
+                     if entry['type'] == 'f'])
+
+    def referenced_sources(self):
+        """List the source numbers referenced by any chunk"""
+        result = {}
+        for entry in self.entries:
+            for digest, source, sequence in entry.get('chunks', ()):
+                result[source] = True
+        return sorted(result.keys())
+
+    def write(self, path):
+        """Write this index to ``path``"""
+        fileobj = open(path, 'w')
+        try:
+            print >>fileobj, "holland-chunk-index\t%d" % INDEX_VERSION
+            print >>fileobj, "chunk-size\t%d" % self.chunk_size
+            print >>fileobj, "digest\t%s" % self.digest
+            print >>fileobj, "chain\t%d" % self.chain
+            for index, source in enumerate(self.sources):
+                print >>fileobj, "source\t%d\t%s\t%s\t%s" % ((index,) + source)
+            for entry in self.entries:
+                if entry['type'] == 'd':
+                    print >>fileobj, "d\t%o\t%d\t%d\t%d\t%s" % \
+                        (entry['mode'], entry['uid'], entry['gid'],
+                         entry['mtime'], entry['path'])
+                elif entry['type'] == 'l':
+                    print >>fileobj, "l\t%d\t%d\t%s\t%s" % \
+                        (entry['uid'], entry['gid'], entry['path'],
+                         entry['target'])
+                else:
+                    print >>fileobj, "f\t%o\t%d\t%d\t%d\t%d\t%s" % \
+                        (entry['mode'], entry['uid'], entry['gid'],
+                         entry['mtime'], entry['size'], entry['path'])
+                    for chunk in entry['chunks']:
+                        print >>fileobj, "c\t%s\t%d\t%d" % chunk
+        finally:
+            fileobj.close()
+
+    def read(cls, path):
+        """Read a chunk index written by `write`
+
+        :raises: IOError, ValueError if the index is unreadable
+        """
+        index = cls(0, None)
+        fileobj = open(path, 'r')
+        try:
+            header = {}
+            entry = None
+            for line in fileobj:
+                line = line.rstrip('\n')
+                kind, rest = line.split('\t', 1)
+                if kind == 'c':
+                    digest, source, sequence = rest.split('\t')
+                    entry['chunks'].append((digest, int(source),
+                                            int(sequence)))
+                elif kind == 'f':
+                    mode, uid, gid, mtime, size, rel = rest.split('\t', 5)
+                    entry = dict(type='f', mode=int(mode, 8), uid=int(uid),
+                                 gid=int(gid), mtime=int(mtime),
+                                 size=int(size), path=rel, chunks=[])
+                    index.entries.append(entry)
+                elif kind == 'd':
+                    mode, uid, gid, mtime, rel = rest.split('\t', 4)
+                    index.entries.append(dict(type='d', mode=int(mode, 8),
+                                              uid=int(uid), gid=int(gid),
+                                              mtime=int(mtime), path=rel))
+                elif kind == 'l':
+                    uid, gid, rel, target = rest.split('\t', 3)
+                    index.entries.append(dict(type='l', uid=int(uid),
+                                              gid=int(gid), path=rel,
+                                              target=target))
+                elif kind == 'source':
+                    number, name, data_file, method = rest.split('\t')
+                    if int(number) != len(index.sources):
+                        raise ValueError("Out of order source %s" % number)
+                    index.sources.append((name, data_file, method))
+                else:
+                    header[kind] = rest
+        finally:
+            fileobj.close()
+        if int(header.get('holland-chunk-index', 0)) != INDEX_VERSION:
+            raise ValueError("Unsupported chunk index version in %s" % path)
+        index.chunk_size = int(header['chunk-size'])
+        index.digest = header['digest']
+        index.chain = int(header['chain'])
+        return index
+    read = classmethod(read)
+
+def walk_datadir(datadir, exclude=()):
+    """List (relative path, lstat result) of everything under ``datadir``
+
+    Directories are listed before their contents.  Symlinks are not
+    followed.
+    """
+    datadir = os.path.normpath(datadir)
+    result = [('.', os.lstat(datadir))]
+    for dirpath, dirnames, filenames in os.walk(datadir):
+        for name in sorted(dirnames) + sorted(filenames):
+            path = os.path.join(dirpath, name)
+            rel = '.' + path[len(datadir):]
+            if _excluded(rel, exclude):
+                if name in dirnames:
+                    dirnames.remove(name)
+                continue
+            try:
+                result.append((rel, os.lstat(path)))
+            except OSError:
+                continue
+        dirnames.sort()
+    return result
+
+def find_base_index(spooldir, chunk_size, full_interval):
+    """Find the chunk index of the most recent backup in the backupset of
+    ``spooldir`` that a new incremental backup can be based on
+
+    :returns: (ChunkIndex, backup directory name) or (None, None) if a full
+              backup should be taken
+    """
+    for backup in previous_backups(spooldir):
+        if backup.is_failed():
+            continue
+        path = os.path.join(backup.path, INDEX_NAME)
+        if not os.path.exists(path):
+            continue
+        name = os.path.basename(backup.path)
+        try:
+            index = ChunkIndex.read(path)
+        except (IOError, ValueError), exc:
+            LOG.warning("Ignoring unreadable chunk index %s: %s", path, exc)
+            return None, None
+        if index.chunk_size != chunk_size or index.digest != DIGEST_NAME:
+            LOG.info("Chunk size or digest changed since backup %s. "
+                     "Taking a full backup.", name)
+            return None, None
+        if full_interval and index.chain + 1 > full_interval:
+            LOG.info("%d incremental backup(s) since the last full backup. "
+                     "Taking a full backup.", index.chain)
+            return None, None
+        backupset_dir = os.path.dirname(backup.path)
+        for number in index.referenced_sources():
+            source, data_file, method = index.sources[number]
+            if not os.path.exists(os.path.join(backupset_dir, source,
+                                               data_file)):
+                LOG.info("Backup %s refers to data in %s, which no longer "
+                         "exists. Taking a full backup.", name, source)
+                return None, None
+        return index, name
+    return None, None
+
+class IncrementalArchiveAction(object):
+    """Archive only the chunks of the snapshot datadir that changed since
+    the previous backup
+
+    ``open_archive`` is called with an archive file name and should return
+    an open output stream for it, compressed with ``compression``.  Usage
+    is recorded in the ``status`` dict, if given.
+    """
+    def __init__(self, snap_datadir, spooldir, open_archive, compression,
+                 config, status=None):
+        self.snap_datadir = snap_datadir
+        self.spooldir = spooldir
+        self.open_archive = open_archive
+        self.compression = compression
+        self.config = config
+        self.status = status
+
+    def __call__(self, event, snapshot_fsm, snapshot_vol):
+        chunk_size = self.config['chunk-size']
+        base, base_name = find_base_index(self.spooldir, chunk_size,
+                                          self.config['full-interval'])
+        if base is None:
+            index = ChunkIndex(chunk_size)
+            LOG.info("Taking a full block-level backup of %s",
+                     self.snap_datadir)
+        else:
+            index = ChunkIndex(chunk_size, chain=base.chain + 1)
+            LOG.info("Taking an incremental block-level backup of %s "
+                     "based on backup %s", self.snap_datadir, base_name)
+
+        stream = self.open_archive('backup.data')
+        source = index.add_source(os.path.basename(self.spooldir),
+                                  os.path.basename(stream.name),
+                                  self.compression)
+        try:
+            totals = self._archive(index, source, base, stream, snapshot_fsm)
+        finally:
+            try:
+                stream.close()
+            except IOError, exc:
+                LOG.error("Data stream %s failed: %s", stream.name, exc)
+                raise BackupError(str(exc))
+        index.write(os.path.join(self.spooldir, INDEX_NAME))
+
+        total, written, written_bytes = totals
+        LOG.info("Wrote %d of %d chunk(s) (%s) to %s", written, total,
+                 format_bytes(written_bytes), stream.name)
+        if self.status is not None:
+            self.status['chain'] = str(index.chain)
+            self.status['base'] = base_name or ''
+            self.status['chunks-total'] = str(total)
+            self.status['chunks-written'] = str(written)
+            self.status['bytes-written'] = str(written_bytes)
+            self.status['depends-on'] = ','.join(
+                [index.sources[number][0]
+                 for number in index.referenced_sources()
+                 if number != source])
+
+    def _archive(self, index, source, base, stream, snapshot_fsm):
+        """Hash every file and write changed chunks to ``stream``
+
+        :returns: (chunks seen, chunks written, bytes written)
+        """
+        previous = {}
+        if base is not None:
+            previous = base.files()
+        total = written = written_bytes = 0
+        for rel, info in walk_datadir(self.snap_datadir,
+                                      self.config['exclude']):
+            if signal.SIGINT in snapshot_fsm.sigmgr.pending:
+                raise KeyboardInterrupt("Interrupted")
+            path = os.path.join(self.snap_datadir, rel)
+            if stat.S_ISDIR(info.st_mode):
+                index.entries.append(dict(type='d', path=rel,
+                                          mode=stat.S_IMODE(info.st_mode),
+                                          uid=info.st_uid, gid=info.st_gid,
+                                          mtime=int(info.st_mtime)))
+                continue
+            if stat.S_ISLNK(info.st_mode):
+                index.entries.append(dict(type='l', path=rel,
+                                          target=os.readlink(path),
+                                          uid=info.st_uid, gid=info.st_gid))
+                continue
+            if not stat.S_ISREG(info.st_mode):
+                LOG.debug("Skipping special file %s", path)
+                continue
+            old_chunks = previous.get(rel, {}).get('chunks', [])
+            chunks = []
+            size = 0
+            fileobj = open(path, 'rb')
+            try:
+                while True:
+                    data = fileobj.read(index.chunk_size)
+                    if not data:
+                        break
+                    size += len(data)
+                    digest = new_digest(data).hexdigest()
+                    number = len(chunks)
+                    if number < len(old_chunks) and \
+                            old_chunks[number][0] == digest:
+                        old_source = base.sources[old_chunks[number][1]]
+                        chunks.append((digest,
+                                       index.add_source(*old_source),
+                                       old_chunks[number][2]))
+                    else:
+                        stream.write(struct.pack(LENGTH_FORMAT, len(data)))
+                        stream.write(data)
+                        chunks.append((digest, source, written))
+                        written += 1
+                        written_bytes += len(data)
+                    total += 1
+            finally:
+                fileobj.close()
+            index.entries.append(dict(type='f', path=rel,
+                                      mode=stat.S_IMODE(info.st_mode),
+                                      uid=info.st_uid, gid=info.st_gid,
+                                      mtime=int(info.st_mtime),
+                                      size=size,
+                                      chunks=chunks))
+        return total, written, written_bytes
+
+def restore_chunks(backup_dir, target_dir):
+    """Rebuild the datadir saved by an incremental backup in ``target_dir``
+
+    The data streams of every backup the chunk index of ``backup_dir``
+    refers to are read once, in turn, and each chunk is written to every
+    position it occupies in the restored files.
+
+    :raises: IOError, ValueError if a data stream or the index is damaged
+    """
+    index = ChunkIndex.read(os.path.join(backup_dir, INDEX_NAME))
+    backupset_dir = os.path.dirname(os.path.normpath(backup_dir))
+    digest_factory = lookup_digest(index.digest)
+    if digest_factory is None:
+        LOG.warning("%s digests are not available. Restored chunks will "
+                    "not be verified.", index.digest)
+
+    # where each chunk of each source goes: {source: {sequence: [...]}}
+    placements = {}
+    for entry in index.entries:
+        path = os.path.join(target_dir, entry['path'])
+        if entry['type'] == 'd':
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        elif entry['type'] == 'l':
+            os.symlink(entry['target'], path)
+        else:
+            fileobj = open(path, 'wb')
+            try:
+                fileobj.truncate(entry['size'])
+            finally:
+                fileobj.close()
+            for number, (digest, source, sequence) in \
+                    enumerate(entry['chunks']):
+                placements.setdefault(source, {}).setdefault(sequence, []) \
+                    .append((path, number*index.chunk_size, digest))
+
+    for source in sorted(placements.keys()):
+        name, data_file, method = index.sources[source]
+        LOG.info("Restoring %d chunk(s) from %s/%s",
+                 len(placements[source]), name, data_file)
+        _restore_source(os.path.join(backupset_dir, name, data_file),
+                        method, placements[source], digest_factory)
+
+    # apply ownership and modes last so restrictive directory modes do not
+    # get in the way, deepest paths first
+    entries = list(index.entries)
+    entries.reverse()
+    for entry in entries:
+        path = os.path.join(target_dir, entry['path'])
+        if os.geteuid() == 0:
+            os.lchown(path, entry['uid'], entry['gid'])
+        if entry['type'] != 'l':
+            os.chmod(path, entry['mode'])
+            os.utime(path, (entry['mtime'], entry['mtime']))
+
+def _restore_source(path, method, placements, digest_factory):
+    """Copy the chunks in one data stream to their places"""
+    if method == 'none':
+        stream = open(path, 'rb')
+    else:
+        stream = open_stream(path, 'r', method=method)
+    try:
+        last = max(placements.keys())
+        sequence = 0
+        while sequence <= last:
+            header = _read_exact(stream, LENGTH_SIZE)
+            length, = struct.unpack(LENGTH_FORMAT, header)
+            data = _read_exact(stream, length)
+            for target, offset, digest in placements.get(sequence, ()):
+                if digest_factory and \
+                        digest_factory(data).hexdigest() != digest:
+                    raise ValueError("Chunk %d of %s does not match its "
+                                     "digest" % (sequence, path))
+                fileobj = open(target, 'r+b')
+                try:
+                    fileobj.seek(offset)
+                    fileobj.write(data)
+                finally:
+                    fileobj.close()
+            sequence += 1
+    finally:
+        stream.close()
+
+def _read_exact(stream, size):
+    """Read exactly ``size`` bytes from ``stream``"""
+    chunks = []
+    remaining = size
+    while remaining:
+        data = stream.read(remaining)
+        if not data:
+            raise IOError("Unexpected end of data stream %s" % stream.name)
+        chunks.append(data)
+        remaining -= len(data)
+    return ''.join(chunks)
@@ -1,12 +1,16 @@
 """Common mysqld bootstrapping functionality"""
 
 import os
+import time
 import signal
 import logging
+import resource
 from cStringIO import StringIO
 from subprocess import Popen, STDOUT, list2cmdline
 from holland.core.exceptions import BackupError
-from holland.lib.which import which, WhichError
+from holland.lib.which import WhichError
+from holland.lib.lvm import parse_bytes
+from holland.lib.toolcache import tool_cache
 
 LOG = logging.getLogger(__name__)
 
@@ -21,7 +25,7 @@ def locate_mysqld_exe(config):
         try:
             LOG.debug("Searching for %s on path %s",
                       candidate, path or os.environ['PATH'])
-            return which(candidate, path)
+            return tool_cache.which(candidate, path)
         except WhichError:
             LOG.debug("mysqld path %s does not exist - skipping", candidate)
     raise BackupError("Failed to find mysqld binary")
@@ -58,6 +62,10 @@ class MySQLServer(object):
             self.returncode = self.process.returncode
             self.process = None
 
+    def wait(self):
+        self.returncode = self.process.wait()
+        return self.returncode
+
     def poll(self):
         self.returncode = self.process.poll()
         return self.returncode
@@ -75,16 +83,113 @@ class MySQLServer(object):
         self.stop()
         self.start()
 
+# smallest buffer pool to auto-size to, in bytes
+MIN_BUFFER_POOL_SIZE = 128*1024**2
+# share of the available memory an auto-sized buffer pool may use.
+# MemAvailable counts the page cache, which is better left alone
+AUTO_BUFFER_POOL_FRACTION = 0.25
+# largest auto-sized buffer pool unless innodb-buffer-pool-auto-max is set
+AUTO_BUFFER_POOL_MAX = '1G'
+# open-files-limit to use when the hard limit is unlimited
+MAX_OPEN_FILES = 65535
+# parameters only known to some mysqld versions
+LOOSE_PARAMS = [
+    'innodb-redo-log-capacity',
+    'innodb-read-io-threads',
+    'innodb-write-io-threads',
+    'table-open-cache',
+]
+
+def available_memory():
+    """Estimate how much memory can be used without swapping
+
+    :returns: bytes or None if /proc/meminfo cannot be read
+    """
+    info = {}
+    try:
+        for line in open('/proc/meminfo', 'r'):
+            key, value = line.split(':', 1)
+            info[key] = int(value.split()[0])*1024
+    except (IOError, ValueError, IndexError):
+        return None
+    if 'MemAvailable' in info:
+        return info['MemAvailable']
+    return sum([info.get(key, 0) for key in ('MemFree', 'Buffers', 'Cached')])
+
+def cpu_count():
+    """Number of online CPUs, or 1 if it cannot be found"""
+    try:
+        return max(int(os.sysconf('SC_NPROCESSORS_ONLN')), 1)
+    except (AttributeError, ValueError, OSError):
+        return 1
+
+def open_files_limit():
+    """Highest open-files-limit mysqld can raise itself to"""
+    hard = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+    if hard == resource.RLIM_INFINITY or hard > MAX_OPEN_FILES:
+        return MAX_OPEN_FILES
+    return hard
+
+def tune_server_config(config):
+    """Replace 'auto' values in a mysqld config with ones sized for this
+    host
+
+    innodb-buffer-pool-size gets a quarter of the available memory, at
+    least 128M and at most innodb-buffer-pool-auto-max (1G by default),
+    innodb-read-io-threads and innodb-write-io-threads one thread
+    per CPU (4 - 64), open-files-limit the hard RLIMIT_NOFILE limit and
+    table-open-cache half of that.
+    """
+    tuned = {}
+    max_size = config.pop('innodb-buffer-pool-auto-max', None)
+    if config.get('innodb-buffer-pool-size') == 'auto':
+        try:
+            max_size = parse_bytes(max_size or AUTO_BUFFER_POOL_MAX)
+        except ValueError, exc:
+            raise BackupError("Invalid innodb-buffer-pool-auto-max: %s" % exc)
+        memory = available_memory() or 0
+        size = min(int(memory*AUTO_BUFFER_POOL_FRACTION), max_size)
+        size = max(size, MIN_BUFFER_POOL_SIZE) // 1024**2
+        tuned['innodb-buffer-pool-size'] = '%dM' % size
+    for param in ('innodb-read-io-threads', 'innodb-write-io-threads'):
+        if config.get(param) == 'auto':
+            tuned[param] = min(max(cpu_count(), 4), 64)
+    limit = config.get('open-files-limit')
+    if limit == 'auto':
+        limit = open_files_limit()
+        tuned['open-files-limit'] = limit
+    if config.get('table-open-cache') == 'auto':
+        try:
+            tuned['table-open-cache'] = max(int(limit) // 2, 64)
+        except (TypeError, ValueError):
+            tuned['table-open-cache'] = open_files_limit() // 2
+    if tuned:
+        LOG.info("Tuned mysqld settings: %s",
+                 ', '.join(['%s=%s' % item for item in sorted(tuned.items())]))
+    config.update(tuned)
+    return config
+
 def generate_server_config(config, path):
+    """Write a my.cnf for a mysqld started against a snapshot
+
+    'auto' values are sized for this host by `tune_server_config`.
+    """
+    tune_server_config(config)
     conf_data = StringIO()
     valid_params = [
         'innodb-buffer-pool-size',
         'innodb-log-file-size',
+        'innodb-redo-log-capacity',
         'innodb-log-group-home-dir',
         'innodb-data-home-dir',
         'innodb-data-file-path',
         'innodb-fast-shutdown',
+        'innodb-read-io-threads',
+        'innodb-write-io-threads',
+        'innodb-doublewrite',
+        'innodb-flush-log-at-trx-commit',
         'open-files-limit',
+        'table-open-cache',
         'key-buffer-size',
         'tmpdir',
         'user',
@@ -96,9 +201,16 @@ def generate_server_config(config, path):
     ]
     print >>conf_data, "[mysqld]"
     for key, value in config.iteritems():
-        if key.replace('_', '-') not in valid_params:
+        param = key.replace('_', '-')
+        if param not in valid_params:
             LOG.warning("Ignoring mysqld config parameter %s", key)
             continue
+        if value is None or value == 'auto':
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        if param in LOOSE_PARAMS:
+            key = 'loose-' + key
         print >>conf_data, "%s = %s" % (key, value)
     print >>conf_data, "# not used for --bootstrap but here for completeness"
     print >>conf_data, "port = 3307"
@@ -110,3 +222,63 @@ def generate_server_config(config, path):
     LOG.debug("Generating config: %s", text)
     open(path, 'w').write(text)
     return path
+
+class RecoveryTimer(object):
+    """Time InnoDB crash recovery by following a mysqld error log
+
+    `check` is called periodically while mysqld starts.  Recovery starts
+    when InnoDB logs that it is starting crash recovery and ends once it
+    has applied the redo log or mysqld accepts connections, so times are
+    only as precise as the interval between checks.
+    """
+    START_MARKERS = (
+        'Starting crash recovery',
+        'Database was not shut down normally',
+    )
+    END_MARKERS = (
+        'Apply batch completed',
+        'ready for connections',
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self.started = None
+        self.finished = None
+        # skip anything logged by earlier runs
+        try:
+            self.offset = os.path.getsize(path)
+        except OSError:
+            self.offset = 0
+
+    def check(self):
+        """Read new error log lines and note recovery starting or ending"""
+        try:
+            fileobj = open(self.path, 'r')
+        except IOError:
+            return
+        try:
+            fileobj.seek(self.offset)
+            data = fileobj.read()
+        finally:
+            fileobj.close()
+        # leave any partially written line for the next check
+        end = data.rfind('\n') + 1
+        self.offset += end
+        now = time.time()
+        for line in data[:end].splitlines():
+            if self.started is None:
+                if [marker for marker in self.START_MARKERS if marker in line]:
+                    self.started = now
+            elif self.finished is None:
+                if [marker for marker in self.END_MARKERS if marker in line]:
+                    self.finished = now
+
+    def elapsed(self, end=None):
+        """Seconds spent in crash recovery, or 0 if none was run
+
+        :param end: time to measure to if the end of recovery was not seen
+                    (default: now)
+        """
+        if self.started is None:
+            return 0.0
+        return (self.finished or end or time.time()) - self.started
@@ -2,47 +2,168 @@
 
 import os
 import time
+import shutil
 import signal
 import logging
-from cStringIO import StringIO
-from subprocess import Popen, STDOUT, list2cmdline
+import tempfile
 from holland.core.exceptions import BackupError
-from _mysqld import locate_mysqld_exe, generate_server_config, MySQLServer
+from holland.core.util.process import ProcessSupervisor
+from holland.lib.pagecache import DroppingReader
+from _mysqld import locate_mysqld_exe, generate_server_config, MySQLServer, \
+                    RecoveryTimer
 
 LOG = logging.getLogger(__name__)
 
+#: directory in the backup that prepare-later copies InnoDB redo logs to
+INNODB_LOG_DIR = 'innodb_logs'
+#: directory MySQL 8.0.30 and later keep redo logs in, within
+#: innodb_log_group_home_dir
+INNODB_REDO_DIR = '#innodb_redo'
+
 class InnodbRecoveryAction(object):
-    def __init__(self, mysqld_config):
+    """Run InnoDB crash recovery on the mounted snapshot
+
+    If ``status`` is given, the seconds recovery took are recorded there as
+    recovery-time.
+    """
+    def __init__(self, mysqld_config, status=None):
         self.mysqld_config = mysqld_config
+        self.status = status
         if 'datadir' not in mysqld_config:
             raise BackupError("datadir must be set for InnodbRecovery")
 
     def __call__(self, event, snapshot_fsm, snapshot):
         LOG.info("Starting InnoDB recovery")
+        run_recovery(self.mysqld_config, snapshot_fsm.supervisor,
+                     status=self.status)
+
+class CopyInnodbLogsAction(object):
+    """Copy the InnoDB redo logs off the snapshot
+
+    With prepare-later, crash recovery is run on a restored copy of the
+    backup rather than on the snapshot.  Unless ``archived`` says the logs
+    are archived along with the datadir, they are copied to the
+    innodb_logs directory of the backup.  ``status`` records what
+    recovery will need.
+    """
+    def __init__(self, logdir, spooldir, status, archived=False):
+        self.logdir = logdir
+        self.spooldir = spooldir
+        self.status = status
+        self.archived = archived
+
+    def __call__(self, event, snapshot_fsm, snapshot):
+        names = innodb_log_files(self.logdir)
+        if not names:
+            raise BackupError("No InnoDB redo logs found in %s" % self.logdir)
+        size = 0
+        if self.archived:
+            for name in names:
+                size += os.path.getsize(os.path.join(self.logdir, name))
+            LOG.info("%d InnoDB redo log(s) in %s are archived with the "
+                     "datadir. Not copying them.", len(names), self.logdir)
+            self.status['logs-copied'] = 'no'
+        else:
+            target = os.path.join(self.spooldir, INNODB_LOG_DIR)
+            for name in names:
+                path = os.path.join(target, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                size += copy_file(os.path.join(self.logdir, name), path)
+            LOG.info("Copied %d InnoDB redo log(s) to %s", len(names), target)
+            self.status['logs-copied'] = 'yes'
+        self.status['prepared'] = 'no'
+        self.status['log-files'] = ','.join(names)
+        self.status['log-bytes'] = str(size)
+
+def innodb_log_files(logdir):
+    """List the InnoDB redo logs in ``logdir``, relative to it
 
-        mysqld_exe = locate_mysqld_exe(self.mysqld_config)
-        LOG.info("Bootstrapping with %s", mysqld_exe)
+    These are the ib_logfile<N> files and, for MySQL 8.0.30 and later, the
+    #ib_redo<N> files in #innodb_redo.  The spare #ib_redo<N>_tmp files
+    hold no redo and are skipped.
+    """
+    names = [name for name in sorted(os.listdir(logdir))
+             if name.startswith('ib_logfile')]
+    redo_dir = os.path.join(logdir, INNODB_REDO_DIR)
+    if os.path.isdir(redo_dir):
+        names.extend([os.path.join(INNODB_REDO_DIR, name)
+                      for name in sorted(os.listdir(redo_dir))
+                      if name.startswith('#ib_redo') and
+                      not name.endswith('_tmp')])
+    return names
 
-        mycnf_path = os.path.join(self.mysqld_config['datadir'], 
-                                  'my.innodb_recovery.cnf')
-        self.mysqld_config['log-error'] = 'innodb_recovery.log'
-        my_conf = generate_server_config(self.mysqld_config,
-                                         mycnf_path)
-        
+def copy_file(src, dst, bufsize=1024*1024):
+    """Copy src to dst without filling the page cache with src
+
+    :returns: bytes copied
+    """
+    reader = DroppingReader(src)
+    try:
+        writer = open(dst, 'wb')
+        try:
+            copied = 0
+            while True:
+                data = reader.read(bufsize)
+                if not data:
+                    break
+                writer.write(data)
+                copied += len(data)
+        finally:
+            writer.close()
+    finally:
+        reader.close()
+    return copied
+
+def run_recovery(mysqld_config, supervisor=None, status=None):
+    """Run InnoDB crash recovery on ``mysqld_config['datadir']`` with
+    mysqld --bootstrap
+
+    mysqld uses a scratch directory below the configured tmpdir, which is
+    removed afterwards.
+
+    :raises: BackupError if mysqld fails
+    """
+    if supervisor is None:
+        supervisor = ProcessSupervisor()
+    datadir = mysqld_config['datadir']
+    mysqld_exe = locate_mysqld_exe(mysqld_config)
+    LOG.info("Bootstrapping with %s", mysqld_exe)
+
+    mycnf_path = os.path.join(datadir, 'my.innodb_recovery.cnf')
+    mysqld_config['log-error'] = 'innodb_recovery.log'
+    scratch = tempfile.mkdtemp(prefix='holland-recovery.',
+                               dir=mysqld_config.get('tmpdir') or None)
+    mysqld_config['tmpdir'] = scratch
+    try:
+        my_conf = generate_server_config(mysqld_config, mycnf_path)
+
+        recovery = RecoveryTimer(os.path.join(datadir, 'innodb_recovery.log'))
+        started = time.time()
         mysqld = MySQLServer(mysqld_exe, my_conf)
         mysqld.start(bootstrap=True)
 
-        while mysqld.poll() is None:
-            if signal.SIGINT in snapshot_fsm.sigmgr.pending:
-                mysqld.kill(signal.SIGKILL)
-            time.sleep(0.5)
+        def follow_log():
+            recovery.check()
+            return False
+        # returns once mysqld exits or the backup is interrupted
+        supervisor.wait_for(follow_log, [mysqld.process])
+        if mysqld.poll() is None:
+            mysqld.kill(signal.SIGKILL)
+        mysqld.wait()
+        elapsed = time.time() - started
         LOG.info("%s has stopped", mysqld_exe)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
 
-        if mysqld.returncode != 0:
-            datadir = self.mysqld_config['datadir']
-            for line in open(os.path.join(datadir, 'innodb_recovery.log'), 'r'):
-                LOG.error("%s", line.rstrip())
-            raise BackupError("%s exited with non-zero status (%s) during "
-                              "InnoDB recovery" % (mysqld_exe, mysqld.returncode))
-        else:
-            LOG.info("%s ran successfully", mysqld_exe)
+    if mysqld.returncode != 0:
+        for line in open(os.path.join(datadir, 'innodb_recovery.log'), 'r'):
+            LOG.error("%s", line.rstrip())
+        raise BackupError("%s exited with non-zero status (%s) during "
+                          "InnoDB recovery" % (mysqld_exe, mysqld.returncode))
+    recovery.check()
+    LOG.info("%s ran successfully. InnoDB recovery took %.2fs "
+             "(%.2fs applying redo logs)", mysqld_exe, elapsed,
+             recovery.elapsed(started + elapsed))
+    if status is not None:
+        status['recovery-time'] = '%.2f' % elapsed
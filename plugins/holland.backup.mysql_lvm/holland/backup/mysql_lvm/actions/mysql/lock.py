@@ -1,20 +1,46 @@
 import logging
+from holland.core.exceptions import BackupError
+from holland.lib.mysql import MySQLError
+from holland.lib.mysql.lock import GlobalReadLock, LockError
 
 LOG = logging.getLogger(__name__)
 
 class FlushAndLockMySQLAction(object):
-    def __init__(self, client, extra_flush=True):
+    def __init__(self, client, extra_flush=True, lock=None, status=None):
         self.client = client
         self.extra_flush = extra_flush
+        if lock is None:
+            lock = GlobalReadLock(client, extra_flush=extra_flush)
+        self.lock = lock
+        self.status = status
 
     def __call__(self, event, snapshot_fsm, snapshot_vol):
         if event == 'pre-snapshot':
-            if self.extra_flush:
-                LOG.debug("Executing FLUSH TABLES")
-                self.client.flush_tables()
-            LOG.debug("Executing FLUSH TABLES WITH READ LOCK")
             LOG.info("Acquiring read-lock and flushing tables")
-            self.client.flush_tables_with_read_lock()
+            try:
+                try:
+                    self.lock.acquire()
+                except LockError, exc:
+                    raise BackupError(str(exc))
+                except MySQLError, exc:
+                    raise BackupError("MySQL error while acquiring read "
+                                      "lock [%d] %s" % exc.args)
+            finally:
+                if self.status is not None:
+                    self.lock.record(self.status)
         elif event == 'post-snapshot':
             LOG.info("Releasing read-lock")
-            self.client.unlock_tables()
+            self.lock.release()
+            if self.status is not None:
+                self.lock.record(self.status)
+
+def global_read_lock(client, config):
+    """Create a `GlobalReadLock` from the lock options in a [mysql-lvm]
+    config section"""
+    return GlobalReadLock(client,
+                          policy=config['lock-wait-policy'],
+                          long_query_time=config['lock-wait-query-time'],
+                          max_wait=config['lock-wait-max'],
+                          lock_wait_timeout=config['lock-wait-timeout'],
+                          retries=config['lock-wait-retries'],
+                          extra_flush=config['extra-flush-tables'])
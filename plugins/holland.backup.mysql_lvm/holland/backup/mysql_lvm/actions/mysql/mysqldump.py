@@ -4,15 +4,29 @@ import os
 import time
 import signal
 import logging
-from holland.lib.mysql import connect, MySQLError, PassiveMySQLClient
-from _mysqld import generate_server_config, MySQLServer, locate_mysqld_exe
+from holland.core.exceptions import BackupError
+from holland.lib.mysql import MySQLError
+from _mysqld import generate_server_config, MySQLServer, locate_mysqld_exe, \
+                    RecoveryTimer, cpu_count
 
 LOG = logging.getLogger(__name__)
 
 class MySQLDumpDispatchAction(object):
-    def __init__(self, mysqldump_plugin, mysqld_config):
+    """Start a mysqld against the snapshot and run mysqldump against it
+
+    If ``status`` is given, the seconds spent starting mysqld (excluding
+    InnoDB crash recovery), in crash recovery and running mysqldump are
+    recorded there as startup-time, recovery-time and dump-time.
+
+    Nothing else uses the snapshot mysqld, so up to ``parallel`` databases
+    (0 = one per CPU) are dumped at once without locking.
+    """
+    def __init__(self, mysqldump_plugin, mysqld_config, status=None,
+                 parallel=1):
         self.mysqldump_plugin = mysqldump_plugin
         self.mysqld_config = mysqld_config
+        self.status = status
+        self.parallel = parallel or cpu_count()
 
     def __call__(self, event, snapshot_fsm, snapshot):
         LOG.info("Handing-off to mysqldump plugin")
@@ -35,31 +49,71 @@ class MySQLDumpDispatchAction(object):
 
         # log-bin is disabled to avoid conflict with the normal mysqld process
         self.mysqldump_plugin.config['mysqldump']['bin-log-position'] = False
+        if self.parallel > 1:
+            if self.mysqldump_plugin.config['mysqldump']['file-per-database']:
+                self.mysqldump_plugin.parallel = self.parallel
+            else:
+                LOG.info("file-per-database is disabled. Not dumping "
+                         "databases in parallel.")
 
         mysqld = MySQLServer(mysqld_exe, my_conf)
+        recovery = RecoveryTimer(os.path.join(datadir, 'holland_lvm.log'))
+        started = time.time()
         mysqld.start(bootstrap=False)
         LOG.info("Waiting for %s to start", mysqld_exe)
 
         try:
-            wait_for_mysqld(self.mysqldump_plugin.mysql_config['client'],
-                            mysqld)
+            if not wait_for_mysqld(self.mysqldump_plugin.pool, mysqld,
+                                   snapshot_fsm.supervisor, recovery):
+                if snapshot_fsm.interrupted():
+                    raise KeyboardInterrupt("Interrupted")
+                raise BackupError("%s exited before accepting connections "
+                                  "(see %s)" %
+                                  (mysqld_exe,
+                                   os.path.join(datadir, 'holland_lvm.log')))
             LOG.info("%s accepting connections on unix socket %s", mysqld_exe, socket)
+            recovery_time = recovery.elapsed()
+            startup_time = time.time() - started - recovery_time
+            LOG.info("mysqld started in %.2fs (InnoDB crash recovery took "
+                     "%.2fs)", startup_time, recovery_time)
+            dump_started = time.time()
             self.mysqldump_plugin.backup()
+            dump_time = time.time() - dump_started
+            LOG.info("mysqldump completed in %.2fs", dump_time)
+            if self.status is not None:
+                self.status['startup-time'] = '%.2f' % startup_time
+                self.status['recovery-time'] = '%.2f' % recovery_time
+                self.status['dump-time'] = '%.2f' % dump_time
+                self.status['parallel-dumps'] = \
+                    str(self.mysqldump_plugin.parallel)
         finally:
             mysqld.kill(signal.SIGKILL) # DIE DIE DIE
             mysqld.stop() # we dont' really care about the exit code, if mysqldump ran smoothly :)
 
-def wait_for_mysqld(config, mysqld):
-    client = connect(config, PassiveMySQLClient)
+def wait_for_mysqld(pool, mysqld, supervisor, recovery=None):
+    """Wait until mysqld accepts connections
+
+    If ``recovery`` (a `RecoveryTimer`) is given, it is checked each time
+    the connection is retried.
+
+    :returns: False if mysqld exited or the wait was interrupted
+    """
+    # the connection is returned to the pool for the mysqldump plugin to use
+    client = pool.client()
     LOG.debug("connect via client %r", client)
-    while mysqld.process.poll() is None:
+    def ready():
+        if recovery is not None:
+            recovery.check()
         try:
             client.connect()
             client.ping()
-            LOG.debug("Ping succeeded")
         except MySQLError:
-            time.sleep(0.75)
-            continue
-        else:
-            break
-    client.disconnect()
+            return False
+        LOG.debug("Ping succeeded")
+        if recovery is not None:
+            recovery.check()
+        return True
+    try:
+        return supervisor.wait_for(ready, [mysqld.process])
+    finally:
+        client.disconnect()
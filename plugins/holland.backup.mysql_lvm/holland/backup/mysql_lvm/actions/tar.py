@@ -1,47 +1,192 @@
 import os
-import time
+import heapq
+import fcntl
 import shlex
 import signal
 import logging
+from fnmatch import fnmatch
 from subprocess import list2cmdline, Popen, CalledProcessError
 from holland.core.exceptions import BackupError
+from holland.lib.archive import TarStreamWriter
+from holland.lib.pagecache import cache_dropper
 
 LOG = logging.getLogger(__name__)
 
+def tar_argv(config, directory, files_from=None, paths=None):
+    """Build a tar --create command line from a [tar] config section
+
+    :param directory: directory to archive
+    :param files_from: file listing every path under ``directory`` to
+                       archive.  Directories listed there are archived
+                       without their contents.  If not given, all of
+                       ``directory`` is archived.
+    :param paths: paths under ``directory`` to archive.  Exclude patterns
+                  are applied relative to each of them.
+    """
+    argv = [
+        'tar',
+        '--create',
+        '--file', '-',
+        '--verbose',
+        '--totals',
+    ]
+
+    pre_args = config['pre-args']
+    if pre_args:
+        LOG.info("Adding tar pre-args: %s", pre_args)
+        pre_args = [arg.decode('utf8')
+                    for arg in shlex.split(pre_args.encode('utf8'))]
+        argv.extend(pre_args)
+    argv.extend(['--directory', directory])
+    for param in config['exclude']:
+        for base in paths or ['.']:
+            argv.append("--exclude")
+            argv.append(os.path.join(base, param))
+    if files_from:
+        argv.extend(['--no-recursion', '--files-from', files_from])
+    elif paths:
+        argv.extend(paths)
+    else:
+        argv.append('.')
+    post_args = config['post-args']
+    if post_args:
+        LOG.info("Adding tar post-args: %s", post_args)
+        post_args = [arg.decode('utf8')
+                     for arg in shlex.split(post_args.encode('utf8'))]
+        argv.extend(post_args)
+    return argv
+
+def _excluded(path, exclude):
+    """Check whether the relative path ``path`` matches an exclude pattern"""
+    for pattern in exclude:
+        if fnmatch(path, os.path.join('.', pattern)):
+            return True
+    return False
+
+def _exclude_under(base, exclude):
+    """Build a predicate matching member names below ``base`` against the
+    exclude patterns, as tar_argv anchors them for tar"""
+    patterns = [os.path.join(base, pattern) for pattern in exclude]
+    def excluded(name):
+        for pattern in patterns:
+            if fnmatch(name, pattern):
+                return True
+        return False
+    return excluded
+
+def _walk_tree(datadir, relpath, exclude):
+    """List everything under a directory of ``datadir``
+
+    Excluded entries are skipped, along with the contents of excluded
+    directories.  Symlinks to directories are listed, not followed.
+
+    :returns: tuple of ([relative path, ...] of the directory itself, its
+              subdirectories and symlinks to directories,
+              [(relative path, size), ...] of everything else)
+    """
+    dirs = [os.path.join('.', relpath)]
+    files = []
+    for dirpath, dirnames, filenames in os.walk(os.path.join(datadir,
+                                                             relpath)):
+        for name in list(dirnames):
+            rel = '.' + os.path.join(dirpath, name)[len(datadir):]
+            if _excluded(rel, exclude):
+                dirnames.remove(name)
+            else:
+                dirs.append(rel)
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            rel = '.' + path[len(datadir):]
+            if _excluded(rel, exclude):
+                continue
+            try:
+                files.append((rel, os.lstat(path).st_size))
+            except OSError:
+                continue
+    return dirs, files
+
+def partition_datadir(datadir, count, exclude=()):
+    """Split a datadir into ``count`` work units of similar size
+
+    Each top level entry (normally one directory per database) is a
+    candidate work unit.  Directories larger than an even share of the
+    datadir are split into their individual files, so a single large
+    database can still be spread across several units; the directory
+    itself, its subdirectories and symlinks then stay together in one
+    unit.  Units are filled largest item first.
+
+    Every path to archive is listed, directories included, so the units
+    are meant to be archived without recursion (see `tar_argv`).  The
+    datadir itself is listed as '.' in the largest unit.
+
+    :returns: list of (size, [relative path, ...]) tuples, largest first
+    """
+    datadir = os.path.normpath(datadir)
+    entries = []
+    for name in sorted(os.listdir(datadir)):
+        rel = os.path.join('.', name)
+        if _excluded(rel, exclude):
+            continue
+        path = os.path.join(datadir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            dirs, files = _walk_tree(datadir, name, exclude)
+            size = sum([file_size for file_path, file_size in files])
+            entries.append((size, dirs, files))
+        else:
+            entries.append((os.lstat(path).st_size, [rel], []))
+
+    total = sum([entry[0] for entry in entries])
+    share = total / max(count, 1)
+    items = []
+    for size, dirs, files in entries:
+        if files and size > share:
+            items.append((0, dirs))
+            items.extend([(file_size, [file_path])
+                          for file_path, file_size in files])
+        else:
+            items.append((size, dirs + [file_path
+                                        for file_path, _ in files]))
+    items.sort()
+    items.reverse()
+
+    units = [(0, index, []) for index in range(count)]
+    for size, paths in items:
+        unit_size, index, unit_paths = heapq.heappop(units)
+        unit_paths.extend(paths)
+        heapq.heappush(units, (unit_size + size, index, unit_paths))
+    units.sort()
+    units.reverse()
+    units = [(size, paths) for size, index, paths in units if paths]
+    if units:
+        units[0][1].insert(0, '.')
+    # directories before their contents
+    for size, paths in units:
+        paths.sort()
+    return units
+
+def drop_reads(process, directory, config):
+    """Drop pages of files under ``directory`` from the page cache as the
+    tar ``process`` reads them, if the [tar] page-cache option is 'drop'"""
+    if config.get('page-cache', 'keep') == 'drop':
+        cache_dropper().add_process(process.pid, directory)
+
+def stop_drop_reads(process, config):
+    """Stop dropping pages read by ``process``, dropping any files it
+    still had open"""
+    if config.get('page-cache', 'keep') == 'drop':
+        cache_dropper().remove_process(process.pid)
+
 class TarArchiveAction(object):
-    def __init__(self, snap_datadir, archive_stream, config):
+    def __init__(self, snap_datadir, archive_stream, config, paths=None):
         self.snap_datadir = snap_datadir
         self.archive_stream = archive_stream
         self.config = config
+        self.paths = paths
 
     def __call__(self, event, snapshot_fsm, snapshot_vol):
-        argv = [
-            'tar',
-            '--create',
-            '--file', '-',
-            '--verbose',
-            '--totals',
-            '--directory', self.snap_datadir,
-            '.'
-        ]
-
+        argv = tar_argv(self.config, self.snap_datadir, paths=self.paths)
         pre_args = self.config['pre-args']
-        if pre_args:
-            LOG.info("Adding tar pre-args: %s", pre_args)
-            pre_args = [arg.decode('utf8')
-                        for arg in shlex.split(pre_args.encode('utf8'))]
-            for option in pre_args:
-                argv.insert(-3, option)
-        for param in self.config['exclude']:
-            argv.insert(-1, "--exclude")
-            argv.insert(-1, os.path.join('.', param))
         post_args = self.config['post-args']
-        if post_args:
-            LOG.info("Adding tar post-args: %s", post_args)
-            post_args = [arg.decode('utf8')
-                         for arg in shlex.split(post_args.encode('utf8'))]
-            for option in post_args:
-                argv.append(option)
         LOG.info("Running: %s > %s", list2cmdline(argv), self.archive_stream.name)
 
         archive_dirname = os.path.dirname(self.archive_stream.name)
@@ -57,10 +202,13 @@ class TarArchiveAction(object):
                         stdout=self.archive_stream,
                         stderr=open(archive_log, 'w'),
                         close_fds=True)
-        while process.poll() is None:
-            if signal.SIGINT in snapshot_fsm.sigmgr.pending:
+        drop_reads(process, self.snap_datadir, self.config)
+        try:
+            if not snapshot_fsm.supervisor.wait([process]):
                 os.kill(process.pid, signal.SIGKILL)
-            time.sleep(0.5)
+                process.wait()
+        finally:
+            stop_drop_reads(process, self.config)
 
         try:
             self.archive_stream.close()
@@ -80,3 +228,170 @@ class TarArchiveAction(object):
             for line in open(archive_log, 'r').readlines()[-10:]:
                 LOG.error(" ! %s", line.rstrip())
             raise CalledProcessError(process.returncode, "tar")
+
+class PythonTarArchiveAction(object):
+    """Archive a snapshot datadir without running tar
+
+    Used with the [tar] writer = python option.  The archive is written by
+    holland.lib.archive.TarStreamWriter, which moves file data with
+    sendfile(2) and stores files with holes as GNU sparse members, while
+    read ahead threads keep the stream supplied.  pre-args and post-args
+    do not apply.
+    """
+    def __init__(self, snap_datadir, archive_stream, config, paths=None):
+        self.snap_datadir = snap_datadir
+        self.archive_stream = archive_stream
+        self.config = config
+        self.paths = paths
+
+    def __call__(self, event, snapshot_fsm, snapshot_vol):
+        if self.config['pre-args'] or self.config['post-args']:
+            LOG.warning("[tar] pre-args and post-args are ignored with "
+                        "writer = python")
+        exclude = self.config['exclude']
+        writer = TarStreamWriter(self.archive_stream,
+                                 page_cache=self.config.get('page-cache',
+                                                            'keep'),
+                                 read_ahead=self.config.get('read-ahead', 4),
+                                 interrupted=snapshot_fsm.interrupted)
+        LOG.info("Archiving %s > %s", self.snap_datadir,
+                 self.archive_stream.name)
+        try:
+            try:
+                for path in self.paths or ['.']:
+                    if not writer.add_tree(os.path.join(self.snap_datadir,
+                                                        path),
+                                           path,
+                                           _exclude_under(path, exclude)):
+                        break
+                writer.close()
+            finally:
+                self.archive_stream.close()
+        except (IOError, OSError), exc:
+            LOG.error("Writing %s failed: %s", self.archive_stream.name, exc)
+            raise BackupError(str(exc))
+
+        if snapshot_fsm.interrupted():
+            raise KeyboardInterrupt("Interrupted")
+        LOG.info("Archived %d file(s), %d byte(s) of data. %d sparse file(s) "
+                 "saved %d byte(s) of holes.", writer.files, writer.bytes,
+                 writer.sparse_files, writer.holes)
+
+class ParallelTarArchiveAction(object):
+    """Archive a snapshot datadir as several tar streams at once
+
+    The datadir is split into ``config['streams']`` work units with
+    `partition_datadir` and each unit is archived by its own tar process
+    into its own (compressed) stream, which shortens the time the snapshot
+    has to exist on a large datadir.
+
+    ``open_archive`` is called with an archive file name (e.g.
+    backup.0.tar) and should return an open output stream for it.  The
+    archives, and the file listing the paths in each, are described by
+    backup.manifest in ``spooldir``.  Extracting every archive into the same
+    directory restores the datadir.
+    """
+    def __init__(self, snap_datadir, spooldir, open_archive, config):
+        self.snap_datadir = snap_datadir
+        self.spooldir = spooldir
+        self.open_archive = open_archive
+        self.config = config
+
+    def __call__(self, event, snapshot_fsm, snapshot_vol):
+        units = partition_datadir(self.snap_datadir,
+                                  self.config['streams'],
+                                  self.config['exclude'])
+        LOG.info("Archiving %s as %d parallel tar stream(s)",
+                 self.snap_datadir, len(units))
+        jobs = []
+        try:
+            for index, (size, paths) in enumerate(units):
+                jobs.append(self._start(index, size, paths))
+            self._write_manifest(jobs)
+            snapshot_fsm.supervisor.wait([job['process'] for job in jobs])
+        finally:
+            self._kill(jobs)
+            errors = self._close(jobs)
+
+        if signal.SIGINT in snapshot_fsm.sigmgr.pending:
+            raise KeyboardInterrupt("Interrupted")
+
+        for job in jobs:
+            returncode = job['process'].returncode
+            if returncode != 0:
+                LOG.error("tar exited with non-zero status: %d (%s)",
+                          returncode, job['archive'])
+                LOG.error("Tailing up to the last 10 lines of %s for "
+                          "troubleshooting:", os.path.basename(job['log']))
+                for line in open(job['log'], 'r').readlines()[-10:]:
+                    LOG.error(" ! %s", line.rstrip())
+                raise CalledProcessError(returncode, "tar")
+        if errors:
+            raise BackupError(errors[0])
+
+    def _start(self, index, size, paths):
+        """Start a tar process archiving ``paths``"""
+        files_from = os.path.join(self.spooldir, 'backup.%d.files' % index)
+        listing = open(files_from, 'w')
+        try:
+            for path in paths:
+                print >>listing, path
+        finally:
+            listing.close()
+        stream = self.open_archive('backup.%d.tar' % index)
+        # compressors started for later streams must not inherit this
+        # stream, or it would never see end of file
+        flags = fcntl.fcntl(stream.fileno(), fcntl.F_GETFD)
+        fcntl.fcntl(stream.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        argv = tar_argv(self.config, self.snap_datadir, files_from)
+        LOG.info("Running: %s > %s", list2cmdline(argv), stream.name)
+        archive_log = os.path.join(self.spooldir, 'archive.%d.log' % index)
+        process = Popen(argv,
+                        preexec_fn=os.setsid,
+                        stdout=stream,
+                        stderr=open(archive_log, 'w'),
+                        close_fds=True)
+        drop_reads(process, self.snap_datadir, self.config)
+        return dict(process=process, stream=stream, size=size,
+                    archive=os.path.basename(stream.name),
+                    files=os.path.basename(files_from),
+                    log=archive_log)
+
+    def _write_manifest(self, jobs):
+        """Describe how the archive streams fit together"""
+        path = os.path.join(self.spooldir, 'backup.manifest')
+        manifest = open(path, 'w')
+        try:
+            print >>manifest, "# Extract every archive listed here into the " \
+                              "same directory to restore"
+            print >>manifest, "# the MySQL datadir."
+            print >>manifest, "streams = %d" % len(jobs)
+            for job in jobs:
+                print >>manifest, "[%s]" % job['archive']
+                print >>manifest, "files = %s" % job['files']
+                print >>manifest, "estimated-size = %d" % job['size']
+        finally:
+            manifest.close()
+
+    def _kill(self, jobs):
+        """Kill any tar processes still running"""
+        for job in jobs:
+            if job['process'].poll() is None:
+                os.kill(job['process'].pid, signal.SIGKILL)
+                job['process'].wait()
+            stop_drop_reads(job['process'], self.config)
+
+    def _close(self, jobs):
+        """Close every archive stream
+
+        :returns: list of error messages
+        """
+        errors = []
+        for job in jobs:
+            try:
+                job['stream'].close()
+            except IOError, exc:
+                LOG.error("tar output stream %s failed: %s",
+                          job['stream'].name, exc)
+                errors.append(str(exc))
+        return errors
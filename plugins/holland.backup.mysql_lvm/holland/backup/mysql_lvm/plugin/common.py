@@ -1,56 +1,138 @@
 
 """Utility functions to help out the mysql-lvm plugin"""
 import os
+import time
 import errno
 import shutil
 import tempfile
 import logging
 from holland.core.exceptions import BackupError
+from holland.core.spool import previous_backups
 from holland.core.util.fmt import format_bytes
 from holland.lib.mysql import PassiveMySQLClient, MySQLError, \
-                              build_mysql_config, connect
-from holland.lib.lvm import Snapshot, parse_bytes
+                              build_mysql_config, connect, ConnectionPool
+from holland.core.util.path import getmount
+from holland.lib.lvm import LogicalVolume, Snapshot, SnapshotMonitor, \
+                            ThinPoolMonitor, parse_bytes
+from holland.backup.mysql_lvm.plugin.innodb import MySQLPathInfo
 
 LOG = logging.getLogger(__name__)
 
-def connect_simple(config):
+def connect_simple(config, pool=None):
     """Create a MySQLClientConnection given a mysql:client config
     section from a holland mysql backupset
+
+    If ``pool`` is given, the connection is checked out of that
+    `ConnectionPool` rather than opened directly.
     """
     try:
-        mysql_config = build_mysql_config(config)
-        LOG.debug("mysql_config => %r", mysql_config)
-        connection = connect(mysql_config['client'], PassiveMySQLClient)
+        if pool is None:
+            mysql_config = build_mysql_config(config)
+            LOG.debug("mysql_config => %r", mysql_config)
+            connection = connect(mysql_config['client'], PassiveMySQLClient)
+        else:
+            connection = pool.client()
         connection.connect()
         return connection
     except MySQLError, exc:
         raise BackupError("[%d] %s" % exc.args)
 
+def connection_pool(config):
+    """Create a ConnectionPool given a mysql:client config section from a
+    holland mysql backupset
+    """
+    mysql_config = build_mysql_config(config)
+    return ConnectionPool(mysql_config['client'])
+
 def cleanup_tempdir(path):
     LOG.info("Removing temporary mountpoint %s", path)
     shutil.rmtree(path)
 
-def build_snapshot(config, logical_volume, suppress_tmpdir=False):
-    """Create a snapshot process for running through the various steps
-    of creating, mounting, unmounting and removing a snapshot
+def snapshot_history(backup_directory, count):
+    """Find the snapshot usage recorded by up to ``count`` previous backups
+    in the backupset of ``backup_directory``
+
+    Failed backups are skipped, as a snapshot that overflowed records all
+    of its space as used however much more it would have needed.
+
+    :returns: list of (bytes used, seconds) tuples, newest first
+    """
+    history = []
+    if not count:
+        return history
+    for backup in previous_backups(backup_directory):
+        if backup.is_failed():
+            continue
+        section = backup.config.get('mysql-lvm:snapshot', {})
+        try:
+            used = int(section['snapshot-used'])
+            seconds = float(section['snapshot-seconds'])
+        except (KeyError, ValueError):
+            continue
+        if seconds > 0:
+            history.append((used, seconds))
+        if len(history) >= count:
+            break
+    return history
+
+def size_from_history(history, margin, extent_size):
+    """Size a snapshot from the usage of previous snapshots
+
+    The snapshot is sized to hold the fastest observed write rate for the
+    longest observed snapshot lifetime, plus ``margin`` percent.
+
+    :returns: snapshot size in extents or None if there is no history
+    """
+    if not history:
+        return None
+    rate = max([used / seconds for used, seconds in history])
+    duration = max([seconds for used, seconds in history])
+    size = rate * duration * (100 + margin) / 100
+    return max(int(size / extent_size) + 1, 1)
+
+def size_snapshot(config, logical_volume, requested=None, history=None,
+                  reserved=0):
+    """Work out how many extents to allocate to a snapshot of
+    ``logical_volume``
+
+    ``requested`` is a snapshot-size setting.  If it is not given the
+    snapshot is sized from ``history`` (see `snapshot_history`), or failing
+    that from the size of ``logical_volume``.  ``reserved`` extents of the
+    volume group's free space are already set aside for other snapshots.
+
+    :returns: snapshot size in extents or None for thin volumes
     """
-    snapshot_name = config['snapshot-name'] or \
-                    logical_volume.lv_name + '_snapshot'
     extent_size = int(logical_volume.vg_extent_size)
-    snapshot_size = config['snapshot-size']
-    if not snapshot_size:
-        snapshot_size = min(int(logical_volume.vg_free_count),
-                            (int(logical_volume.lv_size)*0.2) / extent_size,
-                            (15*1024**3) / extent_size,
-                           )
+    snapshot_size = requested
+    free = int(logical_volume.vg_free_count) - reserved
+    if logical_volume.is_thin():
+        LOG.info("%s is a thin volume. Creating a thin snapshot "
+                 "(snapshot-size is ignored)", logical_volume.device_name())
+        snapshot_size = None
+    elif not snapshot_size:
+        snapshot_size = size_from_history(history,
+                                          config['snapshot-size-margin'],
+                                          extent_size)
+        if snapshot_size is None:
+            snapshot_size = min(int(logical_volume.lv_size)*0.2,
+                                15*1024**3) / extent_size
+        else:
+            LOG.info("Sizing snapshot from %d previous backup(s)",
+                     len(history))
+        if snapshot_size > free:
+            LOG.info("Snapshot size %s is larger than the free space in "
+                     "volume group %s (%s)",
+                     format_bytes(snapshot_size*extent_size),
+                     logical_volume.vg_name,
+                     format_bytes(free*extent_size))
+            snapshot_size = free
         LOG.info("Auto-sizing snapshot-size to %s (%d extents)",
                  format_bytes(snapshot_size*extent_size),
                  snapshot_size)
         if snapshot_size < 1:
             raise BackupError("Insufficient free extents on %s "
                               "to create snapshot (free extents = %s)" %
-                              (logical_volume.device_name(),
-                              logical_volume.vg_free_count))
+                              (logical_volume.device_name(), free))
     else:
         try:
             _snapshot_size = snapshot_size
@@ -63,17 +145,135 @@ def build_snapshot(config, logical_volume, suppress_tmpdir=False):
             if snapshot_size < 1:
                 raise BackupError("Requested snapshot-size (%s) is "
                                   "less than 1 extent" % _snapshot_size)
-            if snapshot_size > int(logical_volume.vg_free_count):
+            if snapshot_size > free:
                 LOG.info("Snapshot size requested %s, but only %s available.",
-                         config['snapshot-size'],
-                         format_bytes(int(logical_volume.vg_free_count)*extent_size, precision=4))
+                         requested,
+                         format_bytes(free*extent_size, precision=4))
                 LOG.info("Truncating snapshot-size to %d extents (%s)",
-                         int(logical_volume.vg_free_count),
-                         format_bytes(int(logical_volume.vg_free_count)*extent_size, precision=4))
-                snapshot_size = int(logical_volume.vg_free_count)
+                         free,
+                         format_bytes(free*extent_size, precision=4))
+                snapshot_size = free
         except ValueError, exc:
             raise BackupError("Problem parsing snapshot-size %s" % exc)
 
+    if snapshot_size is not None:
+        snapshot_size = int(snapshot_size)
+    return snapshot_size
+
+def snapshot_volumes(client, datadir):
+    """Find the logical volumes holding the MySQL datadir and the InnoDB
+    log files and shared tablespaces
+
+    :returns: list of (LogicalVolume, mountpoint) tuples, one per
+              filesystem, with the datadir's first
+    """
+    paths = [datadir]
+    client.show_variables(('have_innodb',) + MySQLPathInfo.VARIABLES)
+    if client.show_variable('have_innodb') == 'YES':
+        pathinfo = MySQLPathInfo.from_mysql(client)
+        paths.append(pathinfo.get_innodb_logdir())
+        paths.extend(pathinfo.walk_innodb_shared_tablespaces())
+    volumes = []
+    seen = {}
+    for path in paths:
+        mountpoint = getmount(path)
+        if mountpoint in seen:
+            continue
+        seen[mountpoint] = True
+        try:
+            volume = LogicalVolume.lookup_from_fspath(path)
+        except LookupError, exc:
+            raise BackupError("Failed to lookup logical volume for %s: %s" %
+                              (path, str(exc)))
+        volumes.append((volume, mountpoint))
+    return volumes
+
+def snapshot_path(snapshot, path):
+    """Find where ``path`` on a snapshotted volume is on the mounted
+    snapshot"""
+    if snapshot.root:
+        return _mirror_path(snapshot.root, os.path.realpath(path))
+    return MySQLPathInfo.remap_path(path, snapshot.mountpoint)
+
+def remap_innodb_paths(mysqld_config, pathinfo, snapshot):
+    """Point the InnoDB paths of a mysqld started on the snapshot at the
+    snapshotted files
+
+    :param mysqld_config: dict of mysqld options to update
+    :param pathinfo: `MySQLPathInfo` of the server that was snapshotted
+    """
+    ibd_home_dir = pathinfo.innodb_data_home_dir
+    if ibd_home_dir:
+        # innodb_data_home_dir is set to something
+        ibd_home_dir = snapshot_path(snapshot,
+                                     pathinfo.get_innodb_datadir())
+        mysqld_config['innodb-data-home-dir'] = ibd_home_dir
+        LOG.info("Remapped innodb-data-home-dir from %s to %s for snapshot",
+                 pathinfo.get_innodb_datadir(), ibd_home_dir)
+
+    ibd_file_path = pathinfo.innodb_data_file_path
+    if ibd_file_path:
+        ibd_file_path = pathinfo.remap_tablespaces(
+            snapshot.mountpoint, lambda path: snapshot_path(snapshot, path))
+        mysqld_config['innodb-data-file-path'] = ibd_file_path
+        if ibd_file_path != pathinfo.innodb_data_file_path:
+            LOG.info("Remapped innodb-data-file-path from %s to %s for snapshot",
+                     pathinfo.innodb_data_file_path, ibd_file_path)
+            if not ibd_home_dir:
+                LOG.info("Remapped one or more tablespaces but "
+                         "innodb-data-home-dir is not set. Setting "
+                         "innodb-data-home-dir = '' to support absolute "
+                         "tablespace paths on snapshot.")
+                mysqld_config['innodb-data-home-dir'] = ""
+
+    ib_logdir = pathinfo.innodb_log_group_home_dir
+    if ib_logdir and ib_logdir != './':
+        ib_logdir = snapshot_path(snapshot,
+                                  pathinfo.get_innodb_logdir())
+        mysqld_config['innodb-log-group-home-dir'] = ib_logdir
+        LOG.info("Remapped innodb-log-group-home-dir from %s to %s for snapshot",
+                 pathinfo.get_innodb_logdir(), ib_logdir)
+
+def _mirror_path(root, path):
+    """Place the absolute ``path`` under ``root``"""
+    if root is None:
+        return None
+    return os.path.join(root, path.lstrip(os.sep))
+
+def _snapshot_monitor(config, logical_volume):
+    """Create a monitor for a snapshot of ``logical_volume``, if enabled"""
+    if not config['snapshot-extend-threshold']:
+        return None
+    if logical_volume.is_thin():
+        monitor_class = ThinPoolMonitor
+    else:
+        monitor_class = SnapshotMonitor
+    return monitor_class(config['snapshot-extend-threshold'],
+                         config['snapshot-extend-percent'],
+                         config['snapshot-monitor-interval'])
+
+def build_snapshot(config, logical_volume, suppress_tmpdir=False,
+                   status=None, history=None, volumes=None):
+    """Create a snapshot process for running through the various steps
+    of creating, mounting, unmounting and removing a snapshot
+
+    If ``status`` is given, snapshot usage is recorded in it when the
+    snapshot process finishes.  If ``history`` (as returned by
+    `snapshot_history`) is given and snapshot-size is not set, the snapshot
+    is sized from the usage of previous snapshots.
+
+    Thin volumes get a thin snapshot, which has no size of its own.  Its
+    thin pool is monitored instead of the snapshot.
+
+    If ``volumes`` (as returned by `snapshot_volumes`) lists more than one
+    volume, the others are snapshotted along with ``logical_volume``.  Each
+    snapshot is then mounted below the snapshot mountpoint at the path its
+    origin is mounted on; see `snapshot_path`.
+    """
+    snapshot_name = config['snapshot-name'] or \
+                    logical_volume.lv_name + '_snapshot'
+    snapshot_size = size_snapshot(config, logical_volume,
+                                  config['snapshot-size'], history)
     mountpoint = config['snapshot-mountpoint']
     tempdir = False
     if not mountpoint:
@@ -89,16 +289,52 @@ def build_snapshot(config, logical_volume, suppress_tmpdir=False):
             if exc.errno != errno.EEXIST:
                 raise BackupError("Failure creating snapshot mountpoint: %s" %
                                   str(exc))
-    snapshot = Snapshot(snapshot_name, int(snapshot_size), mountpoint)
+    root = None
+    if volumes and len(volumes) > 1:
+        # with suppress_tmpdir (dry-run) paths are still worked out
+        root = mountpoint or tempfile.gettempdir()
+        mountpoint = _mirror_path(root, volumes[0][1])
+    monitor = _snapshot_monitor(config, logical_volume)
+    snapshot = Snapshot(snapshot_name, snapshot_size, mountpoint,
+                        monitor=monitor, root=root)
+    if volumes and len(volumes) > 1:
+        # volumes in the same volume group share its free extents
+        reserved = {logical_volume.vg_name : snapshot_size or 0}
+        for volume, origin in volumes[1:]:
+            size = size_snapshot(config, volume,
+                                 reserved=reserved.get(volume.vg_name, 0))
+            reserved[volume.vg_name] = reserved.get(volume.vg_name, 0) + \
+                                       (size or 0)
+            snapshot.add_volume(volume, volume.lv_name + '_snapshot', size,
+                                _mirror_path(root, origin),
+                                monitor=_snapshot_monitor(config, volume))
+    if monitor and status is not None:
+        snapshot.register('finish',
+                          lambda *args, **kwargs: monitor.record(status))
+    snapshot.register('pre-remove',
+                      lambda event, volume:
+                      log_final_snapshot_size(event, volume, snapshot, status))
     if tempdir:
         snapshot.register('finish',
-                          lambda *args, **kwargs: cleanup_tempdir(mountpoint))
+                          lambda *args, **kwargs:
+                          cleanup_tempdir(root or mountpoint))
     return snapshot
 
-def log_final_snapshot_size(event, snapshot):
-    """Log the final size of the snapshot before it is removed"""
+def log_final_snapshot_size(event, snapshot, fsm=None, status=None):
+    """Log the final size of the snapshot before it is removed
+
+    If ``status`` is given, the final usage and how long the snapshot
+    existed (since the `Snapshot` ``fsm`` created it) are recorded there
+    so that later backups can size their snapshot from them.  Nothing is
+    recorded for thin snapshots, which are not sized.
+    """
     snapshot.reload()
+    if snapshot.is_thin():
+        return
     snap_percent = float(snapshot.snap_percent)/100
     snap_size = float(snapshot.lv_size)
     LOG.info("Final LVM snapshot size for %s is %s",
         snapshot.device_name(), format_bytes(snap_size*snap_percent))
+    if status is not None and fsm is not None and fsm.created:
+        status['snapshot-used'] = '%d' % (snap_size*snap_percent)
+        status['snapshot-seconds'] = '%.3f' % (time.time() - fsm.created)
@@ -65,17 +65,25 @@ class MySQLPathInfo(tuple):
     innodb_data_file_path = property(itemgetter(4))
     abs_tablespace_paths = property(itemgetter(5))
 
+    #: server variables read by from_mysql()
+    VARIABLES = ('datadir',
+                 'innodb_log_group_home_dir',
+                 'innodb_log_files_in_group',
+                 'innodb_data_home_dir',
+                 'innodb_data_file_path')
+
     #@classmethod
     def from_mysql(cls, mysql):
         """Create a MySQLPathInfo instance from a live MySQL connection"""
-        ibd_homedir = mysql.show_variable('innodb_data_home_dir')
+        variables = mysql.show_variables(cls.VARIABLES)
+        ibd_homedir = variables['innodb_data_home_dir']
         abs_tablespace_paths = bool(ibd_homedir == '')
         return cls(
-            datadir=mysql.show_variable('datadir'),
-            innodb_log_group_home_dir=mysql.show_variable('innodb_log_group_home_dir'),
-            innodb_log_files_in_group=mysql.show_variable('innodb_log_files_in_group'),
+            datadir=variables['datadir'],
+            innodb_log_group_home_dir=variables['innodb_log_group_home_dir'],
+            innodb_log_files_in_group=variables['innodb_log_files_in_group'],
             innodb_data_home_dir=ibd_homedir,
-            innodb_data_file_path=mysql.show_variable('innodb_data_file_path'),
+            innodb_data_file_path=variables['innodb_data_file_path'],
             abs_tablespace_paths=abs_tablespace_paths
         )
     from_mysql = classmethod(from_mysql)
@@ -125,12 +133,15 @@ class MySQLPathInfo(tuple):
         return os.path.join(mountpoint, rpath)
     remap_path = staticmethod(remap_path)
 
-    def remap_tablespaces(self, mountpoint):
+    def remap_tablespaces(self, mountpoint, remap=None):
         """Remap innodb-data-file-path paths to a new mountpoint
 
         innodb-data-file-path = /mnt/raid/ibdata/ibdata1:10M:autoextend
         >>> remap_tablespaces('/mnt/snapshot/')
         '/mnt/snapshot/ibdata/ibdata1:10M:autoextend'
+
+        If given, ``remap`` is called with each absolute tablespace path
+        and returns its new path, rather than remapping to ``mountpoint``.
         """
         innodb_data_home_dir = self.innodb_data_home_dir
         innodb_data_file_path = self.innodb_data_file_path
@@ -139,7 +150,10 @@ class MySQLPathInfo(tuple):
         for spec in innodb_data_file_path.split(';'):
             name, rest = spec.split(':', 1)
             if innodb_data_home_dir == '' and isabs(name):
-                name = self.remap_path(name, mountpoint)
+                if remap:
+                    name = remap(name)
+                else:
+                    name = self.remap_path(name, mountpoint)
             spec = ':'.join([name, rest])
             spec_list.append(spec)
         return ';'.join(spec_list)
@@ -157,7 +171,19 @@ def is_subdir(path, start):
         path, end = os.path.split(path)
     return path == start
 
-def check_innodb(pathinfo, ensure_subdir_of_datadir=False):
+def check_innodb(pathinfo, ensure_subdir_of_datadir=False,
+                 multiple_volumes=False):
+    """Check that InnoDB files can be backed up from a snapshot of the
+    datadir's volume
+
+    With ``multiple_volumes`` the volumes holding the InnoDB files are
+    snapshotted along with the datadir and archived by path, so files on
+    other filesystems or outside the datadir are allowed.
+
+    :raises: BackupError if the layout is unsafe
+    """
+    if multiple_volumes:
+        return
     is_unsafe_for_lvm = False
     is_unsafe_for_physical_backups = False
     datadir = realpath(pathinfo.datadir)
@@ -187,7 +213,8 @@ def check_innodb(pathinfo, ensure_subdir_of_datadir=False):
     if is_unsafe_for_lvm:
         raise BackupError("One or more InnoDB file paths are not on the same "
                           "logical volume as the datadir.  This is unsafe for "
-                          "LVM snapshot backups.")
+                          "LVM snapshot backups unless snapshot-all-volumes "
+                          "is enabled.")
     if is_unsafe_for_physical_backups:
         raise BackupError("One or more InnoDB files are not contained within "
                           "the MySQL datadir. A consistent filesystem backup "
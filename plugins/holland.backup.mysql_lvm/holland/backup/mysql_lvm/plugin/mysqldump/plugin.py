@@ -10,6 +10,8 @@ from holland.core.util.fmt import format_bytes
 from holland.core.util.path import directory_size
 from holland.core.exceptions import BackupError
 from holland.backup.mysql_lvm.plugin.common import build_snapshot, \
+                                                   snapshot_history, \
+                                                   snapshot_volumes, \
                                                    connect_simple
 from holland.backup.mysql_lvm.plugin.mysqldump.util import setup_actions
 from holland.backup.mysqldump import MySQLDumpPlugin
@@ -21,12 +23,34 @@ CONFIGSPEC = """
 # default: mysql lv + _snapshot
 snapshot-name = string(default=None)
 
-# default: minimum of 20% of mysql lv or mysql vg free size
+# default: sized from previous backups, otherwise the minimum of 20% of
+#          mysql lv or mysql vg free size
+#          (ignored for thin volumes, which get a thin snapshot)
 snapshot-size = string(default=None)
+# number of previous backups to size the snapshot from (0 = don't)
+snapshot-size-history = integer(min=0, default=5)
+# extra space to allow for when sizing from previous backups, in percent
+snapshot-size-margin = integer(min=0, default=50)
 
 # default: temporary directory
 snapshot-mountpoint = string(default=None)
 
+# also snapshot the volumes holding the InnoDB log files and tablespaces
+# when they are not on the datadir's volume
+snapshot-all-volumes = boolean(default=no)
+
+# databases to dump at once from the snapshot mysqld, without locking
+# (0 = one per CPU, 1 = dump serially using [mysqldump] lock-method)
+parallel-dumps = integer(min=0, default=1)
+
+# extend the snapshot (or for thin snapshots, the thin pool) when it is
+# this percent full (0 = never)
+snapshot-extend-threshold = integer(min=0, max=100, default=80)
+# grow the snapshot by this percent of its size each time
+snapshot-extend-percent = integer(min=1, default=25)
+# how often to check snapshot usage, in seconds
+snapshot-monitor-interval = integer(min=1, default=10)
+
 # default: flush tables with read lock by default
 lock-tables = boolean(default=yes)
 
@@ -34,12 +58,33 @@ lock-tables = boolean(default=yes)
 #          run flush tables with read lock
 extra-flush-tables = boolean(default=yes)
 
+# what to do about long running statements before locking:
+# ignore, wait, kill or abort
+lock-wait-policy = option('ignore', 'wait', 'kill', 'abort', default='ignore')
+# statements running at least this many seconds are considered long
+lock-wait-query-time = integer(min=1, default=60)
+# how long to wait for long statements to finish under wait/kill
+lock-wait-max = integer(min=0, default=300)
+# session lock_wait_timeout for each lock attempt (0 = server default)
+lock-wait-timeout = integer(min=0, default=0)
+# how many times to retry after lock-wait-timeout expires
+lock-wait-retries = integer(min=0, default=0)
+
 [mysqld]
 mysqld-exe              = force_list(default=list('mysqld', '/usr/libexec/mysqld'))
 user                    = string(default='mysql')
-innodb-buffer-pool-size = string(default=128M)
+# auto: sized from available memory, CPU count and the open file limit
+innodb-buffer-pool-size = string(default=auto)
+# largest buffer pool innodb-buffer-pool-size = auto will use
+innodb-buffer-pool-auto-max = string(default=1G)
+innodb-read-io-threads  = string(default=auto)
+open-files-limit        = string(default=auto)
+table-open-cache        = string(default=auto)
 key-buffer-size         = string(default=16M)
 tmpdir                  = string(default=None)
+# the snapshot is discarded after the dump, so skip durability
+innodb-doublewrite      = boolean(default=no)
+innodb-flush-log-at-trx-commit = integer(min=0, max=2, default=0)
 
 """.splitlines() + MySQLDumpPlugin.CONFIGSPEC
 
@@ -58,8 +103,10 @@ class MysqlDumpLVMBackup(object):
         self.name = name
         self.target_directory = target_directory
         self.dry_run = dry_run
-        self.client = connect_simple(self.config['mysql:client'])
         self.mysqldump_plugin = MySQLDumpPlugin(name, config, target_directory, dry_run)
+        # share connections with the mysqldump plugin's estimate phase
+        self.client = connect_simple(self.config['mysql:client'],
+                                     self.mysqldump_plugin.pool)
 
     def estimate_backup_size(self):
         """Estimate the backup size this plugin will produce
@@ -88,10 +135,27 @@ class MysqlDumpLVMBackup(object):
             raise BackupError("Failed to lookup logical volume for %s: %s" %
                               (datadir, str(exc)))
 
+        volumes = None
+        if self.config['mysql-lvm']['snapshot-all-volumes']:
+            try:
+                volumes = snapshot_volumes(self.client, datadir)
+            except MySQLError, exc:
+                raise BackupError("[%d] %s" % exc.args)
+            if len(volumes) > 1:
+                LOG.info("InnoDB files span %d logical volumes: %s",
+                         len(volumes),
+                         ', '.join([lv.device_name() for lv, _ in volumes]))
 
         # create a snapshot manager
         snapshot = build_snapshot(self.config['mysql-lvm'], volume,
-                                  suppress_tmpdir=self.dry_run)
+                                  suppress_tmpdir=self.dry_run,
+                                  volumes=volumes,
+                                  status=self.config.setdefault(
+                                      'mysql-lvm:snapshot', {}),
+                                  history=snapshot_history(
+                                      self.target_directory,
+                                      self.config['mysql-lvm']
+                                                 ['snapshot-size-history']))
         # calculate where the datadirectory on the snapshot will be located
         rpath = relpath(datadir, getmount(datadir))
         snap_datadir = os.path.abspath(os.path.join(snapshot.mountpoint or
@@ -111,33 +175,52 @@ class MysqlDumpLVMBackup(object):
                     self.config.filename)
             self.config['mysqldump']['bin-log-position'] = False
 
-        if self.dry_run:
-            self._dry_run(volume, snapshot, datadir)
-            # do the normal mysqldump dry-run
-            return self.mysqldump_plugin.backup()
-
         try:
-            snapshot.start(volume)
-        except CallbackFailuresError, exc:
-            # XXX: one of our actions failed.  Log this better
-            for callback, error in exc.errors:
-                LOG.error("%s", error)
-            raise BackupError("Error occurred during snapshot process. Aborting.")
-        except LVMCommandError, exc:
-            # Something failed in the snapshot process
-            raise BackupError(str(exc))
+            if self.dry_run:
+                self._dry_run(volume, snapshot, datadir)
+                # do the normal mysqldump dry-run
+                return self.mysqldump_plugin.backup()
+
+            try:
+                snapshot.start(volume)
+            except CallbackFailuresError, exc:
+                # XXX: one of our actions failed.  Log this better
+                for callback, error in exc.errors:
+                    LOG.error("%s", error)
+                raise BackupError("Error occurred during snapshot process. "
+                                  "Aborting.")
+            except LVMCommandError, exc:
+                # Something failed in the snapshot process
+                raise BackupError(str(exc))
+        finally:
+            self.client.disconnect()
+            self.mysqldump_plugin.pool.close()
 
     def _dry_run(self, volume, snapshot, datadir):
         """Implement dry-run for LVM snapshots.
         """
+        if snapshot.size is None:
+            size = 'thin'
+        else:
+            size = format_bytes(snapshot.size*int(volume.vg_extent_size))
         LOG.info("* Would snapshot source volume %s/%s as %s/%s (size=%s)",
              volume.vg_name,
              volume.lv_name,
              volume.vg_name,
              snapshot.name,
-             format_bytes(snapshot.size*int(volume.vg_extent_size)))
+             size)
         LOG.info("* Would mount on %s",
              snapshot.mountpoint or 'generated temporary directory')
+        for info in snapshot.volumes:
+            if info['size'] is None:
+                size = 'thin'
+            else:
+                size = format_bytes(info['size'] *
+                                    int(info['volume'].vg_extent_size))
+            LOG.info("* Would also snapshot %s as %s/%s (size=%s) and "
+                     "mount it on %s", info['volume'].device_name(),
+                     info['volume'].vg_name, info['name'], size,
+                     info['mountpoint'])
 
         snapshot_mountpoint = snapshot.mountpoint or tempfile.gettempdir()
         if getmount(self.target_directory) == getmount(datadir):
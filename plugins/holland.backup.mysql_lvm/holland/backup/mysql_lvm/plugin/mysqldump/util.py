@@ -11,8 +11,9 @@ from holland.lib.lvm import Snapshot, parse_bytes
 from holland.backup.mysql_lvm.actions import FlushAndLockMySQLAction, \
                                              RecordMySQLReplicationAction, \
                                              MySQLDumpDispatchAction
-from holland.backup.mysql_lvm.plugin.common import log_final_snapshot_size, \
-                                                   connect_simple
+from holland.backup.mysql_lvm.actions.mysql.lock import global_read_lock
+from holland.backup.mysql_lvm.plugin.common import connect_simple, \
+                                                   remap_innodb_paths
 from holland.backup.mysql_lvm.plugin.innodb import MySQLPathInfo, check_innodb
 
 LOG = logging.getLogger(__name__)
@@ -27,8 +28,10 @@ def setup_actions(snapshot, config, client, datadir, spooldir, plugin):
     """
 
     if config['mysql-lvm']['lock-tables']:
-        extra_flush = config['mysql-lvm']['extra-flush-tables']
-        act = FlushAndLockMySQLAction(client, extra_flush)
+        lock = global_read_lock(client, config['mysql-lvm'])
+        act = FlushAndLockMySQLAction(client, lock=lock,
+                                      status=config.setdefault('mysql:lock',
+                                                               {}))
         snapshot.register('pre-snapshot', act, priority=100)
         snapshot.register('post-snapshot', act, priority=100)
     if config['mysql-lvm'].get('replication', True):
@@ -41,46 +44,24 @@ def setup_actions(snapshot, config, client, datadir, spooldir, plugin):
     if not mysqld_config['tmpdir']:
         mysqld_config['tmpdir'] = tempfile.gettempdir()
 
+    # fetch every variable needed below in a single round trip
+    client.show_variables(('have_innodb', 'innodb_log_file_size') +
+                          MySQLPathInfo.VARIABLES)
     if client.show_variable('have_innodb') == 'YES':
         pathinfo = MySQLPathInfo.from_mysql(client)
-        check_innodb(pathinfo)
+        check_innodb(pathinfo, multiple_volumes=bool(snapshot.root))
 
         ib_log_size = client.show_variable('innodb_log_file_size')
         if ib_log_size:
             mysqld_config['innodb-log-file-size'] = ib_log_size
 
-        ibd_home_dir = pathinfo.innodb_data_home_dir
-        if ibd_home_dir:
-            # innodb_data_home_dir is set to something
-            ibd_home_dir = pathinfo.remap_path(pathinfo.get_innodb_datadir(),
-                                               snapshot.mountpoint)
-            mysqld_config['innodb-data-home-dir'] = ibd_home_dir
-            LOG.info("Remapped innodb-data-home-dir from %s to %s for snapshot",
-                     pathinfo.get_innodb_datadir(), ibd_home_dir)
+        remap_innodb_paths(mysqld_config, pathinfo, snapshot)
 
-        ibd_file_path = pathinfo.innodb_data_file_path
-        if ibd_file_path:
-            ibd_file_path = pathinfo.remap_tablespaces(snapshot.mountpoint)
-            mysqld_config['innodb-data-file-path'] = ibd_file_path
-            if ibd_file_path != pathinfo.innodb_data_file_path:
-                LOG.info("Remapped innodb-data-file-path from %s to %s for snapshot",
-                         pathinfo.innodb_data_file_path, ibd_file_path)
-                if not ibd_home_dir:
-                    LOG.info("Remapped one or more tablespaces but "
-                             "innodb-data-home-dir is not set. Setting "
-                             "innodb-data-home-dir = '' to support absolute "
-                             "tablespace paths on snapshot.")
-                    mysqld_config['innodb-data-home-dir'] = ""
-
-        ib_logdir = pathinfo.innodb_log_group_home_dir
-        if ib_logdir and ib_logdir != './':
-            ib_logdir = pathinfo.remap_path(pathinfo.get_innodb_logdir(),
-                                            snapshot.mountpoint)
-            mysqld_config['innodb-log-group-home-dir'] = ib_logdir
-            LOG.info("Remapped innodb-log-group-home-dir from %s to %s for snapshot",
-                     pathinfo.get_innodb_logdir(), ib_logdir)
-
-    act = MySQLDumpDispatchAction(plugin, mysqld_config)
+    act = MySQLDumpDispatchAction(plugin, mysqld_config,
+                                  status=config.setdefault('mysql-lvm:mysqld',
+                                                           {}),
+                                  parallel=config['mysql-lvm']
+                                                 ['parallel-dumps'])
     snapshot.register('post-mount', act, priority=100)
 
     errlog_src = os.path.join(datadir, 'holland_lvm.log')
@@ -89,5 +70,3 @@ def setup_actions(snapshot, config, client, datadir, spooldir, plugin):
                       lambda *args, **kwargs: shutil.copyfile(errlog_src,
                                                               errlog_dst)
                      )
-
-    snapshot.register('pre-remove', log_final_snapshot_size)
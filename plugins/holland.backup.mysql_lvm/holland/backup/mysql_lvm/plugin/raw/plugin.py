@@ -9,7 +9,10 @@ from holland.lib.lvm import LogicalVolume, CallbackFailuresError, \
                             LVMCommandError, relpath, getmount
 from holland.lib.mysql.client import MySQLError
 from holland.backup.mysql_lvm.plugin.common import build_snapshot, \
-                                                   connect_simple
+                                                   snapshot_history, \
+                                                   snapshot_volumes, \
+                                                   connect_simple, \
+                                                   connection_pool
 from holland.backup.mysql_lvm.plugin.raw.util import setup_actions
 
 LOG = logging.getLogger(__name__)
@@ -19,15 +22,37 @@ CONFIGSPEC = """
 # default: mysql lv + _snapshot
 snapshot-name = string(default=None)
 
-# default: minimum of 20% of mysql lv or mysql vg free size
+# default: sized from previous backups, otherwise the minimum of 20% of
+#          mysql lv or mysql vg free size
+#          (ignored for thin volumes, which get a thin snapshot)
 snapshot-size = string(default=None)
+# number of previous backups to size the snapshot from (0 = don't)
+snapshot-size-history = integer(min=0, default=5)
+# extra space to allow for when sizing from previous backups, in percent
+snapshot-size-margin = integer(min=0, default=50)
 
 # default: temporary directory
 snapshot-mountpoint = string(default=None)
 
+# also snapshot the volumes holding the InnoDB log files and tablespaces
+# when they are not on the datadir's volume
+snapshot-all-volumes = boolean(default=no)
+
+# extend the snapshot (or for thin snapshots, the thin pool) when it is
+# this percent full (0 = never)
+snapshot-extend-threshold = integer(min=0, max=100, default=80)
+# grow the snapshot by this percent of its size each time
+snapshot-extend-percent = integer(min=1, default=25)
+# how often to check snapshot usage, in seconds
+snapshot-monitor-interval = integer(min=1, default=10)
+
 # default: no
 innodb-recovery = boolean(default=no)
 
+# copy the InnoDB redo logs off the snapshot and leave crash recovery until
+# the backup is restored (holland restore <backup> --prepare)
+innodb-prepare-later = boolean(default=no)
+
 # ignore errors due to strange innodb configurations
 force-innodb-backup = boolean(default=no)
 
@@ -38,21 +63,64 @@ lock-tables = boolean(default=yes)
 #          run flush tables with read lock
 extra-flush-tables = boolean(default=yes)
 
+# what to do about long running statements before locking:
+# ignore, wait, kill or abort
+lock-wait-policy = option('ignore', 'wait', 'kill', 'abort', default='ignore')
+# statements running at least this many seconds are considered long
+lock-wait-query-time = integer(min=1, default=60)
+# how long to wait for long statements to finish under wait/kill
+lock-wait-max = integer(min=0, default=300)
+# session lock_wait_timeout for each lock attempt (0 = server default)
+lock-wait-timeout = integer(min=0, default=0)
+# how many times to retry after lock-wait-timeout expires
+lock-wait-retries = integer(min=0, default=0)
+
+# tar archives the whole datadir; incremental saves only the chunks of
+# each file that changed since the previous backup (see [incremental])
+archive-method = option('tar', 'incremental', default='tar')
+
 [mysqld]
 mysqld-exe              = force_list(default=list('mysqld', '/usr/libexec/mysqld'))
 user                    = string(default='mysql')
-innodb-buffer-pool-size = string(default=128M)
+# auto: sized from available memory and CPU count for redo log apply
+innodb-buffer-pool-size = string(default=auto)
+# largest buffer pool innodb-buffer-pool-size = auto will use
+innodb-buffer-pool-auto-max = string(default=1G)
+innodb-read-io-threads  = string(default=auto)
+innodb-write-io-threads = string(default=auto)
+# recovery runs in a scratch directory below this; use fast storage
 tmpdir                  = string(default=None)
+# mysqld shuts down cleanly after recovery, so these are safe to skip
+innodb-doublewrite      = boolean(default=no)
+innodb-flush-log-at-trx-commit = integer(min=0, max=2, default=0)
 
 [tar]
 exclude = force_list(default='mysql.sock')
 post-args = string(default=None)
 pre-args = string(default=None)
+# drop snapshot pages from the page cache as tar reads them
+page-cache = option('keep', 'drop', default='keep')
+# number of tar streams to archive the datadir with in parallel
+streams = integer(min=1, default=1)
+# tar runs GNU tar; python writes the archive in-process with sendfile and
+# stores sparse files compactly
+writer = option('tar', 'python', default='tar')
+# files the python writer asks the kernel to read ahead of the stream
+read-ahead = integer(min=0, default=4)
+
+[incremental]
+# files are compared with the previous backup in chunks of this size
+chunk-size = string(default='4M')
+# take a full backup after this many incremental backups (0 = never)
+full-interval = integer(min=0, default=6)
+exclude = force_list(default='mysql.sock')
 
 [compression]
 method = option('none', 'gzip', 'gzip-rsyncable', 'pigz', 'bzip2', 'pbzip2', 'lzop', 'gpg', default='gzip')
 options = string(default="")
 level = integer(min=0, max=9, default=1)
+# how backup output uses the page cache: keep, drop or direct (O_DIRECT)
+page-cache = option('keep', 'drop', 'direct', default='keep')
 
 [mysql:client]
 # default: ~/.my.cnf
@@ -89,7 +157,8 @@ class MysqlLVMBackup(object):
         self.name = name
         self.target_directory = target_directory
         self.dry_run = dry_run
-        self.client = connect_simple(self.config['mysql:client'])
+        self.pool = connection_pool(self.config['mysql:client'])
+        self.client = connect_simple(self.config['mysql:client'], self.pool)
 
     def estimate_backup_size(self):
         """Estimate the backup size this plugin will produce
@@ -128,10 +197,27 @@ class MysqlLVMBackup(object):
             raise BackupError("Failed to lookup logical volume for %s: %s" %
                               (datadir, str(exc)))
 
+        volumes = None
+        if self.config['mysql-lvm']['snapshot-all-volumes']:
+            try:
+                volumes = snapshot_volumes(self.client, datadir)
+            except MySQLError, exc:
+                raise BackupError("[%d] %s" % exc.args)
+            if len(volumes) > 1:
+                LOG.info("InnoDB files span %d logical volumes: %s",
+                         len(volumes),
+                         ', '.join([lv.device_name() for lv, _ in volumes]))
 
         # create a snapshot manager
         snapshot = build_snapshot(self.config['mysql-lvm'], volume,
-                                  suppress_tmpdir=self.dry_run)
+                                  suppress_tmpdir=self.dry_run,
+                                  volumes=volumes,
+                                  status=self.config.setdefault(
+                                      'mysql-lvm:snapshot', {}),
+                                  history=snapshot_history(
+                                      self.target_directory,
+                                      self.config['mysql-lvm']
+                                                 ['snapshot-size-history']))
         # calculate where the datadirectory on the snapshot will be located
         rpath = relpath(datadir, getmount(datadir))
         snap_datadir = os.path.abspath(os.path.join(snapshot.mountpoint, rpath))
@@ -142,31 +228,56 @@ class MysqlLVMBackup(object):
                       snap_datadir=snap_datadir,
                       spooldir=self.target_directory)
 
-        if self.dry_run:
-            return self._dry_run(volume, snapshot, datadir)
-
         try:
-            snapshot.start(volume)
-        except CallbackFailuresError, exc:
-            # XXX: one of our actions failed.  Log this better
-            for callback, error in exc.errors:
-                LOG.error("%s", error)
-            raise BackupError("Error occurred during snapshot process. Aborting.")
-        except LVMCommandError, exc:
-            # Something failed in the snapshot process
-            raise BackupError(str(exc))
+            if self.dry_run:
+                return self._dry_run(volume, snapshot, datadir)
+
+            try:
+                snapshot.start(volume)
+            except CallbackFailuresError, exc:
+                # XXX: one of our actions failed.  Log this better
+                for callback, error in exc.errors:
+                    LOG.error("%s", error)
+                raise BackupError("Error occurred during snapshot process. "
+                                  "Aborting.")
+            except LVMCommandError, exc:
+                # Something failed in the snapshot process
+                raise BackupError(str(exc))
+            # keep purge from removing the backups an incremental needs
+            depends_on = self.config.get('mysql-lvm:incremental',
+                                         {}).get('depends-on')
+            if depends_on:
+                self.config['holland:backup']['depends-on'] = \
+                    depends_on.split(',')
+        finally:
+            self.client.disconnect()
+            self.pool.close()
 
     def _dry_run(self, volume, snapshot, datadir):
         """Implement dry-run for LVM snapshots.
         """
+        if snapshot.size is None:
+            size = 'thin'
+        else:
+            size = format_bytes(snapshot.size*int(volume.vg_extent_size))
         LOG.info("* Would snapshot source volume %s/%s as %s/%s (size=%s)",
              volume.vg_name,
              volume.lv_name,
              volume.vg_name,
              snapshot.name,
-             format_bytes(snapshot.size*int(volume.vg_extent_size)))
+             size)
         LOG.info("* Would mount on %s",
              snapshot.mountpoint or 'generated temporary directory')
+        for info in snapshot.volumes:
+            if info['size'] is None:
+                size = 'thin'
+            else:
+                size = format_bytes(info['size'] *
+                                    int(info['volume'].vg_extent_size))
+            LOG.info("* Would also snapshot %s as %s/%s (size=%s) and "
+                     "mount it on %s", info['volume'].device_name(),
+                     info['volume'].vg_name, info['name'], size,
+                     info['mountpoint'])
 
         snapshot_mountpoint = snapshot.mountpoint or tempfile.gettempdir()
         if getmount(self.target_directory) == getmount(datadir):
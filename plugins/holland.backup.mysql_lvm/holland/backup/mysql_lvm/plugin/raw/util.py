@@ -5,13 +5,20 @@ import tempfile
 import logging
 from holland.core.backup import BackupError
 from holland.lib.compression import open_stream
+from holland.lib.lvm import parse_bytes, relpath
 from holland.backup.mysql_lvm.actions import FlushAndLockMySQLAction, \
                                              RecordMySQLReplicationAction, \
                                              InnodbRecoveryAction, \
-                                             TarArchiveAction
-from holland.backup.mysql_lvm.plugin.common import log_final_snapshot_size, \
-                                                   connect_simple
-from holland.backup.mysql_lvm.plugin.innodb import MySQLPathInfo, check_innodb
+                                             CopyInnodbLogsAction, \
+                                             TarArchiveAction, \
+                                             PythonTarArchiveAction, \
+                                             ParallelTarArchiveAction, \
+                                             IncrementalArchiveAction
+from holland.backup.mysql_lvm.actions.mysql.lock import global_read_lock
+from holland.backup.mysql_lvm.plugin.innodb import MySQLPathInfo, \
+                                                   check_innodb, is_subdir
+from holland.backup.mysql_lvm.plugin.common import remap_innodb_paths, \
+                                                   snapshot_path
 
 LOG = logging.getLogger(__name__)
 
@@ -21,50 +28,171 @@ def setup_actions(snapshot, config, client, snap_datadir, spooldir):
 
     Optional actions:
         * MySQL locking
-        * InnoDB recovery
+        * InnoDB recovery, or copying the redo logs for recovery later
         * Recording MySQL replication
     """
-    mysql = connect_simple(config['mysql:client'])
-    if mysql.show_variable('have_innodb') == 'YES':
+    # fetch every variable needed below in a single round trip
+    client.show_variables(('have_innodb', 'innodb_log_file_size',
+                           'innodb_redo_log_capacity') +
+                          MySQLPathInfo.VARIABLES)
+    pathinfo = None
+    if client.show_variable('have_innodb') == 'YES':
+        pathinfo = MySQLPathInfo.from_mysql(client)
         try:
-            pathinfo = MySQLPathInfo.from_mysql(mysql)
-        finally:
-            mysql.close()
-        try:
-            check_innodb(pathinfo, ensure_subdir_of_datadir=True)
+            check_innodb(pathinfo, ensure_subdir_of_datadir=True,
+                         multiple_volumes=bool(snapshot.root))
         except BackupError:
             if not config['mysql-lvm']['force-innodb-backup']:
                 raise
 
     if config['mysql-lvm']['lock-tables']:
-        extra_flush = config['mysql-lvm']['extra-flush-tables']
-        act = FlushAndLockMySQLAction(client, extra_flush)
+        lock = global_read_lock(client, config['mysql-lvm'])
+        act = FlushAndLockMySQLAction(client, lock=lock,
+                                      status=config.setdefault('mysql:lock',
+                                                               {}))
         snapshot.register('pre-snapshot', act, priority=100)
         snapshot.register('post-snapshot', act, priority=100)
     if config['mysql-lvm'].get('replication', True):
         repl_cfg = config.setdefault('mysql:replication', {})
         act = RecordMySQLReplicationAction(client, repl_cfg)
         snapshot.register('pre-snapshot', act, 0)
-    if config['mysql-lvm']['innodb-recovery']:
+    if config['mysql-lvm']['innodb-prepare-later']:
+        if pathinfo is None:
+            LOG.warning("innodb-prepare-later is enabled but InnoDB is not. "
+                        "Nothing to prepare.")
+        else:
+            if config['mysql-lvm']['innodb-recovery']:
+                LOG.info("innodb-prepare-later is enabled. Not running "
+                         "InnoDB recovery on the snapshot.")
+            status = config.setdefault('mysql-lvm:innodb', {})
+            record_innodb_layout(status, pathinfo,
+                                 client.show_variable('innodb_log_file_size'),
+                                 client.show_variable(
+                                     'innodb_redo_log_capacity'))
+            logdir = pathinfo.get_innodb_logdir()
+            # logs within the datadir are archived along with it
+            archived = is_subdir(logdir, os.path.realpath(pathinfo.datadir))
+            act = CopyInnodbLogsAction(snapshot_path(snapshot, logdir),
+                                       spooldir, status, archived=archived)
+            snapshot.register('post-mount', act, priority=100)
+    elif config['mysql-lvm']['innodb-recovery']:
         mysqld_config = dict(config['mysqld'])
         mysqld_config['datadir'] = snap_datadir
         if not mysqld_config['tmpdir']:
             mysqld_config['tmpdir'] = tempfile.gettempdir()
         ib_log_size = client.show_variable('innodb_log_file_size')
         mysqld_config['innodb-log-file-size'] = ib_log_size
-        act = InnodbRecoveryAction(mysqld_config)
+        if snapshot.root and pathinfo:
+            remap_innodb_paths(mysqld_config, pathinfo, snapshot)
+        act = InnodbRecoveryAction(mysqld_config,
+                                   status=config.setdefault('mysql-lvm:innodb',
+                                                            {}))
         snapshot.register('post-mount', act, priority=100)
 
+    if snapshot.root:
+        # several volumes are mounted under snapshot.root.  Archive each
+        # path relative to it.
+        if config['mysql-lvm']['archive-method'] == 'incremental' or \
+                config['tar']['streams'] > 1:
+            raise BackupError("snapshot-all-volumes only supports "
+                              "archive-method = tar with one tar stream")
+        paths = archive_paths(client.show_variable('datadir'), pathinfo)
+        archive_stream = open_archive(config, spooldir, 'backup.tar')
+        act = tar_action(config)(snapshot.root, archive_stream,
+                                 config['tar'], paths=paths)
+    elif config['mysql-lvm']['archive-method'] == 'incremental':
+        incremental = dict(config['incremental'])
+        try:
+            incremental['chunk-size'] = parse_bytes(incremental['chunk-size'])
+        except ValueError, exc:
+            raise BackupError("Invalid [incremental] chunk-size: %s" % exc)
+        compression = config['compression']['method']
+        if config['compression']['level'] == 0:
+            compression = 'none'
+        act = IncrementalArchiveAction(snap_datadir, spooldir,
+                                       lambda name: open_archive(config,
+                                                                 spooldir,
+                                                                 name),
+                                       compression,
+                                       incremental,
+                                       status=config.setdefault(
+                                           'mysql-lvm:incremental', {}))
+    elif config['tar']['streams'] > 1:
+        if config['tar']['writer'] == 'python':
+            LOG.warning("[tar] writer = python only applies to a single "
+                        "stream. Running %d tar processes.",
+                        config['tar']['streams'])
+        act = ParallelTarArchiveAction(snap_datadir, spooldir,
+                                       lambda name: open_archive(config,
+                                                                 spooldir,
+                                                                 name),
+                                       config['tar'])
+    else:
+        archive_stream = open_archive(config, spooldir, 'backup.tar')
+        act = tar_action(config)(snap_datadir, archive_stream, config['tar'])
+    snapshot.register('post-mount', act, priority=50)
+
+def tar_action(config):
+    """Choose the action that writes a single tar archive"""
+    if config['tar']['writer'] == 'python':
+        return PythonTarArchiveAction
+    return TarArchiveAction
+
+def record_innodb_layout(status, pathinfo, ib_log_size,
+                         redo_log_capacity=None):
+    """Record the InnoDB settings needed to run recovery on a restored copy
+    of the datadir
+
+    Paths within the datadir are recorded relative to it.  Redo logs
+    outside of the datadir are copied into it before recovery, so their
+    directory is recorded as the datadir itself.  ``redo_log_capacity``
+    is only recorded for servers that have innodb_redo_log_capacity
+    (MySQL 8.0.30 and later).
+    """
+    datadir = os.path.realpath(pathinfo.datadir)
+    status['innodb-log-file-size'] = ib_log_size
+    if redo_log_capacity:
+        status['innodb-redo-log-capacity'] = redo_log_capacity
+    logdir = pathinfo.get_innodb_logdir()
+    if is_subdir(logdir, datadir):
+        status['innodb-log-group-home-dir'] = relpath(logdir, datadir)
+    else:
+        status['innodb-log-group-home-dir'] = os.curdir
+    status['innodb-data-file-path'] = pathinfo.innodb_data_file_path
+    ibd_home_dir = pathinfo.innodb_data_home_dir
+    if ibd_home_dir:
+        ibd_home_dir = pathinfo.get_innodb_datadir()
+        if is_subdir(ibd_home_dir, datadir):
+            ibd_home_dir = relpath(ibd_home_dir, datadir)
+    status['innodb-data-home-dir'] = ibd_home_dir
+
+def archive_paths(datadir, pathinfo=None):
+    """List the paths to archive when several volumes are snapshotted,
+    relative to the root directory the snapshots are mounted under
+
+    These are the datadir and any InnoDB log directory or shared
+    tablespaces outside of it.
+    """
+    datadir = os.path.realpath(datadir)
+    paths = [datadir]
+    if pathinfo is not None:
+        for path in [pathinfo.get_innodb_logdir()] + \
+                    list(pathinfo.walk_innodb_shared_tablespaces()):
+            if path not in paths and not is_subdir(path, datadir):
+                paths.append(path)
+    return [path.lstrip(os.sep) for path in paths]
+
+def open_archive(config, spooldir, name):
+    """Open an archive stream in spooldir using the configured compression
+    """
+    path = os.path.join(spooldir, name)
     try:
-        archive_stream = open_stream(os.path.join(spooldir, 'backup.tar'),
-                                     'w',
-                                     method=config['compression']['method'],
-                                     level=config['compression']['level'],
-                                     extra_args=config['compression']['options'])
+        return open_stream(path,
+                           'w',
+                           method=config['compression']['method'],
+                           level=config['compression']['level'],
+                           extra_args=config['compression']['options'],
+                           page_cache=config['compression']['page-cache'])
     except OSError, exc:
         raise BackupError("Unable to create archive file '%s': %s" %
-                          (os.path.join(spooldir, 'backup.tar'), exc))
-    act = TarArchiveAction(snap_datadir, archive_stream, config['tar'])
-    snapshot.register('post-mount', act, priority=50)
-
-    snapshot.register('pre-remove', log_final_snapshot_size)
+                          (path, exc))
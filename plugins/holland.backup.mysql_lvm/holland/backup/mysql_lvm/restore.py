@@ -0,0 +1,124 @@
+"""Restore support for mysql-lvm backups"""
+
+import os
+import shutil
+import logging
+from optparse import OptionParser
+from holland.core.exceptions import BackupError
+from holland.backup.mysql_lvm.actions.incremental import INDEX_NAME, \
+                                                         restore_chunks
+from holland.backup.mysql_lvm.actions.mysql.innodb import INNODB_LOG_DIR, \
+                                                          run_recovery
+
+LOG = logging.getLogger(__name__)
+
+class MysqlLVMRestore(object):
+    """Rebuild the datadir saved by a mysql-lvm backup
+
+    Backups taken with archive-method = incremental are rebuilt from their
+    chunks; tar based backups are restored by extracting backup.tar
+    directly.  Either can then be prepared with --prepare, which runs the
+    InnoDB crash recovery that innodb-prepare-later skipped at backup time.
+    """
+
+    def __init__(self, backup):
+        self.backup = backup
+
+    def dispatch(self, argv):
+        """Parse restore options and run the restore
+
+        :returns: 0 on success, 1 on failure
+        """
+        parser = OptionParser(prog=argv[0],
+                              usage="%prog --target-directory <path> "
+                                    "[--prepare]")
+        parser.add_option('--target-directory', '-t', metavar='PATH',
+                          help="Empty directory to rebuild the datadir in. "
+                               "With --prepare for a tar backup, the "
+                               "directory backup.tar was extracted to")
+        parser.add_option('--prepare', action='store_true', default=False,
+                          help="Run InnoDB crash recovery on the restored "
+                               "datadir")
+        parser.add_option('--mysqld', metavar='PATH', action='append',
+                          help="mysqld to run InnoDB recovery with "
+                               "(default: mysqld, /usr/libexec/mysqld)")
+        parser.add_option('--user', metavar='NAME', default='mysql',
+                          help="User to run mysqld as (default: mysql)")
+        opts, args = parser.parse_args(argv[1:])
+        if not opts.target_directory:
+            parser.error("--target-directory is required")
+        target = os.path.abspath(opts.target_directory)
+        incremental = os.path.exists(os.path.join(self.backup.path,
+                                                  INDEX_NAME))
+        if not incremental and not opts.prepare:
+            LOG.error("%s is not an incremental backup. Extract its tar "
+                      "archive(s) instead.", self.backup.name)
+            return 1
+        try:
+            if incremental:
+                if os.path.exists(target) and os.listdir(target):
+                    LOG.error("Target directory %s is not empty", target)
+                    return 1
+                LOG.info("Restoring %s to %s", self.backup.name, target)
+                restore_chunks(self.backup.path, target)
+                LOG.info("Restored %s to %s", self.backup.name, target)
+            if opts.prepare:
+                prepare_datadir(self.backup, target, opts.mysqld,
+                                opts.user)
+        except (IOError, OSError, ValueError, BackupError), exc:
+            LOG.error("Restore failed: %s", exc)
+            return 1
+        return 0
+
+def prepare_datadir(backup, datadir, mysqld_exe=None, user='mysql'):
+    """Run InnoDB crash recovery on a restored copy of a backup taken with
+    innodb-prepare-later
+
+    Redo logs that were copied off the snapshot rather than archived with
+    the datadir are put in ``datadir`` first.
+
+    :raises: BackupError if the backup does not need preparing or recovery
+             fails
+    """
+    status = backup.config.get('mysql-lvm:innodb', {})
+    if status.get('prepared') != 'no':
+        raise BackupError("%s was not taken with innodb-prepare-later" %
+                          backup.name)
+    if not os.path.isdir(datadir):
+        raise BackupError("%s is not a directory" % datadir)
+    log_home_dir = os.path.join(datadir,
+                                status.get('innodb-log-group-home-dir',
+                                           os.curdir))
+    if status.get('logs-copied', 'yes') == 'yes':
+        logdir = os.path.join(backup.path, INNODB_LOG_DIR)
+        for name in status['log-files'].split(','):
+            path = os.path.join(log_home_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            shutil.copyfile(os.path.join(logdir, name), path)
+    mysqld_config = {
+        'mysqld-exe' : mysqld_exe or ['mysqld', '/usr/libexec/mysqld'],
+        'user' : user,
+        'datadir' : datadir,
+        'innodb-log-group-home-dir' : os.path.normpath(log_home_dir),
+        'innodb-log-file-size' : status['innodb-log-file-size'],
+        'innodb-data-file-path' : status['innodb-data-file-path'],
+        'innodb-buffer-pool-size' : 'auto',
+        'innodb-read-io-threads' : 'auto',
+        'innodb-write-io-threads' : 'auto',
+        'innodb-doublewrite' : False,
+        'innodb-flush-log-at-trx-commit' : 0,
+    }
+    if status.get('innodb-redo-log-capacity'):
+        mysqld_config['innodb-redo-log-capacity'] = \
+            status['innodb-redo-log-capacity']
+    ibd_home_dir = status.get('innodb-data-home-dir')
+    if ibd_home_dir:
+        mysqld_config['innodb-data-home-dir'] = os.path.join(datadir,
+                                                             ibd_home_dir)
+    elif ibd_home_dir == '':
+        # absolute tablespace paths
+        mysqld_config['innodb-data-home-dir'] = ''
+    LOG.info("Running InnoDB recovery on %s", datadir)
+    run_recovery(mysqld_config)
+    LOG.info("Prepared %s in %s", backup.name, datadir)
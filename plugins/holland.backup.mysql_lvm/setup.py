@@ -28,6 +28,9 @@ setup(name="holland.backup.mysql_lvm",
       [holland.backup]
       mysql-lvm = holland.backup.mysql_lvm:MysqlLVMBackup
       mysqldump-lvm = holland.backup.mysql_lvm.plugin.mysqldump:MysqlDumpLVMBackup
+
+      [holland.restore]
+      mysql-lvm = holland.backup.mysql_lvm.restore:MysqlLVMRestore
       """,
       namespace_packages=['holland', 'holland.backup'],
       )
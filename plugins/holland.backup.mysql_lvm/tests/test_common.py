@@ -0,0 +1,95 @@
+"""
+Test sizing snapshots from the usage of previous snapshots
+"""
+
+import os
+import shutil
+import tempfile
+from nose.tools import *
+from holland.core.exceptions import BackupError
+from holland.core.spool import Backup
+from holland.backup.mysql_lvm.plugin.common import snapshot_history, \
+                                                   size_from_history, \
+                                                   size_snapshot
+
+MB = 1024**2
+EXTENT = 4*MB
+CONFIG = {'snapshot-size-margin' : 20}
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+class FakeVolume(object):
+    vg_name = 'vg'
+    vg_extent_size = str(EXTENT)
+
+    def __init__(self, free_extents, size=10*1024*MB, thin=False):
+        self.vg_free_count = str(free_extents)
+        self.lv_size = str(size)
+        self.thin = thin
+
+    def is_thin(self):
+        return self.thin
+
+    def device_name(self):
+        return '/dev/vg/lv'
+
+def make_backup(name, used=None, seconds=None, failed=False):
+    path = os.path.join(tmpdir, 'default', name)
+    os.makedirs(path)
+    backup = Backup(path, 'default', name)
+    info = backup.config['holland:backup']
+    info['start-time'] = float(name.split('_')[0])
+    info['stop-time'] = info['start-time'] + 1
+    info['failed'] = failed
+    if used is not None:
+        backup.config['mysql-lvm:snapshot'] = {
+            'snapshot-used' : str(used),
+            'snapshot-seconds' : str(seconds),
+        }
+    backup.flush()
+    return path
+
+def test_snapshot_history():
+    make_backup('1_a', 100*MB, 60)
+    make_backup('2_a', 50*MB, 30)
+    # overflowed snapshot of a failed backup
+    make_backup('3_a', 1024*MB, 10, failed=True)
+    make_backup('4_a')
+    make_backup('5_a', 80*MB, 0)
+    current = make_backup('6_a')
+    eq_(snapshot_history(current, 5), [(50*MB, 30.0), (100*MB, 60.0)])
+    eq_(snapshot_history(current, 1), [(50*MB, 30.0)])
+    eq_(snapshot_history(current, 0), [])
+
+def test_size_from_history():
+    eq_(size_from_history([], 20, EXTENT), None)
+    # fastest rate (2MB/s) for the longest lifetime (60s) plus 20%
+    history = [(60*MB, 30.0), (60*MB, 60.0)]
+    eq_(size_from_history(history, 20, EXTENT), int(144*MB / EXTENT) + 1)
+
+def test_size_snapshot_requested():
+    eq_(size_snapshot(CONFIG, FakeVolume(1000), '400M'), 100)
+    # truncated to the free space
+    eq_(size_snapshot(CONFIG, FakeVolume(50), '400M'), 50)
+    assert_raises(BackupError, size_snapshot, CONFIG, FakeVolume(50), '1K')
+    assert_raises(BackupError, size_snapshot, CONFIG, FakeVolume(50), 'lots')
+
+def test_size_snapshot_auto():
+    # 20% of the volume without any history
+    eq_(size_snapshot(CONFIG, FakeVolume(10000)), 512)
+    history = [(60*MB, 30.0)]
+    eq_(size_snapshot(CONFIG, FakeVolume(10000), history=history),
+        size_from_history(history, 20, EXTENT))
+    eq_(size_snapshot(CONFIG, FakeVolume(10000, thin=True)), None)
+
+def test_size_snapshot_reserved():
+    # other snapshots of a multi-volume backup already claim 900 extents
+    eq_(size_snapshot(CONFIG, FakeVolume(1000), '400M', reserved=900), 100)
+    eq_(size_snapshot(CONFIG, FakeVolume(1000), reserved=900), 100)
+    assert_raises(BackupError, size_snapshot, CONFIG, FakeVolume(1000),
+                  reserved=1000)
@@ -0,0 +1,289 @@
+"""
+Test block-level incremental archives and restoring them from their chunks
+"""
+
+import os
+import shutil
+import tempfile
+from nose.tools import *
+from holland.core.spool import Backup
+from holland.backup.mysql_lvm.actions.incremental import ChunkIndex, \
+        IncrementalArchiveAction, find_base_index, restore_chunks, \
+        INDEX_NAME, DIGEST_NAME
+
+CHUNK_SIZE = 4096
+CONFIG = {
+    'chunk-size' : CHUNK_SIZE,
+    'full-interval' : 0,
+    'exclude' : ['mysql.pid'],
+}
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+def write_file(path, data, mtime=1000000000):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fileobj = open(path, 'wb')
+    try:
+        fileobj.write(data)
+    finally:
+        fileobj.close()
+    os.utime(path, (mtime, mtime))
+
+def make_datadir():
+    datadir = tempfile.mkdtemp(dir=tmpdir)
+    write_file(os.path.join(datadir, 'ibdata1'),
+               ''.join([chr(index % 251) for index in range(5*CHUNK_SIZE)]))
+    write_file(os.path.join(datadir, 'test', 't1.ibd'), 'a'*CHUNK_SIZE*2)
+    write_file(os.path.join(datadir, 'test', 't2.ibd'), 'b'*100)
+    write_file(os.path.join(datadir, 'test', 'empty.ibd'), '')
+    write_file(os.path.join(datadir, 'mysql.pid'), '1234')
+    os.makedirs(os.path.join(datadir, 'tmp'))
+    os.symlink('test', os.path.join(datadir, 'test_link'))
+    os.chmod(os.path.join(datadir, 'test', 't2.ibd'), 0600)
+    os.chmod(os.path.join(datadir, 'test'), 0750)
+    if os.geteuid() == 0:
+        os.lchown(os.path.join(datadir, 'test', 't1.ibd'), 1234, 1234)
+    for path in ('test', 'tmp', '.'):
+        os.utime(os.path.join(datadir, path), (1000000000, 1000000000))
+    return datadir
+
+def describe(root):
+    """Map every path under root to its type, mode, owner, mtime and
+    content"""
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        names = dirnames + filenames
+        if dirpath == root:
+            names.append('.')
+        for name in names:
+            path = os.path.normpath(os.path.join(dirpath, name))
+            info = os.lstat(path)
+            if os.path.islink(path):
+                result[path[len(root):]] = (info.st_uid, info.st_gid,
+                                            os.readlink(path))
+                continue
+            if os.path.isdir(path):
+                data = None
+            else:
+                data = open(path, 'rb').read()
+            result[path[len(root):]] = (info.st_mode, info.st_uid,
+                                        info.st_gid, int(info.st_mtime),
+                                        data)
+    return result
+
+class FakeSignalManager(object):
+    pending = []
+
+class FakeSnapshotFSM(object):
+    sigmgr = FakeSignalManager()
+
+def make_backup(backupset, name, failed=False):
+    path = os.path.join(backupset, name)
+    os.makedirs(path)
+    backup = Backup(path, os.path.basename(backupset), name)
+    info = backup.config['holland:backup']
+    info['start-time'] = float(name)
+    info['stop-time'] = info['start-time'] + 1
+    info['failed'] = failed
+    backup.flush()
+    return path
+
+def run_backup(datadir, backupset, name, config=CONFIG, failed=False):
+    """Take an incremental backup of datadir as backup ``name``
+
+    :returns: (backup directory, status dict)
+    """
+    path = make_backup(backupset, name, failed)
+    def open_archive(archive):
+        return open(os.path.join(path, archive), 'wb')
+    status = {}
+    action = IncrementalArchiveAction(datadir, path, open_archive, 'none',
+                                      config, status)
+    action(None, FakeSnapshotFSM(), None)
+    return path, status
+
+def test_index_round_trip():
+    index = ChunkIndex(CHUNK_SIZE, chain=2)
+    eq_(index.add_source('1', 'backup.data', 'none'), 0)
+    eq_(index.add_source('2', 'backup.data.gz', 'gzip'), 1)
+    eq_(index.add_source('1', 'backup.data', 'none'), 0)
+    index.entries = [
+        dict(type='d', path='.', mode=0755, uid=27, gid=27, mtime=1),
+        dict(type='l', path='./link', uid=0, gid=0, target='a b\\c'),
+        dict(type='f', path='./with\ttab', mode=0640, uid=27, gid=27,
+             mtime=2, size=CHUNK_SIZE + 1,
+             chunks=[('abc', 1, 0), ('def', 0, 7)]),
+        dict(type='f', path='./empty', mode=0600, uid=27, gid=27,
+             mtime=3, size=0, chunks=[]),
+    ]
+    path = os.path.join(tmpdir, 'round_trip.chunks')
+    index.write(path)
+    copy = ChunkIndex.read(path)
+    eq_(copy.chunk_size, CHUNK_SIZE)
+    eq_(copy.digest, DIGEST_NAME)
+    eq_(copy.chain, 2)
+    eq_(copy.sources, index.sources)
+    eq_(copy.entries, index.entries)
+    eq_(copy.referenced_sources(), [0, 1])
+    eq_(sorted(copy.files()), ['./empty', './with\ttab'])
+
+def test_index_out_of_order_sources():
+    path = os.path.join(tmpdir, 'out_of_order.chunks')
+    index = ChunkIndex(CHUNK_SIZE)
+    index.add_source('1', 'backup.data', 'none')
+    index.add_source('2', 'backup.data', 'none')
+    index.write(path)
+    lines = open(path).readlines()
+    sources = [line for line in lines if line.startswith('source')]
+    sources.reverse()
+    fileobj = open(path, 'w')
+    try:
+        fileobj.writelines([line for line in lines
+                            if not line.startswith('source')] + sources)
+    finally:
+        fileobj.close()
+    assert_raises(ValueError, ChunkIndex.read, path)
+
+def test_index_version():
+    path = os.path.join(tmpdir, 'version.chunks')
+    ChunkIndex(CHUNK_SIZE).write(path)
+    data = open(path).read()
+    write_file(path, data.replace('holland-chunk-index\t1',
+                                  'holland-chunk-index\t2'))
+    assert_raises(ValueError, ChunkIndex.read, path)
+    write_file(path, data.replace('holland-chunk-index\t1\n', ''))
+    assert_raises(ValueError, ChunkIndex.read, path)
+
+def restore(backup_dir):
+    target = tempfile.mkdtemp(dir=tmpdir)
+    restore_chunks(backup_dir, target)
+    return describe(target)
+
+def test_incremental_restore():
+    datadir = make_datadir()
+    backupset = tempfile.mkdtemp(dir=tmpdir)
+    full, status = run_backup(datadir, backupset, '1')
+    eq_(status['chain'], '0')
+    eq_(status['base'], '')
+    eq_(status['depends-on'], '')
+    eq_(status['chunks-written'], status['chunks-total'])
+    os.unlink(os.path.join(datadir, 'mysql.pid'))
+    os.utime(datadir, (1000000000, 1000000000))
+    expected_full = describe(datadir)
+
+    # change one chunk, grow a file, add and remove files
+    fileobj = open(os.path.join(datadir, 'ibdata1'), 'r+b')
+    try:
+        fileobj.seek(2*CHUNK_SIZE + 10)
+        fileobj.write('changed')
+    finally:
+        fileobj.close()
+    os.utime(os.path.join(datadir, 'ibdata1'), (1000000100, 1000000100))
+    write_file(os.path.join(datadir, 'test', 't2.ibd'), 'b'*(CHUNK_SIZE + 1),
+               mtime=1000000200)
+    write_file(os.path.join(datadir, 'tmp', 'new'), 'n'*10)
+    os.unlink(os.path.join(datadir, 'test', 'empty.ibd'))
+    for path in ('test', 'tmp'):
+        os.utime(os.path.join(datadir, path), (1000000300, 1000000300))
+    incremental, status = run_backup(datadir, backupset, '2')
+    eq_(status['chain'], '1')
+    eq_(status['base'], '1')
+    eq_(status['depends-on'], '1')
+    # ibdata1's changed chunk, both chunks of t2.ibd and tmp/new
+    eq_(status['chunks-written'], '4')
+    eq_(status['chunks-total'], '10')
+
+    eq_(restore(incremental), describe(datadir))
+    # the full backup is still restorable on its own
+    eq_(restore(full), expected_full)
+
+def test_base_chunk_size_changed():
+    datadir = make_datadir()
+    backupset = tempfile.mkdtemp(dir=tmpdir)
+    run_backup(datadir, backupset, '1')
+    current = make_backup(backupset, '2')
+    index, name = find_base_index(current, CHUNK_SIZE, 0)
+    eq_(name, '1')
+    eq_(find_base_index(current, CHUNK_SIZE*2, 0), (None, None))
+
+def test_base_digest_changed():
+    datadir = make_datadir()
+    backupset = tempfile.mkdtemp(dir=tmpdir)
+    full, status = run_backup(datadir, backupset, '1')
+    path = os.path.join(full, INDEX_NAME)
+    index = ChunkIndex.read(path)
+    index.digest = 'md5'
+    index.write(path)
+    current = make_backup(backupset, '2')
+    eq_(find_base_index(current, CHUNK_SIZE, 0), (None, None))
+
+def test_base_full_interval():
+    datadir = make_datadir()
+    backupset = tempfile.mkdtemp(dir=tmpdir)
+    run_backup(datadir, backupset, '1')
+    run_backup(datadir, backupset, '2')
+    current = make_backup(backupset, '3')
+    index, name = find_base_index(current, CHUNK_SIZE, 0)
+    eq_((index.chain, name), (1, '2'))
+    index, name = find_base_index(current, CHUNK_SIZE, 2)
+    eq_(name, '2')
+    eq_(find_base_index(current, CHUNK_SIZE, 1), (None, None))
+
+    # the next backup starts a new chain
+    config = dict(CONFIG)
+    config['full-interval'] = 1
+    shutil.rmtree(current)
+    path, status = run_backup(datadir, backupset, '3', config)
+    eq_(status['chain'], '0')
+    eq_(status['chunks-written'], status['chunks-total'])
+
+def test_base_missing_data():
+    datadir = make_datadir()
+    backupset = tempfile.mkdtemp(dir=tmpdir)
+    full, status = run_backup(datadir, backupset, '1')
+    run_backup(datadir, backupset, '2')
+    current = make_backup(backupset, '3')
+    os.unlink(os.path.join(full, 'backup.data'))
+    eq_(find_base_index(current, CHUNK_SIZE, 0), (None, None))
+
+def test_base_failed_backup():
+    datadir = make_datadir()
+    backupset = tempfile.mkdtemp(dir=tmpdir)
+    run_backup(datadir, backupset, '1', failed=True)
+    current = make_backup(backupset, '2')
+    eq_(find_base_index(current, CHUNK_SIZE, 0), (None, None))
+    shutil.rmtree(current)
+
+    # a failed backup is skipped in favour of the one before it
+    run_backup(datadir, backupset, '2')
+    run_backup(datadir, backupset, '3', failed=True)
+    current = make_backup(backupset, '4')
+    index, name = find_base_index(current, CHUNK_SIZE, 0)
+    eq_(name, '2')
+
+def test_restore_corrupted_chunk():
+    datadir = make_datadir()
+    backupset = tempfile.mkdtemp(dir=tmpdir)
+    full, status = run_backup(datadir, backupset, '1')
+    path = os.path.join(full, 'backup.data')
+    data = open(path, 'rb').read()
+    # flip a byte in the first chunk, after its length header
+    write_file(path, data[:10] + chr(ord(data[10]) ^ 0xff) + data[11:])
+    assert_raises(ValueError, restore_chunks, full,
+                  tempfile.mkdtemp(dir=tmpdir))
+
+def test_restore_truncated_data():
+    datadir = make_datadir()
+    backupset = tempfile.mkdtemp(dir=tmpdir)
+    full, status = run_backup(datadir, backupset, '1')
+    path = os.path.join(full, 'backup.data')
+    data = open(path, 'rb').read()
+    write_file(path, data[:-10])
+    assert_raises(IOError, restore_chunks, full,
+                  tempfile.mkdtemp(dir=tmpdir))
@@ -0,0 +1,144 @@
+"""
+Test copying and recording the InnoDB redo logs for innodb-prepare-later
+"""
+
+import os
+import shutil
+import tempfile
+from nose.tools import *
+from holland.backup.mysql_lvm.actions.mysql.innodb import \
+        CopyInnodbLogsAction, innodb_log_files, INNODB_LOG_DIR
+from holland.backup.mysql_lvm.plugin.innodb import MySQLPathInfo
+from holland.backup.mysql_lvm.plugin.raw.util import record_innodb_layout
+from holland.backup.mysql_lvm import restore
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+def make_files(path, names):
+    for name in names:
+        name = os.path.join(path, name)
+        if not os.path.isdir(os.path.dirname(name)):
+            os.makedirs(os.path.dirname(name))
+        fileobj = open(name, 'wb')
+        try:
+            fileobj.write(os.path.basename(name))
+        finally:
+            fileobj.close()
+
+def make_pathinfo(datadir, logdir):
+    return MySQLPathInfo(datadir=datadir,
+                         innodb_log_group_home_dir=logdir,
+                         innodb_log_files_in_group=2,
+                         innodb_data_home_dir=None,
+                         innodb_data_file_path='ibdata1:10M:autoextend',
+                         abs_tablespace_paths=False)
+
+def test_log_files():
+    logdir = tempfile.mkdtemp(dir=tmpdir)
+    make_files(logdir, ['ib_logfile1', 'ib_logfile0', 'ibdata1'])
+    eq_(innodb_log_files(logdir), ['ib_logfile0', 'ib_logfile1'])
+
+def test_log_files_innodb_redo():
+    logdir = tempfile.mkdtemp(dir=tmpdir)
+    make_files(logdir, ['#innodb_redo/#ib_redo10',
+                        '#innodb_redo/#ib_redo11_tmp',
+                        '#innodb_redo/#ib_redo9'])
+    eq_(innodb_log_files(logdir), ['#innodb_redo/#ib_redo10',
+                                   '#innodb_redo/#ib_redo9'])
+
+def test_copy_logs():
+    logdir = tempfile.mkdtemp(dir=tmpdir)
+    spooldir = tempfile.mkdtemp(dir=tmpdir)
+    make_files(logdir, ['#innodb_redo/#ib_redo9'])
+    status = {}
+    CopyInnodbLogsAction(logdir, spooldir, status)(None, None, None)
+    copied = os.path.join(spooldir, INNODB_LOG_DIR, '#innodb_redo',
+                          '#ib_redo9')
+    eq_(open(copied).read(), '#ib_redo9')
+    eq_(status, {'prepared' : 'no',
+                 'log-files' : '#innodb_redo/#ib_redo9',
+                 'log-bytes' : '9',
+                 'logs-copied' : 'yes'})
+
+def test_archived_logs_are_not_copied():
+    logdir = tempfile.mkdtemp(dir=tmpdir)
+    spooldir = tempfile.mkdtemp(dir=tmpdir)
+    make_files(logdir, ['ib_logfile0', 'ib_logfile1'])
+    status = {}
+    CopyInnodbLogsAction(logdir, spooldir, status,
+                         archived=True)(None, None, None)
+    ok_(not os.path.exists(os.path.join(spooldir, INNODB_LOG_DIR)))
+    eq_(status['logs-copied'], 'no')
+    eq_(status['log-files'], 'ib_logfile0,ib_logfile1')
+    eq_(status['log-bytes'], '22')
+
+def test_record_layout():
+    datadir = os.path.realpath(tempfile.mkdtemp(dir=tmpdir))
+    status = {}
+    record_innodb_layout(status, make_pathinfo(datadir, './logs'), '48M')
+    eq_(status['innodb-log-file-size'], '48M')
+    eq_(status['innodb-log-group-home-dir'], 'logs')
+    ok_('innodb-redo-log-capacity' not in status)
+
+    # logs outside of the datadir are copied into it for recovery
+    status = {}
+    record_innodb_layout(status, make_pathinfo(datadir, tmpdir), '48M',
+                         '104857600')
+    eq_(status['innodb-log-group-home-dir'], '.')
+    eq_(status['innodb-redo-log-capacity'], '104857600')
+
+class FakeBackup(object):
+    def __init__(self, path, status):
+        self.name = 'default/20161018_000000'
+        self.path = path
+        self.config = {'mysql-lvm:innodb' : status}
+
+def prepare(backup, datadir):
+    recovered = []
+    real_run_recovery = restore.run_recovery
+    restore.run_recovery = recovered.append
+    try:
+        restore.prepare_datadir(backup, datadir)
+    finally:
+        restore.run_recovery = real_run_recovery
+    return recovered[0]
+
+def test_prepare_copied_logs():
+    backup_dir = tempfile.mkdtemp(dir=tmpdir)
+    datadir = tempfile.mkdtemp(dir=tmpdir)
+    make_files(os.path.join(backup_dir, INNODB_LOG_DIR),
+               ['#innodb_redo/#ib_redo9'])
+    backup = FakeBackup(backup_dir, {
+        'prepared' : 'no',
+        'log-files' : '#innodb_redo/#ib_redo9',
+        'logs-copied' : 'yes',
+        'innodb-log-group-home-dir' : '.',
+        'innodb-log-file-size' : '48M',
+        'innodb-redo-log-capacity' : '104857600',
+        'innodb-data-file-path' : 'ibdata1:10M:autoextend',
+    })
+    config = prepare(backup, datadir)
+    ok_(os.path.exists(os.path.join(datadir, '#innodb_redo', '#ib_redo9')))
+    eq_(config['innodb-log-group-home-dir'], datadir)
+    eq_(config['innodb-redo-log-capacity'], '104857600')
+
+def test_prepare_archived_logs():
+    backup_dir = tempfile.mkdtemp(dir=tmpdir)
+    datadir = tempfile.mkdtemp(dir=tmpdir)
+    backup = FakeBackup(backup_dir, {
+        'prepared' : 'no',
+        'log-files' : 'ib_logfile0,ib_logfile1',
+        'logs-copied' : 'no',
+        'innodb-log-group-home-dir' : 'logs',
+        'innodb-log-file-size' : '48M',
+        'innodb-data-file-path' : 'ibdata1:10M:autoextend',
+    })
+    config = prepare(backup, datadir)
+    eq_(os.listdir(datadir), [])
+    eq_(config['innodb-log-group-home-dir'], os.path.join(datadir, 'logs'))
+    ok_('innodb-redo-log-capacity' not in config)
@@ -0,0 +1,156 @@
+"""
+Test splitting a datadir across several tar streams
+"""
+
+import os
+import shutil
+import tempfile
+import subprocess
+from nose.tools import *
+from holland.backup.mysql_lvm.actions.tar import partition_datadir, \
+                                                ParallelTarArchiveAction
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+def make_file(path, size):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fileobj = open(path, 'wb')
+    try:
+        fileobj.write(os.path.basename(path)[:1] * size)
+    finally:
+        fileobj.close()
+
+def make_datadir():
+    datadir = tempfile.mkdtemp(dir=tmpdir)
+    for name in ('t1.ibd', 't2.ibd', 't3.ibd', 't4.ibd'):
+        make_file(os.path.join(datadir, 'big', name), 4000)
+    make_file(os.path.join(datadir, 'small', 't1.ibd'), 1000)
+    make_file(os.path.join(datadir, 'ibdata1'), 3000)
+    make_file(os.path.join(datadir, 'mysql.pid'), 10)
+    os.makedirs(os.path.join(datadir, 'big', 'empty'))
+    os.makedirs(os.path.join(datadir, 'big', 'tmp'))
+    make_file(os.path.join(datadir, 'big', 'tmp', 'scratch'), 10)
+    os.symlink('../small', os.path.join(datadir, 'big', 'small_link'))
+    os.symlink('ibdata1', os.path.join(datadir, 'ibdata_link'))
+    os.chmod(os.path.join(datadir, 'big'), 0750)
+    if os.getuid() == 0:
+        os.chown(os.path.join(datadir, 'big'), 1234, 1234)
+    return datadir
+
+def members(units):
+    result = []
+    for size, paths in units:
+        result.extend(paths)
+    return sorted(result)
+
+def test_partition_balance():
+    datadir = make_datadir()
+    units = partition_datadir(datadir, 3)
+    eq_(len(units), 3)
+    sizes = [size for size, paths in units]
+    eq_(sizes, sorted(sizes, reverse=True))
+    # 16010 bytes of big/ are split by file: 20027 bytes in all
+    ok_(sizes[0] - sizes[-1] <= 4000, sizes)
+    eq_(sum(sizes), 20027)
+    # every path is listed exactly once
+    all_paths = members(units)
+    eq_(len(all_paths), len(set(all_paths)))
+    ok_('.' in units[0][1])
+
+def test_partition_split_directory():
+    datadir = make_datadir()
+    units = partition_datadir(datadir, 3)
+    structure = ['./big', './big/empty', './big/small_link', './big/tmp']
+    # the split directory stays in one unit, ahead of its contents
+    holders = [paths for size, paths in units if './big' in paths]
+    eq_(len(holders), 1)
+    for path in structure:
+        ok_(path in holders[0], path)
+    for paths in [paths for size, paths in units]:
+        eq_(paths, sorted(paths))
+    # a directory that is not split is listed with its contents
+    holders = [paths for size, paths in units if './small' in paths]
+    ok_('./small/t1.ibd' in holders[0])
+
+def test_partition_excludes():
+    datadir = make_datadir()
+    units = partition_datadir(datadir, 2, exclude=['*.pid', 'big/tmp'])
+    all_paths = members(units)
+    ok_('./mysql.pid' not in all_paths)
+    ok_('./big/tmp' not in all_paths)
+    ok_('./big/tmp/scratch' not in all_paths)
+    ok_('./big/t1.ibd' in all_paths)
+    ok_('./ibdata_link' in all_paths)
+
+def test_partition_single_stream():
+    datadir = make_datadir()
+    units = partition_datadir(datadir, 1)
+    eq_(len(units), 1)
+    eq_(units[0][0], 20027)
+
+class FakeSupervisor(object):
+    def wait(self, processes):
+        for process in processes:
+            process.wait()
+        return True
+
+class FakeSignalManager(object):
+    pending = []
+
+class FakeSnapshotFSM(object):
+    supervisor = FakeSupervisor()
+    sigmgr = FakeSignalManager()
+
+def describe(root):
+    """Map every path under root to its type, mode, owner and content"""
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in ['.'] + dirnames + filenames:
+            path = os.path.normpath(os.path.join(dirpath, name))
+            if name == '.' and dirpath != root:
+                continue
+            info = os.lstat(path)
+            if os.path.islink(path):
+                data = os.readlink(path)
+            elif os.path.isdir(path):
+                data = None
+            else:
+                data = open(path, 'rb').read()
+            result[path[len(root):]] = (info.st_mode, info.st_uid, data)
+    return result
+
+def test_parallel_tar_reassembly():
+    datadir = make_datadir()
+    spooldir = tempfile.mkdtemp(dir=tmpdir)
+    config = {
+        'streams' : 3,
+        'exclude' : ['mysql.pid'],
+        'pre-args' : '',
+        'post-args' : '',
+        'page-cache' : 'keep',
+    }
+    def open_archive(name):
+        return open(os.path.join(spooldir, name), 'wb')
+    action = ParallelTarArchiveAction(datadir, spooldir, open_archive, config)
+    action(None, FakeSnapshotFSM(), None)
+    manifest = open(os.path.join(spooldir, 'backup.manifest')).read()
+    ok_('streams = 3' in manifest)
+
+    restored = tempfile.mkdtemp(dir=tmpdir)
+    for index in range(3):
+        archive = os.path.join(spooldir, 'backup.%d.tar' % index)
+        subprocess.check_call(['tar', '--extract', '--same-owner',
+                               '--preserve-permissions', '--file', archive,
+                               '--directory', restored])
+    os.unlink(os.path.join(datadir, 'mysql.pid'))
+    expected = describe(datadir)
+    del expected['']
+    actual = describe(restored)
+    del actual['']
+    eq_(actual, expected)
@@ -4,6 +4,8 @@ import sys
 import csv
 import errno
 import logging
+import threading
+from Queue import Queue, Empty
 from holland.core.exceptions import BackupError
 from holland.lib.safefilename import encode
 from holland.backup.mysqldump.command import ALL_DATABASES, MySQLDumpError
@@ -27,8 +29,14 @@ def start(mysqldump,
           lock_method='auto-detect',
           file_per_database=True,
           open_stream=open,
-          compression_ext=''):
-    """Run a mysqldump backup"""
+          compression_ext='',
+          parallel=1):
+    """Run a mysqldump backup
+
+    With ``file_per_database``, up to ``parallel`` databases are dumped at
+    once.  Each mysqldump sees a different point in time, so this is only
+    consistent against a server nothing else is writing to.
+    """
 
     if not schema and file_per_database:
         raise BackupError("file_per_database specified without a valid schema")
@@ -52,28 +60,20 @@ def start(mysqldump,
         if flush_logs:
             mysqldump.options.remove('--flush-logs')
         last = len(target_databases)
+        jobs = []
         for count, db in enumerate(target_databases):
             more_options = [mysqldump_lock_option(lock_method, [db])]
             # add --flush-logs only to the last mysqldump run
             if flush_logs and count == last:
                 more_options.append('--flush-logs')
-            db_name = encode(db.name)[0]
-            if db_name != db.name:
-                LOG.warning("Encoding file-name for database %s to %s", db.name, db_name)
-            try:
-                stream = open_stream('%s.sql' % db_name, 'w')
-            except (IOError, OSError), exc:
-                raise BackupError("Failed to open output stream %s: %s" %
-                                  ('%s.sql' + compression_ext, str(exc)))
-            try:
-                mysqldump.run([db.name], stream, more_options)
-            finally:
-                try:
-                    stream.close()
-                except (IOError, OSError), exc:
-                    if exc.errno != errno.EPIPE:
-                        LOG.error("%s", str(exc))
-                        raise BackupError(str(exc))
+            jobs.append((db, more_options))
+        if parallel > 1:
+            dump_parallel(mysqldump, jobs, open_stream, compression_ext,
+                          parallel, sizes=schema.database_sizes)
+        else:
+            for db, more_options in jobs:
+                dump_database(mysqldump, db, more_options, open_stream,
+                              compression_ext)
     else:
         more_options = [mysqldump_lock_option(lock_method, target_databases)]
         try:
@@ -82,9 +82,14 @@ def start(mysqldump,
             raise BackupError("Failed to open output stream %s: %s" %
                               'all_databases.sql' + compression_ext, exc)
         try:
+            estimated_size = 0
+            if schema:
+                estimated_size = sum([db.size for db in schema.databases
+                                      if not db.excluded])
             if target_databases is not ALL_DATABASES:
                 target_databases = [db.name for db in target_databases]
-            mysqldump.run(target_databases, stream, more_options)
+            mysqldump.run(target_databases, stream, more_options,
+                          estimated_size=estimated_size)
         finally:
             try:
                 stream.close()
@@ -93,6 +98,76 @@ def start(mysqldump,
                     LOG.error("%s", str(exc))
                     raise BackupError(str(exc))
 
+def dump_database(mysqldump, db, more_options, open_stream, compression_ext):
+    """Dump a single database to <encoded name>.sql"""
+    db_name = encode(db.name)[0]
+    if db_name != db.name:
+        LOG.warning("Encoding file-name for database %s to %s", db.name, db_name)
+    try:
+        stream = open_stream('%s.sql' % db_name, 'w')
+    except (IOError, OSError), exc:
+        raise BackupError("Failed to open output stream %s: %s" %
+                          ('%s.sql' + compression_ext, str(exc)))
+    try:
+        mysqldump.run([db.name], stream, more_options,
+                      estimated_size=db.size)
+    finally:
+        try:
+            stream.close()
+        except (IOError, OSError), exc:
+            if exc.errno != errno.EPIPE:
+                LOG.error("%s", str(exc))
+                raise BackupError(str(exc))
+
+def dump_parallel(mysqldump, jobs, open_stream, compression_ext, workers,
+                  sizes=None):
+    """Run `dump_database` for each (database, options) in ``jobs`` with up
+    to ``workers`` mysqldump processes at once
+
+    The largest databases by ``sizes`` (a mapping of database name to
+    bytes, as from MySQLClient.show_database_sizes) are started first, so
+    that a large database is not left dumping on its own at the end.
+    Without ``sizes`` each database's own size is used.  No new dumps are
+    started once one fails.
+    """
+    if sizes is None:
+        size_of = lambda db: db.size or 0
+    else:
+        size_of = lambda db: sizes.get(db.name, 0)
+    queue = Queue()
+    for job in sorted(jobs, key=lambda job: size_of(job[0]), reverse=True):
+        queue.put(job)
+
+    errors = []
+
+    def run_dumps():
+        """Dump databases from the queue until it is empty or a dump fails"""
+        while not errors:
+            try:
+                db, more_options = queue.get_nowait()
+            except Empty:
+                break
+            try:
+                dump_database(mysqldump, db, more_options, open_stream,
+                              compression_ext)
+            except Exception, exc:
+                LOG.debug("Dump of %s failed", db.name, exc_info=True)
+                errors.append(exc)
+
+    workers = max(min(workers, len(jobs)), 1)
+    LOG.info("Dumping %d database(s) with %d parallel mysqldump process(es)",
+             len(jobs), workers)
+    threads = []
+    for _ in range(workers):
+        thread = threading.Thread(target=run_dumps)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
 def write_manifest(schema, open_stream, ext):
     """Write real database names => encoded names to MANIFEST.txt"""
     manifest_fileobj = open_stream('MANIFEST.txt', 'w', method='none')
@@ -0,0 +1,275 @@
+"""Binary log archiving for point-in-time recovery between full backups"""
+
+import os
+import csv
+import socket
+import logging
+from holland.core.exceptions import BackupError
+from holland.core.spool import Backupset, previous_backups
+from holland.core.util.fmt import format_bytes
+from holland.lib.compression import open_stream
+from holland.lib.mysql import ConnectionPool, MySQLError, build_mysql_config
+
+LOG = logging.getLogger(__name__)
+
+CONFIGSPEC = """
+[mysql-binlog]
+# backupset whose [mysql:replication] position seeds the first archive run
+start-from          = string(default=None)
+# rotate the active binary log so it can be archived by this run
+flush-logs          = boolean(default=yes)
+# default: directory of log_bin_basename or log_bin_index
+binlog-directory    = string(default=None)
+
+[compression]
+method = option('none', 'gzip', 'gzip-rsyncable', 'pigz', 'bzip2', 'pbzip2', 'lzma', 'lzop', 'gpg', default='gzip')
+options = string(default="")
+inline = boolean(default=yes)
+level  = integer(min=0, max=9, default=1)
+
+[mysql:client]
+defaults-extra-file = force_list(default=list('~/.my.cnf'))
+user                = string(default=None)
+password            = string(default=None)
+socket              = string(default=None)
+host                = string(default=None)
+port                = integer(min=0, default=None)
+""".splitlines()
+
+class MySQLBinlogPlugin(object):
+    """Archive MySQL binary logs written since the last archived log
+
+    Each run copies every closed binary log after the last one archived by
+    this backupset (or after the position recorded by a full backup in the
+    backupset named by ``start-from``) into the spool, along with an index
+    describing what was archived.
+    """
+    CONFIGSPEC = CONFIGSPEC
+
+    def __init__(self, name, config, target_directory, dry_run=False):
+        self.name = name
+        self.config = config
+        self.target_directory = target_directory
+        self.dry_run = dry_run
+        self.config.validate_config(self.CONFIGSPEC) # -> ValidationError
+        self.mysql_config = build_mysql_config(self.config['mysql:client'])
+        self.pool = ConnectionPool(self.mysql_config['client'])
+        self.client = self.pool.client()
+
+    def estimate_backup_size(self):
+        """Estimate the size of the binary logs this plugin will archive"""
+        try:
+            self.client.connect()
+            try:
+                self._check_local_server()
+                binlogs = self.client.show_binary_logs()
+            except MySQLError, exc:
+                raise BackupError("MySQL Error [%d] %s" % exc.args)
+        finally:
+            self.client.disconnect()
+        if not self.config['mysql-binlog']['flush-logs'] or self.dry_run:
+            # without a rotation the active log is left for the next run
+            binlogs = binlogs[:-1]
+        return sum([size for _, size in self._pending_logs(binlogs)])
+
+    def backup(self):
+        """Archive any binary logs not yet captured by this backupset"""
+        config = self.config['mysql-binlog']
+        try:
+            self.client.connect()
+            try:
+                if self.client.show_variable('log_bin') != 'ON':
+                    raise BackupError("Binary logging is not enabled on this "
+                                      "MySQL server")
+                self._check_local_server()
+                binlog_dir = config['binlog-directory'] or \
+                             self._binlog_directory()
+                if not os.path.isdir(binlog_dir):
+                    raise BackupError("Binary log directory %s does not "
+                                      "exist on this host" % binlog_dir)
+                if config['flush-logs'] and not self.dry_run:
+                    LOG.info("Rotating binary logs with FLUSH BINARY LOGS")
+                    self.client.flush_binary_logs()
+                binlogs = self.client.show_binary_logs()
+            except MySQLError, exc:
+                raise BackupError("MySQL Error [%d] %s" % exc.args)
+        finally:
+            self.client.disconnect()
+            self.pool.close()
+
+        # the last log is still being written to and will be picked up by
+        # the next run
+        pending = self._pending_logs(binlogs[:-1])
+        if not pending:
+            LOG.info("No new binary logs to archive")
+
+        if self.dry_run:
+            for name, size in pending:
+                LOG.info("* Would archive %s (%s)",
+                         os.path.join(binlog_dir, name), format_bytes(size))
+            return
+
+        data_dir = os.path.join(self.target_directory, 'backup_data')
+        os.mkdir(data_dir)
+        index = []
+        for name, size in pending:
+            index.append((name, size, self._archive_log(binlog_dir,
+                                                        name,
+                                                        data_dir)))
+        write_binlog_index(index, os.path.join(data_dir, 'binlog.index'))
+
+        section = self.config.setdefault('mysql:binlog', {})
+        section['binlog-directory'] = binlog_dir
+        section['log-count'] = len(index)
+        if index:
+            section['first-log-file'] = index[0][0]
+            section['start-position'] = self._start_position(index[0][0])
+            section['last-log-file'] = index[-1][0]
+        else:
+            # carry the archive position forward for the next run
+            last_log = self._last_archived_log()
+            if last_log:
+                section['last-log-file'] = last_log
+        LOG.info("Archived %d binary log(s)", len(index))
+
+    def _check_local_server(self):
+        """Binary logs are read from the local filesystem, so refuse to
+        archive a MySQL server running on another host
+
+        :raises: BackupError if the server is remote
+        """
+        host = self.mysql_config['client'].get('host')
+        if host in (None, '', 'localhost', '127.0.0.1', '::1'):
+            return
+        server_host = self.client.show_variable('hostname')
+        if not server_host:
+            return
+        local_names = [socket.gethostname().lower(),
+                       socket.getfqdn().lower()]
+        if server_host.lower() not in local_names:
+            raise BackupError("mysql-binlog reads binary logs from the local "
+                              "filesystem, but host = %s is a remote MySQL "
+                              "server (%s). Run holland on the MySQL server "
+                              "itself." % (host, server_host))
+
+    def _binlog_directory(self):
+        """Find the directory the server writes binary logs to"""
+        for variable in ('log_bin_basename', 'log_bin_index'):
+            path = self.client.show_variable(variable)
+            if path:
+                return os.path.dirname(path)
+        return self.client.show_variable('datadir')
+
+    def _archive_log(self, binlog_dir, name, data_dir):
+        """Copy a single binary log into the spool through open_stream"""
+        path = os.path.join(binlog_dir, name)
+        zopts = self.config['compression']
+        try:
+            src = open(path, 'rb')
+        except IOError, exc:
+            raise BackupError("Failed to open binary log %s: %s" % (path, exc))
+        try:
+            try:
+                dst = open_stream(os.path.join(data_dir, name), 'w',
+                                  method=zopts['method'],
+                                  level=zopts['level'],
+                                  extra_args=zopts['options'])
+            except (IOError, OSError), exc:
+                raise BackupError("Failed to open output stream for %s: %s" %
+                                  (name, exc))
+            try:
+                while True:
+                    chunk = src.read(1024*1024)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            finally:
+                try:
+                    dst.close()
+                except IOError, exc:
+                    raise BackupError("Failed to archive %s: %s" % (name, exc))
+        finally:
+            src.close()
+        LOG.info("Archived %s to %s", path, dst.name)
+        return os.path.basename(dst.name)
+
+    def _pending_logs(self, binlogs):
+        """Filter the server's binary logs down to those not yet archived"""
+        names = [name for name, _ in binlogs]
+        last_log = self._last_archived_log()
+        if last_log:
+            if last_log in names:
+                return binlogs[names.index(last_log) + 1:]
+            LOG.warning("Last archived binary log %s is no longer available "
+                        "on the server. Archiving all binary logs, but there "
+                        "may be a gap in the archive.", last_log)
+            return list(binlogs)
+        first_log = self._seed_position()[0]
+        if first_log:
+            if first_log in names:
+                return binlogs[names.index(first_log):]
+            LOG.warning("Binary log %s recorded by backupset '%s' is no "
+                        "longer available on the server.", first_log,
+                        self.config['mysql-binlog']['start-from'])
+        LOG.info("No previous binary log archive found. Archiving all "
+                 "binary logs.")
+        return list(binlogs)
+
+    def _last_archived_log(self):
+        """Find the last binary log archived by a previous run"""
+        for backup in previous_backups(self.target_directory):
+            section = backup.config.get('mysql:binlog', {})
+            if section.get('last-log-file'):
+                return section['last-log-file']
+        return None
+
+    def _start_position(self, first_log):
+        """Position within the first archived log that replay should start"""
+        if self._last_archived_log():
+            return 4
+        log_file, log_pos = self._seed_position()
+        if log_file == first_log and log_pos:
+            return log_pos
+        return 4
+
+    def _seed_position(self):
+        """Find the binary log position of the newest full backup in the
+        ``start-from`` backupset, as recorded in [mysql:replication]
+        """
+        start_from = self.config['mysql-binlog']['start-from']
+        if not start_from:
+            return None, None
+        spool_path = os.path.dirname(
+                        os.path.dirname(os.path.realpath(self.target_directory)))
+        backupset = Backupset(start_from, os.path.join(spool_path, start_from))
+        for backup in backupset.list_backups(reverse=True) or []:
+            section = backup.config.get('mysql:replication', {})
+            if section.get('master_log_file'):
+                return section['master_log_file'], \
+                       int(section.get('master_log_pos', 4))
+        LOG.warning("No binary log position recorded by backupset '%s'",
+                    start_from)
+        return None, None
+
+    def info(self):
+        """Summarize information about this backup"""
+        section = self.config.get('mysql:binlog', {})
+        return "binary logs archived = %s (%s to %s)" % (
+            section.get('log-count', 0),
+            section.get('first-log-file', '-'),
+            section.get('last-log-file', '-'),
+        )
+
+def write_binlog_index(index, path):
+    """Write binary log name => size, archived name to an index file"""
+    fileobj = open(path, 'w')
+    try:
+        writer = csv.writer(fileobj,
+                            dialect=csv.excel_tab,
+                            lineterminator="\n",
+                            quoting=csv.QUOTE_MINIMAL)
+        for name, size, archive_name in index:
+            writer.writerow([name, size, archive_name])
+    finally:
+        fileobj.close()
+    LOG.info("Wrote binary log index %s", path)
@@ -5,7 +5,8 @@ import re
 import errno
 import logging
 import subprocess
-from tempfile import TemporaryFile
+from holland.lib.toolcache import tool_cache
+from holland.backup.mysqldump.progress import DumpMonitor, DumpStatus
 
 LOG = logging.getLogger(__name__)
 
@@ -28,6 +29,24 @@ def check_master_data(version, arg):
                 raise MyOptionError("Argument to --master-data must be 1 or 2 "
                                     "not %r" % arg)
 
+def takes_global_lock(args):
+    """Check whether mysqldump run with args will issue
+    FLUSH TABLES WITH READ LOCK"""
+    for arg in args:
+        if arg in ('--lock-all-tables', '-x') or \
+                arg.startswith('--master-data'):
+            return True
+    return False
+
+def holds_locks(args):
+    """Check whether mysqldump run with args holds table locks or the
+    global read lock for as long as it runs"""
+    if '--single-transaction' in args:
+        return False
+    if takes_global_lock(args):
+        return True
+    return '--skip-lock-tables' not in args
+
 class MySQLDumpError(Exception):
     """Excepton class for MySQLDump errors"""
 
@@ -127,20 +146,11 @@ MYSQLDUMP_OPTIONS = [
 
 def mysqldump_version(command):
     """Return the version of the given mysqldump command"""
-    args = [
-        command,
-        '--no-defaults',
-        '--version',
-    ]
-    list2cmdline = subprocess.list2cmdline
-    cmdline = list2cmdline(args)
-    LOG.debug("Executing: %s", cmdline)
+    cmdline = subprocess.list2cmdline([command, '--no-defaults', '--version'])
     try:
-        process = subprocess.Popen(args,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT,
-                                   close_fds=True)
-        stdout, _ = process.communicate()
+        returncode, stdout = tool_cache.probe(command,
+                                              '--no-defaults',
+                                              '--version')
     except OSError, exc:
         if exc.errno == errno.ENOENT:
             raise MySQLDumpError("'%s' does not exist" % command)
@@ -148,9 +158,9 @@ def mysqldump_version(command):
             raise MySQLDumpError("Error[%d:%s] when trying to run '%s'" % \
                     (exc.errno, errno.errorcode[exc.errno], command))
 
-    if process.returncode != 0:
+    if returncode != 0:
         LOG.error("%s exited with non-zero status[%d]",
-                  cmdline, process.returncode)
+                  cmdline, returncode)
         for line in stdout.splitlines():
             LOG.error("! %s", line)
     try:
@@ -166,12 +176,22 @@ class MySQLDump(object):
     def __init__(self,
                  defaults_file,
                  cmd_path='mysqldump',
-                 extra_defaults=False):
+                 extra_defaults=False,
+                 progress_interval=0,
+                 status_path=None,
+                 throttle=None,
+                 prelock=None):
         if not os.path.exists(cmd_path):
             raise MySQLDumpError("'%s' does not exist" % cmd_path)
         self.cmd_path = cmd_path
         self.defaults_file = defaults_file
         self.extra_defaults = extra_defaults
+        self.progress_interval = progress_interval
+        self.status = None
+        if status_path:
+            self.status = DumpStatus(status_path)
+        self.throttle = throttle
+        self.prelock = prelock
         self.version = mysqldump_version(cmd_path)
         self.version_str = u'.'.join([str(digit) for digit in self.version])
         self.mysqldump_optcheck = MyOptionChecker(self.version)
@@ -188,8 +208,18 @@ class MySQLDump(object):
         self.options.append(option)
         self.mysqldump_optcheck.check_option(option)
 
-    def run(self, databases, stream, additional_options=None):
-        """Run mysqldump with the options configured on this instance"""
+    def run(self, databases, stream, additional_options=None,
+            estimated_size=0):
+        """Run mysqldump with the options configured on this instance
+
+        Progress is reported every ``progress_interval`` seconds, using
+        ``estimated_size`` to estimate the time remaining.  If this instance
+        has a throttle, mysqldump and any inline compression process are
+        registered with it while mysqldump runs, unless mysqldump holds
+        table locks for the whole run.  If this instance has a
+        prelock callable, it is called before running a mysqldump that will
+        take the global read lock.
+        """
         if not hasattr(stream, 'fileno'):
             raise MySQLDumpError("Invalid output stream")
 
@@ -216,20 +246,49 @@ class MySQLDump(object):
                 args.append('--databases')
             args.extend(databases)
 
+        if self.prelock and takes_global_lock(args):
+            self.prelock()
+
         LOG.info("Executing: %s", subprocess.list2cmdline(args))
-	errlog = TemporaryFile()
-        pid = subprocess.Popen(args, 
-                               stdout=stream.fileno(), 
-                               stderr=errlog.fileno(), 
+        # stdout is copied to the stream by the monitor, which counts the
+        # bytes written for progress reporting
+        pid = subprocess.Popen(args,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
                                close_fds=True)
-        status = pid.wait()
+        if databases is ALL_DATABASES:
+            label = 'all databases'
+        else:
+            label = ','.join(databases)
+        monitor = DumpMonitor(pid, stream, label,
+                              estimated_size=estimated_size,
+                              interval=self.progress_interval,
+                              status=self.status,
+                              cmd_path=self.cmd_path)
+        monitor.start()
+        throttled = []
+        if self.throttle and holds_locks(args):
+            # a stopped mysqldump would keep its locks and block writers,
+            # including the replication SQL thread the throttle watches
+            LOG.warning("Not throttling mysqldump of %s as it holds table "
+                        "locks while it runs", label)
+        elif self.throttle:
+            throttled.append(pid.pid)
+            if getattr(stream, 'pid', None) is not None:
+                throttled.append(stream.pid.pid)
+        for throttled_pid in throttled:
+            self.throttle.add_process(throttled_pid)
         try:
-            errlog.flush()
-            errlog.seek(0)
-            for line in errlog:
-                LOG.error("%s[%d]: %s", self.cmd_path, pid.pid, line.rstrip())
+            status = pid.wait()
         finally:
-            errlog.close()
-	if status != 0:
+            for throttled_pid in throttled:
+                self.throttle.remove_process(throttled_pid)
+        monitor.join()
+        pid.stdout.close()
+        pid.stderr.close()
+        if monitor.error is not None:
+            raise MySQLDumpError("Failed to write mysqldump output: %s" %
+                                 monitor.error)
+        if status != 0:
             raise MySQLDumpError("mysqldump exited with non-zero status %d" % \
                                  pid.returncode)
@@ -6,7 +6,11 @@ import codecs
 import logging
 from holland.core.exceptions import BackupError
 from holland.lib.compression import open_stream, lookup_compression
-from holland.lib.mysql import MySQLSchema, connect, MySQLError
+from holland.lib.toolcache import tool_cache
+from holland.lib.which import WhichError
+from holland.core.spool import previous_backups
+from holland.lib.mysql import MySQLSchema, connect, MySQLError, \
+                              ConnectionPool
 from holland.lib.mysql import include_glob, exclude_glob, \
                               include_glob_qualified, \
                               exclude_glob_qualified
@@ -21,6 +25,11 @@ from holland.lib.mysql.option import load_options, \
 from holland.backup.mysqldump.command import MySQLDump, MySQLDumpError, \
                                              MyOptionError
 from holland.backup.mysqldump.mock import MockEnvironment
+from holland.backup.mysqldump.views import find_invalid_views, \
+                                           catalog_digest, view_digests, \
+                                           load_view_cache, save_view_cache
+from holland.backup.mysqldump.throttle import mysql_throttle
+from holland.lib.mysql.lock import GlobalReadLock, LockError
 
 LOG = logging.getLogger(__name__)
 
@@ -42,6 +51,8 @@ engines             = force_list(default=list("*"))
 exclude-engines     = force_list(default=list())
 
 exclude-invalid-views = boolean(default=no)
+invalid-views-workers = integer(min=1, default=4)
+invalid-views-cache = boolean(default=no)
 
 flush-logs           = boolean(default=no)
 flush-privileges    = boolean(default=yes)
@@ -57,11 +68,24 @@ additional-options  = force_list(default=list())
 
 estimate-method = string(default='plugin')
 
+progress-interval = integer(min=0, default=60)
+
+lock-wait-policy = option('ignore', 'wait', 'kill', 'abort', default='ignore')
+lock-wait-query-time = integer(min=1, default=60)
+lock-wait-max = integer(min=0, default=300)
+
+throttle-max-replication-lag = integer(min=0, default=0)
+throttle-max-threads-running = integer(min=0, default=0)
+throttle-interval = integer(min=1, default=5)
+throttle-max-pause = integer(min=1, default=30)
+
 [compression]
 method = option('none', 'gzip', 'gzip-rsyncable', 'pigz', 'bzip2', 'pbzip2', 'lzma', 'lzop', 'gpg', default='gzip')
 options = string(default="")
 inline = boolean(default=yes)
 level  = integer(min=0, max=9, default=1)
+# how backup output uses the page cache: keep, drop or direct (O_DIRECT)
+page-cache = option('keep', 'drop', 'direct', default='keep')
 
 [mysql:client]
 defaults-extra-file = force_list(default=list('~/.my.cnf'))
@@ -99,7 +123,14 @@ class MySQLDumpPlugin(object):
         self.schema.add_engine_filter(exclude_glob(*config['exclude-engines']))
 
         self.mysql_config = build_mysql_config(self.config['mysql:client'])
-        self.client = connect(self.mysql_config['client'])
+        # connections are reused across the estimate and backup phases
+        self.pool = ConnectionPool(self.mysql_config['client'])
+        self.client = self.pool.client()
+        # databases to dump at once with file-per-database.  Parallel dumps
+        # run without locking and are not consistent with each other, so
+        # this is only raised by callers that own the server, such as
+        # mysqldump-lvm's snapshot mysqld.
+        self.parallel = 1
 
     def estimate_backup_size(self):
         """Estimate the size of the backup this plugin will generate"""
@@ -115,6 +146,9 @@ class MySQLDumpPlugin(object):
         if estimate_method != 'plugin':
             raise BackupError("Invalid estimate-method '%s'" % estimate_method)
 
+        if not self.schema.has_table_filters():
+            return self._fast_estimate()
+
         try:
             db_iter = DatabaseIterator(self.client)
             tbl_iter = MetadataTableIterator(self.client)
@@ -129,20 +163,57 @@ class MySQLDumpPlugin(object):
         finally:
             self.client.disconnect()
 
+    def _fast_estimate(self):
+        """Estimate the backup size from one aggregate query
+
+        Only usable when no table or engine filters are in effect, as
+        database filters are the only ones that can be applied to the
+        per-database totals.
+        """
+        try:
+            try:
+                self.client.connect()
+                sizes = self.client.show_database_sizes(
+                            exclude=DatabaseIterator.STD_EXCLUSIONS
+                        )
+            except MySQLError, exc:
+                LOG.error("Failed to estimate backup size")
+                LOG.error("[%d] %s", *exc.args)
+                raise BackupError("MySQL Error [%d] %s" % exc.args)
+            # kept for the backup phase, which does not load table sizes
+            self.schema.set_database_sizes(sizes)
+            return sum([size for name, size in sizes
+                        if not self.schema.is_db_filtered(name)])
+        finally:
+            self.client.disconnect()
+
     def _fast_refresh_schema(self):
         # determine if we can skip expensive table metadata lookups entirely
         # and just worry about finding database names
         # However, with lock-method=auto-detect we must look at table engines
         # to determine what lock method to use
         config = self.config['mysqldump']
-        fast_iterate = config['lock-method'] != 'auto-detect' and \
+        fast_iterate = self._lock_method() != 'auto-detect' and \
                         not config['exclude-invalid-views']
 
+        # table sizes are not loaded here.  Summarize them per database for
+        # progress reporting and parallel dump ordering, unless the estimate
+        # was made to avoid querying the information schema.  Parallel dumps
+        # are ordered by these sizes even when table filters make them
+        # unfit for progress reporting
+        fetch_sizes = self.schema.database_sizes is None and \
+                      (self.parallel > 1 or
+                       (config['estimate-method'] == 'plugin' and
+                        not self.schema.has_table_filters()))
         try:
             db_iter = DatabaseIterator(self.client)
             tbl_iter = SimpleTableIterator(self.client, record_engines=True)
             try:
                 self.client.connect()
+                if fetch_sizes:
+                    self.schema.set_database_sizes(
+                        self.client.show_database_sizes(
+                            exclude=DatabaseIterator.STD_EXCLUSIONS))
                 self.schema.refresh(db_iter=db_iter,
                                     tbl_iter=tbl_iter,
                                     fast_iterate=fast_iterate)
@@ -167,7 +238,10 @@ class MySQLDumpPlugin(object):
 
         try:
             if self.config['mysqldump']['stop-slave']:
-                self.client = connect(self.mysql_config['client'])
+                if self.dry_run:
+                    # connect() is mocked in dry-run mode, so the slave
+                    # is not actually stopped
+                    self.client = connect(self.mysql_config['client'])
                 if self.client.show_status('Slave_running', session=None) != 'ON':
                     raise BackupError("stop-slave enabled, but replication is "
                                   "either not configured or the slave is not "
@@ -181,6 +255,8 @@ class MySQLDumpPlugin(object):
                 _start_slave(self.client, self.config['mysql:replication'])
             if mock_env:
                 mock_env.restore_environment()
+            self.client.disconnect()
+            self.pool.close()
 
     def _backup(self):
         """Real backup method.  May raise BackupError exceptions"""
@@ -193,7 +269,7 @@ class MySQLDumpPlugin(object):
             LOG.info("* Finding and excluding invalid views...")
             definitions_path = os.path.join(self.target_directory,
                                             'invalid_views.sql')
-            exclude_invalid_views(self.schema, self.client, definitions_path)
+            self._exclude_invalid_views(definitions_path)
         add_exclusions(self.schema, defaults_file)
 
         # find the path to the mysqldump command
@@ -202,10 +278,25 @@ class MySQLDumpPlugin(object):
 
         # setup the mysqldump environment
         extra_defaults = config['extra-defaults']
+        throttle = None
+        prelock = None
+        if not self.dry_run:
+            throttle = mysql_throttle(self.pool.client(), config,
+                                      self._lock_method())
+            lock = GlobalReadLock(self.client,
+                                  policy=config['lock-wait-policy'],
+                                  long_query_time=config['lock-wait-query-time'],
+                                  max_wait=config['lock-wait-max'])
+            prelock = lambda: self._prelock(lock)
         try:
-            mysqldump = MySQLDump(defaults_file, 
-                                  mysqldump_bin, 
-                                  extra_defaults=extra_defaults)
+            mysqldump = MySQLDump(defaults_file,
+                                  mysqldump_bin,
+                                  extra_defaults=extra_defaults,
+                                  progress_interval=config['progress-interval'],
+                                  status_path=os.path.join(self.target_directory,
+                                                           'mysqldump.status'),
+                                  throttle=throttle,
+                                  prelock=prelock)
         except MySQLDumpError, exc:
             raise BackupError(str(exc))
 
@@ -232,15 +323,99 @@ class MySQLDumpPlugin(object):
             cmd = ''
             ext = ''
 
+        if throttle:
+            throttle.start()
         try:
-            start(mysqldump=mysqldump,
-                  schema=self.schema,
-                  lock_method=config['lock-method'],
-                  file_per_database=config['file-per-database'],
-                  open_stream=self._open_stream,
-                  compression_ext=ext)
-        except MySQLDumpError, exc:
-            raise BackupError(str(exc))
+            try:
+                start(mysqldump=mysqldump,
+                      schema=self.schema,
+                      lock_method=self._lock_method(),
+                      file_per_database=config['file-per-database'],
+                      open_stream=self._open_stream,
+                      compression_ext=ext,
+                      parallel=self.parallel)
+            except MySQLDumpError, exc:
+                raise BackupError(str(exc))
+        finally:
+            if throttle:
+                throttle.stop()
+                throttle.check.close()
+                throttle.record(self.config.setdefault('mysqldump:throttle',
+                                                       {}))
+                LOG.info("mysqldump was paused %d time(s) for %.1fs in total",
+                         throttle.pauses, throttle.throttled)
+
+    def _lock_method(self):
+        """Find the lock-method to run mysqldump with"""
+        if self.parallel > 1:
+            return 'none'
+        return self.config['mysqldump']['lock-method']
+
+    def _prelock(self, lock):
+        """Deal with long running statements before mysqldump takes the
+        global read lock, according to lock-wait-policy"""
+        if lock.policy == 'ignore':
+            return
+        try:
+            try:
+                lock.check_long_queries()
+            except LockError, exc:
+                raise MySQLDumpError(str(exc))
+            except MySQLError, exc:
+                raise MySQLDumpError("MySQL error while checking for long "
+                                     "running statements [%d] %s" % exc.args)
+        finally:
+            lock.record(self.config.setdefault('mysql:lock', {}))
+
+    def _exclude_invalid_views(self, definitions_path):
+        """Exclude invalid views, skipping views that a previous backup
+        found valid if invalid-views-cache is enabled
+        """
+        config = self.config['mysqldump']
+        cache_path = os.path.join(self.target_directory, 'valid_views')
+        known_valid = []
+        catalog = None
+        if config['invalid-views-cache']:
+            try:
+                definitions = self.client.show_view_definitions()
+                catalog = catalog_digest(self.client, definitions)
+                digests = view_digests(definitions)
+            except MySQLError, exc:
+                raise BackupError("MySQL Error [%d] %s" % exc.args)
+        if catalog is not None:
+            cached = self._previous_view_cache(catalog)
+            known_valid = [view for view, digest in digests.items()
+                           if digest in cached]
+
+        valid_views = exclude_invalid_views(self.schema,
+                                            self.client,
+                                            definitions_path,
+                                            self.pool.client,
+                                            config['invalid-views-workers'],
+                                            known_valid)
+        if catalog is not None:
+            save_view_cache(cache_path, catalog,
+                            [digests[view] for view in valid_views
+                             if view in digests])
+
+    def _previous_view_cache(self, catalog):
+        """Find the valid views recorded by the last backup, if nothing
+        the views depend on has changed on the server since"""
+        for backup in previous_backups(self.target_directory):
+            path = os.path.join(backup.path, 'valid_views')
+            if not os.path.exists(path):
+                continue
+            try:
+                previous_catalog, digests = load_view_cache(path)
+            except IOError, exc:
+                LOG.warning("Failed to read %s: %s", path, exc)
+                return set()
+            if previous_catalog != catalog:
+                LOG.info("* Tables, routines or privileges have changed "
+                         "since %s. Checking all views.", backup.name)
+                return set()
+            return digests
+        return set()
 
     def _open_stream(self, path, mode, method=None):
         """Open a stream through the holland compression api, relative to
@@ -254,7 +429,9 @@ class MySQLDumpPlugin(object):
                              mode,
                              compression_method,
                              compression_level,
-                             extra_args=compression_options)
+                             extra_args=compression_options,
+                             page_cache=self.config['compression']
+                                                   ['page-cache'])
         return stream
 
     def info(self):
@@ -295,9 +472,11 @@ def find_mysqldump(path=None):
     for _path in search_path.split(':'):
         if os.path.isfile(_path):
             return os.path.realpath(_path)
-        if os.path.exists(os.path.join(_path, 'mysqldump')):
-            return os.path.realpath(os.path.join(_path, 'mysqldump'))
-    raise BackupError("Failed to find mysqldump in %s" % search_path)
+    try:
+        return os.path.realpath(tool_cache.which('mysqldump',
+                                                 search_path.split(':')))
+    except WhichError:
+        raise BackupError("Failed to find mysqldump in %s" % search_path)
 
 def collect_mysqldump_options(config, mysqldump, client):
     """Do intelligent collection of mysqldump options from the config
@@ -401,19 +580,26 @@ def _start_slave(client, config=None):
     except MySQLError, exc:
         raise BackupError("Failed to restart slave [%d] %s" % exc.args)
 
-def exclude_invalid_views(schema, client, definitions_file):
+def exclude_invalid_views(schema, client, definitions_file,
+                          connect_client=None, workers=1, known_valid=()):
     """Flag invalid MySQL views as excluded to skip them during a mysqldump
+
+    Views are checked concurrently over ``workers`` connections created by
+    ``connect_client``, or on ``client`` itself without it.  Views listed in
+    ``known_valid`` are not checked.
+
+    :returns: list of (database, name) tuples of views found to be valid
     """
     sqlf = open(definitions_file, 'w')
     LOG.info("* Invalid and excluded views will be saved to %s",
             definitions_file)
-    cursor = client.cursor()
     try:
         print >>sqlf, "--"
         print >>sqlf, "-- DDL of Invalid Views"
         print >>sqlf, "-- Created automatically by Holland"
         print >>sqlf, "--"
         print >>sqlf
+        views = []
         for db in schema.databases:
             if db.excluded:
                 continue
@@ -422,52 +608,57 @@ def exclude_invalid_views(schema, client, definitions_file):
                     continue
                 if table.engine != 'view':
                     continue
-                LOG.debug("Testing view %s.%s", db.name, table.name)
-                invalid_view = False
-                try:
-                    cursor.execute('SHOW FIELDS FROM `%s`.`%s`' %
-                                    (db.name, table.name))
-                    # check for missing definers that would bork
-                    # lock-tables
-                    for _, error_code, msg in client.show_warnings():
-                        if error_code == 1449: # ER_NO_SUCH_USER
-                            raise MySQLError(error_code, msg)
-                except MySQLError, exc:
-                    # 1356 = View references invalid table(s)...
-                    if exc.args[0] in (1356, 1142, 1143, 1449, 1267):
-                        invalid_view = True
-                    else:
-                        LOG.error("Unexpected error when checking invalid "
-                                  "view %s.%s: [%d] %s",
-                                  db.name,
-                                  table.name,
-                                  *exc.args)
-                        raise BackupError("[%d] %s" % exc.args)
-                if invalid_view:
-                    LOG.warning("* Excluding invalid view `%s`.`%s`: [%d] %s",
-                                db.name, table.name, *exc.args)
-                    table.excluded = True
-                    view_definition = client.show_create_view(db.name,
-                                                              table.name,
-                                                              use_information_schema=True)
-                    if view_definition is None:
-                        LOG.error("!!! Failed to retrieve view definition for "
-                                  "`%s`.`%s`", db.name, table.name)
-                        LOG.warning("!!! View definition for `%s`.`%s` will "
-                                    "not be included in this backup", db.name,
-                                    table.name)
-                        continue
-
-                    LOG.info("* Saving view definition for "
-                                 "`%s`.`%s`",
-                                 db.name, table.name)
-                    print >>sqlf, "--"
-                    print >>sqlf, "-- Current View: `%s`.`%s`" % \
-                    (db.name, table.name)
-                    print >>sqlf, "--"
-                    print >>sqlf
-                    print >>sqlf, view_definition + ';'
-                    print >>sqlf
+                views.append((db.name, table.name, table))
+
+        known_valid = dict.fromkeys(known_valid)
+        if known_valid:
+            LOG.info("* Skipping %d view(s) found valid by a previous backup",
+                     len([view for view in views
+                          if view[0:2] in known_valid]))
+        check_client = None
+        if connect_client is None:
+            # check on the caller's own connection, which has to stay open
+            # for the lookups below
+            check_client = client
+        try:
+            invalid = find_invalid_views([view[0:2] for view in views
+                                          if view[0:2] not in known_valid],
+                                         connect_client,
+                                         workers,
+                                         client=check_client)
+        except MySQLError, exc:
+            raise BackupError("[%d] %s" % exc.args)
+
+        valid_views = []
+        for db_name, table_name, table in views:
+            if (db_name, table_name) not in invalid:
+                valid_views.append((db_name, table_name))
+                continue
+            LOG.warning("* Excluding invalid view `%s`.`%s`: [%d] %s",
+                        db_name, table_name, *invalid[(db_name, table_name)])
+            table.excluded = True
+            view_definition = client.show_create_view(db_name,
+                                                      table_name,
+                                                      use_information_schema=True)
+            if view_definition is None:
+                LOG.error("!!! Failed to retrieve view definition for "
+                          "`%s`.`%s`", db_name, table_name)
+                LOG.warning("!!! View definition for `%s`.`%s` will "
+                            "not be included in this backup", db_name,
+                            table_name)
+                continue
+
+            LOG.info("* Saving view definition for "
+                         "`%s`.`%s`",
+                         db_name, table_name)
+            print >>sqlf, "--"
+            print >>sqlf, "-- Current View: `%s`.`%s`" % \
+            (db_name, table_name)
+            print >>sqlf, "--"
+            print >>sqlf
+            print >>sqlf, view_definition + ';'
+            print >>sqlf
+        return valid_views
     finally:
         sqlf.close()
 
@@ -0,0 +1,179 @@
+"""Monitor a running mysqldump process"""
+
+import os
+import time
+import errno
+import select
+import logging
+import threading
+from holland.core.util.fmt import format_bytes, format_interval
+
+LOG = logging.getLogger(__name__)
+
+class DumpMonitor(threading.Thread):
+    """Follow a running mysqldump process
+
+    mysqldump's stdout is a pipe that this thread copies to ``stream``,
+    counting the bytes on the way.  stderr output from mysqldump is logged
+    as it arrives and, every ``interval`` seconds, the throughput and
+    estimated time remaining are logged and recorded in ``status``, a
+    `DumpStatus` shared by every mysqldump run of a backup.
+
+    If writing to ``stream`` fails, the error is kept in ``error`` and the
+    pipe is closed so that mysqldump fails as well.
+    """
+
+    def __init__(self, process, stream, label, estimated_size=0,
+                 interval=60, status=None, cmd_path='mysqldump'):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.process = process
+        self.cmd_path = cmd_path
+        self.stream = stream
+        self.label = label
+        self.estimated_size = estimated_size
+        self.interval = interval
+        self.status = status
+        self.start_time = None
+        self.written = 0
+        self.error = None
+
+    def run(self):
+        """Copy stdout, log stderr lines and log progress until mysqldump
+        closes both"""
+        self.start_time = time.time()
+        stdout = self.process.stdout.fileno()
+        stderr = self.process.stderr.fileno()
+        fds = [stdout, stderr]
+        next_sample = self.start_time + (self.interval or 0)
+        buf = ''
+        while fds:
+            timeout = None
+            if self.interval:
+                timeout = max(next_sample - time.time(), 0)
+            try:
+                readable = select.select(fds, [], [], timeout)[0]
+            except select.error, exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+            if stdout in readable:
+                data = os.read(stdout, 65536)
+                if not data:
+                    fds.remove(stdout)
+                elif not self.copy(data):
+                    fds.remove(stdout)
+                    self.process.stdout.close()
+            if stderr in readable:
+                data = os.read(stderr, 8192)
+                if not data:
+                    fds.remove(stderr)
+                else:
+                    lines = (buf + data).split('\n')
+                    buf = lines.pop()
+                    for line in lines:
+                        self.log_stderr(line)
+            if self.interval and time.time() >= next_sample:
+                self.report()
+                next_sample = time.time() + self.interval
+        if buf:
+            self.log_stderr(buf)
+        if self.interval:
+            self.report(finished=True)
+
+    def log_stderr(self, line):
+        """Log a line of mysqldump's stderr output"""
+        LOG.error("%s[%d]: %s", self.cmd_path, self.process.pid,
+                  line.rstrip())
+
+    def copy(self, data):
+        """Write a chunk of mysqldump's output to the stream
+
+        :returns: False if the write failed
+        """
+        fd = self.stream.fileno()
+        try:
+            while data:
+                count = os.write(fd, data)
+                self.written += count
+                data = data[count:]
+        except (IOError, OSError), exc:
+            LOG.error("Failed to write mysqldump output for %s: %s",
+                      self.label, exc)
+            self.error = exc
+            return False
+        return True
+
+    def bytes_written(self):
+        """Number of bytes of (uncompressed) output mysqldump has written
+        so far"""
+        return self.written
+
+    def report(self, finished=False):
+        """Log the current progress and update the status record"""
+        elapsed = max(time.time() - self.start_time, 1)
+        written = self.bytes_written()
+        rate = written / elapsed
+        status = [
+            ('state', finished and 'finished' or 'running'),
+            ('databases', self.label),
+            ('bytes-written', written),
+            ('estimated-size', self.estimated_size),
+            ('elapsed', int(elapsed)),
+            ('throughput', int(rate)),
+        ]
+        if finished:
+            LOG.info("mysqldump %s: finished, %s written (%s/s)",
+                     self.label, format_bytes(written), format_bytes(rate))
+        elif self.estimated_size and rate and written < self.estimated_size:
+            eta = (self.estimated_size - written) / rate
+            status.append(('eta', int(eta)))
+            LOG.info("mysqldump %s: %s written (%s/s), %s remaining",
+                     self.label, format_bytes(written), format_bytes(rate),
+                     format_interval(int(eta)))
+        else:
+            LOG.info("mysqldump %s: %s written (%s/s)",
+                     self.label, format_bytes(written), format_bytes(rate))
+        if self.status:
+            self.status.update(self.label, status)
+
+class DumpStatus(object):
+    """Progress of the mysqldump runs of a backup
+
+    Each run is recorded in its own ``[mysqldump:progress:<databases>]``
+    section of a single status file, so parallel dumps do not overwrite
+    each other.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.labels = []
+        self.records = {}
+
+    def update(self, label, status):
+        """Replace the record for ``label`` and rewrite the status file"""
+        self.lock.acquire()
+        try:
+            if label not in self.records:
+                self.labels.append(label)
+            self.records[label] = list(status) + [('updated',
+                                                   int(time.time()))]
+            self.write()
+        finally:
+            self.lock.release()
+
+    def write(self):
+        """Write every record to the status file"""
+        try:
+            fileobj = open(self.path, 'w')
+            try:
+                for label in self.labels:
+                    print >>fileobj, "[mysqldump:progress:%s]" % label
+                    for key, value in self.records[label]:
+                        print >>fileobj, "%s = %s" % (key, value)
+                    print >>fileobj
+            finally:
+                fileobj.close()
+        except IOError, exc:
+            LOG.debug("Failed to write status file %s: %s", self.path, exc)
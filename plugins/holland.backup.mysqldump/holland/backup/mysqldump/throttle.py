@@ -0,0 +1,88 @@
+"""Decide when to throttle mysqldump based on server load"""
+
+import logging
+from holland.lib.throttle import ProcessThrottle
+
+LOG = logging.getLogger(__name__)
+
+class MySQLLoadCheck(object):
+    """Check replication lag and Threads_running on a side connection
+
+    Called by a `ProcessThrottle`.  Returns a description of the threshold
+    that was exceeded, or None if the server is within its limits.  A
+    threshold of 0 disables that check.  Replication lag is only checked if
+    replication is running; a stopped slave never throttles the backup, but
+    a warning is logged while the lag is unavailable.
+    """
+
+    def __init__(self, client, max_replication_lag=0, max_threads_running=0):
+        self.client = client
+        self.max_replication_lag = max_replication_lag
+        self.max_threads_running = max_threads_running
+        self.connected = False
+        self.lag_unavailable = False
+
+    def __call__(self):
+        if not self.connected:
+            self.client.connect()
+            self.connected = True
+        if self.max_replication_lag:
+            status = self.client.show_slave_status()
+            lag = None
+            if status:
+                lag = status.get('seconds_behind_master')
+            if lag is None:
+                if not self.lag_unavailable:
+                    LOG.warning("Replication lag is unavailable (%s). "
+                                "mysqldump will not be throttled on "
+                                "replication lag until it is.",
+                                status and "replication is not running" or
+                                "this server is not a slave")
+                self.lag_unavailable = True
+            else:
+                self.lag_unavailable = False
+                if int(lag) > self.max_replication_lag:
+                    return "replication lag %ss > %ds" % \
+                           (lag, self.max_replication_lag)
+        if self.max_threads_running:
+            running = int(self.client.show_status('Threads_running',
+                                                  session=False))
+            if running > self.max_threads_running:
+                return "Threads_running %d > %d" % \
+                       (running, self.max_threads_running)
+        return None
+
+    def close(self):
+        """Release the side connection"""
+        self.client.disconnect()
+        self.connected = False
+
+def mysql_throttle(client, config, lock_method='single-transaction'):
+    """Create a `ProcessThrottle` from the throttle-* options in a
+    [mysqldump] config section
+
+    mysqldump holds table locks for the whole dump with the flush-lock and
+    lock-tables lock methods.  Pausing it then blocks every writer,
+    including the replication SQL thread, so the lag it is waiting on only
+    grows.  Throttling is disabled for those lock methods.
+
+    :returns: `ProcessThrottle` instance or None if throttling is disabled
+    """
+    if not config['throttle-max-replication-lag'] and \
+            not config['throttle-max-threads-running']:
+        return None
+    if lock_method in ('flush-lock', 'lock-tables'):
+        LOG.warning("Ignoring the throttle-* options with lock-method = %s. "
+                    "Pausing mysqldump while it holds table locks would "
+                    "block replication and other writers.", lock_method)
+        return None
+    check = MySQLLoadCheck(client,
+                           config['throttle-max-replication-lag'],
+                           config['throttle-max-threads-running'])
+    LOG.info("Throttling mysqldump when replication lag exceeds %ds or "
+             "Threads_running exceeds %d (0 = unlimited)",
+             config['throttle-max-replication-lag'],
+             config['throttle-max-threads-running'])
+    return ProcessThrottle(check,
+                           interval=config['throttle-interval'],
+                           max_pause=config['throttle-max-pause'])
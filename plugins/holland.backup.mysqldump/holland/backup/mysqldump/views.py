@@ -0,0 +1,216 @@
+"""Concurrent detection of invalid views
+
+Checking a view means running SHOW FIELDS against it and inspecting the
+warnings, which is two round trips per view.  With many views this is
+spread over a small number of connections, and views already known to be
+valid from a previous run are skipped entirely as long as neither their
+definition, the columns of the tables they reference, the stored routines
+nor the accounts and privileges on the server have changed since.
+"""
+
+import re
+import logging
+import threading
+from Queue import Queue, Empty
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+from holland.lib.mysql import MySQLError
+
+LOG = logging.getLogger(__name__)
+
+#: errors that indicate a view will break mysqldump
+#: 1356 = View references invalid table(s)...
+#: 1449 = The user specified as a definer does not exist
+INVALID_VIEW_ERRORS = (1356, 1142, 1143, 1449, 1267)
+
+def check_view(client, database, name):
+    """Check whether a view is usable
+
+    :raises: MySQLError if the view is invalid
+    """
+    cursor = client.cursor()
+    try:
+        cursor.execute('SHOW FIELDS FROM `%s`.`%s`' %
+                       (database.replace('`', '``'), name.replace('`', '``')))
+        cursor.fetchall()
+    finally:
+        cursor.close()
+    # check for missing definers that would bork lock-tables
+    for _, error_code, msg in client.show_warnings():
+        if error_code == 1449: # ER_NO_SUCH_USER
+            raise MySQLError(error_code, msg)
+
+def find_invalid_views(views, connect_client=None, workers=1, client=None):
+    """Check views concurrently across ``workers`` connections
+
+    :param views: list of (database, name) tuples
+    :param connect_client: callable returning a new unconnected
+                           `PassiveMySQLClient`
+    :param workers: number of connections to check views with
+    :param client: connected client to check every view on instead, in
+                   the calling thread.  It is left connected.
+    :returns: dict mapping (database, name) to the MySQLError args for each
+              invalid view
+    :raises: MySQLError if any view check fails unexpectedly, or whatever
+             other exception a worker failed with
+    """
+    queue = Queue()
+    for view in views:
+        queue.put(view)
+
+    invalid = {}
+    errors = []
+
+    def check_queued(client):
+        """Check views from the queue until it is empty or a check fails"""
+        try:
+            while not errors:
+                try:
+                    database, name = queue.get_nowait()
+                except Empty:
+                    break
+                LOG.debug("Testing view %s.%s", database, name)
+                try:
+                    check_view(client, database, name)
+                except MySQLError, exc:
+                    if exc.args[0] not in INVALID_VIEW_ERRORS:
+                        LOG.error("Unexpected error when checking invalid "
+                                  "view %s.%s: [%d] %s",
+                                  database, name, *exc.args)
+                        raise
+                    invalid[(database, name)] = exc.args
+        except Exception, exc:
+            # any failure leaves views unchecked, so it must fail the whole
+            # check rather than pass them as valid
+            if not isinstance(exc, MySQLError):
+                LOG.error("Unexpected error when checking views: %s", exc)
+            errors.append(exc)
+
+    def run_checks():
+        """Check queued views on a connection of this worker's own"""
+        client = connect_client()
+        try:
+            try:
+                client.connect()
+            except MySQLError, exc:
+                errors.append(exc)
+            else:
+                check_queued(client)
+        finally:
+            client.disconnect()
+
+    if client is not None:
+        LOG.info("* Checking %d view(s)", len(views))
+        check_queued(client)
+    else:
+        workers = max(min(workers, len(views)), 1)
+        LOG.info("* Checking %d view(s) using %d connection(s)",
+                 len(views), workers)
+        threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=run_checks)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return invalid
+
+#: a `schema`.`table` reference in a view definition as stored by MySQL
+TABLE_REFERENCE = re.compile(r'`((?:[^`]|``)+)`\.`((?:[^`]|``)+)`')
+
+def referenced_tables(definition):
+    """Find the tables a view definition refers to
+
+    MySQL stores view definitions with every table qualified by its schema,
+    so this finds each `schema`.`table` reference.  Column references
+    qualified by a table alias are matched as well, which only means a few
+    nonexistent tables are looked up.
+
+    :returns: set of (schema, name) tuples
+    """
+    return set([(schema.replace('``', '`'), name.replace('``', '`'))
+                for schema, name in TABLE_REFERENCE.findall(definition)])
+
+def catalog_digest(client, definitions):
+    """Summarize everything outside a view's definition that decides whether
+    it is valid
+
+    This covers the columns of every table referenced by a view, the stored
+    routines and the accounts and privileges in the grant tables, as
+    dropped definers (1449) and revoked privileges (1142/1143) invalidate a
+    view as surely as a dropped column.  Only referenced tables are looked
+    up, in one query per schema, so that servers before 8.0 do not open
+    every table on the server.
+
+    :param definitions: rows from ``client.show_view_definitions()``
+    :returns: hex digest, or None if the grant tables cannot be read
+    """
+    digest = md5()
+    try:
+        grants = client.show_grant_tables()
+    except MySQLError, exc:
+        LOG.warning("Unable to read the grant tables ([%d] %s). Valid views "
+                    "cannot be cached.", *exc.args)
+        return None
+    tables = set()
+    for row in definitions:
+        tables.update(referenced_tables(row[-1] or ''))
+    columns = client.show_table_columns(tables)
+    for schema, name in sorted(tables):
+        digest.update('%s.%s\n' % (schema, name))
+        for row in columns.get((schema, name), []):
+            digest.update('\t'.join([str(col) for col in row]) + '\n')
+    for row in client.show_routine_catalog():
+        digest.update('\t'.join([str(col) for col in row]) + '\n')
+    for table in sorted(grants):
+        digest.update(table + '\n')
+        for row in grants[table]:
+            digest.update('\t'.join([str(col) for col in row]) + '\n')
+    return digest.hexdigest()
+
+def view_digests(definitions):
+    """Digest the definition of every view on the server
+
+    Views whose definition is not visible to the current user are not
+    included, so they are always checked.
+
+    :param definitions: rows from ``client.show_view_definitions()``
+    :returns: dict mapping (database, name) to a hex digest
+    """
+    result = {}
+    for row in definitions:
+        database, name, _, _, definition = row
+        if not definition:
+            continue
+        digest = md5('\t'.join([str(col) for col in row]))
+        result[(database, name)] = digest.hexdigest()
+    return result
+
+def load_view_cache(path):
+    """Load the catalog digest and valid view digests saved by a previous run
+
+    :returns: tuple of (catalog digest, set of view digests)
+    """
+    fileobj = open(path, 'r')
+    try:
+        lines = [line.strip() for line in fileobj]
+    finally:
+        fileobj.close()
+    if not lines:
+        return None, set()
+    return lines[0], set(lines[1:])
+
+def save_view_cache(path, catalog, digests):
+    """Save the catalog digest and the digests of views found valid"""
+    fileobj = open(path, 'w')
+    try:
+        print >>fileobj, catalog
+        for digest in digests:
+            print >>fileobj, digest
+    finally:
+        fileobj.close()
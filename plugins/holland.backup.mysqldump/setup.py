@@ -32,6 +32,7 @@ setup(name='holland.backup.mysqldump',
       entry_points="""
       [holland.backup]
       mysqldump = holland.backup.mysqldump:provider [mysql, common]
+      mysql-binlog = holland.backup.mysqldump.binlog:MySQLBinlogPlugin [mysql, common]
 
       [holland.restore]
       mysqldump = holland.restore.mysqldump:MySQLRestore
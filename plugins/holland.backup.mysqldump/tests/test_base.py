@@ -0,0 +1,86 @@
+import threading
+from StringIO import StringIO
+from nose.tools import *
+from holland.backup.mysqldump.base import dump_parallel, start
+from holland.backup.mysqldump.command import MySQLDumpError, ALL_DATABASES
+
+class FakeDatabase(object):
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.excluded = False
+
+class FakeSchema(object):
+    def __init__(self, databases):
+        self.databases = databases
+        self.excluded_databases = []
+        self.database_sizes = None
+
+class FakeMySQLDump(object):
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.dumped = []
+        self.sizes = {}
+        self.options = []
+        self.lock = threading.Lock()
+
+    def run(self, databases, stream, more_options, estimated_size=0):
+        if databases is ALL_DATABASES:
+            databases = ['--all-databases']
+        if databases[0] in self.fail:
+            raise MySQLDumpError("mysqldump exited with non-zero status 2")
+        self.lock.acquire()
+        try:
+            self.dumped.append(databases[0])
+            self.sizes[databases[0]] = estimated_size
+        finally:
+            self.lock.release()
+
+def open_stream(path, mode, method=None):
+    stream = StringIO()
+    stream.name = path
+    return stream
+
+def test_dump_parallel():
+    mysqldump = FakeMySQLDump()
+    jobs = [(FakeDatabase('db%d' % i, i), []) for i in range(10)]
+    dump_parallel(mysqldump, jobs, open_stream, '', 4)
+    eq_(sorted(mysqldump.dumped), sorted(['db%d' % i for i in range(10)]))
+
+def test_dump_parallel_largest_first():
+    mysqldump = FakeMySQLDump()
+    jobs = [(FakeDatabase('small', 1), []),
+            (FakeDatabase('large', 100), []),
+            (FakeDatabase('unknown', None), [])]
+    # with one worker the dumps run in the order they were queued
+    dump_parallel(mysqldump, jobs, open_stream, '', 1)
+    eq_(mysqldump.dumped, ['large', 'small', 'unknown'])
+
+def test_dump_parallel_database_sizes():
+    # sizes from show_database_sizes order the dumps when table metadata
+    # was not loaded
+    mysqldump = FakeMySQLDump()
+    jobs = [(FakeDatabase('small', 0), []),
+            (FakeDatabase('large', 0), []),
+            (FakeDatabase('unknown', 0), [])]
+    dump_parallel(mysqldump, jobs, open_stream, '', 1,
+                  sizes=dict(small=1, large=100))
+    eq_(mysqldump.dumped, ['large', 'small', 'unknown'])
+
+def test_dump_parallel_failure():
+    mysqldump = FakeMySQLDump(fail=('db3',))
+    jobs = [(FakeDatabase('db%d' % i, i), []) for i in range(5)]
+    assert_raises(MySQLDumpError, dump_parallel, mysqldump, jobs,
+                  open_stream, '', 2)
+
+def test_start_estimated_size():
+    # progress is reported against the size of each database dumped
+    mysqldump = FakeMySQLDump()
+    schema = FakeSchema([FakeDatabase('db1', 100), FakeDatabase('db2', 20)])
+    start(mysqldump, schema, lock_method='none', open_stream=open_stream)
+    eq_(mysqldump.sizes, dict(db1=100, db2=20))
+
+    mysqldump = FakeMySQLDump()
+    start(mysqldump, schema, lock_method='none', file_per_database=False,
+          open_stream=open_stream)
+    eq_(mysqldump.sizes, {'--all-databases' : 120})
@@ -0,0 +1,93 @@
+import os
+import shutil
+import socket
+import tempfile
+from nose.tools import *
+from holland.core.exceptions import BackupError
+from holland.core.spool import Backup
+from holland.backup.mysqldump.binlog import MySQLBinlogPlugin, \
+                                           write_binlog_index
+
+BINLOGS = [('bin.000001', 100), ('bin.000002', 200), ('bin.000003', 300)]
+
+class FakeClient(object):
+    def __init__(self, hostname=None):
+        self.hostname = hostname
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def show_binary_logs(self):
+        return list(BINLOGS)
+
+    def show_variable(self, key):
+        return dict(hostname=self.hostname).get(key)
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+def make_plugin(name, flush_logs=True, host=None, hostname=None,
+                dry_run=False):
+    path = os.path.join(tmpdir, 'binlogs', name)
+    os.makedirs(path)
+    plugin = MySQLBinlogPlugin.__new__(MySQLBinlogPlugin)
+    plugin.config = {
+        'mysql-binlog' : {
+            'start-from' : None,
+            'flush-logs' : flush_logs,
+            'binlog-directory' : None,
+        }
+    }
+    plugin.target_directory = path
+    plugin.dry_run = dry_run
+    plugin.mysql_config = dict(client=dict(host=host))
+    plugin.client = FakeClient(hostname)
+    return plugin
+
+def test_estimate_with_flush_logs():
+    # the active log is rotated by FLUSH BINARY LOGS and archived
+    plugin = make_plugin('20160101_000000')
+    eq_(plugin.estimate_backup_size(), 600)
+
+def test_estimate_without_flush_logs():
+    # the active log is left for the next run, as backup() does
+    plugin = make_plugin('20160102_000000', flush_logs=False)
+    eq_(plugin.estimate_backup_size(), 300)
+    plugin = make_plugin('20160103_000000', dry_run=True)
+    eq_(plugin.estimate_backup_size(), 300)
+
+def test_pending_after_last_archived_log():
+    previous = os.path.join(tmpdir, 'pending', '20160101_000000')
+    os.makedirs(previous)
+    backup = Backup(previous, 'pending', '20160101_000000')
+    backup.config['mysql:binlog'] = {'last-log-file' : 'bin.000001'}
+    backup.flush()
+    current = os.path.join(tmpdir, 'pending', '20160102_000000')
+    os.makedirs(current)
+    plugin = make_plugin('20160104_000000')
+    plugin.target_directory = current
+    eq_(plugin._pending_logs(BINLOGS), BINLOGS[1:])
+
+def test_remote_server():
+    plugin = make_plugin('20160105_000000', host='db1.example.com',
+                         hostname='db1')
+    assert_raises(BackupError, plugin.estimate_backup_size)
+    # the same host by another name is fine
+    plugin = make_plugin('20160106_000000', host='db1.example.com',
+                         hostname=socket.gethostname())
+    eq_(plugin.estimate_backup_size(), 600)
+    plugin = make_plugin('20160107_000000', host='localhost',
+                         hostname='db1')
+    eq_(plugin.estimate_backup_size(), 600)
+
+def test_write_binlog_index():
+    path = os.path.join(tmpdir, 'binlog.index')
+    write_binlog_index([('bin.000001', 100, 'bin.000001.gz')], path)
+    eq_(open(path).read(), "bin.000001\t100\tbin.000001.gz\n")
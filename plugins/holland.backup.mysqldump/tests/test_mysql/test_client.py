@@ -381,11 +381,11 @@ def test_variable():
     link = connect(ARGS, KWARGS)
     mocker.result(link)
     cursor = link.cursor()
-    sql = 'SHOW SESSION VARIABLES LIKE %s'
+    sql = 'SHOW SESSION VARIABLES WHERE Variable_name IN (%s)'
     cursor.execute(sql, ('sql_log_bin',))
     mocker.result(1L)
-    cursor.fetchone()
-    mocker.result(('sql_log_bin', 'ON'))
+    cursor.fetchall()
+    mocker.result((('sql_log_bin', 'ON'),))
     cursor.close()
     mocker.replay()
 
@@ -401,11 +401,11 @@ def test_variable_nomatch():
     link = connect(ARGS, KWARGS)
     mocker.result(link)
     cursor = link.cursor()
-    sql = 'SHOW SESSION VARIABLES LIKE %s'
+    sql = 'SHOW SESSION VARIABLES WHERE Variable_name IN (%s)'
     cursor.execute(sql, ('postgresql',))
     mocker.result(0L)
-    cursor.fetchone()
-    mocker.result(None)
+    cursor.fetchall()
+    mocker.result(())
     cursor.close()
     mocker.replay()
 
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import subprocess
+from nose.tools import *
+from holland.backup.mysqldump.progress import DumpMonitor, DumpStatus
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+def run_monitor(label, script, estimated_size=0, status=None):
+    stream = open(os.path.join(tmpdir, label + '.sql'), 'w')
+    try:
+        process = subprocess.Popen(['sh', '-c', script],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   close_fds=True)
+        monitor = DumpMonitor(process, stream, label,
+                              estimated_size=estimated_size,
+                              interval=0.1,
+                              status=status)
+        reports = []
+        report = monitor.report
+        def record_report(finished=False):
+            reports.append((monitor.bytes_written(), finished))
+            report(finished)
+        monitor.report = record_report
+        logged = []
+        monitor.log_stderr = logged.append
+        monitor.start()
+        process.wait()
+        monitor.join()
+        process.stdout.close()
+        process.stderr.close()
+        return reports, logged
+    finally:
+        stream.close()
+
+def read_status(path):
+    sections = {}
+    section = None
+    for line in open(path):
+        line = line.strip()
+        if line.startswith('['):
+            section = sections.setdefault(line[1:-1], {})
+        elif line:
+            key, value = line.split(' = ', 1)
+            section[key] = value
+    return sections
+
+def test_monitor_logs_stderr_and_reports():
+    reports, logged = run_monitor('db1',
+                                  'echo 0123456789; echo warning >&2; '
+                                  'sleep 0.3; echo oops >&2')
+    eq_(logged, ['warning', 'oops'])
+    ok_(len(reports) >= 2)
+    # only stdout is counted, however late the final report runs
+    eq_(reports[-1], (11, True))
+    eq_(open(os.path.join(tmpdir, 'db1.sql')).read(), '0123456789\n')
+
+def test_monitor_write_failure():
+    stream = open(os.devnull, 'r')
+    try:
+        process = subprocess.Popen(['sh', '-c', 'echo 0123456789; sleep 0.1; '
+                                                'echo 0123456789'],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   close_fds=True)
+        monitor = DumpMonitor(process, stream, 'db5', interval=0)
+        monitor.log_stderr = lambda line: None
+        monitor.start()
+        process.wait()
+        monitor.join()
+        process.stderr.close()
+    finally:
+        stream.close()
+    ok_(monitor.error is not None)
+    eq_(monitor.bytes_written(), 0)
+
+def test_status_per_dump():
+    path = os.path.join(tmpdir, 'mysqldump.status')
+    status = DumpStatus(path)
+    run_monitor('db2', 'echo 0123456789; sleep 0.3', 1000, status)
+    run_monitor('db3', 'echo 01234; sleep 0.3', 1000, status)
+    sections = read_status(path)
+    eq_(sorted(sections), ['mysqldump:progress:db2',
+                           'mysqldump:progress:db3'])
+    eq_(sections['mysqldump:progress:db2']['bytes-written'], '11')
+    eq_(sections['mysqldump:progress:db3']['bytes-written'], '6')
+    eq_(sections['mysqldump:progress:db3']['state'], 'finished')
+
+def test_eta_from_estimated_size():
+    path = os.path.join(tmpdir, 'eta.status')
+    status = DumpStatus(path)
+    status_lines = []
+    update = status.update
+    def record_update(label, values):
+        status_lines.append(dict(values))
+        update(label, values)
+    status.update = record_update
+    run_monitor('db4', 'echo 0123456789; sleep 0.4', 1000, status)
+    running = [values for values in status_lines
+               if values['state'] == 'running']
+    ok_(running)
+    ok_('eta' in running[0])
+    eq_(running[0]['estimated-size'], 1000)
@@ -0,0 +1,67 @@
+from nose.tools import *
+from holland.backup.mysqldump import throttle
+from holland.backup.mysqldump.command import holds_locks
+from holland.backup.mysqldump.throttle import mysql_throttle, MySQLLoadCheck
+
+CONFIG = {
+    'throttle-max-replication-lag' : 60,
+    'throttle-max-threads-running' : 0,
+    'throttle-interval' : 5,
+    'throttle-max-pause' : 30,
+}
+
+class FakeClient(object):
+    def __init__(self, slave_status):
+        self.slave_status = slave_status
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def show_slave_status(self):
+        return self.slave_status
+
+class RecordingLog(object):
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, *args):
+        self.warnings.append(args)
+
+    def info(self, *args):
+        pass
+
+def test_holds_locks():
+    ok_(holds_locks(['mysqldump', 'db']))
+    ok_(holds_locks(['mysqldump', '--lock-tables', 'db']))
+    ok_(holds_locks(['mysqldump', '--lock-all-tables', 'db']))
+    ok_(holds_locks(['mysqldump', '--master-data=2', '--skip-lock-tables']))
+    assert_false(holds_locks(['mysqldump', '--single-transaction',
+                              '--master-data=2', 'db']))
+    assert_false(holds_locks(['mysqldump', '--skip-lock-tables', 'db']))
+
+def test_no_throttle_with_table_locks():
+    client = FakeClient({})
+    eq_(mysql_throttle(client, CONFIG, 'lock-tables'), None)
+    eq_(mysql_throttle(client, CONFIG, 'flush-lock'), None)
+    ok_(mysql_throttle(client, CONFIG, 'single-transaction') is not None)
+    ok_(mysql_throttle(client, CONFIG, 'none') is not None)
+    ok_(mysql_throttle(client, CONFIG, 'auto-detect') is not None)
+
+def test_unavailable_lag_warns_once():
+    log = throttle.LOG
+    throttle.LOG = RecordingLog()
+    try:
+        check = MySQLLoadCheck(FakeClient({}), max_replication_lag=60)
+        eq_(check(), None)
+        eq_(check(), None)
+        eq_(len(throttle.LOG.warnings), 1)
+        check.client.slave_status = dict(seconds_behind_master=120)
+        eq_(check(), "replication lag 120s > 60s")
+        check.client.slave_status = dict(seconds_behind_master=None)
+        eq_(check(), None)
+        eq_(len(throttle.LOG.warnings), 2)
+    finally:
+        throttle.LOG = log
@@ -0,0 +1,102 @@
+from nose.tools import *
+from holland.lib.mysql import MySQLError
+from holland.backup.mysqldump.views import find_invalid_views, \
+                                           catalog_digest, referenced_tables
+
+DEFINITIONS = [
+    ('test', 'v1', 'root@localhost', 'DEFINER',
+     'select `test`.`t1`.`a` AS `a` from `test`.`t1`'),
+    ('test', 'v2', 'app@%', 'DEFINER',
+     'select `x`.`b` AS `b` from `other`.`t``2` `x`'),
+]
+
+class FakeClient(object):
+    def __init__(self, grants=None, failures=None):
+        self.columns = {
+            ('test', 't1') : [('a', 'int(11)')],
+            ('other', 't`2') : [('b', 'int(11)')],
+        }
+        self.grants = grants
+        if grants is None:
+            self.grants = {
+                'user' : [('localhost', 'root'), ('%', 'app')],
+                'tables_priv' : [],
+            }
+        self.failures = failures or {}
+        self.lookups = []
+        self.connected = False
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def show_grant_tables(self):
+        if self.grants == 'denied':
+            raise MySQLError(1142, "SELECT command denied")
+        return self.grants
+
+    def show_table_columns(self, tables):
+        self.lookups.append(sorted(tables))
+        return dict([(table, self.columns[table]) for table in tables
+                     if table in self.columns])
+
+    def show_routine_catalog(self):
+        return []
+
+def test_referenced_tables():
+    eq_(referenced_tables(DEFINITIONS[0][-1]), set([('test', 't1')]))
+    # alias qualified columns are looked up too, which is harmless
+    eq_(referenced_tables(DEFINITIONS[1][-1]),
+        set([('x', 'b'), ('other', 't`2')]))
+
+def test_catalog_digest_only_reads_referenced_tables():
+    client = FakeClient()
+    catalog_digest(client, DEFINITIONS)
+    # in a single lookup
+    eq_(client.lookups, [[('other', 't`2'), ('test', 't1'), ('x', 'b')]])
+
+def test_catalog_digest_changes():
+    digest = catalog_digest(FakeClient(), DEFINITIONS)
+    eq_(digest, catalog_digest(FakeClient(), DEFINITIONS))
+
+    # a dropped column on a referenced table
+    client = FakeClient()
+    client.columns[('test', 't1')] = []
+    assert_not_equal(digest, catalog_digest(client, DEFINITIONS))
+
+    # a dropped definer
+    client = FakeClient(grants={'user' : [('localhost', 'root')],
+                                'tables_priv' : []})
+    assert_not_equal(digest, catalog_digest(client, DEFINITIONS))
+
+    # a revoked table privilege
+    client = FakeClient(grants={'user' : [('localhost', 'root'), ('%', 'app')],
+                                'tables_priv' : [('%', 'app', 'test', 't1')]})
+    assert_not_equal(digest, catalog_digest(client, DEFINITIONS))
+
+def test_catalog_digest_without_grants():
+    eq_(catalog_digest(FakeClient(grants='denied'), DEFINITIONS), None)
+
+def test_find_invalid_views_worker_failure():
+    # a worker that dies must not leave its views looking valid
+    def connect_client():
+        client = FakeClient()
+        def cursor():
+            raise ValueError("broken")
+        client.cursor = cursor
+        return client
+    assert_raises(ValueError, find_invalid_views,
+                  [('test', 'v1'), ('test', 'v2')], connect_client, 2)
+
+def test_find_invalid_views_on_callers_client():
+    # the caller's client is used as is and left connected
+    client = FakeClient()
+    client.connect()
+    def cursor():
+        raise MySQLError(1356, "View references invalid table(s)")
+    client.cursor = cursor
+    invalid = find_invalid_views([('test', 'v1')], client=client)
+    eq_(invalid.keys(), [('test', 'v1')])
+    ok_(client.connected)
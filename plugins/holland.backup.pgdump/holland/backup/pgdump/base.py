@@ -17,6 +17,7 @@ from holland.core.exceptions import BackupError
 from holland.core.util.fmt import format_bytes
 # Holland general compression functions
 from holland.lib.compression import open_stream
+from holland.lib.throttle import ProcessThrottle
 # holland-common safefilename encoding
 from holland.lib.safefilename import encode as encode_safe
 
@@ -84,7 +85,89 @@ def pg_databases(config, connection):
     logging.debug("pg_databases() -> %r", databases)
     return databases
 
-def run_pgdump(dbname, output_stream, connection_params, format='custom', env=None):
+class PgLoadCheck(object):
+    """Check replication lag on a side connection
+
+    On a standby this is the time since the last replayed transaction.  On
+    a primary it is the largest replay_lag reported in pg_stat_replication,
+    which requires Postgres 10 or later.
+
+    Called by a `ProcessThrottle`.  Returns a description of the lag if it
+    exceeds ``max_replication_lag`` seconds, otherwise None.  A warning is
+    logged while the lag is unavailable.
+    """
+
+    def __init__(self, config, max_replication_lag):
+        self.config = config
+        self.max_replication_lag = max_replication_lag
+        self.connection = None
+        self.lag_unavailable = False
+
+    def replication_lag(self):
+        """Current replication lag in seconds
+
+        :returns: tuple of (lag, reason) where lag is None and reason says
+                  why if the lag is unknown
+        """
+        if self.connection is None:
+            self.connection = get_connection(self.config)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("SELECT pg_is_in_recovery()")
+            if cursor.fetchone()[0]:
+                cursor.execute("SELECT EXTRACT(EPOCH FROM "
+                               "now() - pg_last_xact_replay_timestamp())")
+                reason = "no transaction has been replayed yet"
+            else:
+                cursor.execute("SHOW server_version_num")
+                if int(cursor.fetchone()[0]) < 100000:
+                    return None, "replay_lag requires Postgres 10 or later"
+                cursor.execute("SELECT MAX(EXTRACT(EPOCH FROM replay_lag)) "
+                               "FROM pg_stat_replication")
+                reason = "no standby is reporting replay_lag"
+            lag = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        if lag is None:
+            return None, reason
+        return float(lag), None
+
+    def __call__(self):
+        lag, reason = self.replication_lag()
+        if lag is None:
+            if not self.lag_unavailable:
+                LOG.warning("Replication lag is unavailable (%s). pg_dump "
+                            "will not be throttled until it is.", reason)
+            self.lag_unavailable = True
+            return None
+        self.lag_unavailable = False
+        if lag > self.max_replication_lag:
+            return "replication lag %ds > %ds" % (lag,
+                                                  self.max_replication_lag)
+        return None
+
+    def close(self):
+        """Close the side connection"""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def pg_throttle(config):
+    """Create a `ProcessThrottle` from the throttle-* options in a [pgdump]
+    config section
+
+    :returns: `ProcessThrottle` instance or None if throttling is disabled
+    """
+    max_lag = config['pgdump']['throttle-max-replication-lag']
+    if not max_lag:
+        return None
+    LOG.info("Throttling pg_dump when replication lag exceeds %ds", max_lag)
+    return ProcessThrottle(PgLoadCheck(config, max_lag),
+                           interval=config['pgdump']['throttle-interval'],
+                           max_pause=config['pgdump']['throttle-max-pause'])
+
+def run_pgdump(dbname, output_stream, connection_params, format='custom',
+               env=None, throttle=None):
     """Run pg_dump for the given database and write to the specified output
     stream.
 
@@ -92,6 +175,8 @@ def run_pgdump(dbname, output_stream, connection_params, format='custom', env=No
     :type db: str
     :param output_stream: a file-like object - must have a fileno attribute
                           that is a real, open file descriptor
+    :param throttle: optional `ProcessThrottle` to register pg_dump and
+                     any inline compression process with
     """
     args = [ 'pg_dump' ] + connection_params + [
         '--format', format,
@@ -104,15 +189,28 @@ def run_pgdump(dbname, output_stream, connection_params, format='custom', env=No
     stderr = tempfile.TemporaryFile()
     try:
         try:
-            returncode = subprocess.call(args,
-                                         stdout=output_stream,
-                                         stderr=stderr,
-                                         env=env,
-                                         close_fds=True)
+            process = subprocess.Popen(args,
+                                       stdout=output_stream,
+                                       stderr=stderr,
+                                       env=env,
+                                       close_fds=True)
         except OSError, exc:
             raise PgError("Failed to execute '%s': [%d] %s" %
                           (args[0], exc.errno, exc.strerror))
 
+        throttled = [process.pid]
+        if getattr(output_stream, 'pid', None) is not None:
+            throttled.append(output_stream.pid.pid)
+        if throttle:
+            for pid in throttled:
+                throttle.add_process(pid)
+        try:
+            returncode = process.wait()
+        finally:
+            if throttle:
+                for pid in throttled:
+                    throttle.remove_process(pid)
+
         stderr.flush()
         stderr.seek(0)
         for line in stderr:
@@ -139,7 +237,8 @@ def backup_globals(backup_directory, config, connection_params, env=None):
     output_stream = open_stream(path, 'w',
                                 method=zopts['method'],
                                 level=zopts['level'],
-                                extra_args=zopts['options'])
+                                extra_args=zopts['options'],
+                                page_cache=zopts['page-cache'])
 
     args = [
         'pg_dumpall',
@@ -249,13 +348,29 @@ def backup_pgsql(backup_directory, config, databases):
 
     backup_globals(backup_directory, config, connection_params, env=pgenv)
 
+    throttle = pg_throttle(config)
+    if throttle:
+        throttle.start()
+    try:
+        _backup_databases(backup_directory, config, databases,
+                          connection_params + extra_options, pgenv, throttle)
+    finally:
+        if throttle:
+            throttle.stop()
+            throttle.check.close()
+            throttle.record(config.setdefault('pgdump:throttle', {}))
+            LOG.info("pg_dump was paused %d time(s) for %.1fs in total",
+                     throttle.pauses, throttle.throttled)
+
+def _backup_databases(backup_directory, config, databases, connection_params,
+                      pgenv, throttle=None):
+    """Run pg_dump for each database in databases"""
     ext_map = {
         'custom' : '.dump',
         'plain' : '.sql',
         'tar' : '.tar',
     }
 
-
     backups = []
     for dbname in databases:
         format = config['pgdump']['format']
@@ -270,15 +385,17 @@ def backup_pgsql(backup_directory, config, databases):
         stream = open_stream(filename, 'w',
                              method=zopts['method'],
                              level=zopts['level'],
-                             extra_args=zopts['options'])
+                             extra_args=zopts['options'],
+                             page_cache=zopts['page-cache'])
 
         backups.append((dbname, stream.name))
 
         run_pgdump(dbname=dbname,
                    output_stream=stream,
-                   connection_params=connection_params + extra_options,
+                   connection_params=connection_params,
                    format=format,
-                   env=pgenv)
+                   env=pgenv,
+                   throttle=throttle)
 
         stream.close()
 
@@ -32,11 +32,16 @@ CONFIGSPEC = """
 format = option('plain','tar','custom', default='custom')
 role = string(default=None)
 additional-options = string(default=None)
+throttle-max-replication-lag = integer(min=0, default=0)
+throttle-interval = integer(min=1, default=5)
+throttle-max-pause = integer(min=1, default=30)
 
 [compression]
 method = option('gzip', 'gzip-rsyncable', 'bzip2', 'pbzip2', 'lzop', 'lzma', 'pigz', 'none', default='gzip')
 level = integer(min=0, default=1)
 options = string(default="")
+# how backup output uses the page cache: keep, drop or direct (O_DIRECT)
+page-cache = option('keep', 'drop', 'direct', default='keep')
 
 [pgauth]
 username = string(default=None)
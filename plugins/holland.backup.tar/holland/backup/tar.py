@@ -1,17 +1,38 @@
 import logging
 import os
+import time
+import shutil
 from subprocess import Popen, list2cmdline
 from holland.core.exceptions import BackupError
+from holland.core.spool import previous_backups
+from holland.core.util.path import estimate_size
 from holland.lib.compression import open_stream
 from tempfile import TemporaryFile
 
 LOG = logging.getLogger(__name__)
 
+#: tar --listed-incremental snapshot file kept in each incremental backup
+SNAPSHOT_NAME = 'backup.snar'
+
 # Specification for this plugin
 # See: http://www.voidspace.org.uk/python/validate.html
 CONFIGSPEC = """
 [tar]
 directory = string(default='/home')
+# archive only what changed since the previous backup, using
+# tar --listed-incremental
+incremental = boolean(default=no)
+# take a full backup after this many incremental backups (0 = never)
+full-interval = integer(min=0, default=6)
+# take a full backup once the last one is this many days old (0 = never)
+full-max-age = integer(min=0, default=0)
+# threads that walk the directory to estimate the backup size
+estimate-workers = integer(min=1, default=4)
+# fraction of deeper subdirectories walked to estimate the size
+estimate-sample = float(min=0.001, max=1.0, default=1.0)
+# statvfs uses the space used on the filesystem when directory is a
+# mount point
+estimate-method = option('walk', 'statvfs', default='walk')
 [compression]
 method = option('none', 'gzip', 'gzip-rsyncable', 'pigz', 'bzip2', 'pbzip2', 'lzma', 'lzop', 'gpg', default='gzip')
 options = string(default="")
@@ -37,16 +58,24 @@ class TarPlugin(object):
         self.dry_run = dry_run
         LOG.info("Validating config")
         self.config.validate_config(CONFIGSPEC)
+        # base backup for an incremental backup; see _find_base
+        self._base = None
+        self._base_found = False
 
     def estimate_backup_size(self):
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(self.config['tar']['directory']):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                # verify the symlink and such exist before trying to get its size
-                if os.path.exists(fp):
-                    total_size += os.path.getsize(fp)
-        return total_size
+        tar_config = self.config['tar']
+        # an incremental backup only archives files changed since its base
+        since = 0
+        if tar_config['incremental']:
+            base = self._find_base()
+            if base is not None:
+                since = base.config['holland:backup']['start-time']
+        return estimate_size(tar_config['directory'],
+                             workers=tar_config['estimate-workers'],
+                             newer_than=since,
+                             sample=tar_config['estimate-sample'],
+                             use_statvfs=tar_config['estimate-method'] ==
+                                         'statvfs')
 
     def _open_stream(self, path, mode, method=None):
         """Open a stream through the holland compression api, relative to
@@ -72,6 +101,10 @@ class TarPlugin(object):
             self.config['tar']['directory'].lstrip('/').replace('/', '_'))
         outfile = os.path.join(self.target_directory, out_name)
         args = ['tar', 'c', self.config['tar']['directory']]
+        incremental = None
+        if self.config['tar']['incremental']:
+            snapshot, incremental = self._prepare_snapshot()
+            args[2:2] = ['--listed-incremental', snapshot]
         errlog = TemporaryFile()
         stream = self._open_stream(outfile, 'w')
         LOG.info("Executing: %s", list2cmdline(args))
@@ -80,7 +113,7 @@ class TarPlugin(object):
             stdout=stream.fileno(),
             stderr=errlog.fileno(),
             close_fds=True)
-        status = pid.wait()
+        returncode = pid.wait()
         try:
             errlog.flush()
             errlog.seek(0)
@@ -89,5 +122,104 @@ class TarPlugin(object):
         finally:
             errlog.close()
 
-        if status != 0:
-            raise BackupError('tar failed (status={0})'.format(status))
+        if returncode != 0:
+            raise BackupError('tar failed (status={0})'.format(returncode))
+
+        if incremental is not None:
+            # only recorded once tar succeeds, so later backups are never
+            # based on a partial snapshot file
+            self.config['tar:incremental'] = incremental
+            self.config['holland:backup']['depends-on'] = \
+                [name for name in incremental['depends-on'].split(',')
+                 if name]
+
+    def _find_base(self):
+        """Find the backup to take an incremental backup against
+
+        The base is looked up once, when the backup size is estimated, so
+        that purge-on-demand cannot move the backup onto a different base
+        than the one its size was estimated for.
+        """
+        if not self._base_found:
+            self._base = find_base(self.target_directory, self.config['tar'])
+            self._base_found = True
+        return self._base
+
+    def _prepare_snapshot(self):
+        """Set up the tar snapshot file for an incremental backup
+
+        tar updates the snapshot file in place, so the one saved with the
+        base backup is copied.  A full (level 0) backup starts without one.
+
+        :returns: (snapshot file path, [tar:incremental] status dict)
+        """
+        directory = self.config['tar']['directory']
+        snapshot = os.path.join(self.target_directory, SNAPSHOT_NAME)
+        base = self._find_base()
+        if base is not None and not os.path.isdir(base.path):
+            LOG.warning("Backup %s was purged after the backup size was "
+                        "estimated against it. Taking a full backup, which "
+                        "may need more space than estimated.", base.name)
+            base = None
+        if base is None:
+            LOG.info("Taking a full (level 0) backup of %s", directory)
+            return snapshot, {
+                'level' : '0',
+                'base' : '',
+                'directory' : directory,
+                'depends-on' : '',
+                'full-time' : str(time.time()),
+            }
+        base_status = base.config['tar:incremental']
+        level = int(base_status['level']) + 1
+        depends_on = [name for name in
+                      base_status['depends-on'].split(',') if name]
+        depends_on.append(base.dirname)
+        shutil.copyfile(os.path.join(base.path, SNAPSHOT_NAME), snapshot)
+        LOG.info("Taking a level %d incremental backup of %s against %s",
+                 level, directory, base.name)
+        return snapshot, {
+            'level' : str(level),
+            'base' : base.dirname,
+            'directory' : directory,
+            'depends-on' : ','.join(depends_on),
+            'full-time' : base_status['full-time'],
+        }
+
+def find_base(target_directory, config):
+    """Find the most recent backup in the backupset of ``target_directory``
+    that a new incremental backup can be taken against
+
+    :param config: the [tar] config section
+    :returns: Backup, or None if a full backup should be taken
+    """
+    for backup in previous_backups(target_directory):
+        if backup.is_failed():
+            continue
+        status = backup.config.get('tar:incremental')
+        if not status or \
+           not os.path.exists(os.path.join(backup.path, SNAPSHOT_NAME)):
+            continue
+        if status['directory'] != config['directory']:
+            LOG.info("[tar] directory changed since backup %s. Taking a full "
+                     "backup.", backup.name)
+            return None
+        level = int(status['level'])
+        if config['full-interval'] and level + 1 > config['full-interval']:
+            LOG.info("%d incremental backup(s) since the last full backup. "
+                     "Taking a full backup.", level)
+            return None
+        age = time.time() - float(status['full-time'])
+        if config['full-max-age'] and age > config['full-max-age']*86400:
+            LOG.info("The last full backup is %.1f days old. Taking a full "
+                     "backup.", age / 86400)
+            return None
+        backupset_dir = os.path.dirname(backup.path)
+        for name in [name for name in status['depends-on'].split(',')
+                     if name]:
+            if not os.path.isdir(os.path.join(backupset_dir, name)):
+                LOG.info("Backup %s depends on %s, which no longer exists. "
+                         "Taking a full backup.", backup.name, name)
+                return None
+        return backup
+    return None
@@ -154,6 +154,9 @@ class XtrabackupPlugin(object):
         # innobackupex --tmpdir does not affect xtrabackup
         util.add_xtrabackup_defaults(self.defaults_path, tmpdir=tmpdir)
         args = util.build_xb_args(xb_cfg, backup_directory, self.defaults_path)
+        version = util.innobackupex_version(args[0])
+        if version:
+            LOG.info("* Using %s", version)
         util.execute_pre_command(xb_cfg['pre-command'],
                                  backup_directory=backup_directory)
         stderr = self.open_xb_logfile()
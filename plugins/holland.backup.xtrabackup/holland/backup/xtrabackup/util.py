@@ -12,7 +12,8 @@ from string import Template
 from os.path import join, isabs, expanduser
 from subprocess import Popen, PIPE, STDOUT, list2cmdline
 from holland.core.backup import BackupError
-from holland.lib.which import which, WhichError
+from holland.lib.which import WhichError
+from holland.lib.toolcache import tool_cache
 
 LOG = logging.getLogger(__name__)
 
@@ -92,7 +93,7 @@ def apply_xtrabackup_logfile(xb_cfg, backupdir):
     innobackupex = xb_cfg['innobackupex']
     if not isabs(innobackupex):
         try:
-            innobackupex = which(innobackupex)
+            innobackupex = tool_cache.which(innobackupex)
         except WhichError:
             raise BackupError("Failed to find innobackupex script")
     args = [
@@ -179,12 +180,31 @@ def add_xtrabackup_defaults(defaults_path, **kwargs):
                               defaults_path)
     finally:
         fileobj.close()
+
+def innobackupex_version(innobackupex):
+    """Find the version reported by an innobackupex script
+
+    The output of ``--version`` is cached per installed binary, so this is
+    only run again when the script is upgraded.
+
+    :returns: first line of the version output or None if it cannot be run
+    """
+    try:
+        returncode, output = tool_cache.probe(innobackupex, '--version')
+    except OSError, exc:
+        LOG.debug("Failed to run %s --version: %s", innobackupex, exc)
+        return None
+    for line in output.splitlines():
+        if line.strip():
+            return line.strip()
+    return None
+
 def build_xb_args(config, basedir, defaults_file=None):
     """Build the commandline for xtrabackup"""
     innobackupex = config['innobackupex']
     if not isabs(innobackupex):
         try:
-            innobackupex = which(innobackupex)
+            innobackupex = tool_cache.which(innobackupex)
         except WhichError:
             raise BackupError("Failed to find innobackupex script")
 
@@ -1,11 +1,13 @@
 from dir_archive import DirArchive
 from tar_archive import TarArchive
 from zip_archive import ZipArchive
+from tar_stream import TarStreamWriter
 
 __all__ = [
     'DirArchive',
     'TarArchive',
-    'ZipArchive'
+    'ZipArchive',
+    'TarStreamWriter'
 ]
 
 archive_methods = {
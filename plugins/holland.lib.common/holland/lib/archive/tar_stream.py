@@ -0,0 +1,464 @@
+"""Stream a tar archive of a directory tree without running tar
+
+`TarStreamWriter` writes GNU format tar members straight to a file
+descriptor, such as the stdin pipe of a compression process:
+
+* file data is moved by the kernel with sendfile(2), or copy_file_range(2)
+  when the output is a regular file, rather than being read into python.
+  Both are called through ctypes (python 2 has neither), falling back to
+  read/write where they are missing or unsupported.
+* files with holes (sparse or preallocated InnoDB files) are found with
+  lseek SEEK_DATA/SEEK_HOLE and written as GNU sparse members holding only
+  their data regions.
+* `ReadAhead` threads ask the kernel to start reading the files that will
+  be archived next, so a single output stream does not stall on reads.
+
+The archives can be extracted with GNU tar or the tarfile module.
+"""
+
+import os
+import pwd
+import grp
+import stat
+import errno
+import logging
+import tarfile
+import threading
+from holland.lib.pagecache import fadvise, POSIX_FADV_WILLNEED, \
+                                  POSIX_FADV_SEQUENTIAL, POSIX_FADV_DONTNEED
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+LOG = logging.getLogger(__name__)
+
+BLOCKSIZE = tarfile.BLOCKSIZE
+RECORDSIZE = tarfile.RECORDSIZE
+#: most bytes moved by one sendfile/copy_file_range/read call
+CHUNK_SIZE = 8*1024*1024
+#: smallest file checked for holes
+SPARSE_MIN_SIZE = 1024*1024
+# lseek whence values for finding holes (linux, solaris)
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+# errors meaning a zero-copy call cannot be used for these descriptors
+_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.EXDEV,
+                getattr(errno, 'EOPNOTSUPP', errno.EINVAL),
+                getattr(errno, 'ENOTSUP', errno.EINVAL))
+
+def _load_libc_call(name, restype, argtypes):
+    """Find a function in libc, or None"""
+    if ctypes is None:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+    except OSError:
+        return None
+    func = getattr(libc, name, None)
+    if func is not None:
+        func.restype = restype
+        func.argtypes = argtypes
+    return func
+
+if ctypes is not None:
+    _ssize_t = getattr(ctypes, 'c_ssize_t', ctypes.c_long)
+    _loff_p = ctypes.POINTER(ctypes.c_longlong)
+    _sendfile = _load_libc_call('sendfile64', _ssize_t,
+                                [ctypes.c_int, ctypes.c_int, _loff_p,
+                                 ctypes.c_size_t])
+    _copy_file_range = _load_libc_call('copy_file_range', _ssize_t,
+                                       [ctypes.c_int, _loff_p,
+                                        ctypes.c_int, _loff_p,
+                                        ctypes.c_size_t, ctypes.c_uint])
+else:
+    _sendfile = _copy_file_range = None
+
+def data_regions(fd, size):
+    """Find the (offset, length) regions of a file that hold data
+
+    Holes are found with lseek SEEK_DATA/SEEK_HOLE.  Where those are not
+    supported the whole file is one region.
+    """
+    regions = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, SEEK_DATA)
+            except OSError, exc:
+                if exc.errno == errno.ENXIO:
+                    # only a hole remains
+                    break
+                raise
+            if start >= size:
+                break
+            end = min(os.lseek(fd, start, SEEK_HOLE), size)
+            regions.append((start, end - start))
+            offset = end
+    except OSError, exc:
+        LOG.debug("SEEK_DATA/SEEK_HOLE failed: %s", exc)
+        return [(0, size)]
+    return regions
+
+class ReadAhead(object):
+    """Ask the kernel to read files before they are archived
+
+    ``files`` is a list of (path, size) tuples in the order they will be
+    archived.  Up to ``depth`` files ahead of the position given to
+    `advance`, ``workers`` threads issue POSIX_FADV_WILLNEED for the first
+    ``window`` bytes of each file.
+    """
+
+    def __init__(self, files, workers=4, window=32*1024*1024, depth=None):
+        self.files = files
+        self.workers = workers
+        self.window = window
+        self.depth = depth or workers*2
+        self._position = 0
+        self._next = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """Start the read ahead threads"""
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._run)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def advance(self, index):
+        """Note that the file at ``index`` is being archived"""
+        self._cond.acquire()
+        try:
+            self._position = index
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def stop(self):
+        """Stop the read ahead threads"""
+        self._cond.acquire()
+        try:
+            self._stopped = True
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _take(self):
+        """Wait for the next file to read ahead, or None when done"""
+        self._cond.acquire()
+        try:
+            while not self._stopped and \
+                  self._next >= self._position + self.depth:
+                self._cond.wait()
+            if self._stopped or self._next >= len(self.files):
+                return None
+            item = self.files[self._next]
+            self._next += 1
+            return item
+        finally:
+            self._cond.release()
+
+    def _run(self):
+        while True:
+            item = self._take()
+            if item is None:
+                break
+            path, size = item
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                fadvise(fd, 0, min(size, self.window), POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+
+class TarStreamWriter(object):
+    """Write a tar archive to an output stream
+
+    :param stream: file-like object with a ``fileno()``, such as a stream
+                   from holland.lib.compression.open_stream
+    :param page_cache: 'drop' to drop the pages of each file from the page
+                       cache once it has been archived
+    :param read_ahead: number of `ReadAhead` threads used by `add_tree`
+                       (0 to disable)
+    :param interrupted: callable returning True when `add_tree` should stop
+
+    After `close()` ``files``, ``bytes`` (file data written),
+    ``sparse_files`` and ``holes`` (bytes of holes skipped) describe the
+    archive.
+    """
+
+    def __init__(self, stream, page_cache='keep', read_ahead=4,
+                 interrupted=None):
+        self.stream = stream
+        self.fd = stream.fileno()
+        self.page_cache = page_cache
+        self.read_ahead = read_ahead
+        self.interrupted = interrupted
+        self.offset = 0
+        self.files = 0
+        self.bytes = 0
+        self.sparse_files = 0
+        self.holes = 0
+        self._names = {}
+        try:
+            is_file = stat.S_ISREG(os.fstat(self.fd).st_mode)
+        except OSError:
+            is_file = False
+        self._methods = []
+        if is_file and _copy_file_range is not None:
+            self._methods.append('copy_file_range')
+        if _sendfile is not None:
+            self._methods.append('sendfile')
+        self._methods.append('read')
+
+    def add_tree(self, directory, arcname='.', exclude=None):
+        """Archive ``directory`` and everything below it as ``arcname``
+
+        :param exclude: callable passed each member name (e.g.
+                        ./mysql/user.frm) returning True to skip it
+        :returns: False if interrupted, True otherwise
+        """
+        members = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            rel = dirpath[len(directory):].lstrip(os.sep)
+            base = rel and os.path.join(arcname, rel) or arcname
+            if exclude:
+                dirnames[:] = [name for name in dirnames
+                               if not exclude(os.path.join(base, name))]
+            dirnames.sort()
+            members.append((dirpath, base))
+            for name in sorted(filenames):
+                member = os.path.join(base, name)
+                if exclude and exclude(member):
+                    continue
+                members.append((os.path.join(dirpath, name), member))
+        prefetch = None
+        if self.read_ahead:
+            files = []
+            for path, name in members:
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    files.append((path, st.st_size))
+            prefetch = ReadAhead(files, workers=self.read_ahead)
+            prefetch.start()
+        try:
+            index = 0
+            for path, name in members:
+                if self.interrupted and self.interrupted():
+                    return False
+                if self.add(path, name) and prefetch:
+                    index += 1
+                    prefetch.advance(index)
+        finally:
+            if prefetch:
+                prefetch.stop()
+        return True
+
+    def add(self, path, arcname):
+        """Archive a single file, directory or symlink
+
+        Other file types (sockets, fifos, devices) are skipped.
+
+        :returns: True if a regular file was archived
+        """
+        try:
+            st = os.lstat(path)
+        except OSError, exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            LOG.warning("%s: file removed before it could be archived", path)
+            return False
+        if stat.S_ISDIR(st.st_mode):
+            name = arcname.rstrip('/') + '/'
+            self._write(self._header(name, st, tarfile.DIRTYPE))
+        elif stat.S_ISLNK(st.st_mode):
+            self._write(self._header(arcname, st, tarfile.SYMTYPE,
+                                     linkname=os.readlink(path)))
+        elif stat.S_ISREG(st.st_mode):
+            self._add_file(path, arcname, st)
+            return True
+        else:
+            LOG.info("%s: %s ignored", path,
+                     stat.S_ISSOCK(st.st_mode) and 'socket' or 'special file')
+        return False
+
+    def close(self):
+        """Write the end of archive marker
+
+        The output stream is left open.
+        """
+        self._write('\0' * (BLOCKSIZE*2))
+        remainder = self.offset % RECORDSIZE
+        if remainder:
+            self._write('\0' * (RECORDSIZE - remainder))
+
+    def _add_file(self, path, arcname, st):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            regions = [(0, size)]
+            if size >= SPARSE_MIN_SIZE:
+                regions = data_regions(fd, size)
+            fadvise(fd, 0, 0, POSIX_FADV_SEQUENTIAL)
+            if regions == [(0, size)]:
+                self._write(self._header(arcname, st, tarfile.REGTYPE,
+                                         size=size))
+            else:
+                self._write(self._sparse_header(arcname, st, size, regions))
+                self.sparse_files += 1
+                self.holes += size - sum([length for _, length in regions])
+            stored = 0
+            for offset, length in regions:
+                self._copy(fd, offset, length)
+                stored += length
+            remainder = stored % BLOCKSIZE
+            if remainder:
+                self._write('\0' * (BLOCKSIZE - remainder))
+            if self.page_cache == 'drop':
+                fadvise(fd, 0, 0, POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+        self.files += 1
+        self.bytes += stored
+
+    def _tarinfo(self, name, st, type, size=0, linkname=''):
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.mode = stat.S_IMODE(st.st_mode)
+        tarinfo.uid = st.st_uid
+        tarinfo.gid = st.st_gid
+        tarinfo.uname = self._lookup(pwd.getpwuid, st.st_uid)
+        tarinfo.gname = self._lookup(grp.getgrgid, st.st_gid)
+        tarinfo.mtime = int(st.st_mtime)
+        tarinfo.type = type
+        tarinfo.size = size
+        tarinfo.linkname = linkname
+        return tarinfo
+
+    def _header(self, name, st, type, size=0, linkname=''):
+        return self._tarinfo(name, st, type, size, linkname) \
+                   .tobuf(tarfile.GNU_FORMAT)
+
+    def _sparse_header(self, name, st, size, regions):
+        """Build an old GNU format sparse member header
+
+        The header holds the first four (offset, length) regions and the
+        real file size, and is followed by extension blocks of 21 regions
+        each.  A file ending in a hole gets a final empty region so that
+        extraction recreates its full length.
+        """
+        regions = list(regions)
+        if not regions or regions[-1][0] + regions[-1][1] < size:
+            regions.append((size, 0))
+        stored = sum([length for _, length in regions])
+        buf = self._header(name, st, tarfile.GNUTYPE_SPARSE, size=stored)
+        # the member's own header is the last block, after any long name
+        # blocks
+        header, block = buf[:-BLOCKSIZE], buf[-BLOCKSIZE:]
+        block = block[:386] + _sparse_map(regions[:4], 4) + \
+                (len(regions) > 4 and '\1' or '\0') + \
+                tarfile.itn(size, 12, tarfile.GNU_FORMAT) + \
+                block[495:]
+        block = _set_checksum(block)
+        regions = regions[4:]
+        extensions = []
+        while regions:
+            chunk, regions = regions[:21], regions[21:]
+            ext = _sparse_map(chunk, 21) + (regions and '\1' or '\0')
+            extensions.append(ext + '\0' * (BLOCKSIZE - len(ext)))
+        return header + block + ''.join(extensions)
+
+    def _lookup(self, getter, ident):
+        """Cache user and group names"""
+        key = (getter, ident)
+        if key not in self._names:
+            try:
+                self._names[key] = getter(ident)[0]
+            except KeyError:
+                self._names[key] = ''
+        return self._names[key]
+
+    def _write(self, data):
+        written = 0
+        while written < len(data):
+            written += os.write(self.fd, buffer(data, written))
+        self.offset += len(data)
+
+    def _copy(self, in_fd, offset, length):
+        """Copy ``length`` bytes at ``offset`` in ``in_fd`` to the output"""
+        end = offset + length
+        while offset < end:
+            count = min(end - offset, CHUNK_SIZE)
+            sent = self._send(in_fd, offset, count)
+            if sent == 0:
+                # the file shrank after it was stat'd. pad it as tar does
+                LOG.warning("File shrank by %d bytes; padding with zeroes",
+                            end - offset)
+                while offset < end:
+                    count = min(end - offset, CHUNK_SIZE)
+                    self._write('\0' * count)
+                    offset += count
+                return
+            self.offset += sent
+            if self.page_cache == 'drop':
+                fadvise(in_fd, offset, sent, POSIX_FADV_DONTNEED)
+            offset += sent
+
+    def _send(self, in_fd, offset, count):
+        """Move up to ``count`` bytes to the output with the best method
+        that works, returning the number of bytes moved"""
+        while True:
+            method = self._methods[0]
+            if method == 'read':
+                os.lseek(in_fd, offset, os.SEEK_SET)
+                data = os.read(in_fd, count)
+                written = 0
+                while written < len(data):
+                    written += os.write(self.fd, buffer(data, written))
+                return len(data)
+            position = ctypes.c_longlong(offset)
+            if method == 'sendfile':
+                result = _sendfile(self.fd, in_fd, ctypes.byref(position),
+                                   count)
+            else:
+                result = _copy_file_range(in_fd, ctypes.byref(position),
+                                          self.fd, None, count, 0)
+            if result >= 0:
+                return result
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err in _UNSUPPORTED:
+                LOG.debug("%s is not supported here (%s). Falling back.",
+                          method, os.strerror(err))
+                self._methods.pop(0)
+                continue
+            raise OSError(err, os.strerror(err))
+
+def _sparse_map(regions, slots):
+    """Pack (offset, length) regions into ``slots`` 24 byte entries"""
+    entries = []
+    for offset, length in regions:
+        entries.append(tarfile.itn(offset, 12, tarfile.GNU_FORMAT) +
+                       tarfile.itn(length, 12, tarfile.GNU_FORMAT))
+    return ''.join(entries) + '\0' * (24 * (slots - len(regions)))
+
+def _set_checksum(block):
+    """Recompute the checksum of a 512 byte tar header"""
+    block = block[:148] + ' ' * 8 + block[156:]
+    chksum = tarfile.calc_chksums(block)[0]
+    return block[:148] + '%06o\0' % chksum + block[155:]
@@ -3,6 +3,8 @@ import logging
 import errno
 import subprocess
 import which
+from toolcache import tool_cache
+from pagecache import open_output
 import shlex
 from tempfile import TemporaryFile
 
@@ -21,6 +23,27 @@ COMPRESSION_METHODS = {
     'gpg'   : ('gpg -e --batch --no-tty', '.gpg'),
 }
 
+#: options that only some builds of a compression command support, mapped
+#: to the argument that lists what the build accepts
+OPTIONAL_ARGS = {
+    '--rsyncable' : '--help',
+}
+
+def check_compression_args(command, args):
+    """Verify that ``command`` accepts every optional argument in ``args``
+
+    The help output is probed through the tool cache so the check only runs
+    once per installed binary.
+
+    :raises: OSError if an optional argument is not supported
+    """
+    for arg in args:
+        if arg not in OPTIONAL_ARGS:
+            continue
+        returncode, output = tool_cache.probe(command, OPTIONAL_ARGS[arg])
+        if arg not in output:
+            raise OSError("%s does not support %s" % (command, arg))
+
 def lookup_compression(method):
     """
     Looks up the passed compression method in supported COMPRESSION_METHODS
@@ -34,10 +57,12 @@ def lookup_compression(method):
         cmd, ext = COMPRESSION_METHODS[method]
         argv = shlex.split(cmd)
         try:
-            return [which.which(argv[0])] + argv[1:], ext
+            argv[0] = tool_cache.which(argv[0])
         except which.WhichError, e:
             raise OSError("No command found for compression method '%s'" %
                     method)
+        check_compression_args(argv[0], argv[1:])
+        return argv, ext
     except KeyError:
         raise OSError("Unsupported compression method '%s'" % method)
 
@@ -82,7 +107,7 @@ class CompressionOutput(object):
     Class to create a compressed file descriptor for writing.  Functions like
     a standard file descriptor such as from open().
     """
-    def __init__(self, path, mode, argv, level, inline):
+    def __init__(self, path, mode, argv, level, inline, page_cache='keep'):
         self.argv = argv
         self.level = level
         self.inline = inline
@@ -90,7 +115,7 @@ class CompressionOutput(object):
             self.fileobj = open(os.path.splitext(path)[0], mode)
             self.fd = self.fileobj.fileno()
         else:
-            self.fileobj = open(path, 'w')
+            self.fileobj = open_output(path, page_cache)
             if level:
                 if "gpg" in argv[0]:
                     argv += ['-z%d' % level]
@@ -98,10 +123,14 @@ class CompressionOutput(object):
                     argv += ['-%d' % level]
             LOG.debug("* Executing: %s", subprocess.list2cmdline(argv))
             self.stderr = TemporaryFile()
+            # close_fds keeps the compressor from holding open the pipes of
+            # other streams opened concurrently, which would stop them
+            # seeing EOF
             self.pid = subprocess.Popen(argv,
                                         stdin=subprocess.PIPE,
                                         stdout=self.fileobj.fileno(),
-                                        stderr=self.stderr)
+                                        stderr=self.stderr,
+                                        close_fds=True)
             self.fd = self.pid.stdin.fileno()
         self.name = path
         self.closed = False
@@ -135,6 +164,7 @@ class CompressionOutput(object):
         else:
             self.pid.stdin.close()
             status = self.pid.wait()
+            self.fileobj.close()
             stderr = self.stderr
             stderr.flush()
             stderr.seek(0)
@@ -190,7 +220,8 @@ def open_stream(path,
                 method=None,
                 level=None,
                 inline=True,
-                extra_args=None):
+                extra_args=None,
+                page_cache='keep'):
     """
     Opens a compressed data stream, and returns a file descriptor type object
     that acts much like os.open() does.  If no method is passed, or the 
@@ -202,8 +233,12 @@ def open_stream(path,
     method  -- Compression method (i.e. 'gzip', 'bzip2', 'pbzip2', 'lzop')
     level   -- Compression level
     inline  -- Boolean whether to compress inline, or after the file is written.
+    page_cache -- How output should use the page cache: 'keep', 'drop' or
+                  'direct' (see holland.lib.pagecache.open_output)
     """
     if not method or method == 'none' or level == 0:
+        if mode == 'w':
+            return open_output(path, page_cache)
         return open(path, mode)
     else:
         argv, path = stream_info(path, method)
@@ -213,6 +248,6 @@ def open_stream(path,
             return CompressionInput(path, mode, argv=argv)
         elif mode == 'w':
             return CompressionOutput(path, mode, argv=argv, level=level,
-                                     inline=inline)
+                                     inline=inline, page_cache=page_cache)
         else:
             raise IOError("invalid mode: %s" % mode)
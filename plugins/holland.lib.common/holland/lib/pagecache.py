@@ -0,0 +1,423 @@
+"""Keep backups from flushing the page cache
+
+Reading a whole datadir and writing gigabytes of backup data fills the page
+cache with pages that will never be read again, evicting the pages a busy
+database server relies on.  This module provides the pieces to avoid that:
+
+`fadvise` / `drop_cache`
+    posix_fadvise(2) through ctypes (python 2 has no os.posix_fadvise)
+`CacheDropper`
+    a background thread that periodically flushes and drops the cached
+    pages of files being written by other processes (compressors, tar),
+    and of files being read by other processes (tar reading a snapshot)
+`open_output`
+    open a spool file for writing with a page cache policy: 'keep' (a plain
+    file), 'drop' (written ranges are dropped from the cache after they are
+    flushed) or 'direct' (written with O_DIRECT through aligned buffers)
+`DroppingReader`
+    a file reader that drops pages behind itself
+
+Everything degrades to ordinary cached I/O where ctypes, posix_fadvise or
+O_DIRECT are not available.
+"""
+
+import os
+import mmap
+import errno
+import fcntl
+import atexit
+import logging
+import threading
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+LOG = logging.getLogger(__name__)
+
+#: page cache policies accepted by `open_output`
+PAGE_CACHE_POLICIES = ('keep', 'drop', 'direct')
+
+POSIX_FADV_NORMAL = 0
+POSIX_FADV_RANDOM = 1
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_WILLNEED = 3
+POSIX_FADV_DONTNEED = 4
+POSIX_FADV_NOREUSE = 5
+
+O_DIRECT = getattr(os, 'O_DIRECT', 0)
+
+def _load_fadvise():
+    """Find posix_fadvise in libc"""
+    if ctypes is None:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+    except OSError:
+        return None
+    # posix_fadvise64 takes 64-bit offsets even on 32-bit platforms
+    for name, off_t in (('posix_fadvise64', ctypes.c_longlong),
+                        ('posix_fadvise', ctypes.c_long)):
+        func = getattr(libc, name, None)
+        if func is not None:
+            func.argtypes = [ctypes.c_int, off_t, off_t, ctypes.c_int]
+            func.restype = ctypes.c_int
+            return func
+    return None
+
+_posix_fadvise = _load_fadvise()
+
+def fadvise(fd, offset=0, length=0, advice=POSIX_FADV_DONTNEED):
+    """Give the kernel advice about how a file will be accessed
+
+    A length of 0 means to the end of the file.
+
+    :returns: True if the advice was given, False if posix_fadvise is not
+              available or failed
+    """
+    if _posix_fadvise is None:
+        return False
+    return _posix_fadvise(fd, offset, length, advice) == 0
+
+def drop_cache(fd, offset=0, length=0, sync=True):
+    """Flush a range of a file and drop it from the page cache
+
+    Dirty pages cannot be dropped, so the file is flushed first unless
+    ``sync`` is False.
+    """
+    if sync:
+        try:
+            os.fdatasync(fd)
+        except OSError, exc:
+            LOG.debug("fdatasync(%d) failed: %s", fd, exc)
+    return fadvise(fd, offset, length, POSIX_FADV_DONTNEED)
+
+def drop_path(path, offset=0, length=0, sync=True):
+    """Drop the cached pages of the file at ``path``"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError, exc:
+        LOG.debug("Unable to open %s to drop cached pages: %s", path, exc)
+        return False
+    try:
+        return drop_cache(fd, offset, length, sync)
+    finally:
+        os.close(fd)
+
+class CacheDropper(threading.Thread):
+    """Periodically drop the cached pages of files used by other processes
+
+    ``add_path`` registers a file being written; everything written so far
+    is flushed and dropped every ``interval`` seconds.  ``add_process``
+    registers a process reading files under a directory; the part of each
+    file read so far (from /proc/<pid>/fdinfo) is dropped, and files the
+    process has closed are dropped completely.
+    """
+
+    def __init__(self, interval=1.0):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.interval = interval
+        self._paths = {}
+        self._processes = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def add_path(self, path):
+        """Drop cached pages of ``path`` as it is written"""
+        self._lock.acquire()
+        try:
+            self._paths[path] = True
+        finally:
+            self._lock.release()
+
+    def remove_path(self, path):
+        """Stop tracking ``path``, dropping everything written to it"""
+        self._lock.acquire()
+        try:
+            self._paths.pop(path, None)
+        finally:
+            self._lock.release()
+        drop_path(path)
+
+    def add_process(self, pid, prefix):
+        """Drop cached pages of files under ``prefix`` read by ``pid``"""
+        self._lock.acquire()
+        try:
+            self._processes[pid] = (os.path.realpath(prefix), {})
+        finally:
+            self._lock.release()
+
+    def remove_process(self, pid):
+        """Stop tracking ``pid``, dropping every file it had open"""
+        self._lock.acquire()
+        try:
+            prefix, seen = self._processes.pop(pid, (None, {}))
+        finally:
+            self._lock.release()
+        for path in seen:
+            drop_path(path, sync=False)
+
+    def run(self):
+        """Drop cached pages every ``interval`` seconds until stopped"""
+        while not self._done.isSet():
+            self._done.wait(self.interval)
+            try:
+                self.drop()
+            except Exception, exc:
+                LOG.debug("Failed to drop cached pages: %s", exc,
+                          exc_info=True)
+
+    def drop(self):
+        """Drop cached pages of every registered file and process once"""
+        self._lock.acquire()
+        try:
+            paths = self._paths.keys()
+            processes = self._processes.items()
+        finally:
+            self._lock.release()
+        for path in paths:
+            drop_path(path)
+        for pid, (prefix, seen) in processes:
+            self._drop_process(pid, prefix, seen)
+
+    def _drop_process(self, pid, prefix, seen):
+        """Drop pages read so far by ``pid`` from files under ``prefix``"""
+        current = {}
+        for path, position in _open_files(pid):
+            if path == prefix or path.startswith(prefix + os.sep):
+                current[path] = position
+        for path in seen.keys():
+            if path not in current:
+                # closed since the last pass
+                drop_path(path, sync=False)
+                del seen[path]
+        for path, position in current.items():
+            if position:
+                drop_path(path, 0, position, sync=False)
+            seen[path] = position
+
+    def stop(self):
+        """Stop the dropper thread"""
+        self._done.set()
+        if self.isAlive():
+            self.join()
+
+def _open_files(pid):
+    """List (path, file position) of regular files open by ``pid``"""
+    fd_dir = '/proc/%d/fd' % pid
+    try:
+        fds = os.listdir(fd_dir)
+    except OSError:
+        return []
+    result = []
+    for fd in fds:
+        try:
+            path = os.readlink(os.path.join(fd_dir, fd))
+        except OSError:
+            continue
+        if not path.startswith('/'):
+            # pipes, sockets, anonymous inodes
+            continue
+        position = 0
+        try:
+            for line in open('/proc/%d/fdinfo/%s' % (pid, fd), 'r'):
+                if line.startswith('pos:'):
+                    position = int(line.split()[1])
+                    break
+        except (IOError, ValueError):
+            continue
+        result.append((path, position))
+    return result
+
+_dropper = None
+_dropper_lock = threading.Lock()
+
+def cache_dropper():
+    """Return the shared `CacheDropper`, starting it if necessary"""
+    global _dropper
+    _dropper_lock.acquire()
+    try:
+        if _dropper is None:
+            _dropper = CacheDropper()
+            _dropper.start()
+            # daemon threads still running at interpreter shutdown fail
+            atexit.register(_dropper.stop)
+        return _dropper
+    finally:
+        _dropper_lock.release()
+
+class DroppingOutput(object):
+    """A file written by this or other processes whose pages are dropped
+    from the page cache as they are written"""
+
+    def __init__(self, path, mode='w'):
+        self.fileobj = open(path, mode)
+        self.name = path
+        self.closed = False
+        cache_dropper().add_path(path)
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def write(self, data):
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.fileobj.flush()
+        cache_dropper().remove_path(self.name)
+        self.fileobj.close()
+
+class DirectOutput(object):
+    """A file written with O_DIRECT
+
+    Data written to ``fileno()`` (a pipe, so it may be handed to a child
+    process) is copied by a background thread into page aligned buffers
+    and written with O_DIRECT, bypassing the page cache entirely.  The
+    final partial block is written without O_DIRECT.
+    """
+
+    def __init__(self, path, buffer_size=1024*1024):
+        self.name = path
+        self.closed = False
+        self.error = None
+        self.buffer_size = buffer_size
+        self._fd = os.open(path, os.O_WRONLY|os.O_CREAT|os.O_TRUNC|O_DIRECT,
+                           0666)
+        self._rfd, self._wfd = os.pipe()
+        # other children must not hold the pipe open, or the copy thread
+        # would never see end of file
+        for fd in (self._fd, self._rfd, self._wfd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        self._thread = threading.Thread(target=self._pump)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def fileno(self):
+        return self._wfd
+
+    def write(self, data):
+        while data:
+            written = os.write(self._wfd, data)
+            data = data[written:]
+
+    def flush(self):
+        pass
+
+    def _pump(self):
+        """Copy from the pipe to the file through an aligned buffer"""
+        buf = mmap.mmap(-1, self.buffer_size)
+        used = 0
+        try:
+            try:
+                while True:
+                    data = os.read(self._rfd, self.buffer_size - used)
+                    if not data:
+                        break
+                    buf[used:used+len(data)] = data
+                    used += len(data)
+                    if used == self.buffer_size:
+                        _write_all(self._fd, buf)
+                        used = 0
+                if used:
+                    # O_DIRECT writes must be block aligned; write the tail
+                    # through the page cache and drop it
+                    flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+                    fcntl.fcntl(self._fd, fcntl.F_SETFL, flags & ~O_DIRECT)
+                    _write_all(self._fd, buf[:used])
+                    drop_cache(self._fd)
+            except OSError, exc:
+                LOG.error("Failed writing %s: %s", self.name, exc)
+                self.error = exc
+                # keep draining so the writer does not block forever
+                while os.read(self._rfd, self.buffer_size):
+                    pass
+        finally:
+            buf.close()
+            os.close(self._rfd)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        os.close(self._wfd)
+        self._thread.join()
+        os.close(self._fd)
+        if self.error is not None:
+            raise IOError(self.error.errno,
+                          "Writing %s failed: %s" % (self.name, self.error))
+
+def _write_all(fd, data):
+    """Write all of ``data`` (a string or buffer) to ``fd``"""
+    written = os.write(fd, data)
+    while written < len(data):
+        written += os.write(fd, buffer(data, written))
+
+def open_output(path, page_cache='keep'):
+    """Open ``path`` for writing with the given page cache policy
+
+    'direct' falls back to 'drop' if O_DIRECT is not available or not
+    supported by the filesystem (e.g. tmpfs), and 'drop' behaves like
+    'keep' where posix_fadvise is not available.
+    """
+    if page_cache not in PAGE_CACHE_POLICIES:
+        raise ValueError("Invalid page cache policy %r" % page_cache)
+    if page_cache == 'direct':
+        if O_DIRECT:
+            try:
+                return DirectOutput(path)
+            except OSError, exc:
+                if exc.errno != errno.EINVAL:
+                    raise
+                LOG.info("O_DIRECT is not supported for %s. Dropping "
+                         "cached pages instead.", path)
+        page_cache = 'drop'
+    if page_cache == 'drop' and _posix_fadvise is not None:
+        return DroppingOutput(path)
+    return open(path, 'w')
+
+class DroppingReader(object):
+    """Read a file sequentially, dropping pages behind the read position
+
+    :param drop_every: drop cached pages each time this many bytes have
+                       been read
+    """
+
+    def __init__(self, path, drop_every=8*1024*1024):
+        self.name = path
+        self.fileobj = open(path, 'rb')
+        self.drop_every = drop_every
+        self.closed = False
+        self._dropped = 0
+        fadvise(self.fileobj.fileno(), 0, 0, POSIX_FADV_SEQUENTIAL)
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        position = self.fileobj.tell()
+        if position - self._dropped >= self.drop_every:
+            fadvise(self.fileobj.fileno(), self._dropped,
+                    position - self._dropped, POSIX_FADV_DONTNEED)
+            self._dropped = position
+        return data
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        fadvise(self.fileobj.fileno(), 0, 0, POSIX_FADV_DONTNEED)
+        self.fileobj.close()
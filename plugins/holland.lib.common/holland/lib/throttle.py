@@ -0,0 +1,147 @@
+"""Pause backup processes while a server is overloaded
+
+A `ProcessThrottle` polls a check function every few seconds.  While the
+check reports that the server is overloaded, the processes registered with
+the throttle (typically a dump command and its compressor) are stopped
+with SIGSTOP and later resumed with SIGCONT.
+
+Processes are never left stopped for longer than ``max_pause`` seconds at a
+time.  If the server is still overloaded at that point, the processes are
+allowed to run for one interval before being stopped again, so a dump keeps
+making progress at a reduced rate rather than stalling until the server
+times out its connection.
+"""
+
+import os
+import time
+import errno
+import signal
+import logging
+import threading
+
+LOG = logging.getLogger(__name__)
+
+class ProcessThrottle(threading.Thread):
+    """Stop and resume processes based on a load check
+
+    ``check`` is called with no arguments from the throttle thread and
+    should return a short description of why the backup should be throttled
+    (e.g. "replication lag 120s > 60s"), or None if the backup may run at
+    full speed.  Exceptions raised by ``check`` are treated as None, and a
+    warning is logged when the check starts failing.
+    """
+
+    def __init__(self, check, interval=5, max_pause=30):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.check = check
+        self.interval = interval
+        self.max_pause = max_pause
+        #: total number of seconds processes were stopped
+        self.throttled = 0.0
+        #: number of times processes were stopped
+        self.pauses = 0
+        self._pids = []
+        self._paused_at = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def add_process(self, pid):
+        """Throttle the process ``pid``"""
+        self._lock.acquire()
+        try:
+            self._pids.append(pid)
+            if self._paused_at is not None:
+                _signal(pid, signal.SIGSTOP)
+        finally:
+            self._lock.release()
+
+    def remove_process(self, pid):
+        """Stop throttling the process ``pid``, resuming it if needed"""
+        self._lock.acquire()
+        try:
+            if pid in self._pids:
+                self._pids.remove(pid)
+                if self._paused_at is not None:
+                    _signal(pid, signal.SIGCONT)
+        finally:
+            self._lock.release()
+
+    def run(self):
+        """Check load every ``interval`` seconds until stopped"""
+        failing = False
+        while not self._done.isSet():
+            try:
+                reason = self.check()
+                failing = False
+            except Exception, exc:
+                if not failing:
+                    LOG.warning("Throttle check failed. The backup will not "
+                                "be throttled until it succeeds: %s", exc)
+                LOG.debug("Throttle check failed: %s", exc, exc_info=True)
+                failing = True
+                reason = None
+            if self._done.isSet():
+                break
+            if reason is None:
+                self.resume()
+            elif self._paused_at is None:
+                self.pause(reason)
+            elif time.time() - self._paused_at >= self.max_pause:
+                LOG.info("Throttled for %ds. Resuming for %ds before "
+                         "checking again (%s)",
+                         self.max_pause, self.interval, reason)
+                self.resume()
+                self._done.wait(self.interval)
+                continue
+            self._done.wait(self.interval)
+        self.resume()
+
+    def pause(self, reason):
+        """Stop all registered processes"""
+        self._lock.acquire()
+        try:
+            if self._paused_at is not None:
+                return
+            LOG.info("Pausing backup: %s", reason)
+            for pid in self._pids:
+                _signal(pid, signal.SIGSTOP)
+            self._paused_at = time.time()
+            self.pauses += 1
+        finally:
+            self._lock.release()
+
+    def resume(self):
+        """Resume all registered processes"""
+        self._lock.acquire()
+        try:
+            if self._paused_at is None:
+                return
+            for pid in self._pids:
+                _signal(pid, signal.SIGCONT)
+            elapsed = time.time() - self._paused_at
+            self.throttled += elapsed
+            self._paused_at = None
+            LOG.info("Resuming backup after %.1fs", elapsed)
+        finally:
+            self._lock.release()
+
+    def stop(self):
+        """Stop checking load and resume any stopped processes"""
+        self._done.set()
+        if self.isAlive():
+            self.join()
+        self.resume()
+
+    def record(self, section):
+        """Record how long the backup was throttled in a config section"""
+        section['throttled-seconds'] = '%.1f' % self.throttled
+        section['pauses'] = str(self.pauses)
+
+def _signal(pid, signum):
+    """Send signum to pid, ignoring processes that have already exited"""
+    try:
+        os.kill(pid, signum)
+    except OSError, exc:
+        if exc.errno != errno.ESRCH:
+            raise
@@ -0,0 +1,169 @@
+"""Cache the output of probing external commands
+
+Plugins regularly run commands like ``mysqldump --version`` to find out
+what an installed tool supports.  The result only changes when the tool
+itself is replaced, so probes are cached here keyed by the resolved path
+of the command and the arguments used, and are invalidated whenever the
+device, inode, size or mtime of the binary changes.
+
+The cache is shared by every plugin in a holland process and persisted to
+disk so later runs can skip the probe entirely.
+"""
+
+import os
+import csv
+import errno
+import logging
+import tempfile
+import subprocess
+import which
+
+LOG = logging.getLogger(__name__)
+
+#: default location of the persistent probe cache
+DEFAULT_CACHE_PATH = '/var/cache/holland/toolcache'
+
+def _stamp(path):
+    """Identify a specific version of a binary on disk"""
+    stat = os.stat(path)
+    return (str(stat.st_dev), str(stat.st_ino),
+            str(stat.st_size), str(int(stat.st_mtime)))
+
+class ToolCache(object):
+    """Cache of command probes
+
+    Each probe is recorded as the exit status and combined stdout/stderr
+    output of running a command with a given set of arguments.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._probes = None
+        self._paths = {}
+
+    def which(self, command, path=None):
+        """Find the full path of ``command``
+
+        Lookups are remembered for the life of this process, as long as the
+        previously found binary still exists.
+
+        :raises: which.WhichError if the command cannot be found
+        """
+        key = (command, tuple(path or ()))
+        result = self._paths.get(key)
+        if result is None or not os.path.isfile(result):
+            result = which.which(command, path)
+            self._paths[key] = result
+        return result
+
+    def probe(self, command, *args):
+        """Run ``command`` with ``args`` or return its cached result
+
+        :returns: tuple of (returncode, output)
+        :raises: OSError if command cannot be run
+        """
+        path = os.path.realpath(command)
+        stamp = _stamp(path)
+        key = (path, subprocess.list2cmdline(args))
+        probes = self.load()
+        if probes.get(key, (None,))[0] == stamp:
+            LOG.debug("Using cached result of %s %s", *key)
+            return probes[key][1:]
+
+        argv = [command] + list(args)
+        LOG.debug("Executing: %s", subprocess.list2cmdline(argv))
+        process = subprocess.Popen(argv,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   close_fds=True)
+        output, _ = process.communicate()
+        probes[key] = (stamp, process.returncode, output)
+        self.save()
+        return process.returncode, output
+
+    def load(self):
+        """Load the persisted probes, if they have not been loaded already"""
+        if self._probes is not None:
+            return self._probes
+        self._probes = {}
+        if not self.path:
+            return self._probes
+        try:
+            fileobj = open(self.path, 'rb')
+        except IOError, exc:
+            if exc.errno != errno.ENOENT:
+                LOG.debug("Failed to read tool cache %s: %s", self.path, exc)
+            return self._probes
+        try:
+            try:
+                for row in csv.reader(fileobj, dialect=csv.excel_tab):
+                    path, args = row[0:2]
+                    stamp = tuple(row[2:6])
+                    returncode = int(row[6])
+                    output = row[7].decode('string_escape')
+                    self._probes[(path, args)] = (stamp, returncode, output)
+            except (csv.Error, ValueError, IndexError), exc:
+                LOG.debug("Ignoring invalid tool cache %s: %s", self.path, exc)
+                self._probes = {}
+        finally:
+            fileobj.close()
+        return self._probes
+
+    def save(self):
+        """Persist the probes in this cache
+
+        Probes of binaries that were removed or replaced since they were
+        run are dropped.  Failing to write the cache is not an error - the
+        probes will simply be run again next time.
+        """
+        if not self.path:
+            return
+        self.prune()
+        cache_dir = os.path.dirname(self.path)
+        tmp_path = None
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # each writer gets its own temporary file so concurrent holland
+            # processes never interleave rows; the last rename wins
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir,
+                                            prefix='.toolcache.')
+            fileobj = os.fdopen(fd, 'wb')
+            try:
+                writer = csv.writer(fileobj,
+                                    dialect=csv.excel_tab,
+                                    lineterminator="\n")
+                for (path, args), (stamp, returncode, output) in \
+                        self._probes.items():
+                    writer.writerow([path, args] + list(stamp) +
+                                    [returncode, output.encode('string_escape')])
+            finally:
+                fileobj.close()
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError), exc:
+            LOG.debug("Failed to write tool cache %s: %s", self.path, exc)
+            if tmp_path and os.path.exists(tmp_path):
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+    def prune(self):
+        """Forget probes whose binary no longer exists or has changed"""
+        for key, value in self.load().items():
+            try:
+                if _stamp(key[0]) == value[0]:
+                    continue
+            except OSError:
+                pass
+            LOG.debug("Dropping stale tool cache entry %s %s", *key)
+            del self._probes[key]
+
+    def clear(self):
+        """Forget all cached probes and paths"""
+        self._probes = {}
+        self._paths = {}
+        self.save()
+
+tool_cache = ToolCache(DEFAULT_CACHE_PATH)
@@ -1,5 +1,6 @@
 import os
 import shutil
+import tarfile
 import tempfile
 from nose.tools import *
 from holland.lib.archive import *
@@ -58,3 +59,50 @@ def test_zip_archive():
 
     for name in axv.list():
         ok_(name in name_list)
+
+def _write_tree(root):
+    os.mkdir(os.path.join(root, 'db'))
+    os.mkdir(os.path.join(root, 'skip'))
+    open(os.path.join(root, 'db', 't1.frm'), 'wb').write('frm' * 100)
+    open(os.path.join(root, 'skip', 'x'), 'wb').write('x')
+    # mostly holes: data at the start, middle and end of 64M
+    sparse = open(os.path.join(root, 'ibdata1'), 'wb')
+    for offset in (0, 32*1024*1024, 64*1024*1024 - 4096):
+        sparse.seek(offset)
+        sparse.write('i' * 4096)
+    sparse.close()
+    # ends in a hole
+    tail = open(os.path.join(root, 'ib_logfile0'), 'wb')
+    tail.write('l' * 8192)
+    tail.truncate(8*1024*1024)
+    tail.close()
+    os.symlink('db/t1.frm', os.path.join(root, 'link'))
+    long_name = 'n' * 120 + '.ibd'
+    open(os.path.join(root, 'db', long_name), 'wb').write('long')
+    return ['./db/t1.frm', './ibdata1', './ib_logfile0',
+            './db/' + long_name]
+
+@with_setup(setup_func, teardown_func)
+def test_tar_stream_writer():
+    global tmpdir
+    root = os.path.join(tmpdir, 'data')
+    os.mkdir(root)
+    files = _write_tree(root)
+    path = os.path.join(tmpdir, 'stream.tar')
+    stream = open(path, 'wb')
+    writer = TarStreamWriter(stream, read_ahead=2)
+    ok_(writer.add_tree(root, exclude=lambda name: name == './skip'))
+    writer.close()
+    stream.close()
+
+    archive = tarfile.open(path, 'r')
+    names = archive.getnames()
+    ok_('./skip/x' not in names)
+    eq_(archive.getmember('./link').linkname, 'db/t1.frm')
+    ok_(archive.getmember('./db').isdir())
+    for name in files:
+        data = archive.extractfile(name).read()
+        eq_(data, open(os.path.join(root, name)).read())
+    archive.close()
+    eq_(writer.files, len(files))
+    eq_(os.path.getsize(path) % tarfile.RECORDSIZE, 0)
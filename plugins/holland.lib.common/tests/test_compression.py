@@ -5,6 +5,7 @@ from tempfile import mkdtemp
 
 from holland.core.exceptions import ArgumentError
 from holland.lib import compression
+from holland.lib.toolcache import ToolCache
 
 global tmpdir, config, plugin
 
@@ -40,6 +41,24 @@ def test_lookup_compression():
     assert_equal(cmd, None)
     assert_equal(ext, None)
     
+@with_setup(setup_func, teardown_func)
+def test_check_compression_args():
+    global tmpdir
+    tool = os.path.join(tmpdir, 'gzip')
+    fileobj = open(tool, 'w')
+    fileobj.write("#!/bin/sh\necho '  -1 --fast  compress faster'\n")
+    fileobj.close()
+    os.chmod(tool, 0755)
+    # probe through a private cache rather than the system-wide one
+    real_tool_cache = compression.tool_cache
+    compression.tool_cache = ToolCache(os.path.join(tmpdir, 'toolcache'))
+    try:
+        compression.check_compression_args(tool, ['-1'])
+        assert_raises(OSError, compression.check_compression_args,
+                      tool, ['--rsyncable'])
+    finally:
+        compression.tool_cache = real_tool_cache
+
 @with_setup(setup_func, teardown_func)
 def test_compression():
     global tmpdir
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+from nose.tools import *
+
+from holland.lib.pagecache import open_output, DroppingReader, \
+                                  CacheDropper, DirectOutput, \
+                                  _open_files
+
+def setup():
+    global TMPDIR
+    TMPDIR = tempfile.mkdtemp(dir=os.getcwd())
+
+def teardown():
+    shutil.rmtree(TMPDIR)
+
+def _roundtrip(policy, size):
+    path = os.path.join(TMPDIR, policy + '.out')
+    data = ''.join([chr(i % 251) for i in xrange(size)])
+    stream = open_output(path, policy)
+    stream.write(data)
+    stream.close()
+    eq_(open(path, 'rb').read(), data)
+
+def test_policies():
+    for policy in ('keep', 'drop', 'direct'):
+        # exercise full O_DIRECT buffers and the unaligned tail
+        yield _roundtrip, policy, 1024*1024*2 + 1234
+
+def test_direct_child_writes():
+    path = os.path.join(TMPDIR, 'child.out')
+    try:
+        stream = DirectOutput(path)
+    except OSError:
+        # filesystem without O_DIRECT support
+        return
+    pid = os.fork()
+    if pid == 0:
+        os.write(stream.fileno(), 'x'*5000)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    stream.close()
+    eq_(os.path.getsize(path), 5000)
+
+def test_invalid_policy():
+    assert_raises(ValueError, open_output, os.path.join(TMPDIR, 'x'), 'bogus')
+
+def test_dropping_reader():
+    path = os.path.join(TMPDIR, 'read.in')
+    open(path, 'wb').write('y'*100000)
+    reader = DroppingReader(path, drop_every=4096)
+    chunks = []
+    while True:
+        chunk = reader.read(8192)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    reader.close()
+    eq_(len(''.join(chunks)), 100000)
+
+def test_open_files():
+    path = os.path.join(TMPDIR, 'open.in')
+    open(path, 'wb').write('z'*10000)
+    fd = os.open(path, os.O_RDONLY)
+    os.read(fd, 1000)
+    try:
+        files = dict(_open_files(os.getpid()))
+        eq_(files[os.path.realpath(path)], 1000)
+    finally:
+        os.close(fd)
+
+def test_dropper_process():
+    path = os.path.join(TMPDIR, 'proc.in')
+    open(path, 'wb').write('z'*10000)
+    path = os.path.realpath(path)
+    dropper = CacheDropper()
+    dropper.add_process(os.getpid(), TMPDIR)
+    seen = dropper._processes[os.getpid()][1]
+    fd = os.open(path, os.O_RDONLY)
+    os.read(fd, 1000)
+    dropper.drop()
+    eq_(seen, {path : 1000})
+    os.close(fd)
+    dropper.drop()
+    eq_(seen, {})
+    dropper.remove_process(os.getpid())
@@ -0,0 +1,83 @@
+import os
+import time
+import logging
+import signal
+import subprocess
+from nose.tools import *
+
+from holland.lib.throttle import ProcessThrottle
+
+def _state(pid):
+    """Process state letter from /proc/<pid>/stat"""
+    return open('/proc/%d/stat' % pid).read().split(')')[-1].split()[0]
+
+def test_pause_resume():
+    busy = [True]
+    def check():
+        if busy[0]:
+            return "busy"
+    throttle = ProcessThrottle(check, interval=0.05, max_pause=60)
+    process = subprocess.Popen(['sleep', '10'])
+    try:
+        throttle.add_process(process.pid)
+        throttle.start()
+        time.sleep(0.3)
+        eq_(_state(process.pid), 'T')
+        busy[0] = False
+        time.sleep(0.3)
+        assert_not_equal(_state(process.pid), 'T')
+        throttle.stop()
+        eq_(throttle.pauses, 1)
+        ok_(throttle.throttled > 0)
+        section = {}
+        throttle.record(section)
+        eq_(section['pauses'], '1')
+    finally:
+        throttle.stop()
+        os.kill(process.pid, signal.SIGKILL)
+        process.wait()
+
+def test_remove_resumes():
+    throttle = ProcessThrottle(lambda: "busy", interval=0.05, max_pause=60)
+    process = subprocess.Popen(['sleep', '10'])
+    try:
+        throttle.add_process(process.pid)
+        throttle.start()
+        time.sleep(0.3)
+        eq_(_state(process.pid), 'T')
+        throttle.remove_process(process.pid)
+        assert_not_equal(_state(process.pid), 'T')
+    finally:
+        throttle.stop()
+        os.kill(process.pid, signal.SIGKILL)
+        process.wait()
+
+def test_failing_check():
+    def check():
+        raise RuntimeError("lost connection")
+    throttle = ProcessThrottle(check, interval=0.05)
+    throttle.start()
+    time.sleep(0.2)
+    throttle.stop()
+    eq_(throttle.pauses, 0)
+
+def test_failing_check_warns():
+    records = []
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+    handler = Handler()
+    log = logging.getLogger('holland.lib.throttle')
+    log.addHandler(handler)
+    def check():
+        raise ValueError("no metric")
+    throttle = ProcessThrottle(check, interval=0.05, max_pause=60)
+    try:
+        throttle.start()
+        time.sleep(0.3)
+    finally:
+        throttle.stop()
+        log.removeHandler(handler)
+    # warned once, not once per interval
+    eq_(len([r for r in records if r.levelno == logging.WARNING]), 1)
+    eq_(throttle.pauses, 0)
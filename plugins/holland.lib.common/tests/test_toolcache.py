@@ -0,0 +1,108 @@
+import os
+import time
+import shutil
+from nose.tools import *
+from tempfile import mkdtemp
+
+from holland.lib.toolcache import ToolCache
+from holland.lib.which import WhichError
+
+global tmpdir
+
+def setup_func():
+    global tmpdir
+    tmpdir = mkdtemp()
+
+def teardown_func():
+    global tmpdir
+    shutil.rmtree(tmpdir)
+
+def _write_tool(path, output):
+    fileobj = open(path, 'w')
+    fileobj.write("#!/bin/sh\necho %s\necho \"$@\" >> %s.log\n" %
+                  (output, path))
+    fileobj.close()
+    os.chmod(path, 0755)
+
+def _run_count(path):
+    if not os.path.exists(path + '.log'):
+        return 0
+    return len(open(path + '.log').readlines())
+
+@with_setup(setup_func, teardown_func)
+def test_probe_cached():
+    global tmpdir
+    tool = os.path.join(tmpdir, 'tool')
+    _write_tool(tool, 'tool 1.2.3')
+    cache = ToolCache(os.path.join(tmpdir, 'cache', 'toolcache'))
+    assert_equal(cache.probe(tool, '--version'), (0, 'tool 1.2.3\n'))
+    assert_equal(cache.probe(tool, '--version'), (0, 'tool 1.2.3\n'))
+    assert_equal(_run_count(tool), 1)
+
+    # a new process should reuse the persisted probe
+    cache = ToolCache(os.path.join(tmpdir, 'cache', 'toolcache'))
+    assert_equal(cache.probe(tool, '--version'), (0, 'tool 1.2.3\n'))
+    assert_equal(_run_count(tool), 1)
+
+    # different arguments are probed separately
+    cache.probe(tool, '--help')
+    assert_equal(_run_count(tool), 2)
+
+@with_setup(setup_func, teardown_func)
+def test_probe_invalidated():
+    global tmpdir
+    tool = os.path.join(tmpdir, 'tool')
+    _write_tool(tool, 'tool 1.2.3')
+    cache = ToolCache(os.path.join(tmpdir, 'toolcache'))
+    cache.probe(tool, '--version')
+    # replace the binary with a new version
+    _write_tool(tool, 'tool 1.2.40')
+    os.utime(tool, (time.time() + 60, time.time() + 60))
+    assert_equal(cache.probe(tool, '--version'), (0, 'tool 1.2.40\n'))
+    assert_equal(_run_count(tool), 2)
+
+@with_setup(setup_func, teardown_func)
+def test_which():
+    global tmpdir
+    tool = os.path.join(tmpdir, 'tool')
+    _write_tool(tool, '')
+    cache = ToolCache()
+    assert_equal(cache.which('tool', [tmpdir]), tool)
+    os.unlink(tool)
+    assert_raises(WhichError, cache.which, 'tool', [tmpdir])
+
+@with_setup(setup_func, teardown_func)
+def test_save_private_tmpfile():
+    global tmpdir
+    tool = os.path.join(tmpdir, 'tool')
+    _write_tool(tool, 'tool 1.2.3')
+    path = os.path.join(tmpdir, 'toolcache')
+    # a stale temporary file from another writer must not be reused
+    open(path + '.tmp', 'w').write('garbage')
+    first = ToolCache(path)
+    second = ToolCache(path)
+    first.probe(tool, '--version')
+    second.probe(tool, '--help')
+    assert_equal(open(path + '.tmp').read(), 'garbage')
+    assert_equal(sorted(os.listdir(tmpdir)),
+                 ['tool', 'tool.log', 'toolcache', 'toolcache.tmp'])
+    assert_equal(ToolCache(path).probe(tool, '--help'), (0, 'tool 1.2.3\n'))
+    assert_equal(_run_count(tool), 2)
+
+@with_setup(setup_func, teardown_func)
+def test_save_prunes_stale_probes():
+    global tmpdir
+    kept = os.path.join(tmpdir, 'kept')
+    removed = os.path.join(tmpdir, 'removed')
+    replaced = os.path.join(tmpdir, 'replaced')
+    for tool in (kept, removed, replaced):
+        _write_tool(tool, 'tool 1.2.3')
+    path = os.path.join(tmpdir, 'toolcache')
+    cache = ToolCache(path)
+    for tool in (kept, removed, replaced):
+        cache.probe(tool, '--version')
+    os.unlink(removed)
+    _write_tool(replaced, 'tool 2.0.0 with a longer version string')
+    cache.save()
+    assert_equal(sorted([key[0] for key in ToolCache(path).load()]),
+                 [os.path.realpath(kept)])
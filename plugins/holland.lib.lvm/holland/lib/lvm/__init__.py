@@ -5,6 +5,7 @@ from holland.lib.lvm.util import relpath, getmount, getdevice, parse_bytes
 from holland.lib.lvm.raw import pvs, vgs, lvs, blkid, mount, umount
 from holland.lib.lvm.base import PhysicalVolume, VolumeGroup, LogicalVolume
 from holland.lib.lvm.snapshot import Snapshot, CallbackFailuresError
+from holland.lib.lvm.monitor import SnapshotMonitor, ThinPoolMonitor
 
 __all__ = [
     'relpath',
@@ -24,4 +25,6 @@ __all__ = [
     'LogicalVolume',
     'Snapshot',
     'CallbackFailuresError',
+    'SnapshotMonitor',
+    'ThinPoolMonitor',
 ]
@@ -3,8 +3,9 @@
 import os
 import signal
 import logging
-from holland.lib.lvm.raw import pvs, vgs, lvs, lvsnapshot, lvremove, \
-                                mount, umount, blkid
+from holland.lib.lvm.raw import lvsnapshot, lvremove, lvextend, mount, \
+                                umount, lvs_thin, lvactivate
+from holland.lib.lvm.cache import lvm_cache
 from holland.lib.lvm.util import getdevice, SignalManager
 from holland.lib.lvm.errors import LVMCommandError
 
@@ -68,7 +69,7 @@ class PhysicalVolume(Volume):
 
     def reload(self):
         """Reload this PhysicalVolume"""
-        self.attributes, = pvs(self.pv_name)
+        self.attributes, = lvm_cache.refresh('pvs', self.pv_name)
 
     def lookup(cls, pathspec):
         """Lookup a physical volume for the pathspec given
@@ -79,7 +80,7 @@ class PhysicalVolume(Volume):
         :returns: PhysicalVolume instance
         """
         try:
-            volume, = pvs(pathspec)
+            volume, = lvm_cache.pvs(pathspec)
             return cls(volume)
         except (ValueError, LVMCommandError):
             raise LookupError("No PhysicalVolume could be found for "
@@ -96,7 +97,7 @@ class PhysicalVolume(Volume):
         :returns: iterable of PhysicalVolume instances
         """
 
-        for volume in pvs(pathspec):
+        for volume in lvm_cache.pvs(pathspec):
             yield cls(volume)
     search = classmethod(search)
 
@@ -108,7 +109,7 @@ class VolumeGroup(Volume):
 
     def reload(self):
         """Reload this VolumeGroup"""
-        self.attributes, = vgs(self.vg_name)
+        self.attributes, = lvm_cache.refresh('vgs', self.vg_name)
 
     def lookup(cls, pathspec):
         """Lookup a volume group for ``pathspec``
@@ -119,7 +120,7 @@ class VolumeGroup(Volume):
         :returns: VolumeGroup instance
         """
         try:
-            volume, = vgs(pathspec)
+            volume, = lvm_cache.vgs(pathspec)
             return cls(volume)
         except (LVMCommandError, ValueError):
             raise LookupError("No VolumeGroup could be found for pathspec %r" %
@@ -135,7 +136,7 @@ class VolumeGroup(Volume):
         :returns: iterable of VolumeGroup instances
         """
 
-        for volume in vgs(pathspec):
+        for volume in lvm_cache.vgs(pathspec):
             yield cls(volume)
     search = classmethod(search)
 
@@ -154,7 +155,7 @@ class LogicalVolume(Volume):
         :returns: LogicalVolume instance
         """
         try:
-            volume, = lvs(pathspec)
+            volume, = lvm_cache.lvs(pathspec)
             return cls(volume)
         except (LVMCommandError, ValueError):
             #XX: Perhaps we should be more specific :)
@@ -181,31 +182,94 @@ class LogicalVolume(Volume):
         :returns: iterable of LogicalVolume instances
         """
 
-        for volume in lvs(pathspec):
+        for volume in lvm_cache.lvs(pathspec):
             yield cls(volume)
     search = classmethod(search)
 
     def reload(self):
         """Reload the data for this LogicalVolume"""
-        self.attributes, = lvs(self.device_name())
+        self.attributes, = lvm_cache.refresh('lvs',
+                                             self.vg_name + '/' + self.lv_name)
 
     def snapshot(self, name, size):
         """Snapshot the current LogicalVolume instance and create a snapshot
         volume with the requested volume name and size
 
+        Snapshots of thin volumes are thin snapshots allocated from the
+        same thin pool, so ``size`` is ignored for them.  Thin snapshots
+        are activated after they are created.
+
         :param name: name of the volume
         :param size: size of the snapshot
         :raises: LVMCommandError on error
         :returns: LogicalVolume that is a snapshot of this one on success
         """
+        if self.is_thin():
+            size = None
 
         try:
             lvsnapshot(self.device_name(), name, size)
         except LVMCommandError, exc:
             for line in exc.error.splitlines():
                 LOG.error("%s", line)
+            lvm_cache.invalidate('pvs', 'vgs', 'lvs')
+            raise
+        # the snapshot used free extents and changed the origin's attributes
+        lvm_cache.invalidate('pvs', 'vgs')
+        self.reload()
+        try:
+            attributes, = lvm_cache.refresh('lvs', self.vg_name + '/' + name)
+        except ValueError:
+            raise LookupError("No snapshot %s/%s found after creating it" %
+                              (self.vg_name, name))
+        snapshot = LogicalVolume(attributes)
+        if not snapshot.is_active():
+            snapshot.activate()
+        return snapshot
+
+    def is_thin(self):
+        """Check if this logical volume is a thin volume
+
+        :returns: True if this volume is allocated from a thin pool
+        """
+        return self.lv_attr[0:1] == 'V'
+
+    def is_active(self):
+        """Check if this logical volume is active
+
+        :returns: True if this volume is active
+        """
+        return self.lv_attr[4:5] == 'a'
+
+    def activate(self):
+        """Activate this LogicalVolume, ignoring its activation skip flag
+
+        :raises: LVMCommandError on error
+        """
+        try:
+            lvactivate(self.device_name())
+        except LVMCommandError, exc:
+            for line in exc.error.splitlines():
+                LOG.error("%s", line)
+            lvm_cache.invalidate('lvs')
             raise
-        return LogicalVolume.lookup(self.vg_name + '/' + name)
+        self.reload()
+
+    def thin_pool(self):
+        """Lookup the thin pool this thin volume is allocated from
+
+        :raises: LookupError if this is not a thin volume
+        :returns: LogicalVolume
+        """
+        try:
+            info, = lvs_thin(self.device_name())
+        except (LVMCommandError, ValueError):
+            raise LookupError("Could not report thin pool for %s" %
+                              self.device_name())
+        pool_lv = info['pool_lv'].strip('[]')
+        if not pool_lv:
+            raise LookupError("%s is not a thin volume" % self.device_name())
+        return LogicalVolume.lookup(self.vg_name + '/' + pool_lv)
 
     def is_mounted(self):
         """Check if this logical volume is mounted
@@ -251,11 +315,36 @@ class LogicalVolume(Volume):
         :raises: LVMCommandError on error
         """
         try:
-            lvremove(self.device_name())
-        except LVMCommandError, exc:
-            for line in exc.error.splitlines():
-                LOG.error("%s", line)
-            raise
+            try:
+                lvremove(self.device_name())
+            except LVMCommandError, exc:
+                for line in exc.error.splitlines():
+                    LOG.error("%s", line)
+                lvm_cache.invalidate('lvs')
+                raise
+            lvm_cache.forget('lvs', self.vg_name + '/' + self.lv_name)
+        finally:
+            # freed extents show up in vgs and pvs
+            lvm_cache.invalidate('pvs', 'vgs')
+            lvm_cache.forget('blkid', self.device_name())
+
+    def extend(self, extents):
+        """Grow this LogicalVolume by ``extents`` extents from the free
+        space in its volume group
+
+        :raises: LVMCommandError on error
+        """
+        try:
+            try:
+                lvextend(self.device_name(), extents)
+            except LVMCommandError, exc:
+                for line in exc.error.splitlines():
+                    LOG.error("%s", line)
+                raise
+        finally:
+            # used extents show up in vgs and pvs
+            lvm_cache.invalidate('pvs', 'vgs')
+        self.reload()
 
     def exists(self):
         """Check whether the volume currently exists
@@ -287,7 +376,7 @@ class LogicalVolume(Volume):
         :returns: filesystem type name string
         """
         try:
-            device_info, = blkid(self.device_name())
+            device_info = lvm_cache.blkid(self.device_name())
             LOG.debug("Looked up device_info => %r", device_info)
             return device_info['type']
         except (LVMCommandError, ValueError), exc:
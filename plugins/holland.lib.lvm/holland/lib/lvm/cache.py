@@ -0,0 +1,238 @@
+"""Cache of LVM metadata
+
+Every LVM reporting command rescans block devices, which can take several
+seconds on hosts with many (e.g. SAN) devices.  Rather than run pvs, vgs or
+lvs for every lookup, `LVMCache` runs each report once for every volume on
+the system and answers lookups from the result.
+
+Reloading a single volume only reports on that volume and updates its row
+in the cached report.  The volume classes in `holland.lib.lvm.base`
+refresh the volumes an LVM command changed and invalidate the reports it
+may have changed otherwise (such as free space in vgs and pvs).  The whole
+cache is discarded when a snapshot run finishes.
+
+Snapshots of several volumes are created from concurrent threads, and
+snapshot monitors extend volumes from theirs, so every access to the
+cached reports is serialized by a lock.
+"""
+
+import os
+import stat
+import logging
+import threading
+from holland.lib.lvm.raw import lvm_report, blkid, json
+from holland.lib.lvm.errors import LVMCommandError
+from holland.lib.lvm.constants import PVS_ATTR, VGS_ATTR, LVS_ATTR
+
+LOG = logging.getLogger(__name__)
+
+#: attributes requested for each report command
+REPORT_ATTRIBUTES = {
+    'pvs' : PVS_ATTR,
+    'vgs' : VGS_ATTR,
+    'lvs' : LVS_ATTR,
+}
+
+class LVMCache(object):
+    """Cached pvs, vgs, lvs and blkid results"""
+
+    def __init__(self):
+        self.report_json = json is not None
+        self._reports = {}
+        self._blkid = {}
+        self._lock = threading.RLock()
+
+    def invalidate(self, *commands):
+        """Discard cached results
+
+        :param commands: report commands ('pvs', 'vgs', 'lvs' or 'blkid')
+                         to discard.  If none are given, everything is
+                         discarded.
+        """
+        self._lock.acquire()
+        try:
+            if not commands:
+                self._reports = {}
+                self._blkid = {}
+                return
+            for command in commands:
+                if command == 'blkid':
+                    self._blkid = {}
+                else:
+                    self._reports.pop(command, None)
+        finally:
+            self._lock.release()
+
+    def report(self, command):
+        """Run (or reuse) a full report for ``command``
+
+        The lock is held while the report runs, so concurrent lookups
+        wait for one report rather than each running their own.
+
+        :returns: list of dicts, one per volume
+        """
+        self._lock.acquire()
+        try:
+            try:
+                return self._reports[command]
+            except KeyError:
+                pass
+            rows = self._run_report(command)
+            self._reports[command] = rows
+            return rows
+        finally:
+            self._lock.release()
+
+    def refresh(self, command, pathspec):
+        """Report on the volumes matching ``pathspec`` only
+
+        If a full report for ``command`` is cached, the rows for these
+        volumes are replaced with the new results.
+
+        :returns: list of dicts for the matching volumes
+        """
+        rows = self._run_report(command, [pathspec])
+        self._lock.acquire()
+        try:
+            cached = self._reports.get(command)
+            if cached is not None:
+                stale = _match(command, cached, pathspec) + \
+                        [row for row in cached
+                         if _identity(command, row) in
+                            [_identity(command, new) for new in rows]]
+                cached[:] = [row for row in cached
+                             if row not in stale] + rows
+        finally:
+            self._lock.release()
+        return rows
+
+    def _run_report(self, command, names=()):
+        """Run a report in the best format supported by LVM"""
+        attributes = REPORT_ATTRIBUTES[command]
+        if self.report_json:
+            try:
+                return lvm_report(command, attributes, report_json=True,
+                                  names=names)
+            except LVMCommandError, exc:
+                if 'reportformat' not in exc.error:
+                    raise
+                LOG.debug("%s does not support --reportformat=json. "
+                          "Using comma separated output.", command)
+                self.report_json = False
+        return lvm_report(command, attributes, names=names)
+
+    def pvs(self, pathspec=None):
+        """Report physical volumes matching a device path
+
+        :returns: list of dicts of pvs parameters
+        """
+        return self._lookup('pvs', pathspec)
+
+    def vgs(self, pathspec=None):
+        """Report volume groups matching a volume group name
+
+        :returns: list of dicts of vgs parameters
+        """
+        return self._lookup('vgs', pathspec)
+
+    def lvs(self, pathspec=None):
+        """Report logical volumes matching ``pathspec``
+
+        As with the lvs command, ``pathspec`` may be a volume group name, a
+        vg/lv name or a device path for a logical volume.
+
+        :returns: list of dicts of lvs parameters
+        """
+        return self._lookup('lvs', pathspec)
+
+    def _lookup(self, command, pathspec):
+        """Match ``pathspec`` against the full report for ``command``"""
+        self._lock.acquire()
+        try:
+            return _match(command, self.report(command), pathspec)
+        finally:
+            self._lock.release()
+
+    def forget(self, command, pathspec):
+        """Discard cached results for the volumes matching ``pathspec``,
+        such as after they are removed
+
+        :param command: 'pvs', 'vgs', 'lvs' or 'blkid'
+        """
+        self._lock.acquire()
+        try:
+            if command == 'blkid':
+                self._blkid.pop(os.path.realpath(pathspec), None)
+                return
+            cached = self._reports.get(command)
+            if cached is not None:
+                stale = _match(command, cached, pathspec)
+                cached[:] = [row for row in cached if row not in stale]
+        finally:
+            self._lock.release()
+
+    def blkid(self, device):
+        """Look up block device attributes for a single device
+
+        :returns: dict of blkid data
+        :raises: LVMCommandError, ValueError if blkid finds nothing
+        """
+        path = os.path.realpath(device)
+        self._lock.acquire()
+        try:
+            try:
+                return self._blkid[path]
+            except KeyError:
+                pass
+        finally:
+            self._lock.release()
+        info, = blkid(device)
+        self._lock.acquire()
+        try:
+            self._blkid[path] = info
+        finally:
+            self._lock.release()
+        return info
+
+def _match(command, rows, pathspec):
+    """Select the report rows matching ``pathspec`` as the report command
+    itself would"""
+    if not pathspec:
+        return list(rows)
+    if command == 'pvs':
+        path = os.path.realpath(pathspec)
+        return [row for row in rows
+                if os.path.realpath(row['pv_name']) == path]
+    if command == 'vgs':
+        return [row for row in rows if row['vg_name'] == pathspec]
+    if pathspec.startswith('/'):
+        return [row for row in rows if _is_device(pathspec, row)]
+    if '/' in pathspec:
+        vg_name, lv_name = pathspec.split('/', 1)
+        return [row for row in rows
+                if row['vg_name'] == vg_name and row['lv_name'] == lv_name]
+    return [row for row in rows if row['vg_name'] == pathspec]
+
+def _identity(command, row):
+    """The name that identifies a volume in a report row"""
+    if command == 'pvs':
+        return row['pv_name']
+    if command == 'vgs':
+        return row['vg_name']
+    return (row['vg_name'], row['lv_name'])
+
+def _is_device(path, row):
+    """Check whether path refers to the logical volume in an lvs row"""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return False
+    if stat.S_ISBLK(info.st_mode) and \
+            row['lv_kernel_major'] not in ('', '-1'):
+        return (os.major(info.st_rdev), os.minor(info.st_rdev)) == \
+               (int(row['lv_kernel_major']), int(row['lv_kernel_minor']))
+    lv_path = os.path.join('/dev', row['vg_name'], row['lv_name'])
+    return os.path.realpath(path) == os.path.realpath(lv_path)
+
+#: metadata cache shared by the volume classes in holland.lib.lvm.base
+lvm_cache = LVMCache()
@@ -72,3 +72,18 @@ LVS_ATTR = [
     'vg_extent_count',
     'vg_free_count',
 ]
+
+# thin provisioning attributes are reported separately, as lvm versions
+# without thin provisioning support reject these fields
+THIN_LVS_ATTR = [
+    'lv_name',
+    'vg_name',
+    'lv_attr',
+    'lv_size',
+    'pool_lv',
+    'data_percent',
+    'metadata_percent',
+    'lv_metadata_size',
+    'vg_extent_size',
+    'vg_free_count',
+]
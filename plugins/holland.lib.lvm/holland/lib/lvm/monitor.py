@@ -0,0 +1,318 @@
+"""Watch a snapshot fill up and grow it before it overflows
+
+A copy-on-write snapshot becomes invalid as soon as its exception store is
+full, which on a busy server can happen hours into a backup.  While a
+snapshot is mounted, `SnapshotMonitor` polls its ``snap_percent`` and
+extends the snapshot from the free extents in its volume group whenever
+usage passes a threshold.
+
+The monitor also records how quickly the snapshot filled, so that future
+runs can size the snapshot from the observed rate rather than a fixed
+fraction of the origin volume.
+
+Thin snapshots have no exception store of their own.  Blocks overwritten
+on the origin while the snapshot exists are instead allocated from the
+thin pool, and if the pool runs out of data or metadata space every volume
+in it stalls or fails.  `ThinPoolMonitor` watches the pool's data and
+metadata usage instead of ``snap_percent`` and extends the pool's data
+volume as it fills.
+"""
+
+import time
+import logging
+import threading
+from holland.lib.lvm.raw import lvs, lvs_thin
+from holland.lib.lvm.errors import LVMCommandError
+from holland.lib.lvm.util import format_bytes
+
+LOG = logging.getLogger(__name__)
+
+class SnapshotMonitor(object):
+    """Poll snapshot usage and lvextend the snapshot as it fills
+
+    :param threshold: percent full at which the snapshot is extended
+    :param extend_percent: grow the snapshot by this percent of its current
+                           size each time it is extended
+    :param interval: seconds between polls
+
+    After `stop()` the following attributes describe the run:
+
+    ``size``
+        final snapshot size in bytes
+    ``peak_used``
+        largest number of bytes used in the snapshot
+    ``fill_rate``
+        average bytes per second written to the snapshot
+    ``extended``
+        total bytes added to the snapshot
+    ``extend_count``
+        number of times the snapshot was extended
+    """
+
+    def __init__(self, threshold=80, extend_percent=25, interval=10):
+        self.threshold = threshold
+        self.extend_percent = extend_percent
+        self.interval = interval
+        self.volume = None
+        self.size = 0
+        self.peak_used = 0
+        self.peak_percent = 0.0
+        self.fill_rate = 0.0
+        self.extended = 0
+        self.extend_count = 0
+        self._first = None
+        self._last = None
+        self._exhausted = False
+        self._thread = None
+        self._done = threading.Event()
+
+    def start(self, volume, created=None):
+        """Start monitoring the snapshot LogicalVolume ``volume``
+
+        :param created: time the snapshot was created.  The fill rate is
+                        measured from this point if given.
+        """
+        self.volume = volume
+        if created is not None:
+            self._first = (created, 0)
+        self._thread = threading.Thread(target=self.run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        LOG.debug("Monitoring %s every %ds (extend at %d%% full)",
+                  volume.device_name(), self.interval, self.threshold)
+
+    def stop(self):
+        """Stop monitoring and log the observed fill rate"""
+        if self._thread is None:
+            return
+        self._done.set()
+        self._thread.join()
+        self._thread = None
+        # take one last sample so short runs still report a rate
+        self.poll(extend=False)
+        if self.size:
+            LOG.info("Snapshot %s peaked at %.2f%% of %s (%s used). "
+                     "Average fill rate %s/s",
+                     self.volume.device_name(), self.peak_percent,
+                     format_bytes(self.size), format_bytes(self.peak_used),
+                     format_bytes(self.fill_rate))
+        if self.extend_count:
+            LOG.info("Snapshot %s was extended %d time(s) by %s in total",
+                     self.volume.device_name(), self.extend_count,
+                     format_bytes(self.extended))
+
+    def run(self):
+        """Poll until stopped"""
+        while not self._done.isSet():
+            try:
+                if not self.poll():
+                    break
+            except Exception, exc:
+                LOG.debug("Snapshot monitor poll failed: %s", exc,
+                          exc_info=True)
+            self._done.wait(self.interval)
+
+    def sample(self):
+        """Report the current lvs attributes of the snapshot volume"""
+        for info in lvs(self.volume.device_name()):
+            return info
+        raise LookupError("No logical volume found for %s" %
+                          self.volume.device_name())
+
+    def poll(self, extend=True):
+        """Sample the snapshot and extend it if it is nearly full
+
+        :returns: False if the snapshot is no longer valid
+        """
+        try:
+            info = self.sample()
+        except (LookupError, LVMCommandError), exc:
+            LOG.debug("Failed to sample %s: %s",
+                      self.volume.device_name(), exc)
+            return True
+        # the fifth lv_attr character is the volume state
+        if info['lv_attr'][4:5] in ('I', 'S'):
+            LOG.error("Snapshot %s is no longer valid",
+                      self.volume.device_name())
+            return False
+        percent = float(info['snap_percent'] or 0)
+        size = int(info['lv_size'])
+        used = int(size * percent / 100)
+        now = time.time()
+        if self._first is None:
+            self._first = (now, used)
+        self._last = (now, used)
+        self.size = size
+        if used > self.peak_used:
+            self.peak_used = used
+            self.peak_percent = percent
+        elapsed = self._last[0] - self._first[0]
+        if elapsed > 0:
+            self.fill_rate = max(self._last[1] - self._first[1], 0) / elapsed
+        if extend and percent >= self.threshold:
+            self.extend(info)
+        return True
+
+    def extend(self, info):
+        """Grow the snapshot from its volume group's free extents"""
+        extent_size = int(info['vg_extent_size'])
+        free = int(info['vg_free_count'])
+        wanted = max(int(self.size * self.extend_percent / 100 / extent_size),
+                     1)
+        extents = min(wanted, free)
+        if extents < 1:
+            if not self._exhausted:
+                LOG.warning("Snapshot %s is %s%% full but volume group %s "
+                            "has no free extents to extend it",
+                            self.volume.device_name(), info['snap_percent'],
+                            self.volume.vg_name)
+                self._exhausted = True
+            return
+        LOG.info("Snapshot %s is %s%% full. Extending by %d extents (%s)",
+                 self.volume.device_name(), info['snap_percent'], extents,
+                 format_bytes(extents*extent_size))
+        try:
+            self.volume.extend(extents)
+        except LVMCommandError, exc:
+            LOG.error("Failed to extend snapshot %s: %s",
+                      self.volume.device_name(), exc)
+            return
+        self.extended += extents*extent_size
+        self.extend_count += 1
+        self.size += extents*extent_size
+
+    def record(self, section):
+        """Record snapshot usage in a config section"""
+        section['snapshot-size'] = str(self.size)
+        section['snapshot-peak-used'] = str(self.peak_used)
+        section['snapshot-peak-percent'] = '%.2f' % self.peak_percent
+        section['snapshot-fill-rate'] = '%.0f' % self.fill_rate
+        section['snapshot-extended'] = str(self.extended)
+        section['snapshot-extend-count'] = str(self.extend_count)
+
+class ThinPoolMonitor(SnapshotMonitor):
+    """Poll the thin pool backing a thin snapshot and lvextend the pool
+    as it fills
+
+    Parameters are as for `SnapshotMonitor`, but apply to the thin pool.
+    ``size``, ``peak_used`` and ``peak_percent`` describe the pool's data
+    volume.  In addition:
+
+    ``pool``
+        the thin pool LogicalVolume
+    ``peak_metadata_percent``
+        highest metadata usage seen, in percent
+    """
+
+    def __init__(self, threshold=80, extend_percent=25, interval=10):
+        SnapshotMonitor.__init__(self, threshold, extend_percent, interval)
+        self.pool = None
+        self.peak_metadata_percent = 0.0
+        self._metadata_warned = False
+
+    def start(self, volume, created=None):
+        """Start monitoring the thin pool of the thin snapshot ``volume``"""
+        self.pool = volume.thin_pool()
+        SnapshotMonitor.start(self, volume, created)
+
+    def stop(self):
+        """Stop monitoring and log the peak pool usage"""
+        if self._thread is None:
+            return
+        self._done.set()
+        self._thread.join()
+        self._thread = None
+        self.poll(extend=False)
+        if self.size:
+            LOG.info("Thin pool %s peaked at %.2f%% data (%s of %s) and "
+                     "%.2f%% metadata usage",
+                     self.pool.device_name(), self.peak_percent,
+                     format_bytes(self.peak_used), format_bytes(self.size),
+                     self.peak_metadata_percent)
+        if self.extend_count:
+            LOG.info("Thin pool %s was extended %d time(s) by %s in total",
+                     self.pool.device_name(), self.extend_count,
+                     format_bytes(self.extended))
+
+    def sample(self):
+        """Report the current thin pool usage"""
+        for info in lvs_thin(self.pool.device_name()):
+            return info
+        raise LookupError("No thin pool found for %s" %
+                          self.pool.device_name())
+
+    def poll(self, extend=True):
+        """Sample the thin pool and extend it if it is nearly full
+
+        :returns: False if the thin pool has failed or run out of space
+        """
+        try:
+            info = self.sample()
+        except (LookupError, LVMCommandError), exc:
+            LOG.debug("Failed to sample %s: %s",
+                      self.pool.device_name(), exc)
+            return True
+        # the ninth lv_attr character is the volume health
+        if info['lv_attr'][8:9] in ('F', 'D', 'M'):
+            LOG.error("Thin pool %s has failed or is out of space "
+                      "(lv_attr %s)", self.pool.device_name(),
+                      info['lv_attr'])
+            return False
+        percent = float(info['data_percent'] or 0)
+        metadata_percent = float(info['metadata_percent'] or 0)
+        size = int(info['lv_size'])
+        used = int(size * percent / 100)
+        self.size = size
+        if used > self.peak_used:
+            self.peak_used = used
+            self.peak_percent = percent
+        self.peak_metadata_percent = max(self.peak_metadata_percent,
+                                         metadata_percent)
+        if metadata_percent >= self.threshold and not self._metadata_warned:
+            LOG.warning("Thin pool %s metadata is %.2f%% full. If it fills "
+                        "up, all thin volumes in the pool will fail",
+                        self.pool.device_name(), metadata_percent)
+            self._metadata_warned = True
+        if extend and percent >= self.threshold:
+            self.extend(info)
+        return True
+
+    def extend(self, info):
+        """Grow the thin pool's data volume from its volume group's free
+        extents"""
+        extent_size = int(info['vg_extent_size'])
+        free = int(info['vg_free_count'])
+        wanted = max(int(self.size * self.extend_percent / 100 / extent_size),
+                     1)
+        extents = min(wanted, free)
+        if extents < 1:
+            if not self._exhausted:
+                LOG.warning("Thin pool %s is %s%% full but volume group %s "
+                            "has no free extents to extend it",
+                            self.pool.device_name(), info['data_percent'],
+                            self.pool.vg_name)
+                self._exhausted = True
+            return
+        LOG.info("Thin pool %s is %s%% full. Extending by %d extents (%s)",
+                 self.pool.device_name(), info['data_percent'], extents,
+                 format_bytes(extents*extent_size))
+        try:
+            self.pool.extend(extents)
+        except LVMCommandError, exc:
+            LOG.error("Failed to extend thin pool %s: %s",
+                      self.pool.device_name(), exc)
+            return
+        self.extended += extents*extent_size
+        self.extend_count += 1
+        self.size += extents*extent_size
+
+    def record(self, section):
+        """Record thin pool usage in a config section"""
+        section['thin-pool'] = self.pool.device_name()
+        section['thin-pool-size'] = str(self.size)
+        section['thin-pool-peak-used'] = str(self.peak_used)
+        section['thin-pool-peak-percent'] = '%.2f' % self.peak_percent
+        section['thin-pool-peak-metadata-percent'] = \
+            '%.2f' % self.peak_metadata_percent
+        section['thin-pool-extended'] = str(self.extended)
+        section['thin-pool-extend-count'] = str(self.extend_count)
@@ -5,9 +5,17 @@ import re
 import csv
 import logging
 from cStringIO import StringIO
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
 from subprocess import Popen, PIPE, STDOUT, list2cmdline
 
-from holland.lib.lvm.constants import PVS_ATTR, VGS_ATTR, LVS_ATTR
+from holland.lib.lvm.constants import PVS_ATTR, VGS_ATTR, LVS_ATTR, \
+                                     THIN_LVS_ATTR
 from holland.lib.lvm.errors import LVMCommandError
 
 LOG = logging.getLogger(__name__)
@@ -99,6 +107,92 @@ def lvs(*volume_groups):
 
     return parse_lvm_format(LVS_ATTR, stdout)
 
+def lvs_thin(*logical_volumes):
+    """Report thin provisioning information about logical volumes
+
+    For a thin volume ``pool_lv`` names its thin pool.  For a thin pool
+    ``data_percent`` and ``metadata_percent`` report how full the pool's
+    data and metadata volumes are.
+
+    :param logical_volumes: volumes to report on
+    :returns: list of dicts of lvs parameters
+    """
+    lvs_args = [
+        'lvs',
+        '--unbuffered',
+        '--noheadings',
+        '--nosuffix',
+        '--units=b',
+        '--separator=,',
+        '--options=%s' % ','.join(THIN_LVS_ATTR),
+    ]
+    lvs_args.extend(list(logical_volumes))
+    process = Popen(lvs_args,
+                    stdout=PIPE,
+                    stderr=PIPE,
+                    preexec_fn=os.setsid,
+                    close_fds=True)
+    stdout, stderr = process.communicate()
+
+    if process.returncode != 0:
+        raise LVMCommandError('lvs', process.returncode, stderr)
+
+    return list(parse_lvm_format(THIN_LVS_ATTR, stdout))
+
+def lvm_report(command, attributes, report_json=False, names=()):
+    """Report on every volume known to LVM with a single command
+
+    :param command: one of 'pvs', 'vgs' or 'lvs'.  lvs reports include
+                    internal volumes (lvs --all).
+    :param attributes: list of attributes to report
+    :param report_json: request the JSON report format (LVM 2.02.158+)
+                        rather than comma separated output
+    :param names: only report on these volumes rather than every volume
+    :returns: list of dicts of report parameters
+    """
+    report_args = [
+        command,
+        '--unbuffered',
+        '--noheadings',
+        '--nosuffix',
+        '--units=b',
+        '--options=%s' % ','.join(attributes),
+    ]
+    if command == 'lvs':
+        report_args.insert(1, '--all')
+    if report_json:
+        report_args.append('--reportformat=json')
+    else:
+        report_args.append('--separator=,')
+    report_args.extend(names)
+    LOG.debug("%s", list2cmdline(report_args))
+    process = Popen(report_args,
+                    stdout=PIPE,
+                    stderr=PIPE,
+                    preexec_fn=os.setsid,
+                    close_fds=True)
+    stdout, stderr = process.communicate()
+
+    if process.returncode != 0:
+        raise LVMCommandError(list2cmdline(report_args),
+                              process.returncode,
+                              stderr)
+
+    if report_json:
+        return parse_lvm_json(command[:2], stdout)
+    return list(parse_lvm_format(attributes, stdout))
+
+def parse_lvm_json(key, text):
+    """Convert an LVM JSON report into a list of dicts
+
+    :param key: report type - 'pv', 'vg' or 'lv'
+    """
+    result = []
+    for report in json.loads(text)['report']:
+        for row in report.get(key, []):
+            result.append(dict([(str(name), value.encode('utf8'))
+                                for name, value in row.items()]))
+    return result
 
 def parse_lvm_format(keys, values):
     """Convert LVM tool output into a dictionary"""
@@ -111,16 +205,21 @@ def lvsnapshot(orig_lv_path, snapshot_name, snapshot_extents, chunksize=None):
 
     :param snapshot_lv_name: name of the snapshot
     :param orig_lv_path: path to the logical volume being snapshotted
-    :param snapshot_extents: size to allocate to snapshot volume in extents
+    :param snapshot_extents: size to allocate to snapshot volume in extents.
+                             If None, no size is given and lvcreate creates
+                             a thin snapshot (``orig_lv_path`` must be a
+                             thin volume).
     :param chunksize: (optional) chunksize of the snapshot volume
     """
     lvcreate_args = [
         'lvcreate',
         '--snapshot',
         '--name', snapshot_name,
-        '--extents', "%d" % snapshot_extents,
         orig_lv_path,
     ]
+    if snapshot_extents is not None:
+        lvcreate_args.insert(-1, '--extents')
+        lvcreate_args.insert(-1, "%d" % snapshot_extents)
 
     if chunksize:
         lvcreate_args.insert(-1, '--chunksize')
@@ -175,6 +274,72 @@ def lvremove(lv_path):
                               process.returncode,
                               str(stderr).strip())
 
+def lvextend(lv_path, extents):
+    """Grow a logical volume
+
+    :param lv_path: logical volume to extend
+    :param extents: number of extents to add to the volume
+    :raises: LVMCommandError if lvextend returns with non-zero status
+    """
+    lvextend_args = [
+        'lvextend',
+        '--extents', '+%d' % extents,
+        lv_path,
+    ]
+
+    LOG.debug("%s", list2cmdline(lvextend_args))
+    process = Popen(lvextend_args,
+                    stdout=PIPE,
+                    stderr=PIPE,
+                    preexec_fn=os.setsid,
+                    close_fds=True)
+
+    stdout, stderr = process.communicate()
+
+    for line in str(stdout).splitlines():
+        if not line:
+            continue
+        LOG.debug("%s : %s", list2cmdline(lvextend_args), line)
+
+    if process.returncode != 0:
+        raise LVMCommandError(list2cmdline(lvextend_args),
+                              process.returncode,
+                              str(stderr).strip())
+
+def lvactivate(lv_path):
+    """Activate a logical volume
+
+    Thin snapshots are created with the activation skip flag set, so they
+    are activated here regardless of that flag.
+
+    :param lv_path: logical volume to activate
+    :raises: LVMCommandError if lvchange returns with non-zero status
+    """
+    lvchange_args = [
+        'lvchange',
+        '--activate', 'y',
+        '--ignoreactivationskip',
+        lv_path,
+    ]
+
+    LOG.debug("%s", list2cmdline(lvchange_args))
+    process = Popen(lvchange_args,
+                    stdout=PIPE,
+                    stderr=PIPE,
+                    preexec_fn=os.setsid,
+                    close_fds=True)
+
+    stdout, stderr = process.communicate()
+
+    for line in str(stdout).splitlines():
+        if not line:
+            continue
+        LOG.debug("%s : %s", list2cmdline(lvchange_args), line)
+
+    if process.returncode != 0:
+        raise LVMCommandError(list2cmdline(lvchange_args),
+                              process.returncode,
+                              str(stderr).strip())
 
 ## Filesystem utility functions
 def blkid(*devices):
@@ -1,10 +1,15 @@
 """LVM Snapshot state machine"""
 
+import os
 import sys
+import time
 import signal
 import logging
+import threading
+from holland.core.util.process import ProcessSupervisor
 from holland.lib.lvm.errors import LVMCommandError
 from holland.lib.lvm.util import SignalManager, format_bytes
+from holland.lib.lvm.cache import lvm_cache
 
 LOG = logging.getLogger(__name__)
 
@@ -14,13 +19,50 @@ __all__ = [
 ]
 
 class Snapshot(object):
-    """Snapshot state machine"""
-    def __init__(self, name, size, mountpoint):
+    """Snapshot state machine
+
+    If ``monitor`` is given (a `SnapshotMonitor`), it watches the snapshot
+    from the time it is mounted until it is unmounted.
+
+    Callbacks that run child processes should wait for them with
+    ``supervisor``, which returns as soon as they exit or a SIGINT is
+    trapped.
+
+    Further volumes to snapshot at the same time are added with
+    `add_volume`.  ``root`` is then the directory their snapshots are
+    mounted under.  Callbacks are still passed the snapshot of the volume
+    given to `start`.
+    """
+    def __init__(self, name, size, mountpoint, monitor=None, root=None):
         self.name = name
         self.size = size
         self.mountpoint = mountpoint
+        self.monitor = monitor
+        self.root = root
+        self.volumes = []
+        self.created = None
         self.callbacks = {}
+        self._mounted = []
         self.sigmgr = SignalManager()
+        self.supervisor = ProcessSupervisor(self.interrupted)
+
+    def add_volume(self, logical_volume, name, size, mountpoint,
+                   monitor=None):
+        """Snapshot ``logical_volume`` along with the volume passed to
+        `start`
+
+        All snapshots are created concurrently between the pre-snapshot
+        and post-snapshot callbacks, so they are consistent with each
+        other, and are mounted (shallowest ``mountpoint`` first) before the
+        post-mount callbacks run.
+        """
+        self.volumes.append(dict(volume=logical_volume, name=name, size=size,
+                                 mountpoint=mountpoint, monitor=monitor,
+                                 snapshot=None))
+
+    def interrupted(self):
+        """Check whether a SIGINT was trapped during the snapshot process"""
+        return signal.SIGINT in self.sigmgr.pending
 
     def start(self, volume):
         """Start the snapshot process to snapshot the logical volume
@@ -41,8 +83,12 @@ class Snapshot(object):
 
         try:
             self._apply_callbacks('pre-snapshot', self, None)
-            snapshot = logical_volume.snapshot(self.name, self.size)
+            snapshot = self._create_snapshots(logical_volume)
+            self.created = time.time()
             LOG.info("Created snapshot volume %s", snapshot.device_name())
+            for info in self.volumes:
+                LOG.info("Created snapshot volume %s",
+                         info['snapshot'].device_name())
         except (LVMCommandError, CallbackFailuresError), exc:
             return self.error(None, exc)
 
@@ -53,20 +99,77 @@ class Snapshot(object):
 
         return self.mount_snapshot(snapshot)
 
+    def _create_snapshots(self, logical_volume):
+        """Snapshot ``logical_volume`` and any added volumes
+
+        Added volumes are snapshotted concurrently, each lvcreate in its
+        own thread.  If any snapshot fails the others are removed again.
+
+        :returns: snapshot of ``logical_volume``
+        """
+        if not self.volumes:
+            return logical_volume.snapshot(self.name, self.size)
+        requests = [(logical_volume, self.name, self.size)]
+        for info in self.volumes:
+            requests.append((info['volume'], info['name'], info['size']))
+        results = [None]*len(requests)
+        errors = []
+        def create(index, volume, name, size):
+            try:
+                results[index] = volume.snapshot(name, size)
+            except Exception, exc:
+                errors.append(exc)
+        threads = []
+        for index, request in enumerate(requests):
+            thread = threading.Thread(target=create, args=(index,) + request)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if errors:
+            for snapshot in results:
+                if snapshot is None:
+                    continue
+                try:
+                    snapshot.remove()
+                    LOG.info("Removed snapshot %s on cleanup",
+                             snapshot.device_name())
+                except LVMCommandError, exc:
+                    LOG.error("Failed to remove snapshot %s", exc)
+            raise errors[0]
+        for info, snapshot in zip(self.volumes, results[1:]):
+            info['snapshot'] = snapshot
+        return results[0]
+
+    def _mount(self, snapshot, mountpoint, monitor):
+        """Mount one snapshot volume and start monitoring it"""
+        if not os.path.isdir(mountpoint):
+            os.makedirs(mountpoint)
+        options = None
+        if snapshot.filesystem() == 'xfs':
+            LOG.info("xfs filesystem detected on %s. "
+                     "Using mount -o nouuid",
+                     snapshot.device_name())
+            options = 'nouuid'
+        snapshot.mount(mountpoint, options)
+        self._mounted.append(snapshot)
+        LOG.info("Mounted %s on %s", snapshot.device_name(), mountpoint)
+        if monitor:
+            monitor.start(snapshot, self.created)
+
     def mount_snapshot(self, snapshot):
         """Mount the snapshot"""
 
         try:
             self._apply_callbacks('pre-mount', self, snapshot)
-            options = None
-            if snapshot.filesystem() == 'xfs':
-                LOG.info("xfs filesystem detected on %s. "
-                         "Using mount -o nouuid",
-                         snapshot.device_name())
-                options = 'nouuid'
-            snapshot.mount(self.mountpoint, options)
-            LOG.info("Mounted %s on %s",
-                     snapshot.device_name(), self.mountpoint)
+            mounts = [(self.mountpoint, snapshot, self.monitor)]
+            for info in self.volumes:
+                mounts.append((info['mountpoint'], info['snapshot'],
+                               info['monitor']))
+            # mount parents before any snapshot mounted inside them
+            mounts.sort(key=lambda mount: len(mount[0]))
+            for mountpoint, volume, monitor in mounts:
+                self._mount(volume, mountpoint, monitor)
             self._apply_callbacks('post-mount', self, snapshot)
         except (CallbackFailuresError, LVMCommandError), exc:
             return self.error(snapshot, exc)
@@ -75,10 +178,15 @@ class Snapshot(object):
 
     def unmount_snapshot(self, snapshot):
         """Unmount the snapshot"""
+        self._stop_monitor()
         try:
             self._apply_callbacks('pre-unmount', snapshot)
-            snapshot.unmount()
-            LOG.info("Unmounted %s", snapshot.device_name())
+            # unmount in the reverse order the snapshots were mounted
+            while self._mounted:
+                volume = self._mounted[-1]
+                volume.unmount()
+                self._mounted.pop()
+                LOG.info("Unmounted %s", volume.device_name())
         except (CallbackFailuresError, LVMCommandError), exc:
             return self.error(snapshot, exc)
 
@@ -93,6 +201,11 @@ class Snapshot(object):
         """Remove the snapshot"""
         try:
             self._apply_callbacks('pre-remove', snapshot)
+            for info in self.volumes:
+                info['snapshot'].remove()
+                LOG.info("Removed snapshot %s",
+                         info['snapshot'].device_name())
+                info['snapshot'] = None
             snapshot.remove()
             LOG.info("Removed snapshot %s", snapshot.device_name())
         except (CallbackFailuresError, LVMCommandError), exc:
@@ -107,6 +220,8 @@ class Snapshot(object):
 
     def finish(self):
         """Finish the snapshotting process"""
+        # volumes seen by the next run may be different
+        lvm_cache.invalidate()
         pending = self.sigmgr.pending[:]
         self.sigmgr.restore()
         if signal.SIGINT in pending:
@@ -119,6 +234,8 @@ class Snapshot(object):
     def error(self, snapshot, exc):
         """Handle an error during the snapshot process"""
         LOG.debug("Error encountered during snapshot processing: %s", exc)
+        self._stop_monitor()
+        self._cleanup_volumes()
 
         if snapshot and snapshot.exists():
             snapshot.reload()
@@ -141,6 +258,41 @@ class Snapshot(object):
 
         return self.finish()
 
+    def _cleanup_volumes(self):
+        """Unmount every snapshot and remove the snapshots of added
+        volumes after an error"""
+        while self._mounted:
+            volume = self._mounted.pop()
+            try:
+                volume.unmount()
+                LOG.info("Unmounting snapshot %s on cleanup",
+                         volume.device_name())
+            except LVMCommandError, exc:
+                LOG.error("Failed to unmount snapshot %s", exc)
+        for info in self.volumes:
+            volume = info['snapshot']
+            if volume is None or not volume.exists():
+                continue
+            try:
+                volume.remove()
+                LOG.info("Removed snapshot %s on cleanup",
+                         volume.device_name())
+            except LVMCommandError, exc:
+                LOG.error("Failed to remove snapshot %s", exc)
+            info['snapshot'] = None
+
+    def _stop_monitor(self):
+        """Stop the snapshot monitors, if any are running"""
+        monitors = [self.monitor] + [info['monitor'] for info in self.volumes]
+        for monitor in monitors:
+            if not monitor:
+                continue
+            try:
+                monitor.stop()
+            except Exception, exc:
+                LOG.debug("Failed to stop snapshot monitor: %s", exc,
+                          exc_info=True)
+
     def register(self, event, callback, priority=100):
         """Register a callback for ``event`` with ``priority``
 
@@ -0,0 +1,130 @@
+import threading
+from nose.tools import *
+from holland.lib.lvm.raw import parse_lvm_json
+from holland.lib.lvm.cache import LVMCache
+
+LVS_JSON = """
+  {
+      "report": [
+          {
+              "lv": [
+                  {"vg_name":"vg0", "lv_name":"root", "lv_kernel_major":"-1", "lv_kernel_minor":"-1"},
+                  {"vg_name":"vg0", "lv_name":"mysql", "lv_kernel_major":"-1", "lv_kernel_minor":"-1"},
+                  {"vg_name":"vg1", "lv_name":"mysql", "lv_kernel_major":"-1", "lv_kernel_minor":"-1"}
+              ]
+          }
+      ]
+  }
+"""
+
+def test_parse_lvm_json():
+    rows = parse_lvm_json('lv', LVS_JSON)
+    assert_equals(len(rows), 3)
+    assert_equals(rows[0]['lv_name'], 'root')
+    ok_(isinstance(rows[0]['lv_name'], str))
+    assert_equals(parse_lvm_json('pv', LVS_JSON), [])
+
+class FakeCache(LVMCache):
+    def __init__(self):
+        LVMCache.__init__(self)
+        self.calls = 0
+        self.targeted = []
+        self.rows = parse_lvm_json('lv', LVS_JSON)
+
+    def _run_report(self, command, names=()):
+        if names:
+            self.targeted.extend(names)
+            vg_name, lv_name = names[0].split('/')
+            return [dict(row) for row in self.rows
+                    if row['vg_name'] == vg_name and
+                       row['lv_name'] == lv_name]
+        self.calls += 1
+        return [dict(row) for row in self.rows]
+
+def test_lvs_lookup():
+    cache = FakeCache()
+    assert_equals(len(cache.lvs()), 3)
+    assert_equals(len(cache.lvs('vg0')), 2)
+    lv, = cache.lvs('vg1/mysql')
+    assert_equals(lv['vg_name'], 'vg1')
+    assert_equals(cache.lvs('/dev/vg0/nonexistent'), [])
+    assert_equals(cache.calls, 1)
+
+def test_invalidate():
+    cache = FakeCache()
+    cache.lvs()
+    cache.invalidate('vgs')
+    cache.lvs()
+    assert_equals(cache.calls, 1)
+    cache.invalidate('lvs')
+    cache.lvs()
+    assert_equals(cache.calls, 2)
+    cache.invalidate()
+    cache.lvs()
+    assert_equals(cache.calls, 3)
+
+def test_refresh_single_volume():
+    cache = FakeCache()
+    cache.lvs()
+    cache.rows[1]['lv_attr'] = '-wi-a-'
+    lv, = cache.refresh('lvs', 'vg0/mysql')
+    assert_equals(lv['lv_attr'], '-wi-a-')
+    # the cached report is updated without running a full report
+    assert_equals(cache.lvs('vg0/mysql'), [lv])
+    assert_equals(len(cache.lvs()), 3)
+    assert_equals(cache.calls, 1)
+    assert_equals(cache.targeted, ['vg0/mysql'])
+
+def test_refresh_new_volume():
+    cache = FakeCache()
+    cache.lvs()
+    cache.rows.append({'vg_name' : 'vg0', 'lv_name' : 'snap',
+                       'lv_kernel_major' : '-1', 'lv_kernel_minor' : '-1'})
+    cache.refresh('lvs', 'vg0/snap')
+    assert_equals(len(cache.lvs('vg0')), 3)
+    assert_equals(cache.calls, 1)
+
+def test_forget():
+    cache = FakeCache()
+    cache.lvs()
+    cache.forget('lvs', 'vg0/mysql')
+    assert_equals(cache.lvs('vg0/mysql'), [])
+    assert_equals(len(cache.lvs()), 2)
+    assert_equals(cache.calls, 1)
+
+def test_refresh_waits_for_lock():
+    cache = FakeCache()
+    cache.lvs()
+    cache.rows.append({'vg_name' : 'vg0', 'lv_name' : 'snap',
+                       'lv_kernel_major' : '-1', 'lv_kernel_minor' : '-1'})
+    # another thread (e.g. a snapshot monitor) is using the cached report
+    cache._lock.acquire()
+    try:
+        thread = threading.Thread(target=cache.refresh,
+                                  args=('lvs', 'vg0/snap'))
+        thread.start()
+        thread.join(0.2)
+        ok_(thread.isAlive())
+        assert_equals(len(cache.lvs('vg0')), 2)
+    finally:
+        cache._lock.release()
+    thread.join()
+    assert_equals(len(cache.lvs('vg0')), 3)
+
+def test_concurrent_refresh():
+    cache = FakeCache()
+    cache.lvs()
+    names = ['snap%d' % index for index in range(20)]
+    for name in names:
+        cache.rows.append({'vg_name' : 'vg0', 'lv_name' : name,
+                           'lv_kernel_major' : '-1',
+                           'lv_kernel_minor' : '-1'})
+    threads = [threading.Thread(target=cache.refresh,
+                                args=('lvs', 'vg0/' + name))
+               for name in names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert_equals(len(cache.lvs('vg0')), 22)
+    assert_equals(cache.calls, 1)
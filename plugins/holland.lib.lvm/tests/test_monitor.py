@@ -0,0 +1,127 @@
+from nose.tools import *
+from holland.lib.lvm.monitor import SnapshotMonitor, ThinPoolMonitor
+
+EXTENT = 4*1024**2
+
+class FakeVolume(object):
+    vg_name = 'vg0'
+
+    def __init__(self, extents, free):
+        self.extents = extents
+        self.free = free
+        self.used = 0
+        self.extended = []
+
+    def device_name(self):
+        return '/dev/vg0/mysql_snapshot'
+
+    def extend(self, extents):
+        self.extents += extents
+        self.free -= extents
+        self.extended.append(extents)
+
+    def info(self):
+        size = self.extents*EXTENT
+        return {
+            'lv_attr' : 'swi-ao',
+            'lv_size' : str(size),
+            'snap_percent' : '%.2f' % (self.used*100.0/size),
+            'vg_extent_size' : str(EXTENT),
+            'vg_free_count' : str(self.free),
+        }
+
+class FakeMonitor(SnapshotMonitor):
+    def sample(self):
+        return self.volume.info()
+
+def test_extend():
+    volume = FakeVolume(extents=100, free=30)
+    monitor = FakeMonitor(threshold=80, extend_percent=25)
+    monitor.volume = volume
+    volume.used = 50*EXTENT
+    monitor.poll()
+    eq_(volume.extended, [])
+    volume.used = 90*EXTENT
+    monitor.poll()
+    eq_(volume.extended, [25])
+    # 90 of 125 extents is still below the threshold
+    monitor.poll()
+    eq_(volume.extended, [25])
+    volume.used = 120*EXTENT
+    monitor.poll()
+    # limited by the 5 remaining free extents
+    eq_(volume.extended, [25, 5])
+    monitor.poll()
+    eq_(volume.extended, [25, 5])
+    eq_(monitor.extend_count, 2)
+    eq_(monitor.extended, 30*EXTENT)
+    # usage is derived from the rounded snap_percent
+    ok_(abs(monitor.peak_used - 120*EXTENT) < EXTENT)
+
+def test_invalid_snapshot():
+    volume = FakeVolume(extents=100, free=0)
+    monitor = FakeMonitor()
+    monitor.volume = volume
+    info = volume.info()
+    info['lv_attr'] = 'swi-I-'
+    monitor.sample = lambda: info
+    ok_(not monitor.poll())
+
+def test_record():
+    volume = FakeVolume(extents=100, free=0)
+    monitor = FakeMonitor(interval=0.01)
+    monitor.start(volume, created=0)
+    volume.used = 10*EXTENT
+    monitor.stop()
+    section = {}
+    monitor.record(section)
+    eq_(section['snapshot-peak-used'], str(10*EXTENT))
+    eq_(section['snapshot-size'], str(100*EXTENT))
+    ok_(monitor.fill_rate > 0)
+
+class FakePool(FakeVolume):
+    def __init__(self, extents, free):
+        FakeVolume.__init__(self, extents, free)
+        self.metadata_percent = 0.0
+
+    def device_name(self):
+        return '/dev/vg0/pool'
+
+    def info(self):
+        size = self.extents*EXTENT
+        return {
+            'lv_attr' : 'twi-aotz--',
+            'lv_size' : str(size),
+            'data_percent' : '%.2f' % (self.used*100.0/size),
+            'metadata_percent' : '%.2f' % self.metadata_percent,
+            'vg_extent_size' : str(EXTENT),
+            'vg_free_count' : str(self.free),
+        }
+
+class FakeThinMonitor(ThinPoolMonitor):
+    def sample(self):
+        return self.pool.info()
+
+def test_thin_pool_extend():
+    pool = FakePool(extents=100, free=10)
+    monitor = FakeThinMonitor(threshold=80, extend_percent=25)
+    monitor.pool = pool
+    pool.used = 85*EXTENT
+    pool.metadata_percent = 90.0
+    ok_(monitor.poll())
+    # the pool is extended, not the snapshot
+    eq_(pool.extended, [10])
+    eq_(monitor.peak_metadata_percent, 90.0)
+    section = {}
+    monitor.record(section)
+    eq_(section['thin-pool'], '/dev/vg0/pool')
+    eq_(section['thin-pool-extend-count'], '1')
+
+def test_thin_pool_out_of_space():
+    pool = FakePool(extents=100, free=0)
+    monitor = FakeThinMonitor()
+    monitor.pool = pool
+    info = pool.info()
+    info['lv_attr'] = 'twi-aotzD-'
+    monitor.sample = lambda: info
+    ok_(not monitor.poll())
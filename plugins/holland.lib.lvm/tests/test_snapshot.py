@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+from os.path import join
+from nose.tools import *
+from holland.lib.lvm.errors import LVMCommandError
+from holland.lib.lvm.snapshot import Snapshot
+
+class FakeVolume(object):
+    def __init__(self, name, events, fail=False):
+        self.name = name
+        self.events = events
+        self.fail = fail
+        self.mounted = False
+        self.removed = False
+
+    def device_name(self):
+        return '/dev/vg0/' + self.name
+
+    def snapshot(self, name, size):
+        if self.fail:
+            raise LVMCommandError('lvcreate', -1, 'failed')
+        self.events.append(('snapshot', self.name))
+        return FakeVolume(name, self.events)
+
+    def filesystem(self):
+        return 'ext3'
+
+    def mount(self, path, options=None):
+        self.events.append(('mount', self.name, path))
+        self.mounted = True
+
+    def unmount(self):
+        self.events.append(('unmount', self.name))
+        self.mounted = False
+
+    def is_mounted(self):
+        return self.mounted
+
+    def exists(self):
+        return not self.removed
+
+    def remove(self):
+        self.events.append(('remove', self.name))
+        self.removed = True
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+def test_multiple_volumes():
+    events = []
+    snapshot = Snapshot('data_snapshot', 10, join(tmpdir, 'var/lib/mysql'),
+                        root=tmpdir)
+    snapshot.add_volume(FakeVolume('logs', events), 'logs_snapshot', 10,
+                        join(tmpdir, 'var/lib/mysql/logs'))
+    snapshot.add_volume(FakeVolume('root', events), 'root_snapshot', 10,
+                        tmpdir)
+    snapshot.start(FakeVolume('data', events))
+    # every snapshot exists before any is mounted
+    eq_(sorted([event[1] for event in events[:3]]),
+        ['data', 'logs', 'root'])
+    mounts = [event[1:] for event in events if event[0] == 'mount']
+    eq_(mounts, [('root_snapshot', tmpdir),
+                 ('data_snapshot', join(tmpdir, 'var/lib/mysql')),
+                 ('logs_snapshot', join(tmpdir, 'var/lib/mysql/logs'))])
+    unmounts = [event[1] for event in events if event[0] == 'unmount']
+    eq_(unmounts, ['logs_snapshot', 'data_snapshot', 'root_snapshot'])
+    removed = [event[1] for event in events if event[0] == 'remove']
+    eq_(sorted(removed), ['data_snapshot', 'logs_snapshot', 'root_snapshot'])
+
+def test_failed_snapshot_removes_others():
+    events = []
+    snapshot = Snapshot('data_snapshot', 10, join(tmpdir, 'data'),
+                        root=tmpdir)
+    snapshot.add_volume(FakeVolume('logs', events, fail=True),
+                        'logs_snapshot', 10, join(tmpdir, 'logs'))
+    assert_raises(LVMCommandError, snapshot.start, FakeVolume('data', events))
+    eq_(events, [('snapshot', 'data'), ('remove', 'data_snapshot')])
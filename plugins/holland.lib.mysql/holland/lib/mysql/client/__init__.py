@@ -2,12 +2,15 @@ from holland.lib.mysql.client.base import MySQLClient, MySQLError, \
                                           ProgrammingError, OperationalError, \
                                           connect, \
                                           PassiveMySQLClient,  AutoMySQLClient
+from holland.lib.mysql.client.pool import ConnectionPool, PooledMySQLClient
 
 __all__ = [
     'connect',
     'MySQLClient',
     'AutoMySQLClient',
     'PassiveMySQLClient',
+    'ConnectionPool',
+    'PooledMySQLClient',
     'MySQLError',
     'ProgrammingError',
     'OperationalError',
@@ -59,6 +59,7 @@ class MySQLClient(object):
         :param kwargs: kwargs dict to pass to MySQLdb.connect
         """
         self._connection = MySQLdb.connect(*args, **kwargs)
+        self.flush_variable_cache()
 
     def flush_tables(self):
         """Flush MySQL server table data to disk
@@ -192,6 +193,33 @@ class MySQLClient(object):
             exc.args = (exc.args[0], exc.args[1].decode('utf8'))
             raise
 
+    def show_database_sizes(self, exclude=()):
+        """Summarize the size of every database in a single query
+
+        This sums the data and index length of all tables per database
+        from the information schema without building any per-table
+        metadata.  Merge and federated tables are not counted, as they do
+        not hold any data of their own.
+
+        :param exclude: database names to leave out of the summary
+        :returns: list of (database, size) tuples
+        """
+        sql = ("SELECT TABLE_SCHEMA, "
+               "       SUM(COALESCE(DATA_LENGTH, 0) + "
+               "           COALESCE(INDEX_LENGTH, 0)) "
+               "FROM INFORMATION_SCHEMA.TABLES "
+               "WHERE COALESCE(ENGINE, '') NOT IN ('MRG_MYISAM', 'FEDERATED')")
+        if exclude:
+            sql += (" AND TABLE_SCHEMA NOT IN (%s)" %
+                    ','.join(['%s']*len(exclude)))
+        sql += " GROUP BY TABLE_SCHEMA"
+        cursor = self.cursor()
+        try:
+            cursor.execute(sql, tuple(exclude))
+            return [(name, int(size or 0)) for name, size in cursor.fetchall()]
+        finally:
+            cursor.close()
+
     def show_tables(self, database, full=False):
         """List tables in the given database
 
@@ -296,6 +324,99 @@ class MySQLClient(object):
         finally:
             cursor.close()
 
+    def show_view_definitions(self):
+        """Fetch the definition of every view in a single query
+
+        :returns: list of (schema, name, definer, security_type, definition)
+                  tuples from INFORMATION_SCHEMA.VIEWS
+        """
+        sql = ("SELECT TABLE_SCHEMA, TABLE_NAME, DEFINER, SECURITY_TYPE, "
+               "       VIEW_DEFINITION "
+               "FROM INFORMATION_SCHEMA.VIEWS")
+        cursor = self.cursor()
+        try:
+            cursor.execute(sql)
+            return list(cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def show_table_columns(self, tables, batch_size=1000):
+        """List the columns of several tables or views
+
+        Tables are looked up by schema and name, one query per schema (and
+        per ``batch_size`` tables), so servers before 8.0 only read the
+        definitions of the given tables rather than opening every table to
+        fill INFORMATION_SCHEMA.COLUMNS.
+
+        :param tables: sequence of (schema, name) tuples
+        :returns: dict mapping each (schema, name) to a list of
+                  (column_name, column_type) tuples.  Tables that do not
+                  exist are left out.
+        """
+        by_schema = {}
+        for schema, name in tables:
+            by_schema.setdefault(schema, []).append(name)
+        result = {}
+        cursor = self.cursor()
+        try:
+            for schema in sorted(by_schema):
+                names = sorted(set(by_schema[schema]))
+                for offset in xrange(0, len(names), batch_size):
+                    batch = names[offset:offset + batch_size]
+                    sql = ("SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE "
+                           "FROM INFORMATION_SCHEMA.COLUMNS "
+                           "WHERE TABLE_SCHEMA = %%s AND TABLE_NAME IN (%s) "
+                           "ORDER BY TABLE_NAME, ORDINAL_POSITION" %
+                           ','.join(['%s']*len(batch)))
+                    cursor.execute(sql, [schema] + batch)
+                    for name, column, column_type in cursor.fetchall():
+                        result.setdefault((schema, name), []).append(
+                            (column, column_type))
+        finally:
+            cursor.close()
+        return result
+
+    def show_routine_catalog(self):
+        """List every stored routine and when it was last altered
+
+        :returns: list of (schema, name, routine_type, last_altered) tuples
+        """
+        sql = ("SELECT ROUTINE_SCHEMA, ROUTINE_NAME, ROUTINE_TYPE, "
+               "       LAST_ALTERED "
+               "FROM INFORMATION_SCHEMA.ROUTINES "
+               "ORDER BY ROUTINE_SCHEMA, ROUTINE_NAME, ROUTINE_TYPE")
+        cursor = self.cursor()
+        try:
+            cursor.execute(sql)
+            return list(cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def show_grant_tables(self):
+        """Read the accounts and privileges from the mysql grant tables
+
+        Grant tables that do not exist on this server version (such as the
+        8.0 role tables) are skipped.
+
+        :returns: dict mapping grant table name to a sorted list of rows
+        :raises: MySQLError if the grant tables cannot be read
+        """
+        result = {}
+        cursor = self.cursor()
+        try:
+            for table in ('user', 'db', 'tables_priv', 'columns_priv',
+                          'procs_priv', 'role_edges', 'default_roles'):
+                try:
+                    cursor.execute('SELECT * FROM `mysql`.`%s`' % table)
+                except MySQLError, exc:
+                    if exc.args[0] == 1146: # ER_NO_SUCH_TABLE
+                        continue
+                    raise
+                result[table] = sorted(cursor.fetchall())
+            return result
+        finally:
+            cursor.close()
+
     def show_create_table(self, database, table):
         """Fetch DDL for a table
 
@@ -350,6 +471,52 @@ class MySQLClient(object):
         else:
             return dict(zip(keys, master_status))
 
+    def show_binary_logs(self):
+        """Fetch the binary logs known to the MySQL server
+
+        :returns: list of (log_name, file_size) tuples, oldest first
+        """
+        sql = "SHOW BINARY LOGS"
+        cursor = self.cursor()
+        try:
+            cursor.execute(sql)
+            return [(row[0], int(row[1])) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def flush_binary_logs(self):
+        """Close the current binary log and open a new one
+
+        Runs FLUSH BINARY LOGS on 5.5.3+ and FLUSH LOGS otherwise
+        """
+        cursor = self.cursor()
+        cursor.execute('FLUSH /*!50503 BINARY */ LOGS')
+        cursor.close()
+
+    def show_processlist(self):
+        """List the threads running on the MySQL server
+
+        :returns: list of dicts with lowercased SHOW FULL PROCESSLIST column
+                  names as keys
+        """
+        sql = "SHOW FULL PROCESSLIST"
+        cursor = self.cursor()
+        try:
+            cursor.execute(sql)
+            keys = [col[0].lower() for col in cursor.description]
+            return [dict(zip(keys, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def kill_query(self, thread_id):
+        """Abort the statement a thread is currently running
+
+        Runs KILL QUERY, which leaves the thread's connection open.
+        """
+        cursor = self.cursor()
+        cursor.execute('KILL QUERY %d' % int(thread_id))
+        cursor.close()
+
     def start_slave(self):
         """Run START SLAVE on the connected MySQL instance"""
         sql = "START SLAVE"
@@ -383,16 +550,58 @@ class MySQLClient(object):
         return value
 
     def show_variable(self, key, session=False):
-        """Fetch MySQL server variable"""
+        """Fetch MySQL server variable
+
+        The value is remembered for the life of the current connection.
+        See `show_variables()`.
+        """
+        return self.show_variables([key], session)[key]
+
+    def show_variables(self, keys, session=False):
+        """Fetch several MySQL server variables in a single query
+
+        Values are remembered for the life of the current connection, so
+        only variables that have not been requested before are queried.
+        Call `flush_variable_cache()` to discard remembered values.
+
+        :param keys: list of variable names
+        :returns: dict mapping each requested name to its value, or None if
+                  the server has no such variable
+        """
         scope = self.SCOPE[session]
-        sql = 'SHOW %s VARIABLES LIKE ' % scope + '%s'
-        cursor = self.cursor()
-        if cursor.execute(sql, (key,)):
-            value = cursor.fetchone()[1]
-        else:
-            value = None
-        cursor.close()
-        return value
+        missing = [key for key in keys
+                   if (scope, key.lower()) not in self._variables]
+        if missing:
+            sql = 'SHOW %s VARIABLES WHERE Variable_name IN (%s)' % \
+                  (scope, ','.join(['%s']*len(missing)))
+            cursor = self.cursor()
+            try:
+                try:
+                    cursor.execute(sql, tuple(missing))
+                    rows = cursor.fetchall()
+                except MySQLError, exc:
+                    # SHOW ... WHERE requires MySQL 5.0.3+
+                    if exc.args[0] != 1064:
+                        raise
+                    rows = []
+                    for key in missing:
+                        cursor.execute('SHOW %s VARIABLES LIKE ' % scope + '%s',
+                                       (key,))
+                        rows.extend(cursor.fetchall())
+            finally:
+                cursor.close()
+            values = dict([(name.lower(), value) for name, value in rows])
+            for key in missing:
+                self._variables[(scope, key.lower())] = values.get(key.lower())
+        return dict([(key, self._variables[(scope, key.lower())])
+                     for key in keys])
+
+    def flush_variable_cache(self):
+        """Forget any server variables and version remembered for this
+        connection
+        """
+        self._variables = {}
+        self._server_version = None
 
     def set_variable(self, key, value, session=True):
         """Set a MySQL server variable.
@@ -408,19 +617,25 @@ class MySQLClient(object):
         cursor = self.cursor()
         cursor.execute(sql)
         cursor.close()
+        self._variables.pop((self.SCOPE[session], key.lower()), None)
         return self.show_variable(key, session)
 
     def server_version(self):
         """
         server_version(self)
         returns a numeric tuple: major, minor, revision versions (respectively)
+
+        The version is remembered for the life of the current connection.
         """
-        version = self.get_server_info()
-        m = re.match(r'^(\d+)\.(\d+)\.(\d+)', version)
-        if m:
-            return tuple([int(v) for v in m.groups()])
-        else:
-            raise MySQLError("Could not match server version: %r" % version)
+        if self._server_version is None:
+            version = self.get_server_info()
+            m = re.match(r'^(\d+)\.(\d+)\.(\d+)', version)
+            if m:
+                self._server_version = tuple([int(v) for v in m.groups()])
+            else:
+                raise MySQLError("Could not match server version: %r" %
+                                 version)
+        return self._server_version
 
     def __getattr__(self, key):
         """Pass through to the underlying MySQLdb.Connection object"""
@@ -435,6 +650,7 @@ class PassiveMySQLClient(MySQLClient):
         self._connection = None
         self._args = args
         self._kwargs = kwargs
+        self.flush_variable_cache()
 
     def connect(self):
         """Connect to MySQL using the connection parameters this instance
@@ -443,6 +659,7 @@ class PassiveMySQLClient(MySQLClient):
         :raises: `MySQLError`
         """
         self._connection = MySQLdb.connect(*self._args, **self._kwargs)
+        self.flush_variable_cache()
 
     def disconnect(self):
         """Disconnect this instance from MySQL"""
@@ -451,6 +668,7 @@ class PassiveMySQLClient(MySQLClient):
                 self._connection.close()
         finally:
             self._connection = None
+            self.flush_variable_cache()
 
 
 class AutoMySQLClient(PassiveMySQLClient):
@@ -469,10 +687,14 @@ class AutoMySQLClient(PassiveMySQLClient):
             self._connection.ping()
         except MySQLError:
             LOG.info("Reconnecting to MySQL after failed ping")
-            self.connect()
+            self._reconnect()
 
         return PassiveMySQLClient.__getattr__(self, key)
 
+    def _reconnect(self):
+        """Replace a connection that failed a ping"""
+        self.connect()
+
 def connect(config, client_class=AutoMySQLClient):
     """Create a MySQLClient object from a dict
 
@@ -487,6 +709,15 @@ def connect(config, client_class=AutoMySQLClient):
                     compress
     :returns: `MySQLClient` instance
     """
+    return client_class(**connection_args(config))
+
+def connection_args(config):
+    """Convert a dict of my.cnf client options to MySQLdb.connect() keyword
+    arguments
+
+    :param config: dict-like object, as accepted by `connect()`
+    :returns: dict of keyword arguments
+    """
 
     # map standard my.cnf parameters to
     # what MySQLdb.connect expects
@@ -523,4 +754,5 @@ def connect(config, client_class=AutoMySQLClient):
         except KeyError:
             LOG.warn("Skipping unknown parameter %s", key)
     # also, always use utf8
-    return client_class(charset='utf8', **args)
+    args['charset'] = 'utf8'
+    return args
@@ -0,0 +1,179 @@
+"""Reuse MySQL connections within a single backup run"""
+
+import logging
+import threading
+import MySQLdb
+from holland.lib.mysql.client.base import AutoMySQLClient, MySQLError, \
+                                          connection_args
+
+LOG = logging.getLogger(__name__)
+
+class ConnectionPool(object):
+    """A bounded pool of idle MySQL connections
+
+    Connections are opened with the options in ``config`` as they are
+    at the time a connection is needed, so a plugin may still change
+    ``config`` (for instance to point at a different socket) after the pool
+    is created.  Idle connections opened with different options are never
+    handed out.
+
+    Connections are checked with a ping before being reused.  At most
+    ``max_size`` idle connections are kept; connections returned beyond
+    that are closed.
+
+    Returned connections have any open transaction rolled back and any
+    table locks released before they are reused, and are closed if that
+    fails.  Other session state, such as session variables, is not reset.
+    """
+
+    def __init__(self, config, max_size=4):
+        self.config = config
+        self.max_size = max_size
+        self.opened = 0
+        self.reused = 0
+        self.closed = False
+        self._idle = []
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def client(self):
+        """Create a client that checks its connection out of this pool"""
+        return PooledMySQLClient(self)
+
+    def checkout(self):
+        """Check a connection out of this pool, opening a new connection
+        if no usable idle connection is available
+
+        :raises: `MySQLError` if a new connection cannot be opened
+        """
+        args = connection_args(self.config)
+        key = sorted(args.items())
+        while True:
+            self._lock.acquire()
+            try:
+                for idx, (idle_key, connection) in enumerate(self._idle):
+                    if idle_key == key:
+                        del self._idle[idx]
+                        break
+                else:
+                    connection = None
+            finally:
+                self._lock.release()
+            if connection is None:
+                break
+            try:
+                connection.ping()
+            except MySQLError:
+                LOG.debug("Discarding idle MySQL connection after failed ping")
+                self.discard(connection)
+                continue
+            self.reused += 1
+            return connection
+
+        connection = MySQLdb.connect(**args)
+        self._lock.acquire()
+        try:
+            self.opened += 1
+            self._keys[id(connection)] = key
+        finally:
+            self._lock.release()
+        return connection
+
+    def checkin(self, connection):
+        """Return a connection to this pool"""
+        try:
+            reset_session(connection)
+        except MySQLError, exc:
+            LOG.debug("Discarding MySQL connection that could not be "
+                      "reset: %s", exc)
+            self.discard(connection)
+            return
+        self._lock.acquire()
+        try:
+            if not self.closed and len(self._idle) < self.max_size:
+                self._idle.append((self._keys[id(connection)], connection))
+                return
+        finally:
+            self._lock.release()
+        self.discard(connection)
+
+    def discard(self, connection):
+        """Close a checked out connection rather than returning it"""
+        self._lock.acquire()
+        try:
+            self._keys.pop(id(connection), None)
+        finally:
+            self._lock.release()
+        try:
+            connection.close()
+        except MySQLError:
+            pass
+
+    def close(self):
+        """Close all idle connections
+
+        Connections checked out of a closed pool are closed when they are
+        returned.
+        """
+        self._lock.acquire()
+        try:
+            if self.closed:
+                return
+            self.closed = True
+            idle = self._idle
+            self._idle = []
+        finally:
+            self._lock.release()
+        for _, connection in idle:
+            self.discard(connection)
+        LOG.info("Opened %d MySQL connection(s) for this backup "
+                 "(reused %d time(s))", self.opened, self.reused)
+
+def reset_session(connection):
+    """Roll back any open transaction and release any table locks
+
+    :raises: `MySQLError` if the session cannot be reset
+    """
+    connection.rollback()
+    cursor = connection.cursor()
+    try:
+        cursor.execute('UNLOCK TABLES')
+    finally:
+        cursor.close()
+
+class PooledMySQLClient(AutoMySQLClient):
+    """A client connection backed by a `ConnectionPool`
+
+    connect() checks a connection out of the pool and disconnect() returns
+    it, rather than opening and closing a new MySQL session each time.
+    """
+
+    def __init__(self, pool):
+        self._connection = None
+        self._pool = pool
+        self.flush_variable_cache()
+
+    def connect(self):
+        """Check a connection out of the pool
+
+        :raises: `MySQLError`
+        """
+        self.disconnect()
+        self._connection = self._pool.checkout()
+        self.flush_variable_cache()
+
+    def disconnect(self):
+        """Return this instance's connection to the pool"""
+        connection = self._connection
+        self._connection = None
+        self.flush_variable_cache()
+        if connection is not None:
+            self._pool.checkin(connection)
+
+    def _reconnect(self):
+        """Close a connection that failed a ping and check out another,
+        rather than returning the broken connection to the pool"""
+        connection = self._connection
+        self._connection = None
+        self._pool.discard(connection)
+        self.connect()
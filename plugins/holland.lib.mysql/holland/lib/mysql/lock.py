@@ -0,0 +1,215 @@
+"""Acquire MySQL's global read lock without stalling the server
+
+FLUSH TABLES WITH READ LOCK has to wait for every running statement to
+finish, and while it waits every other session that wants to write - and,
+once tables are being flushed, every session that wants to open a table -
+queues up behind it.  A single long running SELECT can therefore stall an
+entire server.
+
+`GlobalReadLock` looks for long running statements before asking for the
+lock and deals with them according to a policy:
+
+ignore
+    lock immediately, as FLUSH TABLES WITH READ LOCK always has
+wait
+    wait up to ``max_wait`` seconds for long statements to finish
+kill
+    KILL QUERY any long running SELECT statements and wait for any other
+    long statements as with 'wait'
+abort
+    fail immediately if any long statements are running
+
+The lock itself is attempted with a short session lock_wait_timeout (MySQL
+5.5+) and retried, so that time spent blocking other sessions is bounded.
+"""
+
+import re
+import time
+import logging
+from holland.lib.mysql.client import MySQLError
+
+LOG = logging.getLogger(__name__)
+
+#: policies for dealing with long running statements before locking
+LOCK_WAIT_POLICIES = ('ignore', 'wait', 'kill', 'abort')
+
+#: ER_LOCK_WAIT_TIMEOUT
+LOCK_WAIT_TIMEOUT = 1205
+
+SELECT_CRE = re.compile(r'^\s*(?:/\*.*?\*/\s*)*\(*\s*SELECT\b', re.I | re.S)
+
+class LockError(Exception):
+    """Raised when the global read lock cannot be acquired under the
+    configured policy"""
+
+def long_queries(client, min_time):
+    """Find statements that have been running for at least min_time seconds
+
+    Replication and other system threads are never included.
+
+    :returns: list of SHOW FULL PROCESSLIST rows as dicts
+    """
+    own_id = client.thread_id()
+    result = []
+    for row in client.show_processlist():
+        if row['id'] == own_id or row['command'] != 'Query':
+            continue
+        if row['user'] == 'system user' or not row['info']:
+            continue
+        if row['time'] is None or int(row['time']) < min_time:
+            continue
+        result.append(row)
+    return result
+
+class GlobalReadLock(object):
+    """FLUSH TABLES WITH READ LOCK with a pre-lock phase and timing
+
+    After `acquire()` and `release()` the following attributes describe
+    what happened:
+
+    ``prelock_time``
+        seconds spent dealing with long running statements
+    ``wait_time``
+        seconds spent in FLUSH TABLES WITH READ LOCK, over all attempts
+    ``hold_time``
+        seconds the lock was held
+    ``attempts``
+        number of times the lock was requested
+    ``killed``
+        number of statements killed under the 'kill' policy
+    """
+
+    def __init__(self, client,
+                 policy='ignore',
+                 long_query_time=60,
+                 max_wait=300,
+                 lock_wait_timeout=0,
+                 retries=0,
+                 retry_interval=5,
+                 extra_flush=False):
+        if policy not in LOCK_WAIT_POLICIES:
+            raise ValueError("Invalid lock wait policy %r" % policy)
+        self.client = client
+        self.policy = policy
+        self.long_query_time = long_query_time
+        self.max_wait = max_wait
+        self.lock_wait_timeout = lock_wait_timeout
+        self.retries = retries
+        self.retry_interval = retry_interval
+        self.extra_flush = extra_flush
+        self.prelock_time = 0.0
+        self.wait_time = 0.0
+        self.hold_time = None
+        self.attempts = 0
+        self.killed = 0
+        self._locked_at = None
+
+    def check_long_queries(self):
+        """Apply this lock's policy to long running statements
+
+        :raises: `LockError` if long running statements remain
+        """
+        if self.policy == 'ignore':
+            return
+        start = time.time()
+        try:
+            self._check_long_queries()
+        finally:
+            self.prelock_time += time.time() - start
+
+    def _check_long_queries(self):
+        deadline = time.time() + self.max_wait
+        killed = {}
+        while True:
+            queries = long_queries(self.client, self.long_query_time)
+            if not queries:
+                return
+            for query in queries:
+                if query['id'] in killed:
+                    continue
+                LOG.info("Long running statement on thread %s (%ss): %s",
+                         query['id'], query['time'],
+                         query['info'][:256].replace('\n', ' '))
+                if self.policy == 'kill' and SELECT_CRE.match(query['info']):
+                    LOG.warning("Killing statement on thread %s", query['id'])
+                    try:
+                        self.client.kill_query(query['id'])
+                    except MySQLError, exc:
+                        # 1094 = Unknown thread id, it finished on its own
+                        if exc.args[0] != 1094:
+                            raise
+                    self.killed += 1
+                killed[query['id']] = True
+            if self.policy == 'abort':
+                raise LockError("%d statement(s) running longer than %ds. "
+                                "Not attempting to lock." %
+                                (len(queries), self.long_query_time))
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise LockError("%d statement(s) still running after "
+                                "waiting %ds to lock" %
+                                (len(queries), self.max_wait))
+            time.sleep(min(remaining, 1))
+
+    def acquire(self):
+        """Acquire the global read lock
+
+        :raises: `LockError` or MySQLError
+        """
+        self.check_long_queries()
+        original_timeout = None
+        if self.lock_wait_timeout and \
+                self.client.server_version() >= (5, 5, 0):
+            original_timeout = self.client.show_variable('lock_wait_timeout',
+                                                         session=True)
+            self.client.set_variable('lock_wait_timeout',
+                                     self.lock_wait_timeout)
+        try:
+            if self.extra_flush:
+                LOG.debug("Executing FLUSH TABLES")
+                self.client.flush_tables()
+            while True:
+                self.attempts += 1
+                start = time.time()
+                try:
+                    LOG.debug("Executing FLUSH TABLES WITH READ LOCK")
+                    self.client.flush_tables_with_read_lock()
+                    self.wait_time += time.time() - start
+                    break
+                except MySQLError, exc:
+                    self.wait_time += time.time() - start
+                    if exc.args[0] != LOCK_WAIT_TIMEOUT or \
+                            self.attempts > self.retries:
+                        raise
+                    LOG.warning("Timed out waiting %ds for the global read "
+                                "lock. Retrying in %ds (attempt %d of %d)",
+                                self.lock_wait_timeout, self.retry_interval,
+                                self.attempts + 1, self.retries + 1)
+                time.sleep(self.retry_interval)
+                self.check_long_queries()
+        finally:
+            if original_timeout is not None:
+                self.client.set_variable('lock_wait_timeout',
+                                         int(original_timeout))
+        self._locked_at = time.time()
+        LOG.info("Acquired global read lock in %.3fs (%d attempt(s))",
+                 self.wait_time, self.attempts)
+
+    def release(self):
+        """Release the global read lock"""
+        self.client.unlock_tables()
+        if self._locked_at is not None:
+            self.hold_time = time.time() - self._locked_at
+            self._locked_at = None
+            LOG.info("Held global read lock for %.3fs", self.hold_time)
+
+    def record(self, section):
+        """Record lock timings in a config section"""
+        section['lock-wait-policy'] = self.policy
+        section['prelock-seconds'] = '%.3f' % self.prelock_time
+        section['long-queries-killed'] = str(self.killed)
+        if self.attempts:
+            section['lock-wait-seconds'] = '%.3f' % self.wait_time
+            section['lock-attempts'] = str(self.attempts)
+        if self.hold_time is not None:
+            section['lock-hold-seconds'] = '%.3f' % self.hold_time
@@ -1,7 +1,9 @@
 """Summarize a MySQL Schema"""
 
 import time
+import fnmatch
 import logging
+from array import array
 from holland.lib.mysql.client import MySQLError
 
 LOG = logging.getLogger(__name__)
@@ -16,17 +18,26 @@ class MySQLSchema(object):
 
     def __init__(self):
         self.databases = []
+        self.catalog = TableCatalog()
         self._database_filters = []
         self._table_filters = []
         self._engine_filters = []
         self.timestamp = None
+        #: database name => size from `set_database_sizes`
+        self.database_sizes = None
+
+    def tables(self):
+        """Iterate over all tables in this schema"""
+        for database in self.databases:
+            for table in database.tables:
+                yield table
+    tables = property(tables)
 
     def excluded_tables(self):
         """Iterate over tables excluded in this schema"""
         for database in self.databases:
-            for table in database:
-                if table.excluded:
-                    yield table
+            for table in database.excluded_tables():
+                yield table
     excluded_tables = property(excluded_tables)
 
     def excluded_databases(self):
@@ -100,6 +111,40 @@ class MySQLSchema(object):
             if _filter(name):
                 return True
 
+    def has_table_filters(self):
+        """Check if any table or engine filters would exclude tables
+
+        The default filters set up by a plugin - include '*.*' tables and
+        '*' engines and exclude nothing - never exclude anything, so
+        callers may skip per-table lookups entirely when this returns
+        False.
+
+        :returns: True if tables must be examined individually
+        """
+        default_filters = [
+            (self._table_filters, fnmatch.translate('*.*')),
+            (self._engine_filters, fnmatch.translate('*')),
+        ]
+        for filters, include_all in default_filters:
+            if len(filters) != 2:
+                return True
+            include, exclude = filters
+            if include.patterns != [include_all] or exclude.patterns:
+                return True
+        return False
+
+    def set_database_sizes(self, sizes):
+        """Record per-database sizes summarized without table metadata
+
+        Databases found by a later `refresh` report these sizes, so size
+        based decisions still work when tables are not iterated.  Only
+        meaningful when there are no table or engine filters.
+
+        :param sizes: list of (database, size) tuples, as returned by
+                      MySQLClient.show_database_sizes
+        """
+        self.database_sizes = dict(sizes)
+
     def refresh(self, db_iter, tbl_iter, fast_iterate=False):
         """Summarize the schema by walking over the given database and table
         iterators
@@ -118,23 +163,24 @@ class MySQLSchema(object):
                              exclude pattern = ''
         """
         for database in db_iter():
+            if database.catalog is None:
+                database.catalog = self.catalog
             self.databases.append(database)
             if self.is_db_filtered(database.name):
                 database.excluded = True
                 continue
+            if self.database_sizes is not None and \
+               not self.has_table_filters():
+                database.estimated_size = self.database_sizes.get(
+                                                database.name, 0)
 
             # skip iterating over tables when:
             # 1) we are matching all tables (using default pattern)
             # 2) we are matching all engines (using default pattern)
             # 3) caller does not require table iteration
-            if fast_iterate and (len(self._table_filters) == 2 and
-                self._table_filters[0].patterns == ['.*\\..*$'] and
-                self._table_filters[1].patterns == []) and \
-                (len(self._engine_filters) == 2 and
-                self._engine_filters[0].patterns == ['.*$'] and
-                self._engine_filters[1].patterns == []):
-                    # optimize case where we have no table level filters
-                    continue
+            if fast_iterate and not self.has_table_filters():
+                # optimize case where we have no table level filters
+                continue
 
             try:
                 for table in tbl_iter(database.name):
@@ -152,33 +198,155 @@ class MySQLSchema(object):
         self.timestamp = time.time()
 
 
+class Bitmap(object):
+    """A growable array of bits, all initially unset"""
+
+    __slots__ = ('_bytes',)
+
+    def __init__(self):
+        self._bytes = array('B')
+
+    def __getitem__(self, index):
+        byte = index >> 3
+        if byte >= len(self._bytes):
+            return False
+        return bool(self._bytes[byte] & (1 << (index & 7)))
+
+    def __setitem__(self, index, flag):
+        byte = index >> 3
+        if byte >= len(self._bytes):
+            if not flag:
+                return
+            self._bytes.extend([0]*(byte - len(self._bytes) + 1))
+        if flag:
+            self._bytes[byte] |= 1 << (index & 7)
+        else:
+            self._bytes[byte] &= ~(1 << (index & 7)) & 0xff
+
+
+class TableCatalog(object):
+    """Columnar storage for table metadata
+
+    Each table is a row number into a set of parallel arrays rather than a
+    Python object of its own, which keeps the memory used by an instance
+    with millions of tables down to a few dozen bytes per table:
+
+    * database and table names are interned, so the same table name used in
+      many databases is only stored once
+    * storage engines are stored as a small integer code into ``engines``
+    * data and index sizes are stored in typed arrays
+    * the excluded flag is a single bit
+
+    `Database` and `TableView` instances are views over the rows in a
+    catalog.
+    """
+
+    def __init__(self):
+        self.databases = []
+        self.engines = []
+        self._database_codes = {}
+        self._engine_codes = {}
+        self._strings = {}
+        self.database_ids = array('I')
+        self.names = []
+        self.data_sizes = array('d')
+        self.index_sizes = array('d')
+        self.engine_ids = array('H')
+        self.excluded = Bitmap()
+        #: incremented whenever a row is added or excluded so that views can
+        #: tell whether anything they computed is out of date
+        self.generation = 0
+
+    def intern(self, value):
+        """Return a shared copy of the string ``value``"""
+        return self._strings.setdefault(value, value)
+
+    def _code(self, codes, names, value):
+        """Map ``value`` to its index in ``names``, adding it if needed"""
+        try:
+            return codes[value]
+        except KeyError:
+            names.append(self.intern(value))
+            codes[value] = len(names) - 1
+            return codes[value]
+
+    def append(self, database, name, data_size, index_size, engine,
+               excluded=False):
+        """Add a table to this catalog
+
+        :returns: the row number of the new table
+        """
+        row = len(self.names)
+        self.database_ids.append(self._code(self._database_codes,
+                                            self.databases,
+                                            database))
+        self.names.append(self.intern(name))
+        self.data_sizes.append(int(data_size))
+        self.index_sizes.append(int(index_size))
+        self.engine_ids.append(self._code(self._engine_codes,
+                                          self.engines,
+                                          engine))
+        if excluded:
+            self.excluded[row] = True
+        self.generation += 1
+        return row
+
+    def set_excluded(self, row, flag):
+        """Flag the table at ``row`` as excluded or not"""
+        self.excluded[row] = flag
+        self.generation += 1
+
+    def __len__(self):
+        return len(self.names)
+
+
 class Database(object):
     """Representation of a MySQL Database
 
     Only the name an whether this database is
     excluded is recorded"""
 
-    __slots__ = ('name', 'excluded', 'tables')
+    __slots__ = ('name', 'excluded', 'catalog', 'estimated_size',
+                 '_rows', '_size')
 
-    def __init__(self, name):
+    def __init__(self, name, catalog=None):
         self.name = name
-        self.tables  = []
         self.excluded = False
+        self.catalog = catalog
+        #: size from MySQLSchema.set_database_sizes, used instead of the
+        #: table metadata when set
+        self.estimated_size = None
+        self._rows = array('I')
+        self._size = (None, 0)
 
     def add_table(self, tableobj):
         """Add the table object to this database
 
         :param tableobj: `Table` instance that should be added to this
-                         `Database` instance
+                         `Database` instance.  The table's metadata is
+                         copied into this database's catalog.
         """
-        self.tables.append(tableobj)
+        if self.catalog is None:
+            self.catalog = TableCatalog()
+        self._rows.append(self.catalog.append(tableobj.database,
+                                              tableobj.name,
+                                              tableobj.data_size,
+                                              tableobj.index_size,
+                                              tableobj.engine,
+                                              tableobj.excluded))
+
+    def tables(self):
+        """Sequence of `TableView` instances over the tables in this
+        database"""
+        return TableList(self.catalog, self._rows)
+    tables = property(tables)
 
     def excluded_tables(self):
         """List tables associated with this database that are flagged as
         excluded"""
-        for tableobj in self.tables:
-            if tableobj.excluded:
-                yield tableobj
+        for row in self._rows:
+            if self.catalog.excluded[row]:
+                yield TableView(self.catalog, row)
 
     def is_transactional(self):
         """Check if this database is safe to dump in --single-transaction
@@ -194,18 +362,82 @@ class Database(object):
         :returns: int. sum of all data and indexes of tables that are not
                   excluded from this database
         """
-        return sum([table.size for table in self.tables
-                    if not table.excluded
-                        and table.engine not in ('mrg_myisam', 'federated') ])
+        if self.estimated_size is not None:
+            return self.estimated_size
+        catalog = self.catalog
+        if catalog is None:
+            return 0
+        generation, size = self._size
+        if generation == catalog.generation:
+            return size
+        skip = [idx for idx, engine in enumerate(catalog.engines)
+                if engine in ('mrg_myisam', 'federated')]
+        excluded = catalog.excluded
+        data_sizes = catalog.data_sizes
+        index_sizes = catalog.index_sizes
+        engine_ids = catalog.engine_ids
+        size = 0
+        for row in self._rows:
+            if excluded[row] or engine_ids[row] in skip:
+                continue
+            size += data_sizes[row] + index_sizes[row]
+        size = int(size)
+        self._size = (catalog.generation, size)
+        return size
     size = property(size)
 
     def __str__(self):
         return "Database(name=%r, table_count=%d, excluded=%r)" % \
-                (self.name, len(self.tables), self.excluded)
+                (self.name, len(self._rows), self.excluded)
 
     __repr__ = __str__
 
-class Table(object):
+class TableList(object):
+    """Read-only sequence of `TableView` instances over rows in a
+    `TableCatalog`"""
+
+    __slots__ = ('catalog', 'rows')
+
+    def __init__(self, catalog, rows):
+        self.catalog = catalog
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return TableView(self.catalog, self.rows[index])
+
+    def __iter__(self):
+        catalog = self.catalog
+        for row in self.rows:
+            yield TableView(catalog, row)
+
+class _TableInfo(object):
+    """Properties derived from a table's metadata"""
+
+    __slots__ = ()
+
+    def size(self):
+        return self.data_size + self.index_size
+    size = property(size)
+
+    def is_transactional(self):
+        return self.engine in TRANSACTIONAL_ENGINES
+    is_transactional = property(is_transactional)
+
+    def __str__(self):
+        return "%sTable(name=%r, data_size=%s, " + \
+               "index_size=%s, engine=%s, txn=%s)" % \
+                (self.excluded and "[EXCL]" or "",
+                 self.name,
+                 "%.2fMB" % (self.data_size / 1024.0**2),
+                 "%.2fMB" % (self.index_size / 1024.0**2),
+                 self.engine,
+                 str(self.is_transactional)
+                )
+
+class Table(_TableInfo):
     """Representation of a MySQL Table
 
     """
@@ -214,7 +446,6 @@ class Table(object):
                  'data_size',
                  'index_size',
                  'engine',
-                 'is_transactional',
                  'excluded',
                 )
 
@@ -230,24 +461,44 @@ class Table(object):
         self.engine = engine
         self.excluded = False
 
-    def size(self):
-        return self.data_size + self.index_size
-    size = property(size)
+class TableView(_TableInfo):
+    """A table stored as a row in a `TableCatalog`
 
-    def is_transactional(self):
-        return self.engine in TRANSACTIONAL_ENGINES
-    is_transactional = property(is_transactional)
+    This has the same attributes as a `Table`.  Setting ``excluded`` updates
+    the catalog.
+    """
+    __slots__ = ('catalog', 'row')
 
-    def __str__(self):
-        return "%sTable(name=%r, data_size=%s, " + \
-               "index_size=%s, engine=%s, txn=%s)" % \
-                (self.excluded and "[EXCL]" or "",
-                 self.name,
-                 "%.2fMB" % (self.data_size / 1024.0**2),
-                 "%.2fMB" % (self.index_size / 1024.0**2),
-                 self.engine,
-                 str(self.is_transactional)
-                )
+    def __init__(self, catalog, row):
+        self.catalog = catalog
+        self.row = row
+
+    def database(self):
+        return self.catalog.databases[self.catalog.database_ids[self.row]]
+    database = property(database)
+
+    def name(self):
+        return self.catalog.names[self.row]
+    name = property(name)
+
+    def data_size(self):
+        return int(self.catalog.data_sizes[self.row])
+    data_size = property(data_size)
+
+    def index_size(self):
+        return int(self.catalog.index_sizes[self.row])
+    index_size = property(index_size)
+
+    def engine(self):
+        return self.catalog.engines[self.catalog.engine_ids[self.row]]
+    engine = property(engine)
+
+    def _get_excluded(self):
+        return self.catalog.excluded[self.row]
+
+    def _set_excluded(self, flag):
+        self.catalog.set_excluded(self.row, flag)
+    excluded = property(_get_excluded, _set_excluded)
 
 class DatabaseIterator(object):
     """Iterate over databases returns by a MySQLClient instance
@@ -0,0 +1,166 @@
+"""
+Test MySQLClient query helpers against a fake MySQLdb connection
+"""
+
+from nose.tools import *
+from holland.lib.mysql.client import base
+from holland.lib.mysql.client.base import PassiveMySQLClient, MySQLError
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, sql, args=()):
+        self.connection.queries.append((sql, tuple(args)))
+        self.rows = self.connection.respond(sql, tuple(args))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+class FakeConnection(object):
+    def __init__(self, *args, **kwargs):
+        self.queries = []
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def respond(self, sql, args):
+        return []
+
+    def close(self):
+        self.closed = True
+
+class VariablesConnection(FakeConnection):
+    VARIABLES = {
+        'port' : '3306',
+        'max_connections' : '151',
+    }
+    #: error code to fail SHOW VARIABLES ... WHERE with
+    where_error = None
+
+    def respond(self, sql, args):
+        if 'WHERE' in sql:
+            if self.where_error:
+                raise MySQLError(self.where_error, "Syntax error")
+            names = args
+        elif sql.startswith('SET'):
+            name, value = sql.split()[2], sql.split()[-1]
+            self.VARIABLES = dict(self.VARIABLES)
+            self.VARIABLES[name] = value.strip("'")
+            return []
+        else:
+            names = args
+        return [(name, self.VARIABLES[name]) for name in names
+                if name in self.VARIABLES]
+
+    def get_server_info(self):
+        self.queries.append(('get_server_info', ()))
+        return '5.7.30-log'
+
+class OldServerConnection(VariablesConnection):
+    where_error = 1064
+
+class ColumnsConnection(FakeConnection):
+    COLUMNS = {
+        ('test', 't1') : [('a', 'int(11)'), ('b', 'text')],
+        ('test', 't2') : [('c', 'int(11)')],
+        ('other', 't1') : [('d', 'date')],
+    }
+
+    def respond(self, sql, args):
+        schema, names = args[0], args[1:]
+        rows = []
+        for name in sorted(names):
+            for column, column_type in self.COLUMNS.get((schema, name), []):
+                rows.append((name, column, column_type))
+        return rows
+
+def connected_client(connection_class):
+    real_connect = base.MySQLdb.connect
+    base.MySQLdb.connect = connection_class
+    try:
+        client = PassiveMySQLClient()
+        client.connect()
+    finally:
+        base.MySQLdb.connect = real_connect
+    return client
+
+def test_show_table_columns():
+    client = connected_client(ColumnsConnection)
+    tables = [('test', 't1'), ('test', 't2'), ('other', 't1'),
+              ('test', 'missing')]
+    eq_(client.show_table_columns(tables), {
+        ('test', 't1') : [('a', 'int(11)'), ('b', 'text')],
+        ('test', 't2') : [('c', 'int(11)')],
+        ('other', 't1') : [('d', 'date')],
+    })
+    # one query per schema
+    eq_([args for sql, args in client._connection.queries],
+        [('other', 't1'), ('test', 'missing', 't1', 't2')])
+
+def test_show_table_columns_batches():
+    client = connected_client(ColumnsConnection)
+    tables = [('test', 't%d' % idx) for idx in range(5)]
+    result = client.show_table_columns(tables, batch_size=2)
+    eq_(sorted(result), [('test', 't1'), ('test', 't2')])
+    eq_([args for sql, args in client._connection.queries],
+        [('test', 't0', 't1'), ('test', 't2', 't3'), ('test', 't4')])
+
+def test_show_variables_memoized():
+    client = connected_client(VariablesConnection)
+    eq_(client.show_variables(['port', 'nosuchvar']),
+        {'port' : '3306', 'nosuchvar' : None})
+    eq_(len(client._connection.queries), 1)
+    # a second lookup, including of a missing variable, issues no query
+    eq_(client.show_variable('port'), '3306')
+    eq_(client.show_variable('nosuchvar'), None)
+    eq_(len(client._connection.queries), 1)
+    # only variables not seen before are queried
+    eq_(client.show_variables(['port', 'max_connections']),
+        {'port' : '3306', 'max_connections' : '151'})
+    eq_(client._connection.queries[-1][1], ('max_connections',))
+
+def test_set_variable_requeries():
+    client = connected_client(VariablesConnection)
+    client.show_variable('max_connections', session=False)
+    queries = len(client._connection.queries)
+    eq_(client.set_variable('max_connections', 200, session=False), '200')
+    # the SET and a fresh SHOW VARIABLES
+    eq_(len(client._connection.queries), queries + 2)
+
+def test_reconnect_flushes_variables():
+    real_connect = base.MySQLdb.connect
+    base.MySQLdb.connect = VariablesConnection
+    try:
+        client = PassiveMySQLClient()
+        client.connect()
+        client.show_variable('port')
+        eq_(client.server_version(), (5, 7, 30))
+        client.server_version()
+        eq_(len(client._connection.queries), 2)
+        client.disconnect()
+        client.connect()
+        client.show_variable('port')
+        client.server_version()
+        eq_(len(client._connection.queries), 2)
+    finally:
+        base.MySQLdb.connect = real_connect
+
+def test_show_variables_like_fallback():
+    client = connected_client(OldServerConnection)
+    eq_(client.show_variables(['port', 'max_connections']),
+        {'port' : '3306', 'max_connections' : '151'})
+    eq_([args for sql, args in client._connection.queries],
+        [('port', 'max_connections'), ('port',), ('max_connections',)])
+    ok_('LIKE' in client._connection.queries[-1][0])
+
+def test_show_variables_other_errors():
+    class BrokenConnection(VariablesConnection):
+        where_error = 1142
+    client = connected_client(BrokenConnection)
+    assert_raises(MySQLError, client.show_variables, ['port'])
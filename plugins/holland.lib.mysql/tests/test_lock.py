@@ -0,0 +1,100 @@
+"""
+Test the global read lock pre-lock phase
+"""
+
+from nose.tools import *
+from MySQLdb import OperationalError
+from holland.lib.mysql.lock import GlobalReadLock, LockError
+
+class FakeClient(object):
+    def __init__(self, processlist, lock_timeouts=0):
+        self.processlist = processlist
+        self.lock_timeouts = lock_timeouts
+        self.log = []
+
+    def thread_id(self):
+        return 1
+
+    def show_processlist(self):
+        return list(self.processlist)
+
+    def kill_query(self, thread_id):
+        self.log.append(('kill', thread_id))
+        self.processlist = [row for row in self.processlist
+                            if row['id'] != thread_id]
+
+    def server_version(self):
+        return (5, 5, 30)
+
+    def show_variable(self, key, session=False):
+        return '31536000'
+
+    def set_variable(self, key, value, session=True):
+        self.log.append(('set', key, value))
+
+    def flush_tables(self):
+        self.log.append('flush')
+
+    def flush_tables_with_read_lock(self):
+        if self.lock_timeouts:
+            self.lock_timeouts -= 1
+            raise OperationalError(1205, 'Lock wait timeout exceeded')
+        self.log.append('lock')
+
+    def unlock_tables(self):
+        self.log.append('unlock')
+
+def _query(thread_id, info, seconds, user='app'):
+    return dict(id=thread_id, user=user, command='Query',
+                info=info, time=seconds)
+
+PROCESSLIST = [
+    _query(1, 'SHOW FULL PROCESSLIST', 0),
+    _query(5, 'SELECT * FROM big', 600),
+    _query(6, 'UPDATE t SET a = 1', 1),
+    _query(7, 'replaying', 900, user='system user'),
+]
+
+def test_ignore():
+    client = FakeClient(PROCESSLIST)
+    lock = GlobalReadLock(client)
+    lock.acquire()
+    lock.release()
+    eq_(client.log, ['lock', 'unlock'])
+    ok_(lock.hold_time is not None)
+
+def test_abort():
+    client = FakeClient(PROCESSLIST)
+    lock = GlobalReadLock(client, policy='abort')
+    assert_raises(LockError, lock.acquire)
+    eq_(client.log, [])
+
+def test_kill_and_retry():
+    client = FakeClient(PROCESSLIST, lock_timeouts=1)
+    lock = GlobalReadLock(client, policy='kill', lock_wait_timeout=5,
+                          retries=1, retry_interval=0)
+    lock.acquire()
+    eq_(client.log, [('kill', 5),
+                     ('set', 'lock_wait_timeout', 5),
+                     'lock',
+                     ('set', 'lock_wait_timeout', 31536000)])
+    eq_(lock.attempts, 2)
+    eq_(lock.killed, 1)
+    section = {}
+    lock.record(section)
+    eq_(section['lock-attempts'], '2')
+    ok_('lock-hold-seconds' not in section)
+
+def test_kill_skips_writes():
+    processlist = [_query(8, 'INSERT INTO t SELECT * FROM big', 600)]
+    client = FakeClient(processlist)
+    lock = GlobalReadLock(client, policy='kill', max_wait=0)
+    assert_raises(LockError, lock.acquire)
+    eq_(client.log, [])
+
+def test_retries_exhausted():
+    client = FakeClient([], lock_timeouts=2)
+    lock = GlobalReadLock(client, lock_wait_timeout=1,
+                          retries=1, retry_interval=0)
+    assert_raises(OperationalError, lock.acquire)
+    eq_(lock.attempts, 2)
@@ -0,0 +1,106 @@
+"""
+Test connection reuse by ConnectionPool
+"""
+
+from nose.tools import *
+from holland.lib.mysql import MySQLError
+from holland.lib.mysql.client import pool
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql):
+        if self.connection.broken:
+            raise MySQLError(2006, 'MySQL server has gone away')
+        self.connection.statements.append(sql)
+
+    def close(self):
+        pass
+
+class FakeConnection(object):
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.broken = False
+        self.closed = False
+        self.statements = []
+
+    def ping(self):
+        if self.broken:
+            raise MySQLError(2006, 'MySQL server has gone away')
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if self.broken:
+            raise MySQLError(2006, 'MySQL server has gone away')
+        self.statements.append('ROLLBACK')
+
+    def close(self):
+        self.closed = True
+
+def setup():
+    global real_connect
+    real_connect = pool.MySQLdb.connect
+    pool.MySQLdb.connect = FakeConnection
+
+def teardown():
+    pool.MySQLdb.connect = real_connect
+
+def test_reuse():
+    connections = pool.ConnectionPool({'user' : 'root'})
+    client = connections.client()
+    client.connect()
+    connection = client._connection
+    client.disconnect()
+    client.connect()
+    ok_(client._connection is connection)
+    eq_((connections.opened, connections.reused), (1, 1))
+    client.disconnect()
+
+def test_checkin_resets_session():
+    connections = pool.ConnectionPool({'user' : 'root'})
+    client = connections.client()
+    client.connect()
+    connection = client._connection
+    client.disconnect()
+    eq_(connection.statements, ['ROLLBACK', 'UNLOCK TABLES'])
+
+def test_reconnect_discards_broken_connection():
+    connections = pool.ConnectionPool({'user' : 'root'})
+    client = connections.client()
+    client.connect()
+    broken = client._connection
+    broken.broken = True
+    # attributes of the underlying connection are looked up after a ping
+    client.cursor()
+    ok_(client._connection is not broken)
+    ok_(broken.closed)
+    eq_(connections._idle, [])
+    client.disconnect()
+    eq_(len(connections._idle), 1)
+    ok_(connections._idle[0][1] is not broken)
+
+def test_unresettable_connection_is_closed():
+    connections = pool.ConnectionPool({'user' : 'root'})
+    client = connections.client()
+    client.connect()
+    connection = client._connection
+    connection.broken = True
+    client.disconnect()
+    ok_(connection.closed)
+    eq_(connections._idle, [])
+
+def test_max_size_and_close():
+    connections = pool.ConnectionPool({'user' : 'root'}, max_size=1)
+    clients = [connections.client() for _ in range(2)]
+    for client in clients:
+        client.connect()
+    opened = [client._connection for client in clients]
+    for client in clients:
+        client.disconnect()
+    eq_(len(connections._idle), 1)
+    ok_(opened[1].closed)
+    connections.close()
+    ok_(opened[0].closed)
@@ -0,0 +1,110 @@
+"""
+Test the columnar schema model
+"""
+
+import os
+import sys
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+from holland.lib.mysql.schema.base import MySQLSchema, Database, Table, \
+                                          TableCatalog, Bitmap
+from holland.lib.mysql.schema.filter import include_glob, exclude_glob, \
+                                            include_glob_qualified, \
+                                            exclude_glob_qualified
+
+def test_bitmap():
+    bitmap = Bitmap()
+    assert_false(bitmap[100])
+    bitmap[9] = True
+    bitmap[100] = True
+    ok_(bitmap[9])
+    ok_(bitmap[100])
+    assert_false(bitmap[8])
+    bitmap[9] = False
+    assert_false(bitmap[9])
+    bitmap[5000] = False
+    assert_false(bitmap[5000])
+
+def test_table_views():
+    catalog = TableCatalog()
+    db = Database('db1', catalog)
+    db.add_table(Table('db1', 't1', 1024, 512, 'innodb'))
+    db.add_table(Table('db1', 't2', 2048, 0, 'myisam'))
+    db.add_table(Table('db1', 'm1', 4096, 0, 'mrg_myisam'))
+    eq_(len(db.tables), 3)
+    eq_([t.name for t in db.tables], ['t1', 't2', 'm1'])
+    table = db.tables[1]
+    eq_(table.database, 'db1')
+    eq_(table.engine, 'myisam')
+    eq_(table.size, 2048)
+    assert_false(table.is_transactional)
+    eq_(db.size, 1024 + 512 + 2048)
+    table.excluded = True
+    ok_(db.tables[1].excluded)
+    eq_([t.name for t in db.excluded_tables()], ['t2'])
+    eq_(db.size, 1024 + 512)
+
+def test_names_are_interned():
+    catalog = TableCatalog()
+    for idx in range(10):
+        catalog.append('db%d' % idx, ''.join(['use', 'rs']), 0, 0, 'innodb')
+    for name in catalog.names:
+        ok_(name is catalog.names[0])
+    eq_(len(catalog.databases), 10)
+    eq_(catalog.engines, ['innodb'])
+
+class FakeDatabaseIterator(object):
+    def __init__(self, count):
+        self.count = count
+
+    def __call__(self):
+        for idx in xrange(self.count):
+            yield Database('tenant%05d' % idx)
+
+class FakeTableIterator(object):
+    def __init__(self, count):
+        self.count = count
+
+    def __call__(self, database):
+        for idx in xrange(self.count):
+            yield Table(database, 'table%03d' % idx, 16384, 8192, 'innodb')
+
+def test_database_sizes_without_tables():
+    schema = MySQLSchema()
+    schema.add_table_filter(include_glob_qualified('*.*'))
+    schema.add_table_filter(exclude_glob_qualified())
+    schema.add_engine_filter(include_glob('*'))
+    schema.add_engine_filter(exclude_glob())
+    schema.set_database_sizes([('tenant00000', 4096), ('tenant00001', 0)])
+    schema.refresh(db_iter=FakeDatabaseIterator(3),
+                   tbl_iter=FakeTableIterator(0),
+                   fast_iterate=True)
+    eq_([db.size for db in schema.databases], [4096, 0, 0])
+
+def catalog_size(catalog):
+    """Approximate number of bytes used by a catalog"""
+    total = 0
+    for column in (catalog.databases, catalog.engines, catalog.names,
+                   catalog.database_ids, catalog.data_sizes,
+                   catalog.index_sizes, catalog.engine_ids,
+                   catalog.excluded._bytes):
+        total += sys.getsizeof(column)
+    for value in catalog._strings:
+        total += sys.getsizeof(value)
+    return total
+
+def test_memory_1m_tables():
+    """Memory benchmark for a schema of 1M tables
+
+    This takes a while, so only runs with HOLLAND_BENCHMARKS=1 set.
+    """
+    if not os.environ.get('HOLLAND_BENCHMARKS'):
+        raise SkipTest("set HOLLAND_BENCHMARKS=1 to run benchmarks")
+    schema = MySQLSchema()
+    schema.refresh(db_iter=FakeDatabaseIterator(10000),
+                   tbl_iter=FakeTableIterator(100))
+    eq_(len(schema.catalog), 1000000)
+    size = catalog_size(schema.catalog)
+    # one object per table used ~300 bytes per table
+    ok_(size < 1000000 * 64)
+    eq_(sum([db.size for db in schema.databases]), 1000000 * (16384 + 8192))
@@ -0,0 +1,47 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from holland.core.util.path import directory_size, estimate_size
+
+class TestEstimateSize(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.total = 0
+        for top in range(3):
+            for sub in range(20):
+                path = os.path.join(self.tmpdir, 'd%d' % top, 's%d' % sub)
+                os.makedirs(path)
+                for idx in range(5):
+                    data = 'x' * (100 + idx)
+                    open(os.path.join(path, 'f%d' % idx), 'w').write(data)
+                    self.total += len(data)
+        os.symlink(os.path.join(self.tmpdir, 'd0', 's0', 'f0'),
+                   os.path.join(self.tmpdir, 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_exact(self):
+        self.assertEqual(estimate_size(self.tmpdir, workers=1), self.total)
+        self.assertEqual(estimate_size(self.tmpdir, workers=4), self.total)
+        self.assertEqual(directory_size(self.tmpdir), self.total)
+
+    def test_newer_than(self):
+        self.assertEqual(estimate_size(self.tmpdir,
+                                       newer_than=time.time() + 60), 0)
+        since = time.time()
+        time.sleep(0.05)
+        open(os.path.join(self.tmpdir, 'd1', 's1', 'new'), 'w').write('y' * 7)
+        self.assertEqual(estimate_size(self.tmpdir, newer_than=since), 7)
+
+    def test_sample(self):
+        estimate = estimate_size(self.tmpdir, sample=0.5, seed=1)
+        self.assertEqual(estimate, estimate_size(self.tmpdir, sample=0.5,
+                                                 seed=1))
+        self.assert_(0 < estimate < self.total * 3)
+        self.assertRaises(ValueError, estimate_size, self.tmpdir, sample=0)
+
+    def test_missing(self):
+        self.assertEqual(directory_size(os.path.join(self.tmpdir, 'none')), 0)
@@ -0,0 +1,63 @@
+import os
+import time
+import signal
+import unittest
+from subprocess import Popen
+from holland.core.util.process import ProcessSupervisor
+
+class TestProcessSupervisor(unittest.TestCase):
+    def test_wait_returns_on_exit(self):
+        supervisor = ProcessSupervisor(max_interval=30)
+        process = Popen(['sleep', '0.2'])
+        start = time.time()
+        self.assertTrue(supervisor.wait([process]))
+        # woken by SIGCHLD rather than the 30s safety interval
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(process.returncode, 0)
+
+    def test_wait_timeout(self):
+        supervisor = ProcessSupervisor()
+        process = Popen(['sleep', '10'])
+        try:
+            self.assertFalse(supervisor.wait([process], timeout=0.1))
+        finally:
+            os.kill(process.pid, signal.SIGKILL)
+            process.wait()
+
+    def test_interrupted(self):
+        pending = []
+        def trap(signum, frame):
+            pending.append(signum)
+        previous = signal.signal(signal.SIGUSR1, trap)
+        supervisor = ProcessSupervisor(lambda: pending, max_interval=30)
+        process = Popen(['sleep', '10'])
+        killer = Popen(['sh', '-c', 'sleep 0.2; kill -USR1 %d' % os.getpid()])
+        try:
+            start = time.time()
+            self.assertFalse(supervisor.wait([process]))
+            self.assertTrue(time.time() - start < 5)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+            os.kill(process.pid, signal.SIGKILL)
+            process.wait()
+            killer.wait()
+
+    def test_wait_for(self):
+        supervisor = ProcessSupervisor()
+        calls = []
+        def ready():
+            calls.append(True)
+            return len(calls) == 3
+        self.assertTrue(supervisor.wait_for(ready))
+        self.assertEqual(len(calls), 3)
+
+    def test_wait_for_process_exit(self):
+        supervisor = ProcessSupervisor()
+        process = Popen(['true'])
+        self.assertFalse(supervisor.wait_for(lambda: False, [process],
+                                             timeout=10))
+
+    def test_restores_sigchld(self):
+        supervisor = ProcessSupervisor()
+        supervisor.wait([Popen(['true'])])
+        self.assertEqual(signal.getsignal(signal.SIGCHLD), signal.SIG_DFL)
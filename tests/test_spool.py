@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+from holland.core.spool import Backup, Backupset, previous_backups
+
+class TestPreviousBackups(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.backups = []
+        for idx in range(3):
+            name = '2016010%d_000000' % idx
+            path = os.path.join(self.tmpdir, 'default', name)
+            os.makedirs(path)
+            backup = Backup(path, 'default', name)
+            backup.config['holland:backup']['start-time'] = 1000.0 + idx
+            backup.flush()
+            self.backups.append(backup)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_newest_first(self):
+        result = [backup.path for backup in
+                  previous_backups(self.backups[-1].path)]
+        self.assertEqual(result, [self.backups[1].path, self.backups[0].path])
+
+    def test_excludes_current_backup(self):
+        result = [backup.path for backup in
+                  previous_backups(self.backups[0].path)]
+        self.assertEqual(result, [self.backups[2].path, self.backups[1].path])
+
+    def test_is_failed(self):
+        backup = self.backups[0]
+        cfg = backup.config['holland:backup']
+        # never recorded a stop-time, so it did not finish
+        self.assertTrue(backup.is_failed())
+        cfg['stop-time'] = 2000.0
+        self.assertFalse(backup.is_failed())
+        cfg['failed'] = True
+        self.assertTrue(backup.is_failed())
+
+class TestChainAwarePurge(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.backupset = Backupset('default',
+                                   os.path.join(self.tmpdir, 'default'))
+        # a full backup and two incrementals, then a new full backup
+        depends = [[], ['b0'], ['b0', 'b1'], []]
+        for idx, depends_on in enumerate(depends):
+            name = 'b%d' % idx
+            path = os.path.join(self.backupset.path, name)
+            os.makedirs(path)
+            backup = Backup(path, 'default', name)
+            backup.config['holland:backup']['start-time'] = 1000.0 + idx
+            backup.config['holland:backup']['depends-on'] = depends_on
+            backup.flush()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def names(self, backups):
+        return [backup.dirname for backup in backups]
+
+    def test_keeps_base_of_retained_incremental(self):
+        # keeping b3 and b2 also keeps b1 and b0, which b2 needs
+        self.assertEqual(self.names(self.backupset.purge_candidates(2)), [])
+        self.assertEqual(self.names(self.backupset.purge_candidates(1)),
+                         ['b2', 'b1', 'b0'])
+
+    def test_dependents(self):
+        b0 = self.backupset.find_backup('b0')
+        self.assertEqual(self.names(self.backupset.dependents(b0)),
+                         ['b1', 'b2'])
+        b3 = self.backupset.find_backup('b3')
+        self.assertEqual(self.backupset.dependents(b3), [])
+
+    def test_purge(self):
+        purged = self.names(self.backupset.purge(2))
+        self.assertEqual(purged, [])
+        purged = self.names(self.backupset.purge(1))
+        self.assertEqual(purged, ['b2', 'b1', 'b0'])
+        self.assertEqual(self.names(self.backupset.list_backups()), ['b3'])